@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Runs the transit_vis command line tool: python -m transit_vis --help"""
+
+import sys
+
+from transit_vis.src import cli
+
+sys.exit(cli.main())
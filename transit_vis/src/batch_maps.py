@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=E1101
+# pylint: disable=E0611
+# pylint: disable=E0401
+"""Renders many variants of the widget map in parallel.
+
+Each scenario is a dictionary of the inputs to the notebook widget (home and
+destination locations, and the income range), optionally with the limits of
+the speed colormap, and the html file to write the map to:
+    {'home_loc_value': '47.653834, -122.307858',
+     'destination_loc_value': '47.606209, -122.332069',
+     'min_income_value': 30000,
+     'max_income_value': 60000,
+     'vmin': 0, 'vmax': 12,
+     'output_path': 'map_1.html'}
+The routes with their speeds, the census table and the simplified tract shapes
+are prepared once by the parent process. The maps are then rendered by a pool
+of worker processes that are forked from the parent, so the workers share the
+parsed layers copy-on-write instead of each reading and parsing the files.
+Where forking is not available the maps are rendered one at a time.
+"""
+
+
+import gc
+import json
+import multiprocessing
+import os
+import time
+
+import branca.colormap as cm
+
+from transit_vis.src import census_data
+from transit_vis.src import nearest_routes
+from transit_vis.src import route_graph
+from transit_vis.src import segment_store
+from transit_vis.src import transit_vis
+from transit_vis.src import widget_map
+
+
+# Keys that every scenario must have
+SCENARIO_KEYS = [
+    'home_loc_value', 'destination_loc_value',
+    'min_income_value', 'max_income_value', 'output_path']
+
+# The parsed layers shared with the worker processes, set before forking
+_BATCH_LAYERS = {}
+
+
+def check_scenarios(scenarios):
+    """Checks that each scenario has all of the required inputs.
+
+    Args:
+        scenarios: A list of scenario dictionaries.
+
+    Returns:
+        The number of scenarios.
+    """
+    output_paths = set()
+    for i, scenario in enumerate(scenarios):
+        missing = [key for key in SCENARIO_KEYS if key not in scenario]
+        if len(missing) == 0:
+            pass
+        else:
+            raise ValueError(f"scenario {i} is missing {', '.join(missing)}")
+        if scenario['output_path'][-5:] == '.html':
+            pass
+        else:
+            raise ValueError('output file must be an html')
+        if scenario['output_path'] not in output_paths:
+            pass
+        else:
+            raise ValueError(f"scenario {i} has the same output_path as another")
+        output_paths.add(scenario['output_path'])
+    return len(scenarios)
+
+def render_scenario(scenario):
+    """Renders one scenario from the shared layers and writes it to html.
+
+    Args:
+        scenario: A scenario dictionary.
+
+    Returns:
+        A tuple of the output path and the seconds taken to render it.
+    """
+    start = time.perf_counter()
+    layers = _BATCH_LAYERS
+    colormap = cm.LinearColormap(
+        ['red', 'yellow', 'green'],
+        vmin=scenario.get('vmin', layers['colormap'].vmin),
+        vmax=scenario.get('vmax', layers['colormap'].vmax))
+    f_map = widget_map.generate_folium_map_widget(
+        layers['segment_data'],
+        layers['census_path'],
+        colormap,
+        scenario['home_loc_value'],
+        scenario['destination_loc_value'],
+        scenario['min_income_value'],
+        scenario['max_income_value'],
+        tracts=layers['tracts'],
+        vertex_index=layers['vertex_index'],
+        trip_graph=layers['trip_graph'])
+    f_map.save(scenario['output_path'])
+    return scenario['output_path'], time.perf_counter() - start
+
+def render_scenarios(scenarios, segment_path, census_path, max_workers=None):
+    """Renders the widget map for each scenario and writes them to html files.
+
+    Uses the speeds most recently joined to the routes in this process (see
+    transit_vis.write_speeds_to_map_segments).
+
+    Args:
+        scenarios: A list of scenario dictionaries.
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+        census_path: A string path to the geojson TIGER shapefile that the
+            combined s0801 and s1902 tables were prepared for by
+            census_data.prepare_census_data.
+        max_workers: The number of worker processes, or None for one per cpu.
+            With 1 the maps are rendered in this process.
+
+    Returns:
+        A dictionary with the list of 'output_paths' written, the total
+        'seconds' taken, and the throughput in 'maps_per_minute'.
+    """
+    num_scenarios = check_scenarios(scenarios)
+    start = time.perf_counter()
+
+    # Parse the shared layers once, before any workers are started
+    segment_data = segment_store.get_enriched_segments(segment_path)
+    _BATCH_LAYERS.clear()
+    _BATCH_LAYERS.update({
+        'segment_data': segment_data,
+        'census_path': census_path,
+        'tracts': widget_map.prepare_widget_tracts(census_path, segment_data),
+        'vertex_index': nearest_routes.load_vertex_index(segment_path),
+        'trip_graph': route_graph.build_route_graph(segment_data['features']),
+        'colormap': transit_vis.speed_colormap([
+            feature['properties']['AVG_SPEED_M_S']
+            for feature in segment_data['features']])})
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    max_workers = min(max_workers, num_scenarios)
+    if max_workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Keep the garbage collector from touching (and so copying) the
+        # shared layers in the workers
+        gc.freeze()
+        try:
+            with multiprocessing.get_context('fork').Pool(max_workers) as pool:
+                results = pool.map(render_scenario, scenarios)
+        finally:
+            gc.unfreeze()
+    else:
+        results = [render_scenario(scenario) for scenario in scenarios]
+
+    seconds = time.perf_counter() - start
+    maps_per_minute = 60 * num_scenarios / seconds if seconds > 0 else 0.0
+    print(f"Rendered {num_scenarios} maps in {seconds:.1f} s "
+          f"({maps_per_minute:.1f} maps per minute)")
+    return {
+        'output_paths': [path for path, _ in results],
+        'seconds': seconds,
+        'maps_per_minute': maps_per_minute}
+
+def main_function_batch(
+        table_name,
+        s0801_path,
+        s1902_path,
+        segment_path,
+        census_path,
+        scenario_path,
+        max_workers=None):
+    """Downloads the latest speeds and renders every scenario in a json file.
+
+    Args:
+        table_name: The name of the dynamodb table containing speed data.
+        s0801_path: A string path to the location of the raw s0801 data, not
+            including file type ending (.csv).
+        s1902_path: A string path to the location of the raw s1902 data, not
+            including file type ending (.csv).
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data.
+        census_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, containing polygon data for census tracts
+            in the state of Washington.
+        scenario_path: A string path to a json file with a list of scenario
+            dictionaries.
+        max_workers: The number of worker processes, or None for one per cpu.
+
+    Returns:
+        The dictionary returned by render_scenarios.
+    """
+    with open(scenario_path, 'r') as scenario_file:
+        scenarios = json.load(scenario_file)
+    check_scenarios(scenarios)
+    print("Preparing census data...")
+    census_data.prepare_census_data(s0801_path, s1902_path, census_path)
+    print("Getting speed data from dynamodb...")
+    table = transit_vis.connect_to_dynamo_table(table_name)
+    speed_lookup = transit_vis.cached_table_to_lookup(
+        table,
+        f"{os.path.dirname(segment_path)}/{table_name}_lookup_tmp.json.gz",
+        total_segments=4)
+    transit_vis.write_speeds_to_map_segments(speed_lookup, segment_path)
+    print("Rendering maps...")
+    return render_scenarios(scenarios, segment_path, census_path, max_workers)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=E1101
+# pylint: disable=E0611
+# pylint: disable=E0401
+"""Prepares the census tract table used by the map, and caches the result.
+
+The s0801 and s1902 tables downloaded from the American Community Survey have
+hundreds of columns, of which the map uses only a handful. This module reads
+just those columns, merges the two tables on their census tract id, and stores
+the merged table in a pickle file next to the tract shapefile. The pickle is
+keyed by a hash of the raw ACS files, so the tables are only read and merged
+again when one of them changes. The paths of the raw files are stored with the
+pickle, so load_census_data checks the hash too and prepares the table again
+if a raw file changed. Both transit_vis.main_function and the notebook widget
+use this module to prepare the census data.
+"""
+
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from transit_vis.src import topology
+
+
+# Raw ACS columns that are kept, and the names they are given in the map
+S0801_COLUMNS = {
+    'GEO_ID': 'GEO_ID',
+    'S0801_C01_001E': 'total_workers',
+    'S0801_C01_009E': 'workers_using_transit'}
+S1902_COLUMNS = {
+    'GEO_ID': 'GEO_ID',
+    'S1902_C01_001E': 'total_households',
+    'S1902_C03_001E': 'mean_income',
+    'S1902_C02_008E': 'percent_w_assistance',
+    'S1902_C02_020E': 'percent_white',
+    'S1902_C02_021E': 'percent_black_or_african_american'}
+INTEGER_COLUMNS = ['total_workers', 'total_households', 'mean_income']
+
+# Change when the columns or processing above change to invalidate old caches
+CENSUS_CACHE_VERSION = '2'
+
+# Merged tables already prepared during this process, keyed by tract path
+_PREPARED_TABLES = {}
+
+# Simplified tract layers already prepared during this process, keyed by path
+_PREPARED_LAYERS = {}
+
+
+def hash_census_inputs(s0801_path, s1902_path):
+    """Computes a hash of the raw ACS tables and the columns kept from them.
+
+    Args:
+        s0801_path: A string path to the location of the raw s0801 data, not
+            including file type ending (.csv).
+        s1902_path: A string path to the location of the raw s1902 data, not
+            including file type ending (.csv).
+
+    Returns:
+        A hex string that changes whenever either table or the column selection
+        changes.
+    """
+    input_hash = hashlib.sha256()
+    input_hash.update(CENSUS_CACHE_VERSION.encode())
+    input_hash.update(repr((S0801_COLUMNS, S1902_COLUMNS)).encode())
+    for path in (s0801_path, s1902_path):
+        with open(f"{path}.csv", 'rb') as census_file:
+            input_hash.update(census_file.read())
+    return input_hash.hexdigest()
+
+def read_acs_table(acs_path, columns):
+    """Reads only the specified columns of a raw ACS table.
+
+    The second row of the ACS download holds column descriptions and is
+    skipped. The estimates are read as strings and converted with
+    pd.to_numeric: thousands separators are removed, top and bottom coded
+    estimates (i.e. '250,000+' or '2,500-') keep their number, and any other
+    marker (i.e. '-', '(X)' or 'N') is read as NaN. The GEO_ID is shortened to
+    the 11 digit tract id used by the TIGER shapefile.
+
+    Args:
+        acs_path: A string path to the location of the raw ACS data, not
+            including file type ending (.csv).
+        columns: A dictionary from raw column names to the names to give them.
+
+    Returns:
+        A Pandas Dataframe with the renamed columns.
+    """
+    acs_df = pd.read_csv(
+        f"{acs_path}.csv",
+        usecols=list(columns.keys()),
+        dtype=str,
+        skiprows=[1])
+    acs_df = acs_df.rename(columns=columns)
+    for name in columns.values():
+        if name != 'GEO_ID':
+            acs_df[name] = pd.to_numeric(
+                acs_df[name].str.replace(',', '').str.rstrip('+-'),
+                errors='coerce').astype('float64')
+    acs_df['GEO_ID'] = acs_df['GEO_ID'].str[-11:]
+    return acs_df
+
+def read_cached_table(tract_shapes_path):
+    """Returns the cached census table for a shapefile from memory or disk.
+
+    Args:
+        tract_shapes_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, not including file type ending (.geojson).
+
+    Returns:
+        A dictionary with the 'input_hash' the table was prepared from, the
+        'input_paths' of the raw ACS tables, and the 'census_df' table itself,
+        or None if no table has been prepared.
+    """
+    if tract_shapes_path in _PREPARED_TABLES:
+        return _PREPARED_TABLES[tract_shapes_path]
+    if os.path.exists(f"{tract_shapes_path}_tmp.pkl"):
+        _PREPARED_TABLES[tract_shapes_path] = pd.read_pickle(
+            f"{tract_shapes_path}_tmp.pkl")
+        return _PREPARED_TABLES[tract_shapes_path]
+    return None
+
+def prepare_census_data(s0801_path, s1902_path, tract_shapes_path):
+    """Returns the merged census table, reading the ACS tables only if needed.
+
+    Hashes the raw ACS tables and compares the hash to the one stored with the
+    cached table (in memory, or in a *_tmp.pkl file in the same folder as the
+    TIGER shapefiles). If they match, the cached table is returned. Otherwise
+    the variables of interest are read from s0801 and s1902, merged on their
+    census tract id, and the cache is rewritten.
+
+    Args:
+        s0801_path: A string path to the location of the raw s0801 data, not
+            including file type ending (.csv).
+        s1902_path: A string path to the location of the raw s1902 data, not
+            including file type ending (.csv).
+        tract_shapes_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, not including file type ending (.geojson).
+
+    Returns:
+        A Pandas Dataframe with one row per census tract, and columns for the
+        GEO_ID and each of the census variables of interest.
+    """
+    input_hash = hash_census_inputs(s0801_path, s1902_path)
+    cached = read_cached_table(tract_shapes_path)
+    if cached is not None and cached['input_hash'] == input_hash:
+        return cached['census_df']
+
+    # Read only the variables of interest from each table and combine them
+    commuters_df = read_acs_table(s0801_path, S0801_COLUMNS)
+    households_df = read_acs_table(s1902_path, S1902_COLUMNS)
+    census_df = pd.merge(commuters_df, households_df, on='GEO_ID')
+    for column in INTEGER_COLUMNS:
+        census_df[column] = census_df[column].astype('Int64')
+    cached = {
+        'input_hash': input_hash,
+        'input_paths': [s0801_path, s1902_path],
+        'census_df': census_df}
+    pd.to_pickle(cached, f"{tract_shapes_path}_tmp.pkl")
+    _PREPARED_TABLES[tract_shapes_path] = cached
+    return census_df
+
+def load_census_data(tract_shapes_path):
+    """Loads the merged census table most recently prepared for a shapefile.
+
+    Uses the table prepared by prepare_census_data if there is one, after
+    checking the hash of the raw ACS tables it was prepared from (and
+    preparing it again if they changed). Otherwise falls back to a *_tmp.csv
+    file written by write_census_data_to_csv.
+
+    Args:
+        tract_shapes_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, not including file type ending (.geojson).
+
+    Returns:
+        A Pandas Dataframe with one row per census tract, and columns for the
+        GEO_ID and each of the census variables of interest.
+    """
+    cached = read_cached_table(tract_shapes_path)
+    if cached is not None and 'input_paths' in cached:
+        return prepare_census_data(*cached['input_paths'], tract_shapes_path)
+    census_df = pd.read_csv(f"{tract_shapes_path}_tmp.csv", dtype={'GEO_ID': str})
+    return census_df
+
+def polygon_rings(geometry):
+    """Returns the rings of a Polygon or MultiPolygon geometry.
+
+    Args:
+        geometry: A geojson Polygon or MultiPolygon geometry.
+
+    Returns:
+        A list of polygons, each a list of rings of [lon, lat] coordinates.
+    """
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+def simplify_tracts(features, tolerance, precision):
+    """Simplifies tract polygons without opening gaps between neighbors.
+
+    Coordinates are first rounded to the given number of decimal places. The
+    rings are then cut into arcs wherever neighboring tracts start or stop
+    sharing a border, and each distinct arc is simplified once with the
+    Douglas-Peucker algorithm, so both tracts on a border get the same
+    simplified border. Rings that would collapse to fewer than four points
+    keep their rounded, unsimplified coordinates.
+
+    Args:
+        features: A list of geojson features with Polygon or MultiPolygon
+            geometry.
+        tolerance: The largest distance, in degrees, that a removed point may
+            be from the simplified border.
+        precision: An integer number of decimal places to keep.
+
+    Returns:
+        A list of new features with MultiPolygon geometry and the same
+        properties.
+    """
+    factor = 10**precision
+    rings = []
+    ring_owners = []
+    for i, feature in enumerate(features):
+        for j, polygon in enumerate(polygon_rings(feature['geometry'])):
+            for ring in polygon:
+                points = []
+                for lon, lat in (pt[:2] for pt in ring):
+                    point = (int(round(lon * factor)), int(round(lat * factor)))
+                    if len(points) == 0 or point != points[-1]:
+                        points.append(point)
+                if len(points) >= 4:
+                    rings.append(points)
+                    ring_owners.append((i, j))
+    arcs, ring_refs = topology.cut_arcs(rings)
+    simple_arcs = [
+        topology.simplify_arc(arc, tolerance * factor) for arc in arcs]
+
+    polygons = [{} for _ in features]
+    for points, refs, (i, j) in zip(rings, ring_refs, ring_owners):
+        simple_ring = topology.join_arcs(simple_arcs, refs)
+        if len(simple_ring) < 4:
+            simple_ring = points
+        polygons[i].setdefault(j, []).append(
+            [[x / factor, y / factor] for x, y in simple_ring])
+    simple_features = []
+    for feature, feature_polygons in zip(features, polygons):
+        simple_features.append({
+            'type': 'Feature',
+            'properties': feature['properties'],
+            'geometry': {
+                'type': 'MultiPolygon',
+                'coordinates': [
+                    feature_polygons[j] for j in sorted(feature_polygons)]}})
+    return simple_features
+
+def prepare_tract_layer(tract_shapes_path, census_df, route_bbox,
+                        tolerance=0.0001, precision=5):
+    """Returns the tract shapes for the choropleth, clipped and simplified.
+
+    Keeps only tracts that have a row in the merged ACS table and whose
+    bounding box overlaps the bounding box of the route network, then
+    simplifies their borders with simplify_tracts. The result is written to a
+    *_simplified_tmp.geojson file next to the TIGER shapefile along with a hash
+    of everything it was built from, and is reused until one of those changes.
+
+    Args:
+        tract_shapes_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, not including file type ending (.geojson).
+        census_df: A Pandas Dataframe with a GEO_ID column of the tracts that
+            have census data, as returned by prepare_census_data.
+        route_bbox: A tuple of (min lon, min lat, max lon, max lat) covering
+            the route network, or None to keep tracts anywhere.
+        tolerance: The largest distance, in degrees, that a removed point may
+            be from a simplified border.
+        precision: An integer number of decimal places to keep.
+
+    Returns:
+        A geojson dictionary of the clipped and simplified tracts.
+    """
+    geo_ids = sorted(set(census_df['GEO_ID'].astype(str)))
+    layer_hash = hashlib.sha256()
+    with open(f"{tract_shapes_path}.geojson", 'rb') as shapefile:
+        layer_hash.update(shapefile.read())
+    layer_hash.update(repr((geo_ids, route_bbox, tolerance, precision)).encode())
+    layer_hash = layer_hash.hexdigest()
+    layer_path = f"{tract_shapes_path}_simplified_tmp.geojson"
+
+    cached = _PREPARED_LAYERS.get(layer_path)
+    if cached is None and os.path.exists(layer_path):
+        with open(layer_path, 'r') as layer_file:
+            cached = json.load(layer_file)
+    if cached is not None and cached.get('input_hash') == layer_hash:
+        _PREPARED_LAYERS[layer_path] = cached
+        return cached
+
+    with open(f"{tract_shapes_path}.geojson", 'r') as shapefile:
+        tract_shapes = json.load(shapefile)
+    geo_ids = set(geo_ids)
+    features = []
+    for feature in tract_shapes['features']:
+        if str(feature['properties']['GEOID10']) not in geo_ids:
+            continue
+        if route_bbox is not None:
+            tract_bbox = topology.geojson_bbox({'features': [feature]})
+            if tract_bbox is None \
+                    or tract_bbox[0] > route_bbox[2] \
+                    or tract_bbox[2] < route_bbox[0] \
+                    or tract_bbox[1] > route_bbox[3] \
+                    or tract_bbox[3] < route_bbox[1]:
+                continue
+        features.append(feature)
+    tract_layer = {
+        'type': 'FeatureCollection',
+        'input_hash': layer_hash,
+        'features': simplify_tracts(features, tolerance, precision)}
+    with open(layer_path, 'w') as layer_file:
+        json.dump(tract_layer, layer_file, separators=(',', ':'))
+    _PREPARED_LAYERS[layer_path] = tract_layer
+    return tract_layer
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Command line entry point for each stage of the visualization tool.
+
+Runs one of the seven stages of the tool from the terminal:
+    init: uploads the route network to a new dynamodb table (once)
+    summarize: aggregates recent speeds from RDS and uploads them (daily)
+    render: downloads the speeds and draws the Folium map
+    serve: keeps the map layers in memory and serves them over http
+    batch: renders a widget map for each scenario in a json file
+    daily: summarizes speeds and then draws the map as one resumable pipeline
+    partitions: creates the coming daily partitions of the RDS location table
+The modules behind each stage import boto3, pandas, folium and other large
+libraries that take seconds to load, so they are only imported once the
+arguments have been parsed and a stage is actually run. The importtime command
+measures how long importing a module takes with python -X importtime and
+compares it to the budgets in IMPORT_BUDGETS_US.
+
+Usage: python -m transit_vis {init,summarize,render,serve,batch,daily,partitions,
+    importtime}
+    [options]
+"""
+
+
+import argparse
+import importlib
+import subprocess
+import sys
+
+
+# Longest acceptable cumulative import time (microseconds) for each module;
+# the stage modules load boto3, pandas and folium, so theirs are larger
+IMPORT_BUDGETS_US = {
+    'transit_vis.src.cli': 100000,
+    'transit_vis.src.speed_cache': 100000,
+    'transit_vis.src.topology': 500000,
+    'transit_vis.src.summarize_rds': 2000000,
+    'transit_vis.src.transit_vis': 2500000,
+    'transit_vis.src.widget_modules': 3500000}
+
+
+def run_init(args):
+    """Runs initialize_dynamodb.main_function_init with the parsed arguments.
+
+    Args:
+        args: An argparse Namespace with geojson and table attributes.
+
+    Returns:
+        The number of features uploaded to the database.
+    """
+    initialize_dynamodb = importlib.import_module(
+        'transit_vis.src.initialize_dynamodb')
+    num_features = initialize_dynamodb.main_function_init(
+        args.geojson,
+        args.table)
+    print(f"{num_features} features in data uploaded to dynamodb")
+    return num_features
+
+def run_summarize(args):
+    """Runs summarize_rds.main_function_summ with the parsed arguments.
+
+    Args:
+        args: An argparse Namespace with table, num_days and rds_limit
+            attributes.
+
+    Returns:
+        The number of segments updated in the database.
+    """
+    summarize_rds = importlib.import_module('transit_vis.src.summarize_rds')
+    num_segments = summarize_rds.main_function_summ(
+        dynamodb_table_name=args.table,
+        num_days=args.num_days,
+        rds_limit=args.rds_limit)
+    print(f"Number of segments updated: {num_segments}")
+    return num_segments
+
+def run_render(args):
+    """Runs transit_vis.main_function with the parsed arguments.
+
+    Args:
+        args: An argparse Namespace with table, s0801, s1902, segments, census
+            and fetch_mode attributes.
+
+    Returns:
+        1 when done writing the Folium map .html file.
+    """
+    transit_vis = importlib.import_module('transit_vis.src.transit_vis')
+    return transit_vis.main_function(
+        table_name=args.table,
+        s0801_path=args.s0801,
+        s1902_path=args.s1902,
+        segment_path=args.segments,
+        census_path=args.census,
+        fetch_mode=args.fetch_mode)
+
+def run_serve(args):
+    """Runs map_server.serve_map with the parsed arguments.
+
+    Args:
+        args: An argparse Namespace with table, s0801, s1902, segments, census,
+            host, port and refresh attributes.
+
+    Returns:
+        1 when the server has been shut down.
+    """
+    map_server = importlib.import_module('transit_vis.src.map_server')
+    return map_server.serve_map(
+        table_name=args.table,
+        s0801_path=args.s0801,
+        s1902_path=args.s1902,
+        segment_path=args.segments,
+        census_path=args.census,
+        host=args.host,
+        port=args.port,
+        refresh_interval=args.refresh)
+
+def run_batch(args):
+    """Runs batch_maps.main_function_batch with the parsed arguments.
+
+    Args:
+        args: An argparse Namespace with scenarios, table, s0801, s1902,
+            segments, census and workers attributes.
+
+    Returns:
+        The dictionary of output paths and throughput from render_scenarios.
+    """
+    batch_maps = importlib.import_module('transit_vis.src.batch_maps')
+    return batch_maps.main_function_batch(
+        table_name=args.table,
+        s0801_path=args.s0801,
+        s1902_path=args.s1902,
+        segment_path=args.segments,
+        census_path=args.census,
+        scenario_path=args.scenarios,
+        max_workers=args.workers)
+
+def run_daily(args):
+    """Runs the summarize and render stages together with pipeline.run_pipeline.
+
+    The census data is prepared while the GTFS files and RDS data are
+    downloaded, and a run that failed part way resumes after the last stage
+    that finished.
+
+    Args:
+        args: An argparse Namespace with table, num_days, rds_limit, s0801,
+            s1902, segments, census, fetch_mode and artifacts attributes.
+
+    Returns:
+        The dictionary of stages run and reused from run_pipeline.
+    """
+    pipeline = importlib.import_module('transit_vis.src.pipeline')
+    summarize_rds = importlib.import_module('transit_vis.src.summarize_rds')
+    transit_vis = importlib.import_module('transit_vis.src.transit_vis')
+    stages = summarize_rds.summary_stages(
+        args.table, args.num_days, args.rds_limit, summarize_rds.last_full_day())
+    stages += transit_vis.map_stages(
+        args.table,
+        args.s0801,
+        args.s1902,
+        args.segments,
+        args.census,
+        fetch_mode=args.fetch_mode,
+        after=['num_uploaded', 'snapshot_path', 'archive_days'])
+    result = pipeline.run_pipeline(
+        stages, args.artifacts, targets=['render'], prune=True)
+    print(f"Stages run: {', '.join(result['run']) or 'none'}")
+    print(f"Stages reused: {', '.join(result['reused']) or 'none'}")
+    return result
+
+def run_partitions(args):
+    """Runs trip_partitions.maintain_partitions with the parsed arguments.
+
+    Args:
+        args: An argparse Namespace with ahead and keep attributes.
+
+    Returns:
+        A tuple of the lists of partition names created and dropped.
+    """
+    clients = importlib.import_module('transit_vis.src.clients')
+    trip_partitions = importlib.import_module('transit_vis.src.trip_partitions')
+    with clients.rds_connection() as conn:
+        created, dropped = trip_partitions.maintain_partitions(
+            conn, days_ahead=args.ahead, days_to_keep=args.keep)
+    print(f"Created partitions: {', '.join(created) or 'none'}")
+    print(f"Dropped partitions: {', '.join(dropped) or 'none'}")
+    return created, dropped
+
+def measure_import_time(module_name):
+    """Measures the cumulative time to import a module in a new interpreter.
+
+    Runs python -X importtime in a subprocess so that modules already imported
+    by this process do not hide the cost.
+
+    Args:
+        module_name: The dotted name of the module to import.
+
+    Returns:
+        The cumulative import time of the module in microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module_name}"],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True)
+    for line in result.stderr.splitlines():
+        # Lines look like: "import time:   self | cumulative | name"
+        if line.startswith('import time:'):
+            fields = line[len('import time:'):].split('|')
+            if len(fields) == 3 and fields[2].strip() == module_name:
+                return int(fields[1])
+    raise ValueError(f"no import time reported for {module_name}")
+
+def run_importtime(args):
+    """Reports the import time of each module with a budget.
+
+    Args:
+        args: An argparse Namespace with a modules attribute; if it is empty
+            every module in IMPORT_BUDGETS_US is measured.
+
+    Returns:
+        The number of modules that were over their budget.
+    """
+    modules = args.modules if len(args.modules) > 0 else list(IMPORT_BUDGETS_US)
+    num_over = 0
+    for module_name in modules:
+        import_us = measure_import_time(module_name)
+        budget_us = IMPORT_BUDGETS_US.get(module_name)
+        status = ''
+        if budget_us is not None and import_us > budget_us:
+            status = f" OVER BUDGET ({budget_us} us)"
+            num_over += 1
+        print(f"{module_name}: {import_us} us{status}")
+    return num_over
+
+def build_parser():
+    """Creates the argument parser for each of the stages.
+
+    Returns:
+        An argparse ArgumentParser with a subcommand for each stage.
+    """
+    parser = argparse.ArgumentParser(
+        prog='transit_vis',
+        description='Summarize bus speeds and plot them with census data.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    init_parser = subparsers.add_parser(
+        'init', help='upload the route network to a new dynamodb table')
+    init_parser.add_argument('--geojson', default='./transit_vis/data/kcm_routes')
+    init_parser.add_argument('--table', default='KCM_Bus_Routes')
+    init_parser.set_defaults(func=run_init)
+
+    summarize_parser = subparsers.add_parser(
+        'summarize', help='aggregate recent speeds from RDS and upload them')
+    summarize_parser.add_argument('--table', default='KCM_Bus_Routes')
+    summarize_parser.add_argument('--num-days', type=int, default=1)
+    summarize_parser.add_argument('--rds-limit', type=int, default=10000)
+    summarize_parser.set_defaults(func=run_summarize)
+
+    render_parser = subparsers.add_parser(
+        'render', help='download speeds and draw the map')
+    render_parser.add_argument('--table', default='KCM_Bus_Routes')
+    render_parser.add_argument('--s0801', default='./transit_vis/data/s0801')
+    render_parser.add_argument('--s1902', default='./transit_vis/data/s1902')
+    render_parser.add_argument('--segments', default='./transit_vis/data/kcm_routes')
+    render_parser.add_argument(
+        '--census', default='./transit_vis/data/seattle_census_tracts_2010')
+    render_parser.add_argument(
+        '--fetch-mode', choices=['cache', 'keys', 'scan', 'snapshot'], default='cache')
+    render_parser.set_defaults(func=run_render)
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='serve the map and its layers from a local web server')
+    serve_parser.add_argument('--table', default='KCM_Bus_Routes')
+    serve_parser.add_argument('--s0801', default='./transit_vis/data/s0801')
+    serve_parser.add_argument('--s1902', default='./transit_vis/data/s1902')
+    serve_parser.add_argument('--segments', default='./transit_vis/data/kcm_routes')
+    serve_parser.add_argument(
+        '--census', default='./transit_vis/data/seattle_census_tracts_2010')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument(
+        '--refresh', type=float, default=300,
+        help='seconds between checks for new speeds')
+    serve_parser.set_defaults(func=run_serve)
+
+    batch_parser = subparsers.add_parser(
+        'batch', help='render a widget map for each scenario in a json file')
+    batch_parser.add_argument('scenarios')
+    batch_parser.add_argument('--table', default='KCM_Bus_Routes')
+    batch_parser.add_argument('--s0801', default='./transit_vis/data/s0801')
+    batch_parser.add_argument('--s1902', default='./transit_vis/data/s1902')
+    batch_parser.add_argument('--segments', default='./transit_vis/data/kcm_routes')
+    batch_parser.add_argument(
+        '--census', default='./transit_vis/data/seattle_census_tracts_2010')
+    batch_parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of worker processes (default: one per cpu)')
+    batch_parser.set_defaults(func=run_batch)
+
+    daily_parser = subparsers.add_parser(
+        'daily', help='summarize speeds and draw the map, resuming failed runs')
+    daily_parser.add_argument('--table', default='KCM_Bus_Routes')
+    daily_parser.add_argument('--num-days', type=int, default=1)
+    daily_parser.add_argument('--rds-limit', type=int, default=10000)
+    daily_parser.add_argument('--s0801', default='./transit_vis/data/s0801')
+    daily_parser.add_argument('--s1902', default='./transit_vis/data/s1902')
+    daily_parser.add_argument('--segments', default='./transit_vis/data/kcm_routes')
+    daily_parser.add_argument(
+        '--census', default='./transit_vis/data/seattle_census_tracts_2010')
+    daily_parser.add_argument(
+        '--fetch-mode', choices=['cache', 'keys', 'scan', 'snapshot'], default='cache')
+    daily_parser.add_argument(
+        '--artifacts', default='./transit_vis/data/pipeline_tmp',
+        help='folder to save the results of each stage in')
+    daily_parser.set_defaults(func=run_daily)
+
+    partitions_parser = subparsers.add_parser(
+        'partitions', help='create upcoming daily partitions of the RDS table')
+    partitions_parser.add_argument(
+        '--ahead', type=int, default=7,
+        help='number of days, starting today, to have partitions for')
+    partitions_parser.add_argument(
+        '--keep', type=int, default=None,
+        help='drop partitions older than this many days (default: keep all)')
+    partitions_parser.set_defaults(func=run_partitions)
+
+    importtime_parser = subparsers.add_parser(
+        'importtime', help='check module import times against their budgets')
+    importtime_parser.add_argument('modules', nargs='*')
+    importtime_parser.set_defaults(func=run_importtime)
+    return parser
+
+def main(argv=None):
+    """Parses the command line and runs the requested stage.
+
+    Args:
+        argv: A list of command line arguments, or None to use sys.argv.
+
+    Returns:
+        The exit status of the command: 1 if importtime found modules over
+        their budget, and 0 once any other stage has run.
+    """
+    args = build_parser().parse_args(argv)
+    result = args.func(args)
+    if args.func is run_importtime:
+        return int(result > 0)
+    return 0
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=E1101
+# pylint: disable=E0611
+# pylint: disable=E0401
+"""Shares pooled connections to dynamodb and the RDS data warehouse.
+
+Every module that talks to AWS or the warehouse gets its connections here
+instead of making its own. The boto3 session and low level clients are made
+once per process with a botocore config that keeps enough pooled http
+connections open for the threads that scan and read the table at once, retries
+throttled requests with adaptive backoff, and sets timeouts and tcp keep-alive.
+Boto3 resources are not thread safe, so each thread gets its own resource, and
+they all share the (thread safe) client of the process and its connection
+pool. The warehouse connections come from a psycopg2 ThreadedConnectionPool,
+and each connection is checked with a trivial query before it is handed out so
+a connection dropped by the server is replaced instead of failing a query.
+Everything cached here is dropped in a process forked from the one that made
+it, since sockets cannot be shared between processes.
+"""
+
+
+import contextlib
+import os
+import threading
+
+import boto3
+import botocore.config
+
+from transit_vis.src import config as cfg
+
+
+# Pooled http connections per boto3 resource; enough for the parallel scan
+# segments and batch_get_item workers of transit_vis to run at once
+MAX_POOL_CONNECTIONS = 16
+
+# Retries of throttled or failed AWS requests, and the request timeouts
+MAX_ATTEMPTS = 8
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# Warehouse connections kept open, and the seconds of idle before keep-alive
+RDS_MIN_CONNECTIONS = 1
+RDS_MAX_CONNECTIONS = 4
+RDS_KEEPALIVE_IDLE = 60
+
+# The clients made in this process
+_CLIENTS = {
+    'lock': threading.Lock(),
+    'pid': None,
+    'session': None,
+    'resources': {},
+    'rds_pool': None}
+
+# The resources made in each thread, which share the clients of the process
+_THREAD_CLIENTS = threading.local()
+
+
+def client_config(max_pool_connections=MAX_POOL_CONNECTIONS):
+    """Makes the botocore config used for every AWS resource.
+
+    Args:
+        max_pool_connections: The number of http connections to keep open.
+
+    Returns:
+        A botocore Config object.
+    """
+    options = {
+        'max_pool_connections': max_pool_connections,
+        'retries': {'max_attempts': MAX_ATTEMPTS, 'mode': 'adaptive'},
+        'connect_timeout': CONNECT_TIMEOUT,
+        'read_timeout': READ_TIMEOUT,
+        'tcp_keepalive': True}
+    try:
+        return botocore.config.Config(**options)
+    except TypeError:
+        # Versions of botocore before 1.27 do not have the keep-alive option
+        del options['tcp_keepalive']
+        return botocore.config.Config(**options)
+
+def _process_clients():
+    """Returns the client cache, emptied first if this process was forked.
+
+    Must be called with the cache lock held.
+    """
+    if _CLIENTS['pid'] != os.getpid():
+        _CLIENTS['pid'] = os.getpid()
+        _CLIENTS['session'] = None
+        _CLIENTS['resources'] = {}
+        _CLIENTS['rds_pool'] = None
+    return _CLIENTS
+
+def get_session():
+    """Returns the boto3 session of this process, made from config.py.
+
+    Settings left blank in config.py fall back to the standard AWS
+    environment variables and configuration files.
+
+    Returns:
+        A boto3 Session object.
+    """
+    with _CLIENTS['lock']:
+        clients = _process_clients()
+        if clients['session'] is None:
+            clients['session'] = boto3.session.Session(
+                region_name=cfg.REGION or None,
+                aws_access_key_id=cfg.ACCESS_ID or None,
+                aws_secret_access_key=cfg.ACCESS_KEY or None)
+        return clients['session']
+
+def get_resource(service_name='dynamodb'):
+    """Returns the boto3 resource of this thread for an AWS service.
+
+    Resources are not thread safe, so one is made for each thread. They are
+    all made from the resource of the process, and share its client and
+    pooled connections.
+
+    Args:
+        service_name: The name of the AWS service.
+
+    Returns:
+        A boto3 Resource object.
+    """
+    session = get_session()
+    with _CLIENTS['lock']:
+        resources = _process_clients()['resources']
+        if service_name not in resources:
+            resources[service_name] = session.resource(
+                service_name, config=client_config())
+        process_resource = resources[service_name]
+    thread_resources = _THREAD_CLIENTS.__dict__.setdefault('resources', {})
+    resource = thread_resources.get(service_name)
+    # Made again if the process resource was, such as after a fork
+    if resource is None or \
+            resource.meta.client is not process_resource.meta.client:
+        resource = type(process_resource)(client=process_resource.meta.client)
+        thread_resources[service_name] = resource
+    return resource
+
+def get_dynamo_table(table_name):
+    """Returns a dynamodb table made from the resource of this thread.
+
+    Args:
+        table_name: The name of the table on the dynamodb resource.
+
+    Returns:
+        A boto3 Table object pointing to the dynamodb table specified.
+    """
+    return get_resource('dynamodb').Table(table_name)
+
+def get_rds_pool():
+    """Returns the pool of connections to the RDS data warehouse.
+
+    Returns:
+        A psycopg2 ThreadedConnectionPool for the warehouse specified in
+        config.py.
+    """
+    # psycopg2 is only needed to summarize speeds, not to draw maps
+    import psycopg2.pool
+    with _CLIENTS['lock']:
+        clients = _process_clients()
+        if clients['rds_pool'] is None:
+            clients['rds_pool'] = psycopg2.pool.ThreadedConnectionPool(
+                RDS_MIN_CONNECTIONS,
+                RDS_MAX_CONNECTIONS,
+                host=cfg.HOST,
+                database=cfg.DATABASE,
+                user=cfg.UID,
+                password=cfg.PWD,
+                connect_timeout=CONNECT_TIMEOUT,
+                keepalives=1,
+                keepalives_idle=RDS_KEEPALIVE_IDLE)
+        return clients['rds_pool']
+
+def check_connection(conn):
+    """Checks that a warehouse connection can still run queries.
+
+    Args:
+        conn: A Psycopg Connection object.
+
+    Returns:
+        True if the connection is open and answered a trivial query.
+    """
+    import psycopg2
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as curs:
+            curs.execute('SELECT 1;')
+        conn.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+def get_rds_connection():
+    """Checks a healthy connection out of the warehouse pool.
+
+    Connections that fail check_connection are closed and replaced. The
+    connection must be given back with release_rds_connection.
+
+    Returns:
+        A Psycopg Connection object for the RDS data warehouse.
+
+    Raises:
+        psycopg2.OperationalError: If no connection passed the check.
+    """
+    import psycopg2
+    pool = get_rds_pool()
+    # Every idle connection may be broken, and then one new one is tried
+    for _ in range(RDS_MAX_CONNECTIONS + 1):
+        conn = pool.getconn()
+        if check_connection(conn):
+            return conn
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError(
+        'no healthy connection to the warehouse could be made')
+
+def release_rds_connection(conn):
+    """Gives a connection from get_rds_connection back to the pool.
+
+    Any transaction left open is rolled back, and broken connections are
+    closed instead of being kept.
+
+    Args:
+        conn: A Psycopg Connection object from get_rds_connection.
+    """
+    import psycopg2
+    broken = bool(conn.closed)
+    if not broken:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    get_rds_pool().putconn(conn, close=broken)
+
+@contextlib.contextmanager
+def rds_connection():
+    """Checks a warehouse connection out of the pool for a with block.
+
+    Yields:
+        A Psycopg Connection object for the RDS data warehouse.
+    """
+    conn = get_rds_connection()
+    try:
+        yield conn
+    finally:
+        release_rds_connection(conn)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=E1101
+# pylint: disable=E0611
+# pylint: disable=E0401
+"""Writes the route layer of the Folium map in a compact, quantized format.
+
+A folium GeoJson layer writes every coordinate at full float precision, and
+repeats every property name and style for every feature, into the map html.
+For the thousands of features in the King County Metro route network this is
+most of the size of the saved map. This module instead encodes the routes in
+the style of TopoJSON: coordinates are quantized to integers on a grid covering
+the network, lines are split into arcs wherever routes meet or part ways so
+that streets shared by several routes are only stored once, and each arc is
+delta encoded. Feature properties are stored as one list per column, and the
+colors are stored as indexes into a small palette. The layer is decoded back
+into Leaflet polylines in the browser.
+"""
+
+
+import json
+
+from folium.map import Layer
+from jinja2 import Template
+
+from transit_vis.src import topology
+
+
+def feature_lines(feature):
+    """Returns the lines of a LineString or MultiLineString feature.
+
+    Args:
+        feature: A geojson feature with LineString or MultiLineString geometry.
+
+    Returns:
+        A list of lines, where each line is a list of [lon, lat] coordinates.
+        Features without line geometry return an empty list.
+    """
+    geometry = feature.get('geometry')
+    if geometry is None:
+        return []
+    if geometry['type'] == 'LineString':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiLineString':
+        return geometry['coordinates']
+    return []
+
+def quantize_lines(features, quantization):
+    """Snaps the coordinates of every feature to an integer grid.
+
+    The grid covers the bounding box of all features with quantization cells
+    along each axis. Repeated consecutive points created by the snapping are
+    removed, as are lines that collapse to a single point.
+
+    Args:
+        features: A list of geojson features with line geometry.
+        quantization: An integer number of grid cells along each axis.
+
+    Returns:
+        A tuple of the quantized lines (a list with one list of lines per
+        feature, each line a list of (x, y) integer tuples), and the transform
+        dictionary with the scale and translate needed to convert the grid
+        positions back to longitude and latitude.
+    """
+    all_lines = [feature_lines(feature) for feature in features]
+    lons = [pt[0] for lines in all_lines for line in lines for pt in line]
+    lats = [pt[1] for lines in all_lines for line in lines for pt in line]
+    if len(lons) == 0:
+        return [[] for _ in features], {'scale': [1, 1], 'translate': [0, 0]}
+    x_0, y_0 = min(lons), min(lats)
+    x_scale = max((max(lons) - x_0) / (quantization - 1), 1e-12)
+    y_scale = max((max(lats) - y_0) / (quantization - 1), 1e-12)
+    quantized = []
+    for lines in all_lines:
+        feature_quantized = []
+        for line in lines:
+            points = []
+            for lon, lat in (pt[:2] for pt in line):
+                point = (
+                    int(round((lon - x_0) / x_scale)),
+                    int(round((lat - y_0) / y_scale)))
+                if len(points) == 0 or point != points[-1]:
+                    points.append(point)
+            if len(points) > 1:
+                feature_quantized.append(points)
+        quantized.append(feature_quantized)
+    transform = {'scale': [x_scale, y_scale], 'translate': [x_0, y_0]}
+    return quantized, transform
+
+def build_topology(features, quantization=100000):
+    """Encodes line features as quantized, delta encoded, shared arcs.
+
+    Each line is cut at the points where routes meet or part ways, and each
+    piece becomes an arc (see topology.cut_arcs). Identical arcs (including
+    those traversed in the opposite direction) are only stored once, so
+    overlapping routes share their arcs. As in TopoJSON, an arc traversed
+    backwards is referenced by the ones' complement of its index. Each arc is
+    stored as a flat [x, y, dx, dy, ...] list where all points after the first
+    are offsets from the one before.
+
+    Args:
+        features: A list of geojson features with line geometry.
+        quantization: An integer number of grid cells along each axis.
+
+    Returns:
+        A dictionary with the transform, the list of encoded arcs, and for each
+        feature a list of lines made up of arc references.
+    """
+    quantized, transform = quantize_lines(features, quantization)
+    arcs, line_refs = topology.cut_arcs(
+        [line for lines in quantized for line in lines])
+    geometries = []
+    start = 0
+    for lines in quantized:
+        geometries.append(line_refs[start:start + len(lines)])
+        start += len(lines)
+
+    encoded_arcs = []
+    for arc in arcs:
+        encoded = [arc[0][0], arc[0][1]]
+        for prev_pt, point in zip(arc[:-1], arc[1:]):
+            encoded.extend([point[0] - prev_pt[0], point[1] - prev_pt[1]])
+        encoded_arcs.append(encoded)
+    return {'transform': transform, 'arcs': encoded_arcs, 'geometries': geometries}
+
+def build_columns(features, fields, colormap, color_field='AVG_SPEED_M_S'):
+    """Stores the tooltip properties and colors of features as columns.
+
+    Args:
+        features: A list of geojson features that have each of the fields and
+            the color_field property.
+        fields: A list of property names to keep for the tooltips.
+        colormap: A Colormap object that describes what values of the
+            color_field should be mapped to what colors.
+        color_field: The name of the property the features are colored by.
+
+    Returns:
+        A dictionary with a list of values for each field, a palette of the
+        unique colors used, and a 'color' column of indexes into the palette.
+        Routes without data (a value of None, or a speed of 0) are drawn
+        gray, as in the GeoJson layer.
+    """
+    columns = {field: [] for field in fields}
+    palette = []
+    palette_index = {}
+    color_column = []
+    for feature in features:
+        properties = feature['properties']
+        for field in fields:
+            columns[field].append(properties.get(field))
+        value = properties.get(color_field)
+        if value is None or (color_field == 'AVG_SPEED_M_S' and value == 0):
+            color = 'gray'
+        else:
+            color = colormap(value)
+        if color not in palette_index:
+            palette_index[color] = len(palette)
+            palette.append(color)
+        color_column.append(palette_index[color])
+    return {'fields': columns, 'palette': palette, 'color': color_column}
+
+def to_script_json(obj):
+    """Serializes an object to json without whitespace for an html script.
+
+    Args:
+        obj: A json serializable object.
+
+    Returns:
+        A string of json that is safe to place inside a <script> element.
+    """
+    return json.dumps(obj, separators=(',', ':')).replace('</', '<\\/')
+
+
+# Browser code that turns the output of build_topology back into, for each
+# feature, a list of lines of [lat, lon] points that Leaflet can draw
+DECODE_TOPOLOGY_JS = u"""
+function decodeTopology(topology) {
+    var scale = topology.transform.scale;
+    var translate = topology.transform.translate;
+    var arcs = topology.arcs.map(function(arc) {
+        var x = 0, y = 0, latlngs = [];
+        for (var i = 0; i < arc.length; i += 2) {
+            x += arc[i];
+            y += arc[i + 1];
+            latlngs.push([
+                y * scale[1] + translate[1],
+                x * scale[0] + translate[0]]);
+        }
+        return latlngs;
+    });
+    function decodeLine(refs) {
+        var latlngs = [];
+        refs.forEach(function(ref, i) {
+            var arc = ref < 0 ? arcs[~ref].slice().reverse() : arcs[ref];
+            latlngs = latlngs.concat(i > 0 ? arc.slice(1) : arc);
+        });
+        return latlngs;
+    }
+    return topology.geometries.map(function(lines) {
+        return lines.map(decodeLine);
+    });
+}
+"""
+
+# Browser code that escapes a value before it is put into tooltip html
+ESCAPE_HTML_JS = u"""
+function escapeHtml(value) {
+    return String(value).replace(/[&<>"']/g, function(c) {
+        return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+    });
+}
+"""
+
+
+class CompactRouteLayer(Layer):
+    """A Folium layer that draws routes from a compact encoding of geojson.
+
+    Produces the same drawing, highlighting and tooltips as the folium GeoJson
+    layer used in transit_vis.generate_folium_map, from the encoding built by
+    build_topology and build_columns. Layers that color the same routes by
+    other properties can reuse the geometry of this layer with geometry_from,
+    so it is only written to the map once.
+
+    Args:
+        data: A geojson dictionary of line features with speed data, as
+            returned by segment_store.join_speeds.
+        colormap: A Colormap object that describes what values of the
+            color_field should be mapped to what colors.
+        fields: A list of property names to show in the tooltips.
+        aliases: A list of labels for the fields in the tooltips.
+        name: The name of the layer as shown in the layer control.
+        quantization: An integer number of grid cells along each axis.
+        color_field: The name of the property the routes are colored by; it
+            must be one of the fields.
+        geometry_from: Another CompactRouteLayer of the same features, added
+            to the map before this one, to take the geometry from; or None to
+            encode the geometry in this layer.
+        show: Whether the layer is shown when the map is opened.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        {% if this.geometry_from is none %}
+        var {{ this.get_name() }}_latlngs = (function() {
+            var topology = {{ this.topology_json }};
+            {{ this.decode_js }}
+            return decodeTopology(topology);
+        })();
+        {% endif %}
+        var {{ this.get_name() }} = (function() {
+            var columns = {{ this.columns_json }};
+            var aliases = {{ this.aliases_json }};
+            {{ this.escape_js }}
+            function tooltip(row) {
+                var html = '<table>';
+                Object.keys(columns.fields).forEach(function(field, j) {
+                    var value = columns.fields[field][row];
+                    html += '<tr><th>' + escapeHtml(aliases[j]) + '</th><td>' +
+                        escapeHtml(Array.isArray(value) ? value.join(', ') :
+                                   value === null ? '' : value) +
+                        '</td></tr>';
+                });
+                return html + '</table>';
+            }
+            var group = L.featureGroup();
+            {{ this.latlngs_name }}.forEach(function(latlngs, row) {
+                var color = columns.palette[columns.color[row]];
+                var style = {color: color, weight: color == 'gray' ? 1 : 3};
+                var polyline = L.polyline(latlngs, style);
+                polyline.bindTooltip(function() { return tooltip(row); }, {sticky: true});
+                polyline.on({
+                    mouseover: function(e) {
+                        e.target.setStyle({fillColor: '#ffaf00', color: 'blue', weight: 6});
+                    },
+                    mouseout: function(e) { e.target.setStyle(style); }
+                });
+                group.addLayer(polyline);
+            });
+            return group;
+        })().addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, data, colormap, fields, aliases, name=None,
+                 quantization=100000, color_field='AVG_SPEED_M_S',
+                 geometry_from=None, show=True):
+        super(CompactRouteLayer, self).__init__(
+            name=name, overlay=True, show=show)
+        self._name = 'CompactRouteLayer'
+        if color_field in fields:
+            pass
+        else:
+            raise ValueError(f"fields must include {color_field}")
+        features = data['features']
+        self.geometry_from = geometry_from
+        if geometry_from is None:
+            self.topology_json = to_script_json(
+                build_topology(features, quantization))
+            self.decode_js = DECODE_TOPOLOGY_JS
+            self.latlngs_name = f"{self.get_name()}_latlngs"
+        else:
+            self.latlngs_name = f"{geometry_from.get_name()}_latlngs"
+        self.columns_json = to_script_json(
+            build_columns(features, fields, colormap, color_field))
+        self.aliases_json = to_script_json(aliases)
+        self.escape_js = ESCAPE_HTML_JS
@@ -1,3 +1,7 @@
+-- Bus locations are partitioned by range on collectedTime, one partition per
+-- UTC day (created ahead of time by python -m transit_vis partitions), so a
+-- query for the last day only reads that day's partition. Rows that arrive
+-- before their partition exists go to the default partition.
 CREATE TABLE active_trips_study (
 	tripID integer,
 	vehicleID integer,
@@ -11,6 +15,10 @@ CREATE TABLE active_trips_study (
 	nextStop integer,
 	locationTime integer,
 	collectedTime integer
-);
+) PARTITION BY RANGE (collectedTime);
+CREATE TABLE active_trips_study_default PARTITION OF active_trips_study DEFAULT;
 CREATE INDEX tripid_idx ON active_trips_study (tripid);
-CREATE INDEX loctime_idx ON active_trips_study (locationTime);
\ No newline at end of file
+CREATE INDEX loctime_idx ON active_trips_study (locationTime);
+-- Rows are inserted in collection order, so a BRIN index is a few pages per
+-- partition and still skips the blocks outside a time range
+CREATE INDEX collectedtime_brin_idx ON active_trips_study USING BRIN (collectedTime);
\ No newline at end of file
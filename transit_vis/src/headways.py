@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Measures headways between buses and how often they bunch, from their pings.
+
+The headway at a point on a route is the time between one bus passing it and
+the next bus in the same direction passing it. Every route is split into
+stretches BUCKET_M long (by the tripdistance of the pings), and the time each
+trip passed the start of each stretch is interpolated between the two pings
+on either side of it, so buses are compared at the same place even though
+their pings are not. Sorting the crossings by (route, direction, stretch,
+time) puts the buses that followed each other next to each other, so every
+headway of the day is one np.diff, and the headways are then summarized by
+route with a second sort and np.add.reduceat. Nothing is compared pairwise,
+so a full day of pings takes seconds. A headway shorter than
+BUNCHED_HEADWAY_S means the two buses were bunched.
+"""
+
+
+import numpy as np
+
+
+# Length of the stretches of route that headways are measured at, in meters
+BUCKET_M = 400.0
+
+# Headways shorter than this, in seconds, count as bunched buses
+BUNCHED_HEADWAY_S = 120
+
+# Headways longer than this are breaks in service rather than headways
+MAX_HEADWAY_S = 2 * 60 * 60
+
+# Consecutive pings of a trip further apart than this are not interpolated
+MAX_PING_GAP_S = 300
+
+
+def bucket_crossings(trip_ids, distances, times, bucket_m=BUCKET_M):
+    """Interpolates when each trip passed the start of each stretch of route.
+
+    Args:
+        trip_ids: An array with the trip id of each ping.
+        distances: An array with the distance along its trip of each ping, in
+            meters.
+        times: An array with the epoch time of each ping.
+        bucket_m: The length of each stretch of route, in meters.
+
+    Returns:
+        A tuple of arrays with one value per crossing: the index of the ping
+        just before the crossing, the number of the stretch whose start was
+        crossed, and the epoch time of the crossing.
+    """
+    trip_ids = np.asarray(trip_ids)
+    distances = np.asarray(distances, dtype=float)
+    times = np.asarray(times, dtype=float)
+    order = np.lexsort((times, trip_ids))
+    trip_ids = trip_ids[order]
+    distances = distances[order]
+    times = times[order]
+
+    # Count the stretch starts passed between each ping and the next
+    buckets = np.floor(distances / bucket_m).astype(np.int64)
+    moving = (trip_ids[1:] == trip_ids[:-1]) \
+        & (times[1:] - times[:-1] <= MAX_PING_GAP_S) \
+        & (buckets[1:] > buckets[:-1])
+    num_crossed = np.where(moving, buckets[1:] - buckets[:-1], 0)
+
+    # Make one row per crossing, and interpolate its time
+    pairs = np.repeat(np.arange(len(num_crossed)), num_crossed)
+    steps = np.arange(num_crossed.sum()) \
+        - np.repeat(np.cumsum(num_crossed) - num_crossed, num_crossed)
+    crossed = buckets[pairs] + 1 + steps
+    share = (crossed * bucket_m - distances[pairs]) \
+        / (distances[pairs + 1] - distances[pairs])
+    crossing_times = times[pairs] + share * (times[pairs + 1] - times[pairs])
+    return order[pairs], crossed, crossing_times
+
+def group_starts(*keys):
+    """Finds where each run of equal keys starts in sorted key arrays.
+
+    Args:
+        keys: Arrays of equal length, sorted together.
+
+    Returns:
+        An array of the index of the first row of each group.
+    """
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    if len(changed) > 0:
+        changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changed)
+
+def route_headways(pings, bucket_m=BUCKET_M, bunched_s=BUNCHED_HEADWAY_S):
+    """Summarizes the headways and bunching of each route from its pings.
+
+    Args:
+        pings: A Pandas Dataframe of bus locations with route_id,
+            trip_short_name, direction_id, tripid, tripdistance and
+            locationtime columns, such as the RDS results joined to the GTFS
+            trips by summarize_rds.join_gtfs_route_info.
+        bucket_m: The length of the stretches of route headways are measured
+            at, in meters.
+        bunched_s: Headways shorter than this, in seconds, count as bunched.
+
+    Returns:
+        A list of dictionaries with the route_id, trip_short_name, number of
+        headways measured (headway_count), median headway in whole seconds
+        (median_headway_s) and share of headways that were bunched (as a
+        string rounded to 0.001, bunching_rate) of each route with at least
+        one headway, sorted by route_id and trip_short_name. Pings without a
+        route_id or trip_short_name are left out.
+    """
+    pings = pings.dropna(subset=['route_id', 'trip_short_name'])
+    ping_index, buckets, crossing_times = bucket_crossings(
+        pings['tripid'].to_numpy(),
+        pings['tripdistance'].to_numpy(dtype=float),
+        pings['locationtime'].to_numpy(dtype=float),
+        bucket_m)
+    short_names, name_codes = np.unique(
+        pings['trip_short_name'].to_numpy(dtype=str), return_inverse=True)
+    route_ids = pings['route_id'].to_numpy(dtype=np.int64)[ping_index]
+    name_codes = name_codes[ping_index]
+    directions = pings['direction_id'].fillna(-1).to_numpy(dtype=np.int64)[ping_index]
+
+    # Buses that passed the same place one after the other end up adjacent
+    order = np.lexsort((crossing_times, buckets, directions, name_codes, route_ids))
+    route_ids = route_ids[order]
+    name_codes = name_codes[order]
+    directions = directions[order]
+    buckets = buckets[order]
+    crossing_times = crossing_times[order]
+    same_place = (route_ids[1:] == route_ids[:-1]) \
+        & (name_codes[1:] == name_codes[:-1]) \
+        & (directions[1:] == directions[:-1]) \
+        & (buckets[1:] == buckets[:-1])
+    headways = np.diff(crossing_times)
+    keep = same_place & (headways <= MAX_HEADWAY_S)
+    headways = headways[keep]
+    route_ids = route_ids[1:][keep]
+    name_codes = name_codes[1:][keep]
+    if len(headways) == 0:
+        return []
+
+    # Summarize the headways of each route from one more sort
+    order = np.lexsort((headways, name_codes, route_ids))
+    headways = headways[order]
+    route_ids = route_ids[order]
+    name_codes = name_codes[order]
+    starts = group_starts(route_ids, name_codes)
+    counts = np.diff(np.append(starts, len(headways)))
+    bunching_rates = np.add.reduceat(
+        (headways < bunched_s).astype(np.int64), starts) / counts
+    medians = (headways[starts + (counts - 1) // 2]
+               + headways[starts + counts // 2]) / 2
+    return [
+        {'route_id': int(route_id),
+         'trip_short_name': str(short_names[name_code]),
+         'headway_count': int(count),
+         'median_headway_s': int(round(float(median))),
+         'bunching_rate': str(round(float(bunching_rate), 3))}
+        for route_id, name_code, count, median, bunching_rate in zip(
+            route_ids[starts], name_codes[starts], counts, medians,
+            bunching_rates)]
@@ -14,9 +14,7 @@ aggregate bus speeds to each route, and transit_vis can plot them on a map.
 
 import json
 
-import boto3
-
-from transit_vis.src import config as cfg
+from transit_vis.src import clients
 
 
 def replace_floats(obj):
@@ -48,18 +46,14 @@ def connect_to_dynamo():
     """Connects to the dynamodb resource specified in config.py.
 
     Uses the AWS login information stored in config.py to attempt a connection
-    to dynamodb using the boto3 library.
+    to dynamodb using the boto3 library, through the pooled resource shared
+    with the rest of the process in clients.py.
 
     Returns:
         A boto3 Resource object pointing to dynamodb for the specified
         AWS account.
     """
-    dynamodb = boto3.resource(
-        'dynamodb',
-        region_name=cfg.REGION,
-        aws_access_key_id=cfg.ACCESS_ID,
-        aws_secret_access_key=cfg.ACCESS_KEY)
-    return dynamodb
+    return clients.get_resource('dynamodb')
 
 def create_dynamo_table(dynamodb_resource, table_name):
     """Creates a new table for segments on a specified dynamodb resource.
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=E1101
+# pylint: disable=E0611
+# pylint: disable=E0401
+"""Serves the speed map from a long running local web server.
+
+Saving the map with transit_vis.main_function reparses the route network and
+census tracts and rewrites the whole html file every time the speeds change.
+This server instead keeps the parsed routes, census tracts and latest speeds
+in memory, and serves the map as a small html page that loads three layers as
+separate json endpoints:
+    /layers/routes.json: the route geometry, encoded with compact_layer
+    /layers/census.json: the simplified tracts with their income and color
+    /layers/speeds.json: the speed, color and tooltip of each route
+The routes and census layers are built once. The speeds layer is only rebuilt
+when the speed data changes, which is checked at most once per refresh
+interval. Each layer is built under its own lock, so a speeds refresh does not
+hold up requests for the other layers. Each response has an ETag (one for the
+gzip encoding and one for the plain body, with Vary: Accept-Encoding), so
+browsers revalidate a layer they already have and get an empty 304 response if
+it has not changed.
+
+Usage: python -m transit_vis serve [options]
+"""
+
+
+import gzip
+import hashlib
+import http.server
+import os
+import threading
+import time
+
+import branca.colormap as cm
+import pandas as pd
+
+from transit_vis.src import census_data
+from transit_vis.src import compact_layer
+from transit_vis.src import segment_store
+from transit_vis.src import speed_analytics
+from transit_vis.src import topology
+from transit_vis.src import transit_vis
+
+
+# The page that draws the map in the browser from the three layers
+MAP_PAGE = u"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>King County Metro Speeds</title>
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+<style>
+html, body, #map {width: 100%; height: 100%; margin: 0; padding: 0;}
+.panel {position: fixed; z-index: 1000; background: white; opacity: 0.9;
+        font: 11px sans-serif; padding: 4px;}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="histogram" class="panel" style="bottom: 0px; left: 0px;"></div>
+<div id="legend" class="panel" style="top: 10px; right: 60px;"></div>
+<script>
+__DECODE_TOPOLOGY_JS__
+__ESCAPE_HTML_JS__
+var refreshMs = __REFRESH_MS__;
+var map = L.map('map', {preferCanvas: true}).setView([47.606209, -122.332069], 11);
+L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    attribution: '&copy; OpenStreetMap contributors'}).addTo(map);
+var control = L.control.layers(null, null).addTo(map);
+var routes = L.featureGroup().addTo(map);
+var polylines = [];
+var speeds = null;
+
+function getJson(path) {
+    return fetch(path, {cache: 'no-cache'}).then(function(r) { return r.json(); });
+}
+function tooltip(row) {
+    var html = '<table>';
+    Object.keys(speeds.columns.fields).forEach(function(field, j) {
+        var value = speeds.columns.fields[field][row];
+        html += '<tr><th>' + escapeHtml(speeds.aliases[j]) + '</th><td>' +
+            escapeHtml(Array.isArray(value) ? value.join(', ') :
+                       value === null ? '' : value) + '</td></tr>';
+    });
+    return html + '</table>';
+}
+function routeStyle(row) {
+    return {
+        color: speeds.columns.palette[speeds.columns.color[row]],
+        weight: speeds.columns.fields.AVG_SPEED_M_S[row] == 0 ? 1 : 3};
+}
+function drawPanels() {
+    document.getElementById('histogram').innerHTML = speeds.histogram;
+    document.getElementById('legend').innerHTML =
+        '<div>Average Speed (m/s)</div>' +
+        '<div style="width: 200px; height: 10px; background: linear-gradient(to right, ' +
+        speeds.colormap.colors.join(', ') + ');"></div>' +
+        '<span>' + speeds.colormap.vmin + '</span>' +
+        '<span style="float: right;">' + speeds.colormap.vmax + '</span>';
+}
+function updateSpeeds(data) {
+    if (speeds.version === data.version) { return; }
+    speeds = data;
+    polylines.forEach(function(polyline, row) { polyline.setStyle(routeStyle(row)); });
+    drawPanels();
+}
+getJson('/layers/census.json').then(function(census) {
+    var tracts = L.geoJson(census, {
+        style: function(feature) {
+            return {fillColor: feature.properties.fill, fillOpacity: 0.7,
+                    color: 'black', weight: 1, opacity: 0.4};
+        },
+        onEachFeature: function(feature, layer) {
+            layer.bindTooltip(
+                'Mean Income (usd): ' + escapeHtml(feature.properties.mean_income));
+        }
+    }).addTo(map);
+    tracts.bringToBack();
+    control.addOverlay(tracts, 'Socioeconomic Data');
+});
+Promise.all([getJson('/layers/routes.json'), getJson('/layers/speeds.json')])
+    .then(function(layers) {
+        speeds = layers[1];
+        decodeTopology(layers[0]).forEach(function(latlngs, row) {
+            var polyline = L.polyline(latlngs, routeStyle(row));
+            polyline.bindTooltip(function() { return tooltip(row); }, {sticky: true});
+            polyline.on({
+                mouseover: function(e) {
+                    e.target.setStyle({fillColor: '#ffaf00', color: 'blue', weight: 6});
+                },
+                mouseout: function(e) { e.target.setStyle(routeStyle(row)); }
+            });
+            routes.addLayer(polyline);
+            polylines.push(polyline);
+        });
+        control.addOverlay(routes, 'King Country Metro Speed Data');
+        drawPanels();
+        setInterval(function() { getJson('/layers/speeds.json').then(updateSpeeds); }, refreshMs);
+    });
+</script>
+</body>
+</html>
+"""
+
+
+def encode_response(body):
+    """Prepares a response body to be served with an ETag.
+
+    Args:
+        body: The bytes of the response.
+
+    Returns:
+        A dictionary with the 'body', a 'gzip' compressed copy of the body, an
+        'etag' computed from the contents of the body, and a 'gzip_etag' for
+        the compressed copy, since it is a different representation.
+    """
+    digest = hashlib.sha1(body).hexdigest()
+    return {
+        'body': body,
+        'gzip': gzip.compress(body),
+        'etag': f'"{digest}"',
+        'gzip_etag': f'"{digest}-gz"'}
+
+class MapLayers:
+    """The layers of the map, kept in memory and rebuilt only when stale.
+
+    Args:
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+        census_path: A string path to the geojson TIGER shapefile that the
+            census table was prepared for by census_data.prepare_census_data,
+            not including file type ending (.geojson).
+        get_speed_version: A function that returns a value which changes
+            whenever the speed data changes (e.g. the last_updated time of the
+            dynamodb table). It should be cheap to call.
+        load_speeds: A function that returns the current speed lookup, with
+            (route id, local express code) keys as returned by
+            transit_vis.cached_table_to_lookup.
+        refresh_interval: The least number of seconds between checks of the
+            speed version.
+    """
+    def __init__(self, segment_path, census_path, get_speed_version,
+                 load_speeds, refresh_interval=300):
+        self.segment_path = segment_path
+        self.census_path = census_path
+        self.get_speed_version = get_speed_version
+        self.load_speeds = load_speeds
+        self.refresh_interval = refresh_interval
+        self.speed_version = None
+        self.last_checked = None
+        self.route_mtime = None
+        self.speeds_route_mtime = None
+        self.responses = {}
+        self.locks = {
+            name: threading.Lock() for name in ['routes', 'census', 'speeds']}
+
+    def build_routes(self):
+        """Encodes the route geometry; rebuilt only if the route file changes.
+
+        Returns:
+            A dictionary as returned by encode_response.
+        """
+        segments = segment_store.load_segments(self.segment_path)
+        if self.route_mtime != segments['mtime'] or 'routes' not in self.responses:
+            route_topology = compact_layer.build_topology(
+                segments['kcm_routes']['features'])
+            self.responses['routes'] = encode_response(
+                compact_layer.to_script_json(route_topology).encode())
+            self.route_mtime = segments['mtime']
+        return self.responses['routes']
+
+    def build_census(self):
+        """Builds the tract layer with a fill color for each tract's income.
+
+        Returns:
+            A dictionary as returned by encode_response.
+        """
+        if 'census' in self.responses:
+            return self.responses['census']
+        tracts_df = census_data.load_census_data(self.census_path)
+        tracts_df = tracts_df[['GEO_ID', 'mean_income']].copy()
+        tracts_df['GEO_ID'] = tracts_df['GEO_ID'].astype(str)
+        tracts_df['mean_income'] = pd.to_numeric(
+            tracts_df['mean_income'], errors='coerce')
+        tracts_df = tracts_df.dropna()
+        segments = segment_store.load_segments(self.segment_path)
+        tract_layer = census_data.prepare_tract_layer(
+            self.census_path,
+            tracts_df,
+            topology.geojson_bbox(segments['kcm_routes']))
+        incomes = dict(zip(tracts_df['GEO_ID'], tracts_df['mean_income']))
+        colormap = cm.linear.PuBu_09.scale(
+            tracts_df['mean_income'].min(), tracts_df['mean_income'].max())
+        features = []
+        for feature in tract_layer['features']:
+            income = incomes[str(feature['properties']['GEOID10'])]
+            features.append({
+                'type': 'Feature',
+                'properties': {
+                    'GEOID10': feature['properties']['GEOID10'],
+                    'mean_income': int(income),
+                    'fill': colormap(income)},
+                'geometry': feature['geometry']})
+        self.responses['census'] = encode_response(
+            compact_layer.to_script_json(
+                {'type': 'FeatureCollection', 'features': features}).encode())
+        return self.responses['census']
+
+    def build_speeds(self):
+        """Rebuilds the speeds layer if the speed data has changed.
+
+        The speed version is checked at most once per refresh interval, and
+        the speeds are only downloaded and joined to the routes when it has
+        changed. The speed columns are in feature order, so they are also
+        rebuilt when the routes layer was rebuilt.
+
+        Returns:
+            A dictionary as returned by encode_response.
+        """
+        self.get('routes')
+        current = 'speeds' in self.responses \
+            and self.speeds_route_mtime == self.route_mtime
+        now = time.monotonic()
+        if current and now - self.last_checked < self.refresh_interval:
+            return self.responses['speeds']
+        self.last_checked = now
+        version = self.get_speed_version()
+        if current and version == self.speed_version:
+            return self.responses['speeds']
+        route_mtime = self.route_mtime
+
+        speed_lookup = self.load_speeds()
+        enriched, speeds = segment_store.join_speeds(
+            speed_lookup, self.segment_path)
+        speed_analytics.add_trend_properties(
+            enriched, speed_analytics.route_trends(speed_lookup))
+        colormap = transit_vis.speed_colormap(speeds)
+        speed_layer = {
+            'version': str(version),
+            'columns': compact_layer.build_columns(
+                enriched['features'],
+                transit_vis.ROUTE_TOOLTIP_FIELDS + speed_analytics.TREND_FIELDS,
+                colormap),
+            'aliases': transit_vis.ROUTE_TOOLTIP_ALIASES \
+                + speed_analytics.TREND_ALIASES,
+            'colormap': {
+                'vmin': colormap.vmin,
+                'vmax': colormap.vmax,
+                'colors': [colormap(speed) for speed in (
+                    colormap.vmin,
+                    (colormap.vmin + colormap.vmax) / 2,
+                    colormap.vmax)]},
+            'histogram': transit_vis.speed_histogram_svg(
+                [feature['properties']['AVG_SPEED_M_S']
+                 for feature in enriched['features']])}
+        self.responses['speeds'] = encode_response(
+            compact_layer.to_script_json(speed_layer).encode())
+        self.speed_version = version
+        self.speeds_route_mtime = route_mtime
+        return self.responses['speeds']
+
+    def get(self, name):
+        """Returns a layer of the map, building it first if needed.
+
+        Only one thread builds each layer at a time, but different layers are
+        built at the same time.
+
+        Args:
+            name: One of 'routes', 'census' or 'speeds'.
+
+        Returns:
+            A dictionary as returned by encode_response.
+        """
+        builders = {
+            'routes': self.build_routes,
+            'census': self.build_census,
+            'speeds': self.build_speeds}
+        if name in builders:
+            pass
+        else:
+            raise KeyError(f"no layer named {name}")
+        with self.locks[name]:
+            return builders[name]()
+
+def make_handler(map_layers, refresh_interval):
+    """Creates a request handler class that serves the map and its layers.
+
+    Args:
+        map_layers: A MapLayers object holding the layers to serve.
+        refresh_interval: The number of seconds between checks for new speeds
+            by the page in the browser.
+
+    Returns:
+        A subclass of http.server.BaseHTTPRequestHandler.
+    """
+    page = encode_response(
+        MAP_PAGE.replace(
+            '__DECODE_TOPOLOGY_JS__', compact_layer.DECODE_TOPOLOGY_JS).replace(
+                '__ESCAPE_HTML_JS__', compact_layer.ESCAPE_HTML_JS).replace(
+                    '__REFRESH_MS__', str(int(refresh_interval * 1000))).encode())
+
+    class MapRequestHandler(http.server.BaseHTTPRequestHandler):
+        """Serves the map page and the json layers with ETags."""
+        def do_GET(self):
+            """Responds to a GET request for the page or one of the layers."""
+            path = self.path.split('?')[0]
+            if path in ('/', '/index.html'):
+                response, content_type = page, 'text/html; charset=utf-8'
+            elif path.startswith('/layers/') and path.endswith('.json'):
+                try:
+                    response = map_layers.get(path[len('/layers/'):-len('.json')])
+                except KeyError:
+                    self.send_error(404)
+                    return
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+            body, etag = response['body'], response['etag']
+            if use_gzip:
+                body, etag = response['gzip'], response['gzip_etag']
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Vary', 'Accept-Encoding')
+                self.end_headers()
+                return
+            self.send_response(200)
+            if use_gzip:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args): # pylint: disable=W0622
+            """Only log requests that failed."""
+            if len(args) > 1 and str(args[1]).startswith(('4', '5')):
+                super().log_message(format, *args)
+
+    return MapRequestHandler
+
+def make_server(map_layers, host='127.0.0.1', port=8000, refresh_interval=300):
+    """Creates a threaded http server for the map without starting it.
+
+    Args:
+        map_layers: A MapLayers object holding the layers to serve.
+        host: The address to listen on.
+        port: The port to listen on, or 0 to pick any free port.
+        refresh_interval: The number of seconds between checks for new speeds
+            by the page in the browser.
+
+    Returns:
+        A ThreadingHTTPServer; call serve_forever to start handling requests.
+    """
+    return http.server.ThreadingHTTPServer(
+        (host, port),
+        make_handler(map_layers, refresh_interval))
+
+def serve_map(
+        table_name,
+        s0801_path,
+        s1902_path,
+        segment_path,
+        census_path,
+        host='127.0.0.1',
+        port=8000,
+        refresh_interval=300):
+    """Prepares the map layers and serves them until interrupted.
+
+    Args:
+        table_name: The name of the dynamodb table containing speed data.
+        s0801_path: A string path to the location of the raw s0801 data, not
+            including file type ending (.csv).
+        s1902_path: A string path to the location of the raw s1902 data, not
+            including file type ending (.csv).
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data.
+        census_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, containing polygon data for census tracts
+            in the state of Washington.
+        host: The address to listen on.
+        port: The port to listen on.
+        refresh_interval: The least number of seconds between checks of the
+            dynamodb table for new speeds.
+
+    Returns:
+        1 when the server has been shut down.
+    """
+    print("Preparing census data...")
+    census_data.prepare_census_data(s0801_path, s1902_path, census_path)
+    print("Connecting to dynamodb...")
+    table = transit_vis.connect_to_dynamo_table(table_name)
+    cache_path = f"{os.path.dirname(segment_path)}/{table_name}_lookup_tmp.json.gz"
+    map_layers = MapLayers(
+        segment_path,
+        census_path,
+        get_speed_version=lambda: transit_vis.get_table_last_updated(table),
+        load_speeds=lambda: transit_vis.cached_table_to_lookup(
+            table, cache_path, total_segments=4),
+        refresh_interval=refresh_interval)
+    print("Building map layers...")
+    for name in ('routes', 'census', 'speeds'):
+        map_layers.get(name)
+    server = make_server(map_layers, host, port, refresh_interval)
+    print(f"Serving map at http://{host}:{server.server_address[1]}/ "
+          "(press Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 1
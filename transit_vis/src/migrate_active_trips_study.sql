@@ -0,0 +1,57 @@
+-- Moves an existing unpartitioned active_trips_study table into the daily
+-- partitioned layout of create_gtfs_tables.sql (requires PostgreSQL 11+).
+-- The old table is kept as active_trips_study_unpartitioned; drop it once
+-- the row counts of the two tables have been checked to match. Afterwards run
+-- python -m transit_vis partitions to create the partitions of coming days.
+BEGIN;
+
+ALTER TABLE active_trips_study RENAME TO active_trips_study_unpartitioned;
+ALTER INDEX tripid_idx RENAME TO tripid_unpartitioned_idx;
+ALTER INDEX loctime_idx RENAME TO loctime_unpartitioned_idx;
+
+CREATE TABLE active_trips_study (
+	tripID integer,
+	vehicleID integer,
+	lat float,
+	lon float,
+	orientation integer,
+	scheduleDeviation integer,
+	totalTripDistance float,
+	tripDistance float,
+	closestStop integer,
+	nextStop integer,
+	locationTime integer,
+	collectedTime integer
+) PARTITION BY RANGE (collectedTime);
+CREATE TABLE active_trips_study_default PARTITION OF active_trips_study DEFAULT;
+
+-- One partition for each UTC day that has data, named like
+-- trip_partitions.partition_name
+DO $$
+DECLARE
+	day_start integer;
+BEGIN
+	FOR day_start IN
+		SELECT DISTINCT collectedTime - collectedTime % 86400
+		FROM active_trips_study_unpartitioned
+		WHERE collectedTime IS NOT NULL
+		ORDER BY 1
+	LOOP
+		EXECUTE format(
+			'CREATE TABLE %I PARTITION OF active_trips_study FOR VALUES FROM (%s) TO (%s)',
+			'active_trips_study_p' || to_char(to_timestamp(day_start) AT TIME ZONE 'UTC', 'YYYYMMDD'),
+			day_start,
+			day_start + 86400);
+	END LOOP;
+END $$;
+
+-- Copy in collection order so the BRIN index ranges stay narrow
+INSERT INTO active_trips_study
+SELECT * FROM active_trips_study_unpartitioned ORDER BY collectedTime;
+
+-- Indexes are faster to build once the data is loaded
+CREATE INDEX tripid_idx ON active_trips_study (tripid);
+CREATE INDEX loctime_idx ON active_trips_study (locationTime);
+CREATE INDEX collectedtime_brin_idx ON active_trips_study USING BRIN (collectedTime);
+
+COMMIT;
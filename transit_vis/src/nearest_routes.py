@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Finds the bus routes closest to a point with a grid index of route vertices.
+
+Every vertex of the route network is projected to meters and sorted by the
+cell of a uniform grid that it falls in. A query only looks at the vertices in
+the cells around the point, in rings of cells that grow outwards until the k
+closest routes are known for certain, so it takes about a millisecond instead
+of measuring the distance to every vertex. The index for a route file
+is built once per process and rebuilt only if the file changes.
+"""
+
+
+import numpy as np
+
+from transit_vis.src import compact_layer
+from transit_vis.src import segment_store
+from transit_vis.src import tract_join
+
+
+# Vertex indexes already built during this process, keyed by route file path
+_VERTEX_INDEXES = {}
+
+
+def build_vertex_index(features, cell_size=250.0):
+    """Builds a grid index over the vertices of route features.
+
+    Args:
+        features: A list of geojson route features with line geometry and
+            ROUTE_ID and LOCAL_EXPR properties.
+        cell_size: The width and height of a grid cell in meters.
+
+    Returns:
+        A dictionary with the projection latitude 'lat_0', the grid 'origin',
+        'cell_size' and 'shape', the projected 'points' sorted by cell, the
+        'cells' (flat cell number) and 'routes' (route number) of each point,
+        the 'starts' of each cell in points, the route 'keys' and their
+        'key_numbers', and the 'feature_routes' (route number of each
+        feature).
+    """
+    keys = []
+    key_numbers = {}
+    feature_routes = np.zeros(len(features), dtype=np.int64)
+    lines = []
+    line_routes = []
+    for i, feature in enumerate(features):
+        key = (feature['properties']['ROUTE_ID'], feature['properties']['LOCAL_EXPR'])
+        if key not in key_numbers:
+            key_numbers[key] = len(keys)
+            keys.append(key)
+        feature_routes[i] = key_numbers[key]
+        for line in compact_layer.feature_lines(feature):
+            lines.append(np.asarray(line, dtype=float)[:, :2])
+            line_routes.append(np.full(len(line), key_numbers[key]))
+    lonlats = np.concatenate(lines) if len(lines) > 0 else np.zeros((0, 2))
+    routes = np.concatenate(line_routes) if len(lines) > 0 \
+        else np.zeros(0, dtype=np.int64)
+    lat_0 = float(lonlats[:, 1].mean()) if len(lonlats) > 0 else 0.0
+    points = tract_join.project_points(lonlats, lat_0)
+    origin = points.min(axis=0) if len(points) > 0 else np.zeros(2)
+    cell_xy = np.floor((points - origin) / cell_size).astype(np.int64)
+    shape = cell_xy.max(axis=0) + 1 if len(points) > 0 \
+        else np.ones(2, dtype=np.int64)
+    cells = cell_xy[:, 0] * shape[1] + cell_xy[:, 1]
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    starts = np.searchsorted(cells, np.arange(shape[0] * shape[1] + 1))
+    return {
+        'lat_0': lat_0,
+        'origin': origin,
+        'cell_size': cell_size,
+        'shape': shape,
+        'points': points[order],
+        'cells': cells,
+        'routes': routes[order],
+        'starts': starts,
+        'keys': keys,
+        'key_numbers': key_numbers,
+        'feature_routes': feature_routes}
+
+def load_vertex_index(segment_path, cell_size=250.0):
+    """Returns the vertex index of a route file, building it only if needed.
+
+    Args:
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+        cell_size: The width and height of a grid cell in meters.
+
+    Returns:
+        A vertex index as returned by build_vertex_index.
+    """
+    segments = segment_store.load_segments(segment_path)
+    cached = _VERTEX_INDEXES.get(segment_path)
+    if cached is not None and cached[0] == (segments['mtime'], cell_size):
+        return cached[1]
+    vertex_index = build_vertex_index(
+        segments['kcm_routes']['features'], cell_size)
+    _VERTEX_INDEXES[segment_path] = ((segments['mtime'], cell_size), vertex_index)
+    return vertex_index
+
+def nearest_routes(vertex_index, lat, lon, k=5, max_distance=None):
+    """Finds the k routes with a vertex closest to a point.
+
+    Searches square rings of grid cells around the point, starting with the
+    cell that contains it. After searching r rings, every vertex that has not
+    been looked at is more than r cell widths away, so the search stops once
+    k routes have been found closer than that (or max_distance is reached).
+
+    Args:
+        vertex_index: A vertex index as returned by build_vertex_index.
+        lat: The latitude of the point.
+        lon: The longitude of the point.
+        k: The largest number of routes to return.
+        max_distance: Routes farther than this many meters are left out, or
+            None for no limit.
+
+    Returns:
+        A list of up to k (route key, distance in meters) tuples, closest
+        first, where the route key is (route id, local express code).
+    """
+    if k >= 1:
+        pass
+    else:
+        raise ValueError('k must be at least 1')
+    point = tract_join.project_points([[lon, lat]], vertex_index['lat_0'])[0]
+    cell_size = vertex_index['cell_size']
+    shape = vertex_index['shape']
+    center = np.floor((point - vertex_index['origin']) / cell_size).astype(np.int64)
+    # The first ring that reaches the grid, and the ring that covers all of it
+    min_ring = int(max(0, -center[0], -center[1],
+                       center[0] - shape[0] + 1, center[1] - shape[1] + 1))
+    max_ring = int(max(
+        center[0], shape[0] - 1 - center[0], center[1], shape[1] - 1 - center[1],
+        0))
+    if max_distance is not None:
+        max_ring = min(max_ring, int(np.ceil(max_distance / cell_size)))
+
+    num_routes = len(vertex_index['keys'])
+    best = np.full(num_routes, np.inf)
+    for ring in range(min_ring, max_ring + 1):
+        # The cells at Chebyshev distance ring from the center, inside the grid
+        low = np.maximum(center - ring, 0)
+        high = np.minimum(center + ring, shape - 1)
+        grid_x, grid_y = np.meshgrid(
+            np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1),
+            indexing='ij')
+        on_ring = (np.abs(grid_x - center[0]) == ring) \
+            | (np.abs(grid_y - center[1]) == ring)
+        cells = (grid_x * shape[1] + grid_y)[on_ring]
+        if len(cells) > 0:
+            starts = vertex_index['starts'][cells]
+            counts = vertex_index['starts'][cells + 1] - starts
+            positions = np.arange(counts.sum()) \
+                - np.repeat(np.cumsum(counts) - counts, counts) \
+                + np.repeat(starts, counts)
+            offsets = vertex_index['points'][positions] - point
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            np.minimum.at(best, vertex_index['routes'][positions], distances)
+        # Every vertex not yet searched is at least this far away
+        searched = ring * cell_size
+        if np.count_nonzero(best <= searched) >= k:
+            break
+
+    if max_distance is not None:
+        best[best > max_distance] = np.inf
+    found = np.flatnonzero(np.isfinite(best))
+    found = found[np.argsort(best[found], kind='stable')][:k]
+    return [(vertex_index['keys'][i], float(best[i])) for i in found]
+
+def route_features(vertex_index, features, route_keys):
+    """Selects the features that belong to any of a set of routes.
+
+    Args:
+        vertex_index: A vertex index built from the same features, in the same
+            order, as returned by build_vertex_index.
+        features: A list of geojson route features.
+        route_keys: An iterable of (route id, local express code) keys.
+
+    Returns:
+        A list of the features of those routes, in feature order.
+    """
+    numbers = [
+        vertex_index['key_numbers'][key] for key in route_keys
+        if key in vertex_index['key_numbers']]
+    selected = np.flatnonzero(np.isin(vertex_index['feature_routes'], numbers))
+    return [features[i] for i in selected]
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Runs the stages of the tool as a graph, saving what each stage makes.
+
+Each stage is a dictionary with a 'name', the names of the artifacts it reads
+('inputs') and makes ('outputs'), the 'params' that change what it makes, and
+a 'run' function that takes the input artifacts as keyword arguments and
+returns a dictionary of the output artifacts:
+    {'name': 'preprocess',
+     'inputs': ['raw_results'],
+     'outputs': ['daily_results'],
+     'params': {},
+     'run': lambda raw_results: {'daily_results': clean(raw_results)}}
+The key of a stage is a hash of its name, its params and the keys of the
+stages that made its inputs, so it changes whenever anything upstream of it
+changes. Each output is pickled to {artifact_dir}/{artifact}_{key}.pkl as
+soon as its stage finishes. When a pipeline is run again, for example after
+an upload failed, stages whose outputs were already saved under the same key
+are not run and their artifacts are loaded instead, so the run resumes after
+the last stage that finished. Stages that do not depend on each other run at
+the same time in a thread pool. A run with prune set deletes the artifacts of
+earlier runs once it finishes, so a pipeline run every day does not keep a
+copy of every day's extracts.
+"""
+
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import pickle
+
+
+def check_stages(stages):
+    """Checks that stages form a graph and sorts them so inputs come first.
+
+    Args:
+        stages: A list of stage dictionaries.
+
+    Returns:
+        A list of the stage names, each after the stages that make its inputs.
+    """
+    names = [stage['name'] for stage in stages]
+    if len(set(names)) == len(names):
+        pass
+    else:
+        raise ValueError('stage names must be unique')
+    producers = {}
+    for stage in stages:
+        if len(stage['outputs']) > 0:
+            pass
+        else:
+            raise ValueError(f"{stage['name']} must make at least one artifact")
+        for output in stage['outputs']:
+            if output not in producers:
+                pass
+            else:
+                raise ValueError(f"{output} is made by more than one stage")
+            producers[output] = stage['name']
+    for stage in stages:
+        missing = [name for name in stage['inputs'] if name not in producers]
+        if len(missing) == 0:
+            pass
+        else:
+            raise ValueError(
+                f"{stage['name']} needs {', '.join(missing)}, which no stage makes")
+
+    # Repeatedly take the stages whose inputs have all been made
+    order = []
+    remaining = list(stages)
+    while len(remaining) > 0:
+        ready = [
+            stage for stage in remaining
+            if all(producers[name] in order for name in stage['inputs'])]
+        if len(ready) > 0:
+            pass
+        else:
+            raise ValueError('stages depend on each other in a cycle')
+        order.extend(stage['name'] for stage in ready)
+        remaining = [stage for stage in remaining if stage not in ready]
+    return order
+
+def stage_keys(stages):
+    """Hashes each stage together with everything upstream of it.
+
+    Args:
+        stages: A list of stage dictionaries.
+
+    Returns:
+        A dictionary with the key of each stage name.
+    """
+    by_name = {stage['name']: stage for stage in stages}
+    producers = {
+        output: stage['name'] for stage in stages for output in stage['outputs']}
+    keys = {}
+    for name in check_stages(stages):
+        stage = by_name[name]
+        inputs = {
+            input_name: keys[producers[input_name]]
+            for input_name in stage['inputs']}
+        description = json.dumps(
+            {'name': name, 'params': stage.get('params', {}), 'inputs': inputs},
+            sort_keys=True,
+            default=str)
+        keys[name] = hashlib.sha256(description.encode('utf-8')).hexdigest()[:16]
+    return keys
+
+def file_signature(path):
+    """Describes a file well enough to tell when it changes, for stage params.
+
+    Args:
+        path: A string path to a file.
+
+    Returns:
+        A list of the absolute path, size and modification time of the file,
+        or None if it does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+def artifact_path(artifact_dir, name, key):
+    """Returns the file an artifact made by a stage with a key is saved to."""
+    return os.path.join(artifact_dir, f"{name}_{key}.pkl")
+
+def save_artifact(path, value):
+    """Pickles an artifact, replacing the file only once it is fully written.
+
+    Args:
+        path: A string path to save the artifact to.
+        value: The artifact to save.
+    """
+    with open(f"{path}.part", 'wb') as artifact_file:
+        pickle.dump(value, artifact_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.part", path)
+
+def load_artifact(path):
+    """Loads an artifact saved by save_artifact."""
+    with open(path, 'rb') as artifact_file:
+        return pickle.load(artifact_file)
+
+def prune_artifacts(stages, artifact_dir):
+    """Deletes the saved artifacts that the stages would not make now.
+
+    Args:
+        stages: A list of stage dictionaries.
+        artifact_dir: A string path to the folder artifacts are saved in.
+
+    Returns:
+        A sorted list of the names of the files deleted.
+    """
+    keys = stage_keys(stages)
+    keep = {
+        os.path.basename(artifact_path(artifact_dir, output, keys[stage['name']]))
+        for stage in stages for output in stage['outputs']}
+    removed = []
+    for file_name in sorted(os.listdir(artifact_dir)):
+        if file_name.endswith(('.pkl', '.pkl.part')) and file_name not in keep:
+            os.remove(os.path.join(artifact_dir, file_name))
+            removed.append(file_name)
+    return removed
+
+def run_stage(stage, key, artifact_dir, inputs):
+    """Runs one stage and saves each of its outputs.
+
+    Args:
+        stage: A stage dictionary.
+        key: The key of the stage from stage_keys.
+        artifact_dir: A string path to the folder artifacts are saved in.
+        inputs: A dictionary with the value of each input of the stage.
+
+    Returns:
+        A dictionary with the value of each output of the stage.
+    """
+    outputs = stage['run'](**inputs)
+    missing = [name for name in stage['outputs'] if name not in outputs]
+    if len(missing) == 0:
+        pass
+    else:
+        raise ValueError(f"{stage['name']} did not make {', '.join(missing)}")
+    for name in stage['outputs']:
+        save_artifact(artifact_path(artifact_dir, name, key), outputs[name])
+    return {name: outputs[name] for name in stage['outputs']}
+
+def run_pipeline(stages, artifact_dir, targets=None, max_workers=4,
+                 progress=print, prune=False):
+    """Runs the stages needed to make the outputs of the target stages.
+
+    Only stages whose outputs are not already saved under their current key
+    are run, and only if a target needs them. A run that fails leaves every
+    saved artifact in place, so it can be resumed.
+
+    Args:
+        stages: A list of stage dictionaries.
+        artifact_dir: A string path to the folder to save artifacts in.
+        targets: A list of the names of the stages whose outputs are wanted,
+            or None for every stage.
+        max_workers: The largest number of stages to run at once.
+        progress: A function called with a message as each stage starts.
+        prune: Whether to delete the artifacts saved under other keys, such
+            as those of earlier days, with prune_artifacts once the run
+            finishes.
+
+    Returns:
+        A dictionary with the names of the stages that were 'run' and
+        'reused', and the 'artifacts' made by the target stages.
+    """
+    order = check_stages(stages)
+    by_name = {stage['name']: stage for stage in stages}
+    producers = {
+        output: stage['name'] for stage in stages for output in stage['outputs']}
+    keys = stage_keys(stages)
+    targets = order if targets is None else targets
+    unknown = [name for name in targets if name not in by_name]
+    if len(unknown) == 0:
+        pass
+    else:
+        raise ValueError(f"unknown target stages: {', '.join(unknown)}")
+
+    def is_saved(name):
+        return all(
+            os.path.exists(artifact_path(artifact_dir, output, keys[name]))
+            for output in by_name[name]['outputs'])
+
+    # Walk up from the targets until reaching stages that were already saved
+    to_run = set()
+    reused = set()
+    pending = list(targets)
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in to_run or name in reused:
+            continue
+        if is_saved(name):
+            reused.add(name)
+            continue
+        to_run.add(name)
+        pending.extend(producers[input_name] for input_name in by_name[name]['inputs'])
+
+    values = {}
+    def get_value(name):
+        if name not in values:
+            values[name] = load_artifact(
+                artifact_path(artifact_dir, name, keys[producers[name]]))
+        return values[name]
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(done) < len(to_run):
+            for name in order:
+                stage = by_name[name]
+                if name not in to_run or name in done \
+                        or name in running.values():
+                    continue
+                if all(producers[input_name] not in to_run
+                       or producers[input_name] in done
+                       for input_name in stage['inputs']):
+                    progress(f"Running stage {name}...")
+                    inputs = {
+                        input_name: get_value(input_name)
+                        for input_name in stage['inputs']}
+                    future = executor.submit(
+                        run_stage, stage, keys[name], artifact_dir, inputs)
+                    running[future] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                values.update(future.result())
+                done.add(name)
+
+    artifacts = {
+        output: get_value(output)
+        for name in targets for output in by_name[name]['outputs']}
+    if prune:
+        prune_artifacts(stages, artifact_dir)
+    return {
+        'run': [name for name in order if name in to_run],
+        'reused': [name for name in order if name in reused],
+        'artifacts': artifacts}
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Keeps 7 and 30 day average speeds of every route up to date incrementally.
+
+Averaging the speed of every route over the last week or month from its
+historic_speeds would mean reading and processing every route's full history
+on each map build. Instead summarize_rds.py keeps the running state of the
+averages in ROLLING_PATH and uploads the averages themselves with the rest of
+each route's metrics, so the map reads them like any other field. The state
+has, for each route, a ring buffer of the speed sum and sample count of each
+of the last RING_DAYS days (day d is in slot d % RING_DAYS), and the running
+sum and count of each window in WINDOWS. Moving to a new day subtracts the
+day that falls out of each window and clears its slot, and adding a day's
+speeds adds them to its slot and every window, so each run costs the same
+for each route however long the history is. The averages are weighted by
+the number of speed samples of each day.
+"""
+
+
+import datetime
+import os
+
+import numpy as np
+
+
+# Where summarize_rds.py keeps the running state between runs
+ROLLING_PATH = './transit_vis/data/rolling_speeds.npz'
+
+# Days averaged over by each rolling window
+WINDOWS = (7, 30)
+
+# Days kept in the ring buffer of each route; the longest window
+RING_DAYS = max(WINDOWS)
+
+
+def window_field(window):
+    """Returns the name of the route field of a window's average speed."""
+    return f"avg_speed_{window}d_m_s"
+
+def empty_state():
+    """Makes the state of routes that have no speeds yet.
+
+    Returns:
+        A dictionary with the 'route_ids' and 'codes' of each route, the
+        'last_day' added (a date ordinal, or -1 before any day), the ring
+        buffers 'ring_sums' and 'ring_counts' with shape (routes, RING_DAYS),
+        and the 'window_sums' and 'window_counts' with shape
+        (routes, len(WINDOWS)).
+    """
+    return {
+        'route_ids': np.zeros(0, dtype=np.int64),
+        'codes': np.zeros(0, dtype='<U1'),
+        'last_day': -1,
+        'ring_sums': np.zeros((0, RING_DAYS)),
+        'ring_counts': np.zeros((0, RING_DAYS), dtype=np.int64),
+        'window_sums': np.zeros((0, len(WINDOWS))),
+        'window_counts': np.zeros((0, len(WINDOWS)), dtype=np.int64)}
+
+def load_state(state_path=ROLLING_PATH):
+    """Reads the state saved by save_state.
+
+    Args:
+        state_path: A string path to the state file, including file type
+            ending (.npz).
+
+    Returns:
+        A state dictionary as made by empty_state, which is empty if the file
+        does not exist.
+    """
+    if not os.path.exists(state_path):
+        return empty_state()
+    with np.load(state_path) as saved:
+        state = {name: saved[name] for name in saved.files}
+    state['last_day'] = int(state['last_day'])
+    return state
+
+def save_state(state, state_path=ROLLING_PATH):
+    """Writes the state, replacing the file only once it is fully written.
+
+    Args:
+        state: A state dictionary as made by empty_state.
+        state_path: A string path to the state file, including file type
+            ending (.npz).
+    """
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    with open(f"{state_path}.part", 'wb') as state_file:
+        np.savez(state_file, **state)
+    os.replace(f"{state_path}.part", state_path)
+
+def add_routes(state, route_keys):
+    """Adds rows without any speeds for routes the state does not have yet.
+
+    Args:
+        state: A state dictionary as made by empty_state.
+        route_keys: A list of (route id, local express code) tuples.
+
+    Returns:
+        A tuple of the state with the new rows, and an array of the row of
+        each of route_keys.
+    """
+    rows = {
+        key: i for i, key in enumerate(
+            zip(state['route_ids'].tolist(), state['codes'].tolist()))}
+    new_keys = list(dict.fromkeys(key for key in route_keys if key not in rows))
+    if len(new_keys) > 0:
+        for key in new_keys:
+            rows[key] = len(rows)
+        state = dict(state)
+        state['route_ids'] = np.append(
+            state['route_ids'], [key[0] for key in new_keys]).astype(np.int64)
+        state['codes'] = np.append(
+            state['codes'], [key[1] for key in new_keys]).astype('<U1')
+        for name in ['ring_sums', 'ring_counts', 'window_sums', 'window_counts']:
+            state[name] = np.concatenate([
+                state[name],
+                np.zeros((len(new_keys), state[name].shape[1]),
+                         dtype=state[name].dtype)])
+    return state, np.array([rows[key] for key in route_keys], dtype=np.int64)
+
+def advance_to(state, day):
+    """Moves the state forward to a new day, dropping days that leave windows.
+
+    At most RING_DAYS days are stepped through, however long it has been
+    since the last day.
+
+    Args:
+        state: A state dictionary as made by empty_state.
+        day: The date ordinal to move to.
+
+    Returns:
+        The state on the new day.
+    """
+    state = dict(state)
+    if state['last_day'] < 0:
+        state['last_day'] = day
+        return state
+    first = max(state['last_day'] + 1, day - RING_DAYS + 1)
+    for new_day in range(first, day + 1):
+        for i, window in enumerate(WINDOWS):
+            leaving = (new_day - window) % RING_DAYS
+            state['window_sums'][:, i] -= state['ring_sums'][:, leaving]
+            state['window_counts'][:, i] -= state['ring_counts'][:, leaving]
+        state['ring_sums'][:, new_day % RING_DAYS] = 0.0
+        state['ring_counts'][:, new_day % RING_DAYS] = 0
+    if day - RING_DAYS >= state['last_day']:
+        # Every day in the ring has left every window
+        state['window_sums'][:] = 0.0
+        state['window_counts'][:] = 0
+    state['last_day'] = max(state['last_day'], day)
+    return state
+
+def add_day(state, route_speeds, run_date):
+    """Adds one day's route speeds to the state.
+
+    Adding a day that was already added (such as when the summary is run
+    again on the same day) replaces its speeds.
+
+    Args:
+        state: A state dictionary as made by empty_state.
+        route_speeds: A list of route speed dictionaries with route_id,
+            trip_short_name, avg_speed_m_s and sample_count, as returned by
+            summarize_rds.aggregate_speeds.
+        run_date: A string of the date the speeds are for, i.e. '2020-12-01'.
+
+    Returns:
+        The state with the day added.
+    """
+    day = datetime.date(*[int(part) for part in run_date.split('-')]).toordinal()
+    if state['last_day'] < 0 or day > state['last_day'] - RING_DAYS:
+        pass
+    else:
+        raise ValueError(
+            f"{run_date} is more than {RING_DAYS} days before the last day added")
+    state, rows = add_routes(state, [
+        (int(track['route_id']), track['trip_short_name'][0])
+        for track in route_speeds])
+    state = advance_to(state, day)
+    counts = np.array(
+        [int(track['sample_count']) for track in route_speeds], dtype=np.int64)
+    sums = np.array(
+        [float(track['avg_speed_m_s']) for track in route_speeds]) * counts
+
+    # Replace whatever was in the day's slot, in the windows that include it
+    slot = day % RING_DAYS
+    in_window = np.array([state['last_day'] - day < window for window in WINDOWS])
+    sum_change = sums - state['ring_sums'][rows, slot]
+    count_change = counts - state['ring_counts'][rows, slot]
+    state['window_sums'][rows[:, None], np.flatnonzero(in_window)] += \
+        sum_change[:, None]
+    state['window_counts'][rows[:, None], np.flatnonzero(in_window)] += \
+        count_change[:, None]
+    state['ring_sums'][rows, slot] = sums
+    state['ring_counts'][rows, slot] = counts
+    return state
+
+def window_averages(state, route_keys):
+    """Reads the rolling average speeds of routes from the state.
+
+    Args:
+        state: A state dictionary as made by empty_state.
+        route_keys: A list of (route id, local express code) tuples.
+
+    Returns:
+        A list with a dictionary for each route of the window_field of each
+        window with any samples, as a string rounded to 0.1 m/s.
+    """
+    state, rows = add_routes(state, route_keys)
+    averages = []
+    for row in rows:
+        route_averages = {}
+        for i, window in enumerate(WINDOWS):
+            count = state['window_counts'][row, i]
+            if count > 0:
+                route_averages[window_field(window)] = str(
+                    round(float(state['window_sums'][row, i] / count), 1))
+        averages.append(route_averages)
+    return averages
+
+def update_rolling_speeds(route_metrics, run_date, state_path=ROLLING_PATH):
+    """Adds a day's speeds to the saved state and the averages to the routes.
+
+    Args:
+        route_metrics: A list of route dictionaries with route_id,
+            trip_short_name, avg_speed_m_s and sample_count, as returned by
+            summarize_rds.merge_route_metrics.
+        run_date: A string of the date the speeds are for, i.e. '2020-12-01'.
+        state_path: A string path to the state file, including file type
+            ending (.npz).
+
+    Returns:
+        A list with a copy of each route dictionary, along with the
+        window_field of each window with any samples.
+    """
+    state = add_day(load_state(state_path), route_metrics, run_date)
+    save_state(state, state_path)
+    averages = window_averages(state, [
+        (int(track['route_id']), track['trip_short_name'][0])
+        for track in route_metrics])
+    return [
+        dict(track, **route_averages)
+        for track, route_averages in zip(route_metrics, averages)]
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Estimates travel time between two points over the bus route network.
+
+Every vertex of every route feature is a node of a graph. Consecutive
+vertices of a route are joined by riding edges that take the length of the
+segment divided by the current average speed of the route. Vertices of
+different features within a short walk of each other (including shared stops,
+which are the same point) are joined by transfer edges that take the walking
+time between them. The edges are stored as compressed sparse row arrays (the
+edges leaving node i are indices[indptr[i]:indptr[i + 1]]), so the graph is
+built with a few array operations once per speed refresh and a query is an A*
+search with heapq that only visits the part of the network between the points.
+"""
+
+
+import heapq
+
+import numpy as np
+
+from transit_vis.src import compact_layer
+from transit_vis.src import tract_join
+
+
+# Walking speed on transfer edges, in m/s
+WALK_SPEED_M_S = 1.3
+
+
+def transfer_pairs(points, node_features, transfer_distance):
+    """Finds the pairs of nodes on different features within a short walk.
+
+    Nodes are bucketed in a grid with cells as wide as the transfer distance,
+    so each node only has to be compared with the nodes in the 3 by 3 block
+    of cells around it.
+
+    Args:
+        points: An array of projected node points in meters with shape (n, 2).
+        node_features: An array with the feature number of each node.
+        transfer_distance: The farthest two nodes can be apart, in meters.
+
+    Returns:
+        A tuple of source node, target node and distance arrays, with each
+        pair in both directions.
+    """
+    num_nodes = len(points)
+    if num_nodes == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), \
+            np.zeros(0)
+    cell_xy = np.floor(
+        (points - points.min(axis=0)) / transfer_distance).astype(np.int64)
+    # Pad the grid by a cell on each side so neighbors never wrap around
+    num_y = cell_xy[:, 1].max() + 3
+    keys = (cell_xy[:, 0] + 1) * num_y + cell_xy[:, 1] + 1
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sources, targets = [], []
+    for step_x in (-1, 0, 1):
+        for step_y in (-1, 0, 1):
+            neighbors = keys + step_x * num_y + step_y
+            lows = np.searchsorted(sorted_keys, neighbors, side='left')
+            counts = np.searchsorted(sorted_keys, neighbors, side='right') - lows
+            source = np.repeat(np.arange(num_nodes), counts)
+            target = order[
+                np.arange(counts.sum())
+                - np.repeat(np.cumsum(counts) - counts, counts)
+                + np.repeat(lows, counts)]
+            keep = node_features[source] != node_features[target]
+            sources.append(source[keep])
+            targets.append(target[keep])
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+    offsets = points[targets] - points[sources]
+    distances = np.hypot(offsets[:, 0], offsets[:, 1])
+    keep = distances <= transfer_distance
+    return sources[keep], targets[keep], distances[keep]
+
+def build_route_graph(features, transfer_distance=100.0,
+                      walk_speed=WALK_SPEED_M_S):
+    """Builds the speed weighted graph of a route network.
+
+    Routes with no speed data (an AVG_SPEED_M_S of 0) are ridden at the median
+    speed of the routes that have data.
+
+    Args:
+        features: A list of geojson route features with line geometry and
+            ROUTE_ID, LOCAL_EXPR, ROUTE_NUM and AVG_SPEED_M_S properties, such
+            as from segment_store.get_enriched_segments.
+        transfer_distance: The farthest apart two routes can be to transfer
+            between them, in meters.
+        walk_speed: The walking speed on transfer edges, in m/s.
+
+    Returns:
+        A dictionary with the projection latitude 'lat_0', the projected node
+        'points', the 'node_routes' (route number of each node), the route
+        'keys' and 'route_nums', the csr arrays 'indptr', 'indices' and
+        'weights' (seconds), and the 'max_speed' of any edge.
+    """
+    keys = []
+    route_nums = []
+    key_numbers = {}
+    feature_routes = np.zeros(len(features), dtype=np.int64)
+    speeds = np.zeros(len(features))
+    lines = []
+    line_features = []
+    for i, feature in enumerate(features):
+        properties = feature['properties']
+        key = (properties['ROUTE_ID'], properties['LOCAL_EXPR'])
+        if key not in key_numbers:
+            key_numbers[key] = len(keys)
+            keys.append(key)
+            route_nums.append(properties['ROUTE_NUM'])
+        feature_routes[i] = key_numbers[key]
+        speeds[i] = properties['AVG_SPEED_M_S']
+        for line in compact_layer.feature_lines(feature):
+            lines.append(np.asarray(line, dtype=float)[:, :2])
+            line_features.append(i)
+    has_speed = speeds > 0
+    speeds[~has_speed] = np.median(speeds[has_speed]) if has_speed.any() \
+        else walk_speed
+
+    lengths = np.array([len(line) for line in lines], dtype=np.int64)
+    lonlats = np.concatenate(lines) if len(lines) > 0 else np.zeros((0, 2))
+    lat_0 = float(lonlats[:, 1].mean()) if len(lonlats) > 0 else 0.0
+    points = tract_join.project_points(lonlats, lat_0)
+    num_nodes = len(points)
+    node_lines = np.repeat(np.arange(len(lines)), lengths)
+    node_features = np.repeat(
+        np.array(line_features, dtype=np.int64), lengths)
+
+    # Riding edges join consecutive vertices of the same line, both ways
+    same_line = np.flatnonzero(node_lines[1:] == node_lines[:-1])
+    ride_lengths = np.hypot(*(points[same_line + 1] - points[same_line]).T)
+    ride_seconds = ride_lengths / speeds[node_features[same_line]]
+    walk_sources, walk_targets, walk_lengths = transfer_pairs(
+        points, node_features, transfer_distance)
+    sources = np.concatenate([same_line, same_line + 1, walk_sources])
+    targets = np.concatenate([same_line + 1, same_line, walk_targets])
+    weights = np.concatenate(
+        [ride_seconds, ride_seconds, walk_lengths / walk_speed])
+
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_nodes), out=indptr[1:])
+    return {
+        'lat_0': lat_0,
+        'points': points,
+        'node_routes': feature_routes[node_features],
+        'keys': keys,
+        'route_nums': route_nums,
+        'indptr': indptr,
+        'indices': targets[order],
+        'weights': weights[order],
+        'max_speed': float(max(speeds.max(initial=0.0), walk_speed))}
+
+def nearest_node(route_graph, lat, lon):
+    """Finds the node of a route graph closest to a point.
+
+    Args:
+        route_graph: A graph as returned by build_route_graph.
+        lat: The latitude of the point.
+        lon: The longitude of the point.
+
+    Returns:
+        A tuple of the node number and its distance from the point in meters.
+    """
+    point = tract_join.project_points([[lon, lat]], route_graph['lat_0'])[0]
+    offsets = route_graph['points'] - point
+    distances = np.hypot(offsets[:, 0], offsets[:, 1])
+    node = int(np.argmin(distances))
+    return node, float(distances[node])
+
+def shortest_path(route_graph, source, target):
+    """Finds the fastest path between two nodes with an A* search.
+
+    The straight line distance to the target divided by the fastest speed in
+    the graph never overestimates the time left, so the first time the target
+    is taken off the heap its time is the shortest.
+
+    Args:
+        route_graph: A graph as returned by build_route_graph.
+        source: The node number to start from.
+        target: The node number to reach.
+
+    Returns:
+        A tuple of the travel time in seconds and the list of nodes on the
+        path, or None if the target cannot be reached.
+    """
+    offsets = route_graph['points'] - route_graph['points'][target]
+    remaining = (np.hypot(offsets[:, 0], offsets[:, 1])
+                 / route_graph['max_speed']).tolist()
+    indptr = route_graph['indptr']
+    indices = route_graph['indices']
+    weights = route_graph['weights']
+    best = {source: 0.0}
+    previous = {source: -1}
+    done = set()
+    heap = [(remaining[source], 0.0, source)]
+    while len(heap) > 0:
+        _, seconds, node = heapq.heappop(heap)
+        if node == target:
+            break
+        if node in done:
+            continue
+        done.add(node)
+        start, end = indptr[node], indptr[node + 1]
+        for neighbor, weight in zip(
+                indices[start:end].tolist(), weights[start:end].tolist()):
+            new_seconds = seconds + weight
+            if new_seconds < best.get(neighbor, np.inf):
+                best[neighbor] = new_seconds
+                previous[neighbor] = node
+                heapq.heappush(
+                    heap, (new_seconds + remaining[neighbor], new_seconds, neighbor))
+    else:
+        return None
+    path = [target]
+    while previous[path[-1]] != -1:
+        path.append(previous[path[-1]])
+    return seconds, path[::-1]
+
+def estimate_trip(route_graph, home_lat, home_lon, dest_lat, dest_lon,
+                  max_walk=800.0):
+    """Estimates the travel time on the route network between two points.
+
+    Args:
+        route_graph: A graph as returned by build_route_graph.
+        home_lat: The latitude of the start of the trip.
+        home_lon: The longitude of the start of the trip.
+        dest_lat: The latitude of the end of the trip.
+        dest_lon: The longitude of the end of the trip.
+        max_walk: The farthest either point can be from a route, in meters.
+
+    Returns:
+        A dictionary with the travel 'seconds' between the routes closest to
+        each point (riding, and walking between routes), the 'walk_m' to and
+        from those routes, the 'route_nums' ridden in order, and the [lat, lon]
+        'path', or None if either point is too far from a route or no path
+        joins them.
+    """
+    if len(route_graph['points']) == 0:
+        return None
+    source, home_walk = nearest_node(route_graph, home_lat, home_lon)
+    target, dest_walk = nearest_node(route_graph, dest_lat, dest_lon)
+    if home_walk > max_walk or dest_walk > max_walk:
+        return None
+    result = shortest_path(route_graph, source, target)
+    if result is None:
+        return None
+    seconds, path = result
+    path_routes = route_graph['node_routes'][path]
+    changes = np.flatnonzero(np.diff(path_routes, prepend=-1) != 0)
+    lonlats = route_graph['points'][path] / np.array([
+        tract_join.METERS_PER_DEGREE
+        * np.cos(np.radians(route_graph['lat_0'])),
+        tract_join.METERS_PER_DEGREE])
+    return {
+        'seconds': seconds,
+        'walk_m': home_walk + dest_walk,
+        'route_nums': [route_graph['route_nums'][i] for i in path_routes[changes]],
+        'path': lonlats[:, ::-1].tolist()}
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Keeps parsed route geometry in memory and joins speeds to it.
+
+The route geojson generated by initialize_dynamodb.py is large and does not
+change between map builds, so it is parsed once per process and kept in memory
+until the file on disk is modified. The properties of the features are kept
+as columns, along with the position of each feature's (route id, local express
+code) key in a list of the unique keys. Speeds downloaded from dynamodb are
+looked up once per route key, spread to every feature with one array take per
+property, and the features are built from the columns in a single pass. The
+enriched features are kept in memory and handed directly to the Folium map
+rather than being written back to disk, so speeds must be joined in the same
+process before they are read.
+"""
+
+
+import json
+import os
+
+import numpy as np
+
+from transit_vis.src import speed_cache
+
+
+# Parsed route files keyed by path; each entry is invalidated by file mtime
+_SEGMENT_CACHE = {}
+
+# The most recently enriched features for each route file
+_ENRICHED_SEGMENTS = {}
+
+
+def load_segments(segment_path):
+    """Parses a route geojson file, or returns it from memory if unchanged.
+
+    Along with the parsed geojson, an index is built from each (route id, local
+    express code) key to the positions of the features that have that key, and
+    the feature properties are gathered into columns.
+
+    Args:
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+
+    Returns:
+        A dictionary with the parsed geojson ('kcm_routes'), the index of
+        feature positions for each route key ('route_index'), the unique route
+        keys ('route_keys') and the position of each feature's key in them
+        ('route_codes'), an object array of each property of the features
+        ('property_columns', None where a feature does not have it), and the
+        file modification time it was parsed at ('mtime').
+    """
+    mtime = os.path.getmtime(f"{segment_path}.geojson")
+    cached = _SEGMENT_CACHE.get(segment_path)
+    if cached is not None and cached['mtime'] == mtime:
+        return cached
+    with open(f"{segment_path}.geojson", 'r') as shapefile:
+        kcm_routes = json.load(shapefile)
+    features = kcm_routes['features']
+    route_index = {}
+    for i, feature in enumerate(features):
+        route_key = (
+            feature['properties']['ROUTE_ID'],
+            feature['properties']['LOCAL_EXPR'])
+        route_index.setdefault(route_key, []).append(i)
+    route_keys = list(route_index.keys())
+    route_codes = np.zeros(len(features), dtype=np.int64)
+    for code, positions in enumerate(route_index.values()):
+        route_codes[positions] = code
+    route_index = {
+        route_key: np.array(positions)
+        for route_key, positions in route_index.items()}
+    names = dict.fromkeys(
+        name for feature in features for name in feature['properties'])
+    property_columns = {}
+    for name in names:
+        property_columns[name] = np.empty(len(features), dtype=object)
+        property_columns[name][:] = [
+            feature['properties'].get(name) for feature in features]
+    _SEGMENT_CACHE[segment_path] = {
+        'mtime': mtime,
+        'kcm_routes': kcm_routes,
+        'route_index': route_index,
+        'route_keys': route_keys,
+        'route_codes': route_codes,
+        'property_columns': property_columns}
+    _ENRICHED_SEGMENTS.pop(segment_path, None)
+    return _SEGMENT_CACHE[segment_path]
+
+def join_speeds(speed_lookup, segment_path):
+    """Attaches speeds from a route lookup to the features of a route file.
+
+    Looks up each route key once, then gives every feature the values of its
+    key with one array take per property: AVG_SPEED_M_S, HISTORIC_SPEEDS and
+    each of the speed_cache.ROUTE_METRICS in upper case (i.e. ON_TIME_SHARE).
+    New features are then built from the property columns, sharing the
+    geometry of the parsed features rather than copying it. Features without a
+    speed get an AVG_SPEED_M_S of 0 and HISTORIC_SPEEDS of [0], and metrics
+    missing from the lookup are None.
+
+    Args:
+        speed_lookup: A Dictionary object with (route id, local_express_code)
+            keys and average speed data to be plotted by Folium.
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+
+    Returns:
+        A tuple of the enriched geojson dictionary, and an array containing the
+        average speed of each feature that was paired to a route, in feature
+        order.
+    """
+    segments = load_segments(segment_path)
+    features = segments['kcm_routes']['features']
+    route_keys = segments['route_keys']
+
+    # One value per route key, and a last one for features without a speed
+    key_values = [speed_lookup.get(key) for key in route_keys] + [None]
+    key_matched = np.array([values is not None for values in key_values])
+    codes = segments['route_codes']
+    codes = np.where(key_matched[codes], codes, len(route_keys))
+    key_columns = {
+        'AVG_SPEED_M_S': [
+            0 if values is None else float(values['avg_speed_m_s'])
+            for values in key_values],
+        'HISTORIC_SPEEDS': [
+            [0] if values is None else values['historic_speeds']
+            for values in key_values]}
+    for name in speed_cache.ROUTE_METRICS:
+        key_columns[name.upper()] = [
+            None if values is None else values.get(name) for values in key_values]
+
+    columns = dict(segments['property_columns'])
+    for name, values in key_columns.items():
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        columns[name] = column[codes]
+    names = list(columns.keys())
+    enriched = dict(segments['kcm_routes'])
+    enriched['features'] = [
+        {'type': 'Feature',
+         'properties': dict(zip(names, properties)),
+         'geometry': feature['geometry']}
+        for properties, feature in zip(zip(*columns.values()), features)]
+    _ENRICHED_SEGMENTS[segment_path] = enriched
+    matched = codes < len(route_keys)
+    return enriched, columns['AVG_SPEED_M_S'][matched].astype(float)
+
+def get_enriched_segments(segment_path):
+    """Returns the features most recently enriched with speeds for a file.
+
+    Speeds must have been joined to the route file in this process with
+    join_speeds (i.e. by transit_vis.write_speeds_to_map_segments) since the
+    file last changed.
+
+    Args:
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+
+    Returns:
+        A geojson dictionary with AVG_SPEED_M_S and HISTORIC_SPEEDS properties
+        on every feature.
+    """
+    load_segments(segment_path)
+    if segment_path in _ENRICHED_SEGMENTS:
+        pass
+    else:
+        raise ValueError(
+            f"No speeds have been joined to {segment_path} in this process, "
+            "join them with transit_vis.write_speeds_to_map_segments first")
+    return _ENRICHED_SEGMENTS[segment_path]
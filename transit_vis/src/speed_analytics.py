@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Computes speed trends and anomalies for every route in a few array passes.
+
+The historic_speeds of each route (one average speed per day, oldest first, as
+appended by summarize_rds.py) have different lengths. Days without data are
+not recorded, so every window below counts the recorded days of a route, which
+may span more calendar days. Rather than loop over
+the routes, all of the histories are packed end to end into a single array,
+with an array of offsets marking where each route starts (the compressed
+sparse row layout). Every statistic is then computed for all routes at once
+with cumulative sums and np.bincount over the route number of each value:
+    rolling_mean: the mean of the last few recorded days of each history
+    trend: the least squares slope of speed against recorded day (m/s per
+        recorded day)
+    z_score: how many standard deviations the latest day is from the recorded
+        days before it
+    percent_change: the change from a number of recorded days ago to the
+        latest day
+Speeds of 0 mean there was no data, and are left out of every statistic.
+"""
+
+
+import numpy as np
+
+
+# Route properties added by add_trend_properties, and their tooltip labels.
+# The rolling mean is left out, since the tooltips already show the calendar
+# 7 and 30 day averages kept by speed_cache.
+TREND_FIELDS = ['SPEED_TREND', 'SPEED_Z_SCORE', 'SPEED_PCT_CHANGE']
+TREND_ALIASES = [
+    'Speed Trend (m/s per recorded day)', 'Latest Speed Z-Score',
+    'Speed Change Over Last 7 Recorded Days (%)']
+
+
+def pack_histories(speed_lookup):
+    """Packs the speed history of every route into one flat array.
+
+    Args:
+        speed_lookup: A dictionary with (route id, local express code) keys and
+            values with a historic_speeds list, as returned by
+            transit_vis.table_to_lookup.
+
+    Returns:
+        A dictionary with the route 'keys' in order, the 'values' of every
+        history placed end to end, and the 'offsets' (one longer than keys)
+        where the history of each route starts and ends in values. Speeds of
+        0 or less are dropped.
+    """
+    keys = list(speed_lookup.keys())
+    histories = [
+        np.asarray(speed_lookup[key]['historic_speeds'], dtype=float)
+        for key in keys]
+    histories = [history[history > 0] for history in histories]
+    lengths = np.array([len(history) for history in histories], dtype=np.int64)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate(histories) if len(histories) > 0 else np.zeros(0)
+    return {'keys': keys, 'values': values, 'offsets': offsets}
+
+def packed_rows(packed):
+    """Finds the route and day of every value in a packed history.
+
+    Args:
+        packed: Packed histories as returned by pack_histories.
+
+    Returns:
+        A tuple of the route index of each value, the position of each value
+        in its history (0 for the oldest day), and the length of each history.
+    """
+    offsets = packed['offsets']
+    lengths = np.diff(offsets)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(len(packed['values'])) - offsets[:-1][rows]
+    return rows, positions, lengths
+
+def rolling_mean(packed, window):
+    """Computes the rolling mean of every history, without crossing routes.
+
+    Args:
+        packed: Packed histories as returned by pack_histories.
+        window: The number of days to average; the first days of a history
+            are averaged over the days available.
+
+    Returns:
+        An array like packed['values'] where each value is replaced with the
+        mean of it and up to window - 1 days before it on the same route.
+    """
+    if window >= 1:
+        pass
+    else:
+        raise ValueError('window must be at least 1')
+    values = packed['values']
+    rows, positions, _ = packed_rows(packed)
+    sums = np.concatenate([[0.0], np.cumsum(values)])
+    ends = np.arange(1, len(values) + 1)
+    starts = ends - np.minimum(positions + 1, window)
+    return (sums[ends] - sums[starts]) / (ends - starts) if len(rows) > 0 \
+        else np.zeros(0)
+
+def trend_slopes(packed, days=None):
+    """Fits a least squares line to the recent history of every route.
+
+    Args:
+        packed: Packed histories as returned by pack_histories.
+        days: The number of most recent days to fit, or None for all days.
+
+    Returns:
+        An array with the slope (m/s per day) of each route, NaN for routes
+        with fewer than two days.
+    """
+    rows, positions, lengths = packed_rows(packed)
+    keep = positions >= lengths[rows] - days if days is not None \
+        else np.ones(len(rows), dtype=bool)
+    rows, days_x, speeds = rows[keep], positions[keep], packed['values'][keep]
+    num_routes = len(lengths)
+    count = np.bincount(rows, minlength=num_routes).astype(float)
+    sum_x = np.bincount(rows, weights=days_x, minlength=num_routes)
+    sum_y = np.bincount(rows, weights=speeds, minlength=num_routes)
+    sum_xx = np.bincount(rows, weights=days_x * days_x, minlength=num_routes)
+    sum_xy = np.bincount(rows, weights=days_x * speeds, minlength=num_routes)
+    denom = count * sum_xx - sum_x * sum_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (count * sum_xy - sum_x * sum_y) / denom
+    slopes[(count < 2) | (denom == 0)] = np.nan
+    return slopes
+
+def latest_z_scores(packed, days=None):
+    """Scores how unusual the latest speed of every route is.
+
+    Args:
+        packed: Packed histories as returned by pack_histories.
+        days: The number of days before the latest to compare against, or
+            None for all of them.
+
+    Returns:
+        An array with (latest - mean) / standard deviation of the earlier
+        days for each route, NaN for routes with fewer than two earlier days
+        or no variation.
+    """
+    rows, positions, lengths = packed_rows(packed)
+    earlier = positions < lengths[rows] - 1
+    if days is not None:
+        earlier &= positions >= lengths[rows] - 1 - days
+    num_routes = len(lengths)
+    speeds = packed['values'][earlier]
+    count = np.bincount(rows[earlier], minlength=num_routes).astype(float)
+    sums = np.bincount(rows[earlier], weights=speeds, minlength=num_routes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / count
+        squares = np.bincount(
+            rows[earlier],
+            weights=(speeds - means[rows[earlier]])**2,
+            minlength=num_routes)
+        stds = np.sqrt(squares / (count - 1))
+        latest = np.full(num_routes, np.nan)
+        has_data = lengths > 0
+        latest[has_data] = packed['values'][packed['offsets'][1:][has_data] - 1]
+        scores = (latest - means) / stds
+    scores[(count < 2) | ~(stds > 0)] = np.nan
+    return scores
+
+def percent_changes(packed, days):
+    """Computes the change in speed of every route over a number of days.
+
+    Args:
+        packed: Packed histories as returned by pack_histories.
+        days: The number of days to look back from the latest day.
+
+    Returns:
+        An array with the percent change from days before the latest day to
+        the latest day for each route, NaN for routes without that much
+        history.
+    """
+    offsets = packed['offsets']
+    lengths = np.diff(offsets)
+    changes = np.full(len(lengths), np.nan)
+    has_data = lengths > days
+    latest = packed['values'][offsets[1:][has_data] - 1]
+    before = packed['values'][offsets[1:][has_data] - 1 - days]
+    changes[has_data] = 100 * (latest - before) / before
+    return changes
+
+def route_trends(speed_lookup, window=7, trend_days=30, change_days=7):
+    """Computes every trend statistic for every route in a speed lookup.
+
+    Args:
+        speed_lookup: A dictionary with (route id, local express code) keys and
+            values with a historic_speeds list, as returned by
+            transit_vis.table_to_lookup.
+        window: The number of recorded days in the rolling mean.
+        trend_days: The number of most recent recorded days to fit the trend
+            to, which are also the days the latest z-score is compared
+            against.
+        change_days: The number of recorded days to compute the percent
+            change over.
+
+    Returns:
+        A dictionary with the route 'keys' and one array per statistic, in the
+        same order: 'rolling_mean' (of the latest days), 'trend', 'z_score'
+        and 'percent_change'. Statistics that cannot be computed are NaN.
+    """
+    packed = pack_histories(speed_lookup)
+    lengths = np.diff(packed['offsets'])
+    latest_means = np.full(len(lengths), np.nan)
+    means = rolling_mean(packed, window)
+    latest_means[lengths > 0] = means[packed['offsets'][1:][lengths > 0] - 1]
+    return {
+        'keys': packed['keys'],
+        'rolling_mean': latest_means,
+        'trend': trend_slopes(packed, trend_days),
+        'z_score': latest_z_scores(packed, trend_days),
+        'percent_change': percent_changes(packed, change_days)}
+
+def add_trend_properties(geojson, trends):
+    """Adds the trend statistics of each route to the matching features.
+
+    Statistics are rounded for display, and missing ones are set to None so
+    they are written as null in json. Every feature gets each of the
+    TREND_FIELDS properties, so they can be used in tooltips.
+
+    Args:
+        geojson: A geojson dictionary of route features with ROUTE_ID and
+            LOCAL_EXPR properties, such as from segment_store.join_speeds. The
+            properties of its features are modified.
+        trends: A dictionary of statistics as returned by route_trends.
+
+    Returns:
+        The number of features that had trend data for their route.
+    """
+    columns = [trends['trend'], trends['z_score'], trends['percent_change']]
+    digits = [3, 2, 1]
+    route_values = {}
+    for i, key in enumerate(trends['keys']):
+        route_values[key] = [
+            None if np.isnan(column[i]) else round(float(column[i]), digit)
+            for column, digit in zip(columns, digits)]
+    num_matched = 0
+    empty = [None] * len(TREND_FIELDS)
+    for feature in geojson['features']:
+        properties = feature['properties']
+        values = route_values.get(
+            (properties['ROUTE_ID'], properties['LOCAL_EXPR']), empty)
+        num_matched += values is not empty
+        properties.update(zip(TREND_FIELDS, values))
+    return num_matched
+
+def biggest_slowdowns(geojson, count=10):
+    """Finds the routes whose speed dropped the most over the change period.
+
+    Args:
+        geojson: A geojson dictionary of route features with the
+            SPEED_PCT_CHANGE property from add_trend_properties.
+        count: The largest number of routes to return.
+
+    Returns:
+        A list of up to count features with a negative percent change, from
+        the largest drop to the smallest.
+    """
+    features = [
+        feature for feature in geojson['features']
+        if feature['properties'].get('SPEED_PCT_CHANGE') is not None
+        and feature['properties']['SPEED_PCT_CHANGE'] < 0]
+    if len(features) == 0:
+        return []
+    changes = np.array([
+        feature['properties']['SPEED_PCT_CHANGE'] for feature in features])
+    order = np.argsort(changes, kind='stable')[:count]
+    return [features[i] for i in order]
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Keeps the daily speed of every route in a memory mapped history archive.
+
+dynamodb keeps the speed history of each route as a list on its item, so
+looking at a few routes over a few months means scanning the whole table and
+decoding every list. Along with uploading, summarize_rds.py appends each day's
+route aggregates to this archive in ARCHIVE_PATH, which has one file of raw
+values for each column in ARCHIVE_COLUMNS and a header.json:
+    {"start_date": "2020-12-01", "num_days": 31, "route_capacity": 256,
+     "routes": [[100001, "L"], [100002, "E"], ...],
+     "columns": {"avg_speed_m_s": "<f4", "sample_count": "<i4", ...}}
+Each column file holds a (num_days, route_capacity) array in day order, so
+route i on day j is at [j, i], a new day is written to the end of the file,
+and a range of dates is one contiguous block of it. The files are opened with
+np.memmap, so a query only reads the pages of the days and routes it asks
+for. Routes are numbered in the order they first appear. When there are more
+routes than route_capacity the columns are copied into files twice as wide
+(named with their capacity) before the header is switched over to them, so an
+interrupted append never leaves the header pointing at a partial file.
+Days without data for a route are NaN, or 0 for integer columns.
+"""
+
+
+import datetime
+import json
+import os
+import warnings
+
+import numpy as np
+
+
+# Where summarize_rds.py appends the aggregates of each day
+ARCHIVE_PATH = './transit_vis/data/speed_archive'
+
+# The columns of the archive and their numpy dtypes
+ARCHIVE_COLUMNS = {
+    'avg_speed_m_s': '<f4',
+    'sample_count': '<i4',
+    'on_time_share': '<f4',
+    'median_lateness_s': '<f4',
+    'bunching_rate': '<f4',
+    'median_headway_s': '<f4',
+    'headway_count': '<i4'}
+
+# Routes the column files have room for when an archive is created
+INITIAL_ROUTE_CAPACITY = 256
+
+# Reductions that can be taken across routes by network_history
+REDUCTIONS = {
+    'mean': np.nanmean,
+    'median': np.nanmedian,
+    'sum': np.nansum,
+    'min': np.nanmin,
+    'max': np.nanmax}
+
+
+def parse_date(date):
+    """Returns a datetime.date from a 'YYYY-MM-DD' string or a date."""
+    if isinstance(date, datetime.date):
+        return date
+    return datetime.date(*[int(part) for part in date.split('-')])
+
+def missing_value(dtype):
+    """Returns the value for days without data in a column of a dtype."""
+    return np.nan if np.dtype(dtype).kind == 'f' else 0
+
+def column_path(archive_dir, column, route_capacity):
+    """Returns the file a column with a route capacity is stored in."""
+    return os.path.join(archive_dir, f"{column}_{route_capacity}.bin")
+
+def read_header(archive_dir):
+    """Reads the header of an archive.
+
+    Args:
+        archive_dir: A string path to the archive folder.
+
+    Returns:
+        The header dictionary, with the routes as (route id, local express
+        code) tuples, or None if there is no archive in the folder.
+    """
+    header_path = os.path.join(archive_dir, 'header.json')
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path, 'r') as header_file:
+        header = json.load(header_file)
+    header['routes'] = [tuple(route) for route in header['routes']]
+    return header
+
+def write_header(archive_dir, header):
+    """Replaces the header of an archive once the new one is fully written."""
+    header_path = os.path.join(archive_dir, 'header.json')
+    with open(f"{header_path}.part", 'w') as header_file:
+        json.dump(header, header_file)
+    os.replace(f"{header_path}.part", header_path)
+
+def open_column(archive_dir, column, header=None, mode='r'):
+    """Memory maps one column of an archive.
+
+    Args:
+        archive_dir: A string path to the archive folder.
+        column: The name of a column in the header.
+        header: The header of the archive, or None to read it.
+        mode: The np.memmap mode; 'r' to read or 'r+' to write in place.
+
+    Returns:
+        A mapped array with shape (num_days, route_capacity).
+    """
+    header = read_header(archive_dir) if header is None else header
+    if column in header['columns']:
+        pass
+    else:
+        raise ValueError(f"the archive has no column {column}")
+    if header['num_days'] == 0:
+        # An empty file cannot be mapped
+        return np.zeros((0, header['route_capacity']), dtype=header['columns'][column])
+    return np.memmap(
+        column_path(archive_dir, column, header['route_capacity']),
+        dtype=header['columns'][column],
+        mode=mode,
+        shape=(header['num_days'], header['route_capacity']))
+
+def resize_routes(archive_dir, header, route_capacity):
+    """Copies every column into files with room for more routes.
+
+    Args:
+        archive_dir: A string path to the archive folder.
+        header: The header of the archive.
+        route_capacity: The number of routes the new files have room for.
+
+    Returns:
+        The header of the resized archive, which has been written.
+    """
+    resized = dict(header, route_capacity=route_capacity)
+    for column, dtype in header['columns'].items():
+        if header['num_days'] == 0:
+            open(column_path(archive_dir, column, route_capacity), 'wb').close()
+            continue
+        new_values = np.memmap(
+            column_path(archive_dir, column, route_capacity),
+            dtype=dtype,
+            mode='w+',
+            shape=(header['num_days'], route_capacity))
+        new_values[:, header['route_capacity']:] = missing_value(dtype)
+        new_values[:, :header['route_capacity']] = open_column(
+            archive_dir, column, header)
+        new_values.flush()
+        del new_values
+    write_header(archive_dir, resized)
+    for column in header['columns']:
+        os.remove(column_path(archive_dir, column, header['route_capacity']))
+    return resized
+
+def add_columns(archive_dir, header, columns):
+    """Adds any columns an archive does not have yet, with no data.
+
+    Args:
+        archive_dir: A string path to the archive folder.
+        header: The header of the archive.
+        columns: A dictionary of column names and dtypes that should exist.
+
+    Returns:
+        The header with the new columns, which has been written.
+    """
+    new_columns = {
+        column: dtype for column, dtype in columns.items()
+        if column not in header['columns']}
+    if len(new_columns) == 0:
+        return header
+    row = header['route_capacity']
+    for column, dtype in new_columns.items():
+        np.full(header['num_days'] * row, missing_value(dtype), dtype=dtype) \
+            .tofile(column_path(archive_dir, column, row))
+    header = dict(header, columns=dict(header['columns'], **new_columns))
+    write_header(archive_dir, header)
+    return header
+
+def append_day(route_speeds, archive_dir, run_date, columns=None):
+    """Writes the aggregates of one day to the archive.
+
+    Days are only ever added after the last day of the archive; days skipped
+    in between are left without data. Writing a day that is already in the
+    archive (such as when the summary is run again on the same day) replaces
+    it in place.
+
+    Args:
+        route_speeds: A list of route speed dictionaries with route_id,
+            trip_short_name and a value for each column, as returned by
+            summarize_rds.aggregate_speeds. Columns missing from a dictionary
+            are left without data.
+        archive_dir: A string path to the archive folder.
+        run_date: A string of the date the aggregates are for, i.e.
+            '2020-12-01'.
+        columns: A dictionary of column names and dtypes to store, or None
+            for ARCHIVE_COLUMNS.
+
+    Returns:
+        The header of the archive after the day was written.
+    """
+    columns = ARCHIVE_COLUMNS if columns is None else columns
+    day = parse_date(run_date)
+    os.makedirs(archive_dir, exist_ok=True)
+    header = read_header(archive_dir)
+    if header is None:
+        header = {
+            'start_date': day.isoformat(),
+            'num_days': 0,
+            'route_capacity': INITIAL_ROUTE_CAPACITY,
+            'routes': [],
+            'columns': {}}
+    header = add_columns(archive_dir, header, columns)
+    day_number = (day - parse_date(header['start_date'])).days
+    if day_number >= 0:
+        pass
+    else:
+        raise ValueError(
+            f"{run_date} is before the start of the archive, {header['start_date']}")
+
+    # Number any routes seen for the first time, making room for them
+    route_numbers = {route: i for i, route in enumerate(header['routes'])}
+    routes = list(header['routes'])
+    day_routes = []
+    for track in route_speeds:
+        route = (int(track['route_id']), track['trip_short_name'][0])
+        if route not in route_numbers:
+            route_numbers[route] = len(routes)
+            routes.append(route)
+        day_routes.append(route_numbers[route])
+    route_capacity = header['route_capacity']
+    while route_capacity < len(routes):
+        route_capacity *= 2
+    if route_capacity > header['route_capacity']:
+        header = resize_routes(archive_dir, header, route_capacity)
+
+    # Write the day, and any days skipped before it, after the last full day
+    num_days = max(header['num_days'], day_number + 1)
+    row_numbers = np.array(day_routes, dtype=np.int64)
+    for column, dtype in header['columns'].items():
+        row = np.full(route_capacity, missing_value(dtype), dtype=dtype)
+        if column in columns:
+            row[row_numbers] = np.asarray([
+                track.get(column, missing_value(dtype)) for track in route_speeds
+            ]).astype(dtype)
+        path = column_path(archive_dir, column, route_capacity)
+        row_bytes = route_capacity * np.dtype(dtype).itemsize
+        with open(path, 'r+b') as column_file:
+            # Drop anything written after the last day of an interrupted append
+            column_file.truncate(header['num_days'] * row_bytes)
+            column_file.seek(0, os.SEEK_END)
+            skipped = np.full(
+                (max(day_number - header['num_days'], 0), route_capacity),
+                missing_value(dtype), dtype=dtype)
+            column_file.write(skipped.tobytes())
+            if day_number >= header['num_days']:
+                column_file.write(row.tobytes())
+        if day_number < header['num_days']:
+            values = open_column(archive_dir, column, header, mode='r+')
+            values[day_number] = row
+            values.flush()
+            del values
+    header = dict(header, num_days=num_days, routes=routes)
+    write_header(archive_dir, dict(header, routes=[list(route) for route in routes]))
+    return header
+
+def day_range(header, start_date=None, end_date=None):
+    """Finds the day numbers of a range of dates in an archive.
+
+    Args:
+        header: The header of the archive.
+        start_date: The first date to include, or None for the first day of
+            the archive.
+        end_date: The last date to include, or None for the last day of the
+            archive.
+
+    Returns:
+        A tuple of the first day number and the day number to stop before,
+        clipped to the days in the archive.
+    """
+    archive_start = parse_date(header['start_date'])
+    first = 0 if start_date is None \
+        else (parse_date(start_date) - archive_start).days
+    stop = header['num_days'] if end_date is None \
+        else (parse_date(end_date) - archive_start).days + 1
+    first = min(max(first, 0), header['num_days'])
+    return first, max(min(stop, header['num_days']), first)
+
+def route_numbers(header, route_keys=None):
+    """Finds the numbers of routes in an archive.
+
+    Args:
+        header: The header of the archive.
+        route_keys: A list of (route id, local express code) tuples, or None
+            for every route.
+
+    Returns:
+        An array of the route numbers, in the order of route_keys.
+    """
+    if route_keys is None:
+        return np.arange(len(header['routes']))
+    numbers = {route: i for i, route in enumerate(header['routes'])}
+    missing = [route for route in route_keys if tuple(route) not in numbers]
+    if len(missing) == 0:
+        pass
+    else:
+        raise ValueError(f"routes not in the archive: {missing}")
+    return np.array([numbers[tuple(route)] for route in route_keys], dtype=np.int64)
+
+def query_history(archive_dir, column='avg_speed_m_s', start_date=None,
+                  end_date=None, route_keys=None):
+    """Reads the history of some routes over a range of dates.
+
+    Only the block of days asked for is read from the mapped file.
+
+    Args:
+        archive_dir: A string path to the archive folder.
+        column: The name of the column to read.
+        start_date: The first date to include, or None for the first day of
+            the archive.
+        end_date: The last date to include, or None for the last day of the
+            archive.
+        route_keys: A list of (route id, local express code) tuples, or None
+            for every route.
+
+    Returns:
+        A dictionary with the 'dates' as strings, the 'route_keys', and the
+        'values' as an array with shape (routes, days).
+    """
+    header = read_header(archive_dir)
+    if header is not None:
+        pass
+    else:
+        raise FileNotFoundError(f"no speed archive in {archive_dir}")
+    first, stop = day_range(header, start_date, end_date)
+    numbers = route_numbers(header, route_keys)
+    values = np.array(open_column(archive_dir, column, header)[first:stop])
+    archive_start = parse_date(header['start_date'])
+    return {
+        'dates': [
+            (archive_start + datetime.timedelta(days=day)).isoformat()
+            for day in range(first, stop)],
+        'route_keys': [header['routes'][i] for i in numbers],
+        'values': values[:, numbers].T}
+
+def network_history(archive_dir, column='avg_speed_m_s', reduction='mean',
+                    start_date=None, end_date=None, route_keys=None):
+    """Reduces a column across routes for each day of a range of dates.
+
+    Routes without data on a day are left out of that day's reduction.
+
+    Args:
+        archive_dir: A string path to the archive folder.
+        column: The name of the column to reduce.
+        reduction: The name of a reduction in REDUCTIONS.
+        start_date: The first date to include, or None for the first day of
+            the archive.
+        end_date: The last date to include, or None for the last day of the
+            archive.
+        route_keys: A list of (route id, local express code) tuples to reduce
+            over, or None for every route.
+
+    Returns:
+        A dictionary with the 'dates' as strings and the reduced 'values' of
+        each day.
+    """
+    if reduction in REDUCTIONS:
+        pass
+    else:
+        raise ValueError(f"reduction must be one of {', '.join(REDUCTIONS)}")
+    history = query_history(archive_dir, column, start_date, end_date, route_keys)
+    values = history['values'].astype(float)
+    if np.issubdtype(history['values'].dtype, np.integer):
+        values[values == missing_value(history['values'].dtype)] = np.nan
+    with warnings.catch_warnings():
+        # Days without any data reduce to NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        reduced = REDUCTIONS[reduction](values, axis=0)
+    return {'dates': history['dates'], 'values': reduced}
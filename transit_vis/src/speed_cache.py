@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Keeps a local on-disk copy of the route speed lookup between map builds.
+
+The speeds stored on dynamodb only change once per day when summarize_rds.py
+is run, so downloading the full table on every map build is wasted time. This
+module stores the route lookup built by transit_vis.table_to_lookup in a small
+gzipped json file along with the time it was last synced. Every route written
+by summarize_rds.upload_to_dynamo carries a last_updated attribute, and a single
+metadata item on the same table records when the last upload finished. Each
+upload also writes a change log item listing the routes it wrote, under the
+metadata item's route_id with a sort key made by changes_key. This lets the
+visualization check one item to decide whether the cache is current, and when
+it is not, query the change log items newer than the cache and fetch only the
+routes they list, without scanning the table.
+"""
+
+
+import gzip
+import json
+import os
+
+
+# Key of the metadata item that records when the table was last updated
+META_ROUTE_ID = 0
+META_LOCAL_EXPRESS_CODE = 'META'
+
+# Start of the sort key of the change log items, which is followed by the
+# zero padded upload time so the items sort by time
+CHANGES_PREFIX = 'CHANGES#'
+CHANGES_TIME_DIGITS = 12
+
+# Route attributes written by summarize_rds along with the speeds, which are
+# kept in the lookup when present
+ROUTE_METRICS = [
+    'on_time_share', 'median_lateness_s', 'sample_count',
+    'bunching_rate', 'median_headway_s', 'headway_count',
+    'avg_speed_7d_m_s', 'avg_speed_30d_m_s']
+
+# Cache files already read from disk during this process, keyed by path
+_LOADED_CACHES = {}
+
+
+def changes_key(last_updated):
+    """Returns the sort key of the change log item of an upload.
+
+    Args:
+        last_updated: The integer epoch time of the upload.
+
+    Returns:
+        A string sort key, i.e. 'CHANGES#001607000000'.
+    """
+    return f"{CHANGES_PREFIX}{int(last_updated):0{CHANGES_TIME_DIGITS}d}"
+
+def load_lookup_cache(cache_path):
+    """Lazily loads a route lookup cache from memory or disk.
+
+    Returns the copy of the cache already held in memory if one exists for the
+    path, otherwise reads the gzipped json file from disk the first time it is
+    requested. Missing or unreadable cache files are treated as an empty cache.
+
+    Args:
+        cache_path: A string path to the cache file, including file type ending
+            (.json.gz).
+
+    Returns:
+        A tuple of the route lookup dictionary with (route id, local express
+        code) keys, and the integer epoch time it was last synced (0 if the
+        cache is empty).
+    """
+    if cache_path in _LOADED_CACHES:
+        return _LOADED_CACHES[cache_path]
+    route_lookup = {}
+    last_updated = 0
+    if os.path.exists(cache_path):
+        try:
+            with gzip.open(cache_path, 'rt') as cache_file:
+                contents = json.load(cache_file)
+            for row in contents['routes']:
+                route_id, local_express_code, speed, hist_speeds = row[:4]
+                route_lookup[(route_id, local_express_code)] = dict(
+                    {'avg_speed_m_s': speed, 'historic_speeds': hist_speeds},
+                    **(row[4] if len(row) > 4 else {}))
+            last_updated = contents['last_updated']
+        except (OSError, ValueError, KeyError):
+            route_lookup = {}
+            last_updated = 0
+    _LOADED_CACHES[cache_path] = (route_lookup, last_updated)
+    return _LOADED_CACHES[cache_path]
+
+def save_lookup_cache(cache_path, route_lookup, last_updated):
+    """Writes a route lookup to disk and keeps it in memory for later calls.
+
+    Each route is stored as a compact [route id, code, speed, historic speeds]
+    row rather than a nested dictionary to keep the file small, followed by a
+    dictionary of its ROUTE_METRICS if it has any.
+
+    Args:
+        cache_path: A string path to the cache file, including file type ending
+            (.json.gz).
+        route_lookup: A dictionary with (route id, local express code) keys
+            and avg_speed_m_s, historic_speeds values.
+        last_updated: The integer epoch time the lookup was synced to.
+
+    Returns:
+        1 after writing the cache file.
+    """
+    routes = []
+    for (route_id, local_express_code), values in route_lookup.items():
+        row = [route_id, local_express_code,
+               values['avg_speed_m_s'], values['historic_speeds']]
+        metrics = {
+            name: values[name] for name in ROUTE_METRICS if name in values}
+        if len(metrics) > 0:
+            row.append(metrics)
+        routes.append(row)
+    with gzip.open(cache_path, 'wt') as cache_file:
+        json.dump(
+            {'last_updated': last_updated, 'routes': routes},
+            cache_file,
+            separators=(',', ':'))
+    _LOADED_CACHES[cache_path] = (route_lookup, last_updated)
+    return 1
+
+def clear_lookup_cache(cache_path):
+    """Removes a route lookup cache from memory and disk.
+
+    Forces the next map build to download the full table again.
+
+    Args:
+        cache_path: A string path to the cache file, including file type ending
+            (.json.gz).
+
+    Returns:
+        1 after the cache has been removed.
+    """
+    _LOADED_CACHES.pop(cache_path, None)
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    return 1
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=E1101
+# pylint: disable=E0611
+# pylint: disable=E0401
+"""Saves each day's route speeds as an Arrow file that maps can read directly.
+
+Along with uploading to dynamodb, summarize_rds.py writes the speeds it
+aggregated each day to speeds_{date}.arrow in SNAPSHOT_PATH, with one row per
+route: route_id, local_express_code, avg_speed_m_s, sample_count and date,
+and the METRIC_COLUMNS of summarize_rds.merge_route_metrics (which are left
+out of the lookup when a snapshot does not have them).
+The files are in the uncompressed Arrow IPC format, so reading them is a
+memory map of the file rather than a parse: the columns are used in place
+without being copied. The speed lookup of the latest file has the speed and
+metrics of each route on that day; asked for the history, it is built from
+every daily file instead, in the same form as transit_vis.table_to_lookup, so
+a map can be drawn without reading from dynamodb at all.
+
+pyarrow is optional; it is only imported when a snapshot is written or read.
+"""
+
+
+import datetime
+import glob
+import os
+
+import numpy as np
+
+
+# Where summarize_rds.py writes a snapshot of each day's speeds
+SNAPSHOT_PATH = './transit_vis/data/speed_snapshots'
+
+# Columns of each snapshot
+SNAPSHOT_COLUMNS = [
+    'route_id', 'local_express_code', 'avg_speed_m_s', 'sample_count', 'date']
+
+# Columns added after the first snapshots were written, which may be missing
+METRIC_COLUMNS = [
+    'on_time_share', 'median_lateness_s',
+    'bunching_rate', 'median_headway_s', 'headway_count',
+    'avg_speed_7d_m_s', 'avg_speed_30d_m_s']
+
+# Lookups already built during this process, keyed by snapshot folder and
+# whether they include the history
+_LOADED_SNAPSHOTS = {}
+
+
+def import_pyarrow():
+    """Imports pyarrow, which is only needed for speed snapshots.
+
+    Returns:
+        The pyarrow module, with pyarrow.ipc loaded.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError as error:
+        raise ImportError(
+            'speed snapshots need pyarrow, install it with '
+            'conda install -c conda-forge pyarrow') from error
+    return pyarrow
+
+def snapshot_files(snapshot_dir):
+    """Lists the daily snapshot files in a folder, oldest first.
+
+    Args:
+        snapshot_dir: A string path to the folder of snapshots.
+
+    Returns:
+        A list of string paths to speeds_{date}.arrow files, sorted by date.
+    """
+    return sorted(glob.glob(os.path.join(snapshot_dir, 'speeds_*.arrow')))
+
+def write_snapshot(route_speeds, snapshot_dir, run_date):
+    """Writes the speeds aggregated for one day to an Arrow file.
+
+    Args:
+        route_speeds: A list of route speed dictionaries with route_id,
+            trip_short_name, avg_speed_m_s, sample_count and any of the
+            METRIC_COLUMNS, as returned by summarize_rds.aggregate_speeds.
+        snapshot_dir: A string path to the folder of snapshots.
+        run_date: A string of the date the speeds are for, i.e. '2020-12-01'.
+
+    Returns:
+        The string path the snapshot was written to.
+    """
+    pyarrow = import_pyarrow()
+    day = datetime.date(*[int(part) for part in run_date.split('-')])
+    metrics = {
+        name: pyarrow.array(
+            [None if track.get(name) is None else float(track[name])
+             for track in route_speeds],
+            pyarrow.float64())
+        for name in METRIC_COLUMNS}
+    table = pyarrow.table(dict({
+        'route_id': pyarrow.array(
+            [int(track['route_id']) for track in route_speeds], pyarrow.int64()),
+        'local_express_code': pyarrow.array(
+            [track['trip_short_name'][0] for track in route_speeds],
+            pyarrow.string()),
+        'avg_speed_m_s': pyarrow.array(
+            [float(track['avg_speed_m_s']) for track in route_speeds],
+            pyarrow.float64()),
+        'sample_count': pyarrow.array(
+            [int(track['sample_count']) for track in route_speeds],
+            pyarrow.int64()),
+        'date': pyarrow.array([day] * len(route_speeds), pyarrow.date32())},
+        **metrics))
+
+    # Write to a temporary file first so readers never map a partial file
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_path = os.path.join(snapshot_dir, f"speeds_{run_date}.arrow")
+    with pyarrow.OSFile(f"{snapshot_path}.part", 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(f"{snapshot_path}.part", snapshot_path)
+    return snapshot_path
+
+def read_snapshot(snapshot_path):
+    """Memory maps one snapshot file without copying its columns.
+
+    Args:
+        snapshot_path: A string path to a snapshot file.
+
+    Returns:
+        A pyarrow Table backed by the mapped file.
+    """
+    pyarrow = import_pyarrow()
+    source = pyarrow.memory_map(snapshot_path, 'r')
+    table = pyarrow.ipc.open_file(source).read_all()
+    missing = [name for name in SNAPSHOT_COLUMNS if name not in table.column_names]
+    if len(missing) == 0:
+        pass
+    else:
+        raise ValueError(f"{snapshot_path} is missing {', '.join(missing)}")
+    return table
+
+def load_snapshot_lookup(snapshot_dir=SNAPSHOT_PATH, include_history=False):
+    """Builds the speed lookup of every route from the daily snapshots.
+
+    Only the latest snapshot is read unless the history is asked for. The
+    columns of the snapshots read are grouped by route with numpy, so there is
+    a Python step per route rather than per row of every file. The lookup is
+    rebuilt only when a snapshot it was built from is added or changed.
+
+    Args:
+        snapshot_dir: A string path to the folder of snapshots.
+        include_history: Whether to read every snapshot, to add the
+            historic_speeds of each route and the routes missing from the
+            latest day.
+
+    Returns:
+        A dictionary with (route id, local express code) keys, and values with
+        the avg_speed_m_s of the latest day the route has data for, along with
+        the sample_count and METRIC_COLUMNS of the latest day that has them.
+        With include_history, the values also have the historic_speeds of
+        each day, oldest first, in the same form as
+        transit_vis.table_to_lookup.
+    """
+    paths = snapshot_files(snapshot_dir)
+    if include_history:
+        pass
+    else:
+        paths = paths[-1:]
+    signature = [(path, os.path.getmtime(path)) for path in paths]
+    cached = _LOADED_SNAPSHOTS.get((snapshot_dir, include_history))
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    # The rows of every snapshot read, oldest first
+    tables = [read_snapshot(path) for path in paths]
+    if sum(table.num_rows for table in tables) == 0:
+        return {}
+    route_ids = np.concatenate([
+        table.column('route_id').to_numpy() for table in tables])
+    codes = np.concatenate([
+        table.column('local_express_code').to_numpy() for table in tables])
+    speeds = np.concatenate([
+        table.column('avg_speed_m_s').to_numpy() for table in tables])
+    metrics = {
+        name: np.concatenate([
+            table.column(name).to_numpy().astype(float)
+            if name in table.column_names else np.full(table.num_rows, np.nan)
+            for table in tables])
+        for name in ['sample_count'] + METRIC_COLUMNS}
+
+    # Sort the rows by route, keeping the days of each route in order
+    code_values, code_index = np.unique(codes, return_inverse=True)
+    keys = route_ids * len(code_values) + code_index
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    latest = order[np.r_[starts[1:], len(order)] - 1]
+    route_keys = list(zip(route_ids[latest].tolist(), codes[latest].tolist()))
+    route_lookup = {
+        key: {'avg_speed_m_s': speed}
+        for key, speed in zip(route_keys, speeds[latest].tolist())}
+
+    # The latest day each route has a value for each metric
+    positions = np.arange(len(order))
+    for name, values in metrics.items():
+        sorted_values = values[order]
+        last_valid = np.maximum.reduceat(
+            np.where(np.isnan(sorted_values), -1, positions), starts)
+        for i in np.flatnonzero(last_valid >= 0).tolist():
+            value = sorted_values[last_valid[i]].item()
+            route_lookup[route_keys[i]][name] = \
+                int(value) if name == 'sample_count' else value
+
+    if include_history:
+        for key, history in zip(route_keys, np.split(speeds[order], starts[1:])):
+            route_lookup[key]['historic_speeds'] = history.tolist()
+    _LOADED_SNAPSHOTS[(snapshot_dir, include_history)] = (signature, route_lookup)
+    return route_lookup
@@ -17,16 +17,34 @@ smaller than 24hrs.
 """
 
 
-from datetime import datetime
+from datetime import datetime, timezone
+import time
 from zipfile import ZipFile
 import requests
 
-import boto3
+import botocore.exceptions
 import numpy as np
 import pandas as pd
-import psycopg2
 
-from transit_vis.src import config as cfg
+from transit_vis.src import clients
+from transit_vis.src import headways
+from transit_vis.src import pipeline
+from transit_vis.src import rolling_speeds
+from transit_vis.src import speed_archive
+from transit_vis.src import speed_cache
+from transit_vis.src import speed_snapshot
+from transit_vis.src import trip_partitions
+
+
+# Where the artifacts of each stage of the daily summary are saved
+PIPELINE_PATH = './transit_vis/data/pipeline_tmp'
+
+# Columns of the GTFS trips used to match bus locations to routes
+GTFS_TRIP_COLUMNS = ['route_id', 'trip_id', 'trip_short_name', 'direction_id']
+
+# Schedule deviations (s) counted as on time, from 1 minute early to 5 late
+ON_TIME_EARLY_S = -60
+ON_TIME_LATE_S = 300
 
 
 def convert_cursor_to_tabular(query_result_cursor):
@@ -74,51 +92,98 @@ def convert_cursor_to_tabular(query_result_cursor):
 def connect_to_rds():
     """Connects to the RDS data warehouse specified in config.py.
 
-    Attempts to connect to the database, and if successful it returns a
-    connection object that can be used for queries to the bus location data.
+    Checks a healthy connection out of the shared pool in clients.py, which
+    can be used for queries to the bus location data. It should be given back
+    with clients.release_rds_connection when done.
 
     Returns:
         A Psycopg Connection object for the RDS data warehouse specified in
         config.py.
     """
+    return clients.get_rds_connection()
+
+def build_trip_query(start_time, end_time, rds_limit):
+    """Builds the query for the bus locations collected in a time range.
+
+    The range is half open (start_time <= collectedtime < end_time) to match
+    the bounds of the daily partitions of active_trips_study, so a range of
+    one day does not also touch the first second of the next partition.
+    Psycopg fills the parameters in as literals before the query is sent, so
+    the planner can prune every partition outside of the range.
+
+    Args:
+        start_time: The first epoch collectedtime to include.
+        end_time: The epoch collectedtime to stop before.
+        rds_limit: An integer maximum number of rows to return, or 0 for no
+            limit.
+
+    Returns:
+        A tuple of the query text and the list of its parameters.
+    """
+    query_text = "SELECT * FROM active_trips_study " \
+        "WHERE collectedtime >= %s AND collectedtime < %s"
+    query_params = [start_time, end_time]
+    if rds_limit > 0:
+        query_text += " LIMIT %s"
+        query_params.append(rds_limit)
+    return f"{query_text};", query_params
 
-    conn = psycopg2.connect(
-        host=cfg.HOST,
-        database=cfg.DATABASE,
-        user=cfg.UID,
-        password=cfg.PWD)
-    return conn
+def trip_window(num_days, run_date=None):
+    """Finds the range of collectedtime of the UTC days a summary is for.
 
-def get_last_xdays_results(conn, num_days, rds_limit):
+    The range starts and ends at UTC midnight, which are the bounds of the
+    daily partitions of active_trips_study (see trip_partitions), so the query
+    for one day only reads that day's partition.
+
+    Args:
+        num_days: How many days the range covers, ending with run_date.
+        run_date: A string of the last UTC date in the range, i.e.
+            '2020-12-01', or None for the last full UTC day (yesterday).
+
+    Returns:
+        A tuple of the epoch time the range starts at and the epoch time it
+        ends before.
+    """
+    if run_date is None:
+        end_time = trip_partitions.day_start(time.time())
+    else:
+        end_time = trip_partitions.day_start(
+            datetime.strptime(run_date, '%Y-%m-%d').replace(
+                tzinfo=timezone.utc).timestamp()) \
+            + trip_partitions.SECONDS_PER_DAY
+    return end_time - num_days * trip_partitions.SECONDS_PER_DAY, end_time
+
+def last_full_day():
+    """Returns the date string of the last full UTC day, i.e. '2020-12-01'."""
+    return datetime.fromtimestamp(
+        trip_window(1)[0], timezone.utc).strftime('%Y-%m-%d')
+
+def get_last_xdays_results(conn, num_days, rds_limit, run_date=None):
     """Queries the last x days worth of data from the RDS data warehouse.
 
     Uses the database connection to execute a query for the last x days of
     bus coordinates stored in the RDS data warehouse. The RDS data must have a
     column for collected time (in epoch format) which is used to determine the
-    time. The query is made based on the current system time, so it will count
-    x days back from the present on the current system. All time comparisons
-    between the RDS and the system are done in epoch time, so there should be no
-    concern for time zone differences if running this function from an EC2
-    instance.
+    time. The days are whole UTC days ending with run_date, found by
+    trip_window, so they line up with the daily partitions of the table. All
+    time comparisons between the RDS and the system are done in epoch time, so
+    there should be no concern for time zone differences if running this
+    function from an EC2 instance.
 
     Args:
         conn: A Psycopg Connection object for the RDS data warehouse.
+        num_days: How many days of data to query.
         rds_limit: An integer specifying the maximum number of rows to query.
             Useful for debugging and checking output before making larger
             queries. Set to 0 for no limit.
+        run_date: A string of the last UTC date to query, i.e. '2020-12-01',
+            or None for the last full UTC day.
 
     Returns:
         A Pandas Dataframe object containing the results in the database for the
         last x day period.
     """
-    # Query the specified number of days back from current time
-    end_time = round(datetime.now().timestamp())
-    start_time = end_time - (24*60*60)
-    i = 1
-    while i < num_days:
-        end_time = start_time
-        start_time = end_time - (24*60*60)
-        i += 1
+    start_time, end_time = trip_window(num_days, run_date)
 
     if isinstance(rds_limit, int):
         pass
@@ -130,12 +195,7 @@ def get_last_xdays_results(conn, num_days, rds_limit):
     else:
         raise ValueError('rds_limit must be 0 or greater')
 
-    if rds_limit > 0:
-        query_text = f"SELECT * FROM active_trips_study WHERE collectedtime " \
-            f"BETWEEN {start_time} AND {end_time} LIMIT {rds_limit};"
-    else:
-        query_text = f"SELECT * FROM active_trips_study WHERE collectedtime " \
-            f"BETWEEN {start_time} AND {end_time};"
+    query_text, query_params = build_trip_query(start_time, end_time, rds_limit)
 
     if conn is not None:
         pass
@@ -143,7 +203,7 @@ def get_last_xdays_results(conn, num_days, rds_limit):
         raise TypeError('no Psycopg connection found')
 
     with conn.cursor() as curs:
-        curs.execute(query_text)
+        curs.execute(query_text, query_params)
         daily_results = convert_cursor_to_tabular(curs)
     return daily_results
 
@@ -225,7 +285,8 @@ def connect_to_dynamo_table(table_name):
 
     Uses the AWS login information stored in config.py to attempt a connection
     to dynamodb using the boto3 library, then creates a connection to the
-    specified table.
+    specified table. The connection is shared with the rest of the process
+    through the pooled resource in clients.py.
 
     Args:
         table_name: The name of the table on the dynamodb resource to connect.
@@ -233,21 +294,152 @@ def connect_to_dynamo_table(table_name):
     Returns:
         A boto3 Table object pointing to the dynamodb table specified.
     """
-    dynamodb = boto3.resource(
-        'dynamodb',
-        region_name=cfg.REGION,
-        aws_access_key_id=cfg.ACCESS_ID,
-        aws_secret_access_key=cfg.ACCESS_KEY)
-    table = dynamodb.Table(table_name)
-    return table
+    return clients.get_dynamo_table(table_name)
+
+def aggregate_speeds(to_upload):
+    """Summarizes the speed and schedule adherence of each route.
+
+    Every metric comes from a single pass over the observations: one lexsort
+    orders them by route, and by schedule deviation within each route, and
+    then sums and counts are taken over each route's block with reduceat and
+    the median deviation is read from the middle of each sorted block.
+    Observations without a route_id or trip_short_name (buses that did not
+    match a GTFS trip) are left out.
+
+    Args:
+        to_upload: A Pandas Dataframe of speed observations with route ids,
+            trip short names, avg_speed_m_s and scheduledeviation (seconds
+            late), as made by join_gtfs_route_info.
+
+    Returns:
+        A list of dictionaries with the route_id, trip_short_name, average
+        speed (avg_speed_m_s, as a string rounded to 0.1 m/s), number of
+        observations (sample_count), share of observations on time
+        (on_time_share, as a string rounded to 0.001) and median schedule
+        deviation in whole seconds (median_lateness_s) of each route, sorted
+        by route_id and trip_short_name.
+    """
+    to_upload = to_upload.dropna(subset=['route_id', 'trip_short_name'])
+    if len(to_upload) == 0:
+        return []
+    short_names, name_codes = np.unique(
+        to_upload['trip_short_name'].to_numpy(dtype=str), return_inverse=True)
+    route_ids = to_upload['route_id'].to_numpy(dtype=np.int64)
+    speeds = to_upload['avg_speed_m_s'].to_numpy(dtype=float)
+    deviations = to_upload['scheduledeviation'].to_numpy(dtype=float)
+
+    # Sort by route, then deviation, and find where each route's block starts
+    order = np.lexsort((deviations, name_codes, route_ids))
+    route_ids = route_ids[order]
+    name_codes = name_codes[order]
+    speeds = speeds[order]
+    deviations = deviations[order]
+    starts = np.flatnonzero(np.concatenate([
+        [True],
+        (route_ids[1:] != route_ids[:-1]) | (name_codes[1:] != name_codes[:-1])]))
+    counts = np.diff(np.append(starts, len(order)))
+    mean_speeds = np.add.reduceat(speeds, starts) / counts
+    on_time = (deviations >= ON_TIME_EARLY_S) & (deviations <= ON_TIME_LATE_S)
+    on_time_shares = np.add.reduceat(on_time.astype(np.int64), starts) / counts
+    median_deviations = (deviations[starts + (counts - 1) // 2]
+                         + deviations[starts + counts // 2]) / 2
+    return [
+        {'route_id': int(route_id),
+         'trip_short_name': str(short_names[name_code]),
+         'avg_speed_m_s': str(round(float(mean_speed), 1)),
+         'sample_count': int(count),
+         'on_time_share': str(round(float(on_time_share), 3)),
+         'median_lateness_s': int(round(float(median_deviation)))}
+        for route_id, name_code, mean_speed, count, on_time_share, median_deviation
+        in zip(route_ids[starts], name_codes[starts], mean_speeds, counts,
+               on_time_shares, median_deviations)]
+
+def upload_route_speeds(dynamodb_table, route_speeds, run_date=None):
+    """Uploads the average speed and other metrics of each route to dynamodb.
+
+    Replaces avg_speed_m_s and the speed_cache.ROUTE_METRICS of each route
+    with their latest values in a single update, and appends to
+    historic_speeds which keeps track of past average daily speeds for each
+    segment. Each updated segment and the table metadata item are stamped with
+    the upload time in last_updated, and the keys of the updated segments are
+    written to a change log item for the upload (see speed_cache.changes_key),
+    which lets transit_vis refresh its local cache with only the changed
+    segments.
+
+    Each segment is also stamped with the run_date it was last updated for,
+    and is only updated if it has a different one. Running the upload for a
+    date again, such as to resume one that failed partway, skips the segments
+    already written instead of appending their speeds to historic_speeds twice.
+
+    Args:
+        dynamodb_table: A boto3 Table pointing to a dynamodb table that has been
+            initialized to contain the same segments as route_speeds.
+        route_speeds: A list of route speed dictionaries as returned by
+            aggregate_speeds.
+        run_date: A string of the date the speeds are for, i.e. '2020-12-01',
+            or None for today.
+
+    Returns:
+        The number of routes uploaded, including those already uploaded for
+        run_date.
+    """
+    if run_date is None:
+        run_date = datetime.now().strftime('%Y-%m-%d')
+    # Update each route/segment id in the dynamodb with its new value
+    last_updated = round(datetime.now().timestamp())
+    for track in route_speeds:
+        metrics = [name for name in speed_cache.ROUTE_METRICS if name in track]
+        try:
+            dynamodb_table.update_item(
+                Key={
+                    'route_id': track['route_id'],
+                    'local_express_code': track['trip_short_name'][0]},
+                UpdateExpression="SET avg_speed_m_s=:speed," \
+                    + "".join(f"{name}=:{name}," for name in metrics) \
+                    + "last_updated=:updated,last_run_date=:run_date," \
+                    "historic_speeds=list_append(" \
+                    "if_not_exists(historic_speeds, :empty_list), :vals)",
+                ConditionExpression="attribute_not_exists(last_run_date) " \
+                    "OR last_run_date <> :run_date",
+                ExpressionAttributeValues=dict({
+                    ':speed': track['avg_speed_m_s'],
+                    ':updated': last_updated,
+                    ':run_date': run_date,
+                    ':vals': [track['avg_speed_m_s']],
+                    ':empty_list': []},
+                    **{f":{name}": track[name] for name in metrics}))
+        except botocore.exceptions.ClientError as error:
+            # The segment was already updated for run_date by an earlier run
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                continue
+            raise
+
+    # Log the routes written, before the metadata item says there is an update
+    dynamodb_table.update_item(
+        Key={
+            'route_id': speed_cache.META_ROUTE_ID,
+            'local_express_code': speed_cache.changes_key(last_updated)},
+        UpdateExpression="SET route_keys=:keys",
+        ExpressionAttributeValues={':keys': [
+            [track['route_id'], track['trip_short_name'][0]]
+            for track in route_speeds]})
+
+    # Record the time of this upload so clients can tell their cache is stale
+    dynamodb_table.update_item(
+        Key={
+            'route_id': speed_cache.META_ROUTE_ID,
+            'local_express_code': speed_cache.META_LOCAL_EXPRESS_CODE},
+        UpdateExpression="SET last_updated=:updated",
+        ExpressionAttributeValues={':updated': last_updated})
+    return len(route_speeds)
 
 def upload_to_dynamo(dynamodb_table, to_upload):
     """Uploads the speeds gathered and processed from the RDS to dynamodb.
 
-    Groups all bus speed observations by route/segment ids and averages the
-    observed speeds. Uploads the results to dynamodb; replaces avg_speed_m_s
-    with the latest value, and appends to historic_speeds which keeps track of
-    past average daily speeds for each segment.
+    Groups all bus speed observations by route/segment ids and summarizes the
+    observed speeds and schedule deviations with aggregate_speeds, then
+    uploads the results with
+    upload_route_speeds.
 
     Args:
         dynamodb_table: A boto3 Table pointing to a dynamodb table that has been
@@ -262,30 +454,225 @@ def upload_to_dynamo(dynamodb_table, to_upload):
         pass
     else:
         raise TypeError('to_upload must be a pandas dataframe')
+    return upload_route_speeds(
+        dynamodb_table,
+        aggregate_speeds(to_upload),
+        datetime.now().strftime('%Y-%m-%d'))
 
-    # Aggregate the observed bus speeds by their route/segment ids
-    to_upload = to_upload[['route_id', 'trip_short_name', 'avg_speed_m_s']]
-    to_upload = to_upload.groupby(['route_id', 'trip_short_name']).mean().reset_index()
-    to_upload['avg_speed_m_s'] = round(to_upload['avg_speed_m_s'], 1)
-    to_upload['avg_speed_m_s'] = to_upload['avg_speed_m_s'].apply(str)
-    to_upload = to_upload.to_dict(orient='records')
+def read_gtfs_route_info():
+    """Reads the trip-route conversions saved by update_gtfs_route_info.
 
-    # Update each route/segment id in the dynamodb with its new value
-    for track in to_upload:
-        dynamodb_table.update_item(
-            Key={
-                'route_id': track['route_id'],
-                'local_express_code': track['trip_short_name'][0]},
-            UpdateExpression="SET avg_speed_m_s=:speed," \
-                "historic_speeds=list_append(" \
-                "if_not_exists(historic_speeds, :empty_list), :vals)",
-            ExpressionAttributeValues={
-                ':speed': track['avg_speed_m_s'],
-                ':vals': [track['avg_speed_m_s']],
-                ':empty_list': []})
-    return len(to_upload)
-
-def main_function_summ(dynamodb_table_name, num_days, rds_limit):
+    Returns:
+        A tuple of Pandas Dataframes: the trips (GTFS_TRIP_COLUMNS) and the
+        routes (route_id and route_short_name).
+    """
+    gtfs_trips = pd.read_csv('./transit_vis/data/google_transit/trips.txt')
+    gtfs_trips = gtfs_trips[GTFS_TRIP_COLUMNS]
+    gtfs_routes = pd.read_csv('./transit_vis/data/google_transit/routes.txt')
+    gtfs_routes = gtfs_routes[['route_id', 'route_short_name']]
+    return gtfs_trips, gtfs_routes
+
+def join_gtfs_route_info(daily_results, gtfs_trips, gtfs_routes):
+    """Matches each speed observation to its route with the GTFS tables.
+
+    Args:
+        daily_results: A Pandas Dataframe of speeds from preprocess_trip_data.
+        gtfs_trips: A Pandas Dataframe of GTFS trips from read_gtfs_route_info.
+        gtfs_routes: A Pandas Dataframe of GTFS routes from read_gtfs_route_info.
+
+    Returns:
+        The daily_results with the route_id, trip_short_name, direction_id and
+        route_short_name of each observation.
+    """
+    daily_results = daily_results.merge(
+        gtfs_trips,
+        left_on='tripid',
+        right_on='trip_id')
+    daily_results = daily_results.merge(
+        gtfs_routes,
+        left_on='route_id',
+        right_on='route_id')
+    return daily_results
+
+def find_route_headways(raw_results, gtfs_trips, gtfs_routes):
+    """Measures the headways and bunching of each route from the RDS results.
+
+    Headways need every location of each bus, so the raw results are only
+    deduplicated (as in preprocess_trip_data) before they are matched to
+    their routes, rather than reduced to the speed observations.
+
+    Args:
+        raw_results: A Pandas Dataframe of bus locations from
+            get_last_xdays_results.
+        gtfs_trips: A Pandas Dataframe of GTFS trips from read_gtfs_route_info.
+        gtfs_routes: A Pandas Dataframe of GTFS routes from read_gtfs_route_info.
+
+    Returns:
+        A list of route headway dictionaries as returned by
+        headways.route_headways.
+    """
+    pings = raw_results.drop_duplicates(subset=['tripid', 'locationtime'])
+    return headways.route_headways(
+        join_gtfs_route_info(pings, gtfs_trips, gtfs_routes))
+
+def merge_route_metrics(route_speeds, route_headways):
+    """Adds the headway metrics of each route to its speeds for the upload.
+
+    Args:
+        route_speeds: A list of route speed dictionaries as returned by
+            aggregate_speeds.
+        route_headways: A list of route headway dictionaries as returned by
+            headways.route_headways.
+
+    Returns:
+        A list with a copy of each route speed dictionary, along with the
+        headway_count, median_headway_s and bunching_rate of the route if it
+        had any headways.
+    """
+    headway_lookup = {
+        (track['route_id'], track['trip_short_name']): track
+        for track in route_headways}
+    route_metrics = []
+    for track in route_speeds:
+        route_headway = headway_lookup.get(
+            (track['route_id'], track['trip_short_name']), {})
+        route_metrics.append(dict(track, **{
+            name: value for name, value in route_headway.items()
+            if name in speed_cache.ROUTE_METRICS}))
+    return route_metrics
+
+def summary_stages(dynamodb_table_name, num_days, rds_limit, run_date,
+                   snapshot_dir=speed_snapshot.SNAPSHOT_PATH,
+                   archive_dir=speed_archive.ARCHIVE_PATH,
+                   rolling_path=rolling_speeds.ROLLING_PATH):
+    """Describes each stage of the daily summary for pipeline.run_pipeline.
+
+    The GTFS download and the RDS query do not depend on each other, so they
+    run at the same time, as do the speed aggregation and the headway
+    analysis. The day is then added to the rolling averages, and finally the
+    upload, the Arrow snapshot and the history archive of the route metrics
+    run at the same time. The RDS query covers the UTC days ending with
+    run_date, and the extracts are keyed by run_date, so running the summary
+    again for the same date (even on a later day) reuses whatever stages
+    already finished and summarizes the same rows.
+
+    Args:
+        dynamodb_table_name: The name of the table containing the segments that
+            speeds will be matched and uploaded to.
+        num_days: How many days back data should be queried from RDS.
+        rds_limit: An integer specifying the maximum number of rows to query.
+            Set to 0 for no limit.
+        run_date: A string of the date the summary is for, i.e. '2020-12-01'.
+        snapshot_dir: A string path to the folder to write the day's
+            speed_snapshot file to.
+        archive_dir: A string path to the speed_archive to append the day to.
+        rolling_path: A string path to the state of the rolling_speeds
+            averages.
+
+    Returns:
+        A list of stage dictionaries; the 'upload' stage makes the
+        num_uploaded artifact, the 'snapshot' stage the snapshot_path
+        artifact (None if pyarrow is not installed) and the 'archive' stage
+        the archive_days artifact (the number of days in the archive).
+    """
+    def refresh_gtfs():
+        update_gtfs_route_info()
+        gtfs_trips, gtfs_routes = read_gtfs_route_info()
+        return {'gtfs_trips': gtfs_trips, 'gtfs_routes': gtfs_routes}
+
+    def extract():
+        with clients.rds_connection() as conn:
+            return {'raw_results': get_last_xdays_results(
+                conn, num_days, rds_limit, run_date)}
+
+    def upload(rolling_metrics):
+        table = connect_to_dynamo_table(dynamodb_table_name)
+        return {'num_uploaded': upload_route_speeds(
+            table, rolling_metrics, run_date)}
+
+    def snapshot(rolling_metrics):
+        try:
+            return {'snapshot_path': speed_snapshot.write_snapshot(
+                rolling_metrics, snapshot_dir, run_date)}
+        except ImportError as error:
+            print(f"Skipping the speed snapshot: {error}")
+            return {'snapshot_path': None}
+
+    def archive(rolling_metrics):
+        header = speed_archive.append_day(rolling_metrics, archive_dir, run_date)
+        return {'archive_days': header['num_days']}
+
+    return [
+        {'name': 'gtfs_refresh',
+         'inputs': [],
+         'outputs': ['gtfs_trips', 'gtfs_routes'],
+         'params': {'run_date': run_date, 'trip_columns': GTFS_TRIP_COLUMNS},
+         'run': refresh_gtfs},
+        {'name': 'rds_extract',
+         'inputs': [],
+         'outputs': ['raw_results'],
+         'params': {'run_date': run_date, 'num_days': num_days,
+                    'rds_limit': rds_limit},
+         'run': extract},
+        {'name': 'preprocess',
+         'inputs': ['raw_results'],
+         'outputs': ['daily_results'],
+         'params': {},
+         'run': lambda raw_results: {
+             'daily_results': preprocess_trip_data(raw_results.copy())}},
+        {'name': 'gtfs_join',
+         'inputs': ['daily_results', 'gtfs_trips', 'gtfs_routes'],
+         'outputs': ['joined_results'],
+         'params': {},
+         'run': lambda daily_results, gtfs_trips, gtfs_routes: {
+             'joined_results': join_gtfs_route_info(
+                 daily_results, gtfs_trips, gtfs_routes)}},
+        {'name': 'aggregate',
+         'inputs': ['joined_results'],
+         'outputs': ['route_speeds'],
+         'params': {'metrics': speed_cache.ROUTE_METRICS},
+         'run': lambda joined_results: {
+             'route_speeds': aggregate_speeds(joined_results)}},
+        {'name': 'headways',
+         'inputs': ['raw_results', 'gtfs_trips', 'gtfs_routes'],
+         'outputs': ['route_headways'],
+         'params': {'bucket_m': headways.BUCKET_M,
+                    'bunched_s': headways.BUNCHED_HEADWAY_S},
+         'run': lambda raw_results, gtfs_trips, gtfs_routes: {
+             'route_headways': find_route_headways(
+                 raw_results, gtfs_trips, gtfs_routes)}},
+        {'name': 'merge',
+         'inputs': ['route_speeds', 'route_headways'],
+         'outputs': ['route_metrics'],
+         'params': {},
+         'run': lambda route_speeds, route_headways: {
+             'route_metrics': merge_route_metrics(route_speeds, route_headways)}},
+        {'name': 'rolling',
+         'inputs': ['route_metrics'],
+         'outputs': ['rolling_metrics'],
+         'params': {'run_date': run_date, 'rolling_path': rolling_path,
+                    'windows': rolling_speeds.WINDOWS},
+         'run': lambda route_metrics: {
+             'rolling_metrics': rolling_speeds.update_rolling_speeds(
+                 route_metrics, run_date, rolling_path)}},
+        {'name': 'upload',
+         'inputs': ['rolling_metrics'],
+         'outputs': ['num_uploaded'],
+         'params': {'table': dynamodb_table_name, 'run_date': run_date},
+         'run': upload},
+        {'name': 'snapshot',
+         'inputs': ['rolling_metrics'],
+         'outputs': ['snapshot_path'],
+         'params': {'snapshot_dir': snapshot_dir, 'run_date': run_date},
+         'run': snapshot},
+        {'name': 'archive',
+         'inputs': ['rolling_metrics'],
+         'outputs': ['archive_days'],
+         'params': {'archive_dir': archive_dir, 'run_date': run_date},
+         'run': archive}]
+
+def main_function_summ(dynamodb_table_name, num_days, rds_limit,
+                       artifact_dir=PIPELINE_PATH, run_date=None):
     """Queries 24hrs of data from RDS, calculates speeds, and uploads them.
 
     Runs daily to take 24hrs worth of data stored in the data warehouse
@@ -295,6 +682,10 @@ def main_function_summ(dynamodb_table_name, num_days, rds_limit):
     guarantees that they will be the same ones that are stored on the dynamodb
     database, allowing for this script to upload them. The Folium map will then
     download the speeds and display them using the same geojson file once again.
+    The stages are run by pipeline.run_pipeline, so if a run fails (such as
+    during the upload) running it again for the same run_date resumes after
+    the last stage that finished instead of repeating the query. Once a run
+    finishes, the artifacts of earlier runs are deleted.
 
     Args:
         dynamodb_table_name: The name of the table containing the segments that
@@ -306,46 +697,25 @@ def main_function_summ(dynamodb_table_name, num_days, rds_limit):
         rds_limit: An integer specifying the maximum number of rows to query.
             Useful for debugging and checking output before making larger
             queries. Set to 0 for no limit.
+        artifact_dir: A string path to the folder the artifacts of each stage
+            are saved in.
+        run_date: A string of the UTC date the summary is for, or None for
+            the last full UTC day (yesterday).
 
     Returns:
         An integer of the number of segments that were updated in the
         database.
     """
-    # Update the current gtfs trip-route info from King County Metro
-    print("Updating the GTFS files...")
-    update_gtfs_route_info()
-
-    # Load 24hrs of scraped data
-    print("Connecting to RDS...")
-    conn = connect_to_rds()
-    print("Querying data from RDS (10-20mins if no limit specified)...")
-    daily_results = get_last_xdays_results(conn, num_days, rds_limit)
-    print("Finished query; processing RDS data...")
-    daily_results = preprocess_trip_data(daily_results)
-
-    # Load the gtfs trip-route info and segment shapefile
-    print("Loading shapefile and GTFS files...")
-    gtfs_trips = pd.read_csv('./transit_vis/data/google_transit/trips.txt')
-    gtfs_trips = gtfs_trips[['route_id', 'trip_id', 'trip_short_name']]
-    gtfs_routes = pd.read_csv('./transit_vis/data/google_transit/routes.txt')
-    gtfs_routes = gtfs_routes[['route_id', 'route_short_name']]
-
-    # Merge scraped data with the gtfs data and alter route ids to fit schema
-    print("Merging RDS data with GTFS files...")
-    daily_results = daily_results.merge(
-        gtfs_trips,
-        left_on='tripid',
-        right_on='trip_id')
-    daily_results = daily_results.merge(
-        gtfs_routes,
-        left_on='route_id',
-        right_on='route_id')
-
-    # Upload to dynamoDB
-    print("Uploading aggregated segment data to dynamoDB...")
-    table = connect_to_dynamo_table(dynamodb_table_name)
-    success = upload_to_dynamo(table, daily_results)
-    return success
+    if run_date is None:
+        run_date = last_full_day()
+    result = pipeline.run_pipeline(
+        summary_stages(dynamodb_table_name, num_days, rds_limit, run_date),
+        artifact_dir,
+        targets=['upload', 'snapshot', 'archive'],
+        prune=True)
+    if len(result['reused']) > 0:
+        print(f"Reused the saved results of: {', '.join(result['reused'])}")
+    return result['artifacts']['num_uploaded']
 
 if __name__ == "__main__":
     NUM_SEGMENTS_UPDATED = main_function_summ(
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Geometry helpers for splitting lines and polygon rings into shared arcs.
+
+Routes that run along the same street, and census tracts that border each
+other, store the same coordinates several times. These helpers find the points
+where lines meet or part ways, cut the lines into arcs at those points, and
+store each distinct arc once. Working on arcs rather than whole features lets
+the map encode shared geometry once (compact_layer) and simplify tract borders
+without opening gaps between neighboring tracts (census_data).
+"""
+
+
+import numpy as np
+
+
+def geojson_bbox(geojson):
+    """Computes the bounding box of every coordinate in a geojson object.
+
+    Args:
+        geojson: A geojson dictionary of features of any geometry type.
+
+    Returns:
+        A tuple of (min lon, min lat, max lon, max lat), or None if the object
+        has no coordinates.
+    """
+    lons = []
+    lats = []
+    stack = [feature['geometry']['coordinates']
+             for feature in geojson['features'] if feature.get('geometry')]
+    while len(stack) > 0:
+        coords = stack.pop()
+        if len(coords) > 0 and isinstance(coords[0], (int, float)):
+            lons.append(coords[0])
+            lats.append(coords[1])
+        else:
+            stack.extend(coords)
+    if len(lons) == 0:
+        return None
+    return (min(lons), min(lats), max(lons), max(lats))
+
+def find_junctions(lines):
+    """Finds the points where lines meet, cross or part ways.
+
+    Every line endpoint is a junction. An interior point is a junction if it
+    is reached from different neighboring points by different lines (or by the
+    same line twice), meaning the lines that share it do not continue along
+    the same path on both sides.
+
+    Args:
+        lines: A list of lines, each a list of hashable (x, y) tuples.
+
+    Returns:
+        A set of the (x, y) points that are junctions.
+    """
+    junctions = set()
+    neighbors = {}
+    for line in lines:
+        junctions.add(line[0])
+        junctions.add(line[-1])
+        for i in range(1, len(line) - 1):
+            prev_pt, next_pt = line[i - 1], line[i + 1]
+            pair = (prev_pt, next_pt) if prev_pt < next_pt else (next_pt, prev_pt)
+            seen_pair = neighbors.setdefault(line[i], pair)
+            if seen_pair != pair:
+                junctions.add(line[i])
+    return junctions
+
+def cut_arcs(lines):
+    """Cuts lines into arcs at their junctions and stores shared arcs once.
+
+    As in TopoJSON, an arc traversed backwards is referenced by the ones'
+    complement of its index.
+
+    Args:
+        lines: A list of lines, each a list of hashable (x, y) tuples.
+
+    Returns:
+        A tuple of the list of distinct arcs (each a tuple of points), and a
+        list with the arc references that make up each line.
+    """
+    junctions = find_junctions(lines)
+    arc_index = {}
+    arcs = []
+    line_refs = []
+    for line in lines:
+        refs = []
+        start = 0
+        for i in range(1, len(line)):
+            if line[i] in junctions or i == len(line) - 1:
+                arc = tuple(line[start:i + 1])
+                if arc in arc_index:
+                    refs.append(arc_index[arc])
+                elif arc[::-1] in arc_index:
+                    refs.append(~arc_index[arc[::-1]])
+                else:
+                    arc_index[arc] = len(arcs)
+                    refs.append(len(arcs))
+                    arcs.append(arc)
+                start = i
+        line_refs.append(refs)
+    return arcs, line_refs
+
+def join_arcs(arcs, refs):
+    """Rebuilds a line from the arcs that make it up.
+
+    Args:
+        arcs: A list of arcs, each a sequence of points.
+        refs: A list of arc references as returned by cut_arcs.
+
+    Returns:
+        A list of the points of the line.
+    """
+    points = []
+    for i, ref in enumerate(refs):
+        arc = list(arcs[~ref])[::-1] if ref < 0 else list(arcs[ref])
+        points.extend(arc[1:] if i > 0 else arc)
+    return points
+
+def simplify_arc(arc, tolerance):
+    """Simplifies an arc with the Douglas-Peucker algorithm.
+
+    The first and last points are always kept, so arcs that meet at a junction
+    still meet after being simplified.
+
+    Args:
+        arc: A sequence of (x, y) points.
+        tolerance: The largest distance, in the units of the points, that a
+            removed point may be from the simplified arc.
+
+    Returns:
+        A tuple of the points that are kept.
+    """
+    if len(arc) < 3:
+        return tuple(arc)
+    points = np.array(arc, dtype=float)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while len(stack) > 0:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(
+                segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return tuple(pt for pt, kept in zip(arc, keep) if kept)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Joins the route network to census tracts to summarize speeds by tract.
+
+For each pair of a route feature and a census tract, this module measures the
+length of the route that lies inside the tract. Intersecting every route with
+every tract polygon is slow, so the tracts are first placed in a uniform grid
+index of their bounding boxes, and each route segment is only clipped against
+the tracts in the grid cells it touches. The resulting incidence table (route
+feature, tract, length in meters) only depends on the geometry, so it is saved
+to a *_tracts_tmp.npz file next to the route file and reused until either
+geojson file changes. With the table, the length weighted average speed of the
+routes in every tract is a pair of np.bincount calls.
+"""
+
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from transit_vis.src import census_data
+from transit_vis.src import compact_layer
+from transit_vis.src import segment_store
+
+
+# Change when the incidence computation changes to invalidate old caches
+INCIDENCE_CACHE_VERSION = '1'
+
+# Approximate meters per degree of latitude
+METERS_PER_DEGREE = 111195.0
+
+# Incidence tables already loaded during this process, keyed by cache path
+_INCIDENCE_TABLES = {}
+
+
+def project_points(points, lat_0):
+    """Projects [lon, lat] points to meters with an equirectangular projection.
+
+    Over an area the size of a city this is accurate to well under a percent.
+
+    Args:
+        points: An array of [lon, lat] points with shape (n, 2).
+        lat_0: The latitude (degrees) at which distances are true.
+
+    Returns:
+        An array of [x, y] points in meters with shape (n, 2).
+    """
+    points = np.asarray(points, dtype=float)[:, :2]
+    return points * np.array(
+        [METERS_PER_DEGREE * np.cos(np.radians(lat_0)), METERS_PER_DEGREE])
+
+def route_segments(features, lat_0):
+    """Splits every line of every route feature into straight segments.
+
+    Args:
+        features: A list of geojson features with line geometry.
+        lat_0: The latitude (degrees) at which distances are true.
+
+    Returns:
+        A tuple of the projected segment start points (n, 2), end points
+        (n, 2), and the index of the feature each segment belongs to (n,).
+    """
+    starts, ends, owners = [], [], []
+    for i, feature in enumerate(features):
+        for line in compact_layer.feature_lines(feature):
+            if len(line) < 2:
+                continue
+            points = project_points(line, lat_0)
+            starts.append(points[:-1])
+            ends.append(points[1:])
+            owners.append(np.full(len(points) - 1, i))
+    if len(starts) == 0:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0, dtype=int)
+    return np.concatenate(starts), np.concatenate(ends), np.concatenate(owners)
+
+def tract_edges(feature, lat_0):
+    """Returns every edge of every ring of a tract polygon.
+
+    Args:
+        feature: A geojson feature with Polygon or MultiPolygon geometry.
+        lat_0: The latitude (degrees) at which distances are true.
+
+    Returns:
+        A tuple of the projected edge start points (m, 2) and end points
+        (m, 2). Holes and separate parts are included, so a point is inside
+        the tract if a ray from it crosses an odd number of edges.
+    """
+    starts, ends = [], []
+    for polygon in census_data.polygon_rings(feature['geometry']):
+        for ring in polygon:
+            points = project_points(ring, lat_0)
+            starts.append(points[:-1])
+            ends.append(points[1:])
+    if len(starts) == 0:
+        return np.zeros((0, 2)), np.zeros((0, 2))
+    return np.concatenate(starts), np.concatenate(ends)
+
+def cell_ranges(mins, maxs, origin, cell_size):
+    """Lists the grid cells covered by each of a set of bounding boxes.
+
+    Args:
+        mins: An array of the lower left corner of each box, shape (n, 2).
+        maxs: An array of the upper right corner of each box, shape (n, 2).
+        origin: The [x, y] lower left corner of the grid.
+        cell_size: The width and height of a grid cell.
+
+    Returns:
+        A tuple of the index of the box (k,) and the integer id of the cell
+        (k,) for every cell that each box covers.
+    """
+    low = np.floor((mins - origin) / cell_size).astype(np.int64)
+    high = np.floor((maxs - origin) / cell_size).astype(np.int64)
+    num_x = high[:, 0] - low[:, 0] + 1
+    num_y = high[:, 1] - low[:, 1] + 1
+    counts = num_x * num_y
+    boxes = np.repeat(np.arange(len(mins)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cell_x = low[boxes, 0] + offsets % num_x[boxes]
+    cell_y = low[boxes, 1] + offsets // num_x[boxes]
+    return boxes, cell_x * 1000003 + cell_y
+
+def build_tract_index(tract_bboxes, cell_size=1000.0):
+    """Places tract bounding boxes in a uniform grid index.
+
+    Args:
+        tract_bboxes: An array of [min x, min y, max x, max y] rows, one per
+            tract, in meters.
+        cell_size: The width and height of a grid cell in meters.
+
+    Returns:
+        A dictionary with the grid 'origin' and 'cell_size', the tract
+        'bboxes', and the 'cell_ids' and 'tracts' of every (cell, tract) pair
+        sorted by cell id.
+    """
+    origin = tract_bboxes[:, :2].min(axis=0)
+    tracts, cell_ids = cell_ranges(
+        tract_bboxes[:, :2], tract_bboxes[:, 2:], origin, cell_size)
+    order = np.argsort(cell_ids, kind='stable')
+    return {
+        'origin': origin,
+        'cell_size': cell_size,
+        'bboxes': tract_bboxes,
+        'cell_ids': cell_ids[order],
+        'tracts': tracts[order]}
+
+def candidate_pairs(tract_index, starts, ends):
+    """Finds the tracts whose bounding box may contain part of each segment.
+
+    Args:
+        tract_index: A grid index as returned by build_tract_index.
+        starts: An array of segment start points, shape (n, 2).
+        ends: An array of segment end points, shape (n, 2).
+
+    Returns:
+        A tuple of the segment indexes and tract indexes of each distinct pair
+        of a segment and a tract whose bounding boxes overlap.
+    """
+    mins = np.minimum(starts, ends)
+    maxs = np.maximum(starts, ends)
+    segments, cell_ids = cell_ranges(
+        mins, maxs, tract_index['origin'], tract_index['cell_size'])
+    first = np.searchsorted(tract_index['cell_ids'], cell_ids, side='left')
+    last = np.searchsorted(tract_index['cell_ids'], cell_ids, side='right')
+    counts = last - first
+    pair_segments = np.repeat(segments, counts)
+    positions = np.arange(counts.sum()) \
+        - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    pair_tracts = tract_index['tracts'][positions]
+    num_tracts = len(tract_index['bboxes'])
+    pair_keys = np.unique(pair_segments * num_tracts + pair_tracts)
+    pair_segments, pair_tracts = pair_keys // num_tracts, pair_keys % num_tracts
+    bboxes = tract_index['bboxes'][pair_tracts]
+    overlaps = (mins[pair_segments, 0] <= bboxes[:, 2]) \
+        & (maxs[pair_segments, 0] >= bboxes[:, 0]) \
+        & (mins[pair_segments, 1] <= bboxes[:, 3]) \
+        & (maxs[pair_segments, 1] >= bboxes[:, 1])
+    return pair_segments[overlaps], pair_tracts[overlaps]
+
+def points_in_polygon(points, edge_starts, edge_ends, chunk_size=4000000):
+    """Tests which points are inside a polygon with the even-odd rule.
+
+    Args:
+        points: An array of points to test, shape (p, 2).
+        edge_starts: An array of polygon edge start points, shape (m, 2).
+        edge_ends: An array of polygon edge end points, shape (m, 2).
+        chunk_size: The largest number of point and edge pairs to compare at
+            once, which bounds the memory used.
+
+    Returns:
+        A boolean array (p,) that is True for points inside the polygon.
+    """
+    inside = np.zeros(len(points), dtype=bool)
+    step = max(1, chunk_size // max(len(edge_starts), 1))
+    a_x, a_y = edge_starts[:, 0], edge_starts[:, 1]
+    b_x, b_y = edge_ends[:, 0], edge_ends[:, 1]
+    for start in range(0, len(points), step):
+        p_x = points[start:start + step, 0:1]
+        p_y = points[start:start + step, 1:2]
+        straddles = (a_y > p_y) != (b_y > p_y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = a_x + (p_y - a_y) * (b_x - a_x) / (b_y - a_y)
+        crossings = np.count_nonzero(straddles & (p_x < x_cross), axis=1)
+        inside[start:start + step] = crossings % 2 == 1
+    return inside
+
+def length_inside(starts, ends, edge_starts, edge_ends, chunk_size=4000000):
+    """Measures the length of each segment that lies inside a polygon.
+
+    Each segment is cut wherever it crosses a polygon edge, and the pieces
+    whose midpoint is inside the polygon are added up. Segments that cross no
+    edge are entirely inside or outside, so only their midpoint is tested.
+
+    Args:
+        starts: An array of segment start points, shape (n, 2).
+        ends: An array of segment end points, shape (n, 2).
+        edge_starts: An array of polygon edge start points, shape (m, 2).
+        edge_ends: An array of polygon edge end points, shape (m, 2).
+        chunk_size: The largest number of segment and edge pairs to compare at
+            once, which bounds the memory used.
+
+    Returns:
+        An array (n,) of the length of each segment inside the polygon.
+    """
+    step = max(1, chunk_size // max(len(edge_starts), 1))
+    if len(starts) > step:
+        return np.concatenate([
+            length_inside(
+                starts[start:start + step], ends[start:start + step],
+                edge_starts, edge_ends, chunk_size)
+            for start in range(0, len(starts), step)])
+    directions = ends - starts
+    lengths = np.hypot(directions[:, 0], directions[:, 1])
+    edges = edge_ends - edge_starts
+    offsets_x = edge_starts[None, :, 0] - starts[:, None, 0]
+    offsets_y = edge_starts[None, :, 1] - starts[:, None, 1]
+    denom = directions[:, None, 0] * edges[None, :, 1] \
+        - directions[:, None, 1] * edges[None, :, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        along_segment = (offsets_x * edges[None, :, 1]
+                         - offsets_y * edges[None, :, 0]) / denom
+        along_edge = (offsets_x * directions[:, None, 1]
+                      - offsets_y * directions[:, None, 0]) / denom
+    crosses = (denom != 0) & (along_segment > 0) & (along_segment < 1) \
+        & (along_edge >= 0) & (along_edge < 1)
+
+    inside_lengths = np.zeros(len(starts))
+    simple = ~crosses.any(axis=1)
+    inside_lengths[simple] = lengths[simple] * points_in_polygon(
+        (starts[simple] + ends[simple]) / 2, edge_starts, edge_ends)
+    if simple.all():
+        return inside_lengths
+    # Cut the crossing segments at every crossing, and test each piece
+    cut = np.where(crosses[~simple], along_segment[~simple], np.nan)
+    cut = np.sort(np.hstack([
+        np.zeros((len(cut), 1)), cut, np.ones((len(cut), 1))]), axis=1)
+    cut = cut[:, :int(np.max(np.sum(~np.isnan(cut), axis=1)))]
+    cut = np.where(np.isnan(cut), 1.0, cut)
+    pieces = np.diff(cut, axis=1)
+    middles = (cut[:, :-1] + cut[:, 1:]) / 2
+    crossing_starts = starts[~simple]
+    crossing_dirs = directions[~simple]
+    points = crossing_starts[:, None, :] + middles[:, :, None] * crossing_dirs[:, None, :]
+    piece_inside = points_in_polygon(
+        points.reshape(-1, 2), edge_starts, edge_ends).reshape(pieces.shape)
+    inside_lengths[~simple] = lengths[~simple] * np.sum(
+        pieces * piece_inside, axis=1)
+    return inside_lengths
+
+def build_incidence(route_features, tract_features, cell_size=1000.0):
+    """Measures the length of every route feature inside every census tract.
+
+    Args:
+        route_features: A list of geojson features with line geometry.
+        tract_features: A list of geojson features with Polygon or
+            MultiPolygon geometry.
+        cell_size: The width and height, in meters, of a cell of the grid
+            index over the tracts.
+
+    Returns:
+        A dictionary of equal length arrays with one entry per (route feature,
+        tract) pair that overlap: the 'feature_index' of the route, the
+        'tract_index' of the tract and the 'length_m' of the route inside it.
+    """
+    all_lats = [
+        pt[1] for feature in tract_features
+        for polygon in census_data.polygon_rings(feature['geometry'])
+        for ring in polygon for pt in ring]
+    lat_0 = (min(all_lats) + max(all_lats)) / 2 if len(all_lats) > 0 else 0.0
+    tract_geometry = [tract_edges(feature, lat_0) for feature in tract_features]
+    tract_bboxes = np.array([
+        np.concatenate([
+            np.minimum(starts.min(axis=0), ends.min(axis=0)),
+            np.maximum(starts.max(axis=0), ends.max(axis=0))])
+        if len(starts) > 0 else [np.inf, np.inf, -np.inf, -np.inf]
+        for starts, ends in tract_geometry])
+    seg_starts, seg_ends, seg_owners = route_segments(route_features, lat_0)
+    empty = {
+        'feature_index': np.zeros(0, dtype=np.int64),
+        'tract_index': np.zeros(0, dtype=np.int64),
+        'length_m': np.zeros(0)}
+    # Tracts without any rings cannot contain routes
+    valid_tracts = np.flatnonzero(np.isfinite(tract_bboxes).all(axis=1))
+    if len(seg_starts) == 0 or len(valid_tracts) == 0:
+        return empty
+    tract_index = build_tract_index(tract_bboxes[valid_tracts], cell_size)
+    pair_segments, pair_tracts = candidate_pairs(tract_index, seg_starts, seg_ends)
+    pair_tracts = valid_tracts[pair_tracts]
+
+    feature_index, tract_ids, length_m = [], [], []
+    order = np.argsort(pair_tracts, kind='stable')
+    bounds = np.flatnonzero(np.diff(pair_tracts[order])) + 1
+    for group in np.split(order, bounds):
+        if len(group) == 0:
+            continue
+        tract = pair_tracts[group[0]]
+        segments = pair_segments[group]
+        lengths = length_inside(
+            seg_starts[segments], seg_ends[segments], *tract_geometry[tract])
+        # Add up the segments of each route feature within the tract
+        owners = seg_owners[segments]
+        features, inverse = np.unique(owners, return_inverse=True)
+        feature_lengths = np.bincount(inverse, weights=lengths)
+        keep = feature_lengths > 0
+        feature_index.append(features[keep])
+        tract_ids.append(np.full(np.count_nonzero(keep), tract))
+        length_m.append(feature_lengths[keep])
+    if len(feature_index) == 0:
+        return empty
+    return {
+        'feature_index': np.concatenate(feature_index).astype(np.int64),
+        'tract_index': np.concatenate(tract_ids).astype(np.int64),
+        'length_m': np.concatenate(length_m)}
+
+def load_incidence(segment_path, tract_shapes_path):
+    """Returns the route by tract incidence table, building it only if needed.
+
+    The table is cached in memory and in a *_tracts_tmp.npz file next to the
+    route file, along with the size and modification time of both geojson
+    files. It is rebuilt when either file changes.
+
+    Args:
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+        tract_shapes_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, not including file type ending (.geojson).
+
+    Returns:
+        A dictionary with the 'feature_index', 'tract_index' and 'length_m'
+        arrays from build_incidence, and a 'geo_ids' array with the GEOID10 of
+        each tract index.
+    """
+    input_key = INCIDENCE_CACHE_VERSION
+    for path in (f"{segment_path}.geojson", f"{tract_shapes_path}.geojson"):
+        stat = os.stat(path)
+        input_key += f"|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime}"
+    cache_path = f"{segment_path}_tracts_tmp.npz"
+    cached = _INCIDENCE_TABLES.get(cache_path)
+    if cached is None and os.path.exists(cache_path):
+        with np.load(cache_path) as cache_file:
+            cached = {name: cache_file[name] for name in cache_file.files}
+    if cached is not None and str(cached['input_key']) == input_key:
+        _INCIDENCE_TABLES[cache_path] = cached
+        return cached
+
+    with open(f"{tract_shapes_path}.geojson", 'r') as shapefile:
+        tract_features = json.load(shapefile)['features']
+    route_features = segment_store.load_segments(
+        segment_path)['kcm_routes']['features']
+    incidence = build_incidence(route_features, tract_features)
+    incidence['geo_ids'] = np.array([
+        str(feature['properties']['GEOID10']) for feature in tract_features])
+    incidence['input_key'] = np.array(input_key)
+    np.savez(cache_path, **incidence)
+    _INCIDENCE_TABLES[cache_path] = incidence
+    return incidence
+
+def tract_speeds(incidence, feature_speeds):
+    """Computes the length weighted average speed of the routes in each tract.
+
+    Routes without speed data (a speed of 0) are left out of the average.
+
+    Args:
+        incidence: A route by tract incidence table from load_incidence.
+        feature_speeds: An array with the average speed (m/s) of every route
+            feature, in feature order, or 0 for routes without data.
+
+    Returns:
+        A Pandas Dataframe with one row per tract that has routes with speed
+        data, and columns for the GEO_ID, the length weighted average speed
+        (tract_speed_m_s) and the length of those routes in the tract
+        (route_length_m).
+    """
+    feature_speeds = np.asarray(feature_speeds, dtype=float)
+    speeds = feature_speeds[incidence['feature_index']]
+    lengths = incidence['length_m'] * (speeds > 0)
+    num_tracts = len(incidence['geo_ids'])
+    total_lengths = np.bincount(
+        incidence['tract_index'], weights=lengths, minlength=num_tracts)
+    weighted_speeds = np.bincount(
+        incidence['tract_index'], weights=lengths * speeds, minlength=num_tracts)
+    has_speed = total_lengths > 0
+    return pd.DataFrame({
+        'GEO_ID': incidence['geo_ids'][has_speed],
+        'tract_speed_m_s': weighted_speeds[has_speed] / total_lengths[has_speed],
+        'route_length_m': total_lengths[has_speed]})
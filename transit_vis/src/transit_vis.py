@@ -12,18 +12,59 @@ from the American Community Survey. The map is saved as an html file to open
 in a web browser.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import os
-import json
+import time
+import warnings
 
-import boto3
+from boto3.dynamodb.conditions import Key
 import branca.colormap as cm
 import folium
-from folium.plugins import FloatImage
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from transit_vis.src import config as cfg
+from transit_vis.src import census_data
+from transit_vis.src import clients
+from transit_vis.src import compact_layer
+from transit_vis.src import pipeline
+from transit_vis.src import segment_store
+from transit_vis.src import speed_analytics
+from transit_vis.src import speed_cache
+from transit_vis.src import speed_snapshot
+from transit_vis.src import topology
+from transit_vis.src import tract_join
+
+
+# Route properties shown in the tooltips of the map, and their labels
+ROUTE_TOOLTIP_FIELDS = [
+    'ROUTE_NUM', 'AVG_SPEED_M_S',
+    'ROUTE_ID', 'LOCAL_EXPR', 'HISTORIC_SPEEDS',
+    'ON_TIME_SHARE', 'MEDIAN_LATENESS_S', 'SAMPLE_COUNT',
+    'BUNCHING_RATE', 'MEDIAN_HEADWAY_S', 'HEADWAY_COUNT',
+    'AVG_SPEED_7D_M_S', 'AVG_SPEED_30D_M_S']
+ROUTE_TOOLTIP_ALIASES = [
+    'Route Number', 'Most Recent Speed (m/s)',
+    'Route ID', 'Local (L) or Express (E)', 'Previous Speeds',
+    'Share On Time', 'Median Lateness (s)', 'Speed Samples',
+    'Share of Headways Bunched', 'Median Headway (s)', 'Headways Measured',
+    '7 Day Average Speed (m/s)', '30 Day Average Speed (m/s)']
+
+# Attributes of each route read from dynamodb into the speed lookup
+LOOKUP_PROJECTION = ', '.join(
+    ['route_id', 'local_express_code', 'avg_speed_m_s', 'historic_speeds']
+    + speed_cache.ROUTE_METRICS)
+
+# Route metrics besides speed that can be shown as their own map layer: the
+# property, the layer name, the colors from the low to the high end, and the
+# value of the high end (None for the 95th percentile of the routes)
+METRIC_LAYERS = [
+    ('AVG_SPEED_7D_M_S', '7 Day Average Speed', ['red', 'yellow', 'green'], None),
+    ('AVG_SPEED_30D_M_S', '30 Day Average Speed', ['red', 'yellow', 'green'], None),
+    ('ON_TIME_SHARE', 'Share of Buses On Time', ['red', 'yellow', 'green'], 1.0),
+    ('MEDIAN_LATENESS_S', 'Median Lateness (s)', ['green', 'yellow', 'red'], None),
+    ('SAMPLE_COUNT', 'Number of Speed Samples', ['#deebf7', '#08519c'], None),
+    ('BUNCHING_RATE', 'Share of Buses Bunched', ['green', 'yellow', 'red'], 0.25),
+    ('MEDIAN_HEADWAY_S', 'Median Headway (s)', ['green', 'yellow', 'red'], None)]
 
 
 def connect_to_dynamo_table(table_name):
@@ -31,7 +72,8 @@ def connect_to_dynamo_table(table_name):
 
     Uses the AWS login information stored in config.py to attempt a connection
     to dynamodb using the boto3 library, then creates a connection to the
-    specified table.
+    specified table. The connection is shared with the rest of the process
+    through the pooled resource in clients.py.
 
     Args:
         table_name: The name of the table on the dynamodb resource to connect.
@@ -39,55 +81,122 @@ def connect_to_dynamo_table(table_name):
     Returns:
         A boto3 Table object pointing to the dynamodb table specified.
     """
-    dynamodb = boto3.resource(
-        'dynamodb',
-        region_name=cfg.REGION,
-        aws_access_key_id=cfg.ACCESS_ID,
-        aws_secret_access_key=cfg.ACCESS_KEY)
-    table = dynamodb.Table(table_name)
-    return table
-
-def dump_table(dynamodb_table):
-    """Downloads the contents of a dynamodb table and returns them as a list.
+    return clients.get_dynamo_table(table_name)
+
+def scan_table_segment(dynamodb_table, segment, total_segments,
+                       projection_expression=None, filter_expression=None):
+    """Downloads every page of a single segment of a dynamodb parallel scan.
 
-    Iterates through the contents of a dynamodb scan() call, which returns a
-    LastEvaluatedKey until there are no results left in the scan. Appends each
-    chunk of data returned by scan to an array for further use.
+    Follows the LastEvaluatedKey of a scan() call restricted to one segment of
+    the table until there are no results left in that segment. When only one
+    segment is requested, the scan is a normal sequential scan of the table.
+    The scan goes through the table's low level client, which unlike the Table
+    resource itself is safe to share between the threads of dump_table.
 
     Args:
-        dynamodb_table: A boto3 Table object from which all data will be read
-            into memory and returned.
+        dynamodb_table: A boto3 Table object to scan.
+        segment: An integer index of the segment to scan, from 0 up to
+            total_segments - 1.
+        total_segments: An integer number of segments the table is split into.
+        projection_expression: An optional string of comma separated attribute
+            names to return for each item. If None all attributes are returned.
+        filter_expression: An optional boto3 condition that items must meet to
+            be returned. If None all items are returned.
 
     Returns:
-        A list of items downloaded from the dynamodb table. In this case, each
-        item is a bus route as generated in initialize_db.py.
+        A list of the items downloaded from the specified table segment.
     """
+    scan_kwargs = {'TableName': dynamodb_table.name}
+    if total_segments > 1:
+        scan_kwargs['Segment'] = segment
+        scan_kwargs['TotalSegments'] = total_segments
+    if projection_expression is not None:
+        scan_kwargs['ProjectionExpression'] = projection_expression
+    if filter_expression is not None:
+        scan_kwargs['FilterExpression'] = filter_expression
     result = []
-    response = dynamodb_table.scan()
+    response = dynamodb_table.meta.client.scan(**scan_kwargs)
     result.extend(response['Items'])
     while 'LastEvaluatedKey' in response.keys():
-        response = dynamodb_table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+        response = dynamodb_table.meta.client.scan(
+            ExclusiveStartKey=response['LastEvaluatedKey'],
+            **scan_kwargs)
         result.extend(response['Items'])
     return result
 
-def table_to_lookup(table):
-    """Converts the contents of a dynamodb table to a dictionary for reference.
+def dump_table(dynamodb_table, total_segments=1, projection_expression=None,
+               filter_expression=None):
+    """Downloads the contents of a dynamodb table and returns them as a list.
 
-    Uses dump_table to download the contents of a specified table, then creates
-    a route lookup dictionary where each key is (route id, express code) and
-    contains elements for avg_speed, and historic_speeds.
+    Splits the table into a number of segments using the dynamodb parallel scan
+    (Segment/TotalSegments) and downloads each segment on its own thread. Each
+    segment is paged through with scan_table_segment, and the chunks of data
+    returned are appended to a single list in segment order for further use.
 
     Args:
-        table: A boto3 Table object from which all data will be read
+        dynamodb_table: A boto3 Table object from which all data will be read
             into memory and returned.
+        total_segments: An integer number of segments to scan in parallel.
+            Set to 1 to use a single sequential scan.
+        projection_expression: An optional string of comma separated attribute
+            names to return for each item, i.e. 'route_id, avg_speed_m_s' to
+            avoid downloading historic_speeds. If None all attributes are
+            returned.
+        filter_expression: An optional boto3 condition that items must meet to
+            be returned, i.e. Attr('last_updated').gt(0). If None all items are
+            returned.
+
+    Returns:
+        A list of items downloaded from the dynamodb table. In this case, each
+        item is a bus route as generated in initialize_db.py.
+    """
+    if isinstance(total_segments, int):
+        pass
+    else:
+        raise TypeError('total_segments must be an integer')
+
+    if total_segments >= 1:
+        pass
+    else:
+        raise ValueError('total_segments must be 1 or greater')
+
+    if total_segments == 1:
+        return scan_table_segment(
+            dynamodb_table, 0, 1, projection_expression, filter_expression)
+
+    # Scan each segment on its own thread, then merge them back in order
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segment_results = executor.map(
+            lambda segment: scan_table_segment(
+                dynamodb_table,
+                segment,
+                total_segments,
+                projection_expression,
+                filter_expression),
+            range(total_segments))
+        result = []
+        for items in segment_results:
+            result.extend(items)
+    return result
+
+def items_to_lookup(items, route_lookup=None):
+    """Converts items downloaded from dynamodb to route lookup entries.
+
+    Items without an avg_speed_m_s attribute (such as the table metadata item)
+    are skipped. Decimal values returned by boto3 are converted to floats, and
+    the speed_cache.ROUTE_METRICS of items that have them are kept.
+
+    Args:
+        items: A list of dynamodb items for bus routes.
+        route_lookup: An optional existing lookup dictionary to add the items
+            to. If None a new dictionary is created.
 
     Returns:
         A dictionary with (route id, segment id) keys and average speed (num),
         historic speeds (list), and local express code (str) data.
     """
-    # Put the data in a dictionary to reference when adding speeds to geojson
-    items = dump_table(table)
-    route_lookup = {}
+    if route_lookup is None:
+        route_lookup = {}
     for item in items:
         if 'avg_speed_m_s' in item.keys():
             route_id = int(item['route_id'])
@@ -97,8 +206,228 @@ def table_to_lookup(table):
                 'avg_speed_m_s': float(item['avg_speed_m_s']),
                 'historic_speeds': hist_speeds
             }
+            for name in speed_cache.ROUTE_METRICS:
+                if name in item.keys():
+                    route_lookup[(route_id, local_express_code)][name] = \
+                        float(item[name])
+    return route_lookup
+
+def table_to_lookup(table, total_segments=1):
+    """Converts the contents of a dynamodb table to a dictionary for reference.
+
+    Uses dump_table to download the contents of a specified table, then creates
+    a route lookup dictionary where each key is (route id, express code) and
+    contains elements for avg_speed, and historic_speeds.
+
+    Args:
+        table: A boto3 Table object from which all data will be read
+            into memory and returned.
+        total_segments: An integer number of segments to scan in parallel.
+
+    Returns:
+        A dictionary with (route id, segment id) keys and average speed (num),
+        historic speeds (list), and local express code (str) data.
+    """
+    # Put the data in a dictionary to reference when adding speeds to geojson
+    items = dump_table(
+        table,
+        total_segments=total_segments,
+        projection_expression=LOOKUP_PROJECTION)
+    return items_to_lookup(items)
+
+def get_table_last_updated(table):
+    """Reads the time of the last upload from the table's metadata item.
+
+    Args:
+        table: A boto3 Table object written to by summarize_rds.py.
+
+    Returns:
+        The integer epoch time of the last completed upload, or None if the
+        table has no metadata item (it has not been summarized since the
+        last_updated attribute was introduced).
+    """
+    response = table.meta.client.get_item(
+        TableName=table.name,
+        Key={
+            'route_id': speed_cache.META_ROUTE_ID,
+            'local_express_code': speed_cache.META_LOCAL_EXPRESS_CODE})
+    if 'Item' in response.keys():
+        return int(response['Item']['last_updated'])
+    return None
+
+def get_changed_route_keys(table, since):
+    """Lists the routes uploaded after a time from the table's change log.
+
+    Queries the change log items written by summarize_rds.upload_route_speeds,
+    which share the metadata item's partition, so only the log items newer
+    than since are read rather than the whole table.
+
+    Args:
+        table: A boto3 Table object written to by summarize_rds.py.
+        since: The integer epoch time of the last upload already synced.
+
+    Returns:
+        A tuple of the list of unique (route id, local express code) tuples
+        uploaded after since, and the integer epoch time of the latest upload
+        in the change log (0 if there is none after since).
+    """
+    query_kwargs = {
+        'TableName': table.name,
+        'KeyConditionExpression':
+            Key('route_id').eq(speed_cache.META_ROUTE_ID)
+            & Key('local_express_code').between(
+                speed_cache.changes_key(since + 1),
+                speed_cache.changes_key(10**speed_cache.CHANGES_TIME_DIGITS - 1)),
+        'ProjectionExpression': 'local_express_code, route_keys'}
+    route_keys = {}
+    latest = 0
+    response = {}
+    while True:
+        if 'LastEvaluatedKey' in response.keys():
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        response = table.meta.client.query(**query_kwargs)
+        for item in response['Items']:
+            latest = max(latest, int(
+                item['local_express_code'][len(speed_cache.CHANGES_PREFIX):]))
+            for route_id, local_express_code in item['route_keys']:
+                route_keys[(int(route_id), local_express_code)] = None
+        if 'LastEvaluatedKey' not in response.keys():
+            break
+    return list(route_keys), latest
+
+def cached_table_to_lookup(table, cache_path, total_segments=1):
+    """Returns the route lookup for a table, using a local cache when current.
+
+    Checks the table metadata item to see when speeds were last uploaded. If
+    the cache at cache_path is at least that recent it is returned without any
+    scan. Otherwise the routes listed in the change log since the cache are
+    read with keys_to_lookup and merged into it, and the cache is rewritten.
+    An empty cache, or one older than the change log goes back, is downloaded
+    in full with table_to_lookup. A table without a metadata item is also
+    downloaded in full, but only once: the cache is kept with a warning, since
+    there is no way to tell when it goes stale.
+
+    Args:
+        table: A boto3 Table object from which speed data will be read.
+        cache_path: A string path to the cache file, including file type ending
+            (.json.gz).
+        total_segments: An integer number of segments to scan in parallel.
+
+    Returns:
+        A dictionary with (route id, segment id) keys and average speed (num),
+        historic speeds (list), and local express code (str) data.
+    """
+    route_lookup, cache_last_updated = speed_cache.load_lookup_cache(cache_path)
+    table_last_updated = get_table_last_updated(table)
+    if table_last_updated is None:
+        warnings.warn(
+            f"{table.name} has no metadata item, so the speeds cached in "
+            f"{cache_path} can not be refreshed; clear the cache to download "
+            "the table again")
+        if len(route_lookup) == 0:
+            route_lookup = table_to_lookup(table, total_segments=total_segments)
+            speed_cache.save_lookup_cache(cache_path, route_lookup, 0)
+        return route_lookup
+    if cache_last_updated >= table_last_updated:
+        return route_lookup
+    # Only fetch the routes that were updated since the last sync
+    route_keys, latest = [], 0
+    if cache_last_updated > 0:
+        route_keys, latest = get_changed_route_keys(table, cache_last_updated)
+    if latest == table_last_updated:
+        route_lookup = keys_to_lookup(
+            table, route_keys, route_lookup=dict(route_lookup))
+    else:
+        route_lookup = table_to_lookup(table, total_segments=total_segments)
+    speed_cache.save_lookup_cache(cache_path, route_lookup, table_last_updated)
     return route_lookup
 
+def geojson_to_route_keys(segment_path):
+    """Collects the unique route keys used by the features of a geojson file.
+
+    Args:
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data, not including
+            file type ending (.geojson).
+
+    Returns:
+        A list of unique (route id, local express code) tuples in the order
+        they first appear in the file.
+    """
+    return list(segment_store.load_segments(segment_path)['route_index'].keys())
+
+def batch_get_chunk(dynamodb_table, route_keys, max_retries=8):
+    """Downloads up to 100 routes from dynamodb with a single batch_get_item.
+
+    Dynamodb may return some of the requested keys as UnprocessedKeys when the
+    table's read capacity is exceeded. These are requested again with an
+    exponential backoff until every key has been read.
+
+    Args:
+        dynamodb_table: A boto3 Table object to read the routes from.
+        route_keys: A list of at most 100 (route id, local express code) tuples.
+        max_retries: An integer number of times to request unprocessed keys
+            before giving up.
+
+    Returns:
+        A list of the items found for the requested keys. Keys that are not on
+        the table are left out.
+    """
+    if len(route_keys) <= 100:
+        pass
+    else:
+        raise ValueError('batch_get_item accepts at most 100 keys')
+
+    request_items = {
+        dynamodb_table.name: {
+            'Keys': [
+                {'route_id': route_id, 'local_express_code': local_express_code}
+                for route_id, local_express_code in route_keys],
+            'ProjectionExpression': LOOKUP_PROJECTION}}
+    result = []
+    attempt = 0
+    while len(request_items) > 0:
+        if attempt > max_retries:
+            raise RuntimeError('dynamodb did not process all requested keys')
+        if attempt > 0:
+            time.sleep(0.05 * 2**attempt)
+        response = dynamodb_table.meta.client.batch_get_item(
+            RequestItems=request_items)
+        result.extend(response['Responses'].get(dynamodb_table.name, []))
+        request_items = response.get('UnprocessedKeys', {})
+        attempt += 1
+    return result
+
+def keys_to_lookup(table, route_keys, max_workers=4, route_lookup=None):
+    """Converts only the specified routes of a dynamodb table to a lookup.
+
+    Splits the route keys into chunks of 100 (the batch_get_item limit) and
+    downloads the chunks concurrently with batch_get_chunk. This reads only the
+    routes that will be drawn instead of scanning the full table, which is much
+    faster when the map covers a small part of the network.
+
+    Args:
+        table: A boto3 Table object from which speed data will be read.
+        route_keys: A list of (route id, local express code) tuples to read,
+            i.e. as returned by geojson_to_route_keys.
+        max_workers: An integer number of batch requests to run at once.
+        route_lookup: An optional existing lookup dictionary to add the routes
+            to. If None a new dictionary is created.
+
+    Returns:
+        A dictionary with (route id, segment id) keys and average speed (num),
+        historic speeds (list), and local express code (str) data.
+    """
+    chunks = [route_keys[i:i+100] for i in range(0, len(route_keys), 100)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunk_results = executor.map(
+            lambda chunk: batch_get_chunk(table, chunk),
+            chunks)
+        items = []
+        for chunk_items in chunk_results:
+            items.extend(chunk_items)
+    return items_to_lookup(items, route_lookup)
+
 def write_census_data_to_csv(s0801_path, s1902_path, tract_shapes_path):
     """Writes the data downloaded directly from ACS to TIGER shapefiles.
 
@@ -106,8 +435,10 @@ def write_census_data_to_csv(s0801_path, s1902_path, tract_shapes_path):
     Survey (ACS) website, then filters to variables of interest and saves. In
     this case the two tables are s0801 and s1902, which contain basic
     socioeconomic and commute-related variables. Data was downloaded at the
-    census tract level for the state of Washington. The data is saved in .csv
-    format to be used in the Folium map.
+    census tract level for the state of Washington. The combined table is
+    prepared (or loaded from cache) by census_data.prepare_census_data, which
+    is what the Folium map uses; this function additionally exports it in .csv
+    format.
 
     Args:
         s0801_path: A string path to the location of the raw s0801 data, not
@@ -122,42 +453,21 @@ def write_census_data_to_csv(s0801_path, s1902_path, tract_shapes_path):
         1 after writing the combined datasets to a *_tmp file in the same folder
         as the TIGER shapefiles.
     """
-    # Read in the two tables that were taken from the ACS data portal website
-    s0801_df = pd.read_csv(f"{s0801_path}.csv")
-    s1902_df = pd.read_csv(f"{s1902_path}.csv")
-    # Filter each table to only variables of interest, make more descriptive
-    commuters_df = s0801_df[[
-        'GEO_ID', 'NAME',
-        'S0801_C01_001E', 'S0801_C01_009E']]
-    commuters_df.columns = [
-        'GEO_ID', 'NAME',
-        'total_workers', 'workers_using_transit']
-    commuters_df = commuters_df.loc[1:len(commuters_df), :]
-    commuters_df['GEO_ID'] = commuters_df['GEO_ID'].str[-11:]
-
-    # Repeat for s1902
-    households_df = s1902_df[[
-        'GEO_ID', 'NAME', 'S1902_C01_001E',
-        'S1902_C03_001E', 'S1902_C02_008E',
-        'S1902_C02_020E', 'S1902_C02_021E']]
-    households_df.columns = [
-        'GEO_ID', 'NAME', 'total_households',
-        'mean_income', 'percent_w_assistance',
-        'percent_white', 'percent_black_or_african_american']
-    households_df = households_df.loc[1:len(households_df), :]
-    households_df['GEO_ID'] = households_df['GEO_ID'].str[-11:]
-
-    # Combine datasets on their census tract ID and write to .csv file
-    final_df = pd.merge(commuters_df, households_df, on='GEO_ID').drop(columns=['NAME_x', 'NAME_y'])
+    final_df = census_data.prepare_census_data(
+        s0801_path,
+        s1902_path,
+        tract_shapes_path)
     final_df.to_csv(f"{tract_shapes_path}_tmp.csv", index=False)
     return 1
 
 def write_speeds_to_map_segments(speed_lookup, segment_path):
-    """Creates a _tmp geojson file with speed data downloaded from dynamodb.
+    """Joins speed data downloaded from dynamodb to the route segments.
 
-    Loads the segments generated from initialize_db.py and adds speeds to them
-    based on the specified dictionary. Writes a new *_tmp geojson file that will
-    be loaded by the Folium map and color coded based on segment average speed.
+    Loads the segments generated from initialize_db.py (parsed once and kept in
+    memory by segment_store) and adds speeds to them based on the specified
+    dictionary, along with the trend statistics from speed_analytics. The
+    enriched segments are kept in memory to be color coded by the Folium map
+    based on segment average speed.
 
     Args:
         speed_lookup: A Dictionary object with (route id, local_express_code)
@@ -173,38 +483,139 @@ def write_speeds_to_map_segments(speed_lookup, segment_path):
         pass
     else:
         raise TypeError('Speed lookup must be a dictionary')
-    # Read route geojson, add property for avg speed, keep track of all speeds
-    speeds = np.ones(0)
-    with open(f"{segment_path}.geojson", 'r') as shapefile:
-        kcm_routes = json.load(shapefile)
-    # Check if each geojson feature has a speed in the database
-    for feature in kcm_routes['features']:
-        route_id = feature['properties']['ROUTE_ID']
-        local_express_code = feature['properties']['LOCAL_EXPR']
-        if (route_id, local_express_code) in speed_lookup.keys():
-            speed = speed_lookup[(route_id, local_express_code)]['avg_speed_m_s']
-            feature['properties']['AVG_SPEED_M_S'] = speed
-            feature['properties']['HISTORIC_SPEEDS'] = \
-                speed_lookup[(route_id, local_express_code)]['historic_speeds']
-            speeds = np.append(speeds, speed)
-        else:
-            feature['properties']['AVG_SPEED_M_S'] = 0
-            feature['properties']['HISTORIC_SPEEDS'] = [0]
-    # Plot and save the distribution of speeds to be plotted with Folium
-    plt.figure(figsize=(4, 2.5))
-    plt.style.use('seaborn')
-    plt.hist(speeds[np.nonzero(speeds)], bins=15)
-    plt.xlim((0, 30))
-    plt.title('Network Speeds')
-    plt.xlabel('Average Speed (m/s)')
-    plt.ylabel('Count of Routes')
-    plt.savefig(f"{segment_path}_histogram.png", bbox_inches='tight')
-    # Write the downloaded speeds to temp file to be plotted with Folium
-    with open(f"{segment_path}_w_speeds_tmp.geojson", 'w+') as new_shapefile:
-        json.dump(kcm_routes, new_shapefile)
+    # Add avg speed properties to the route geojson, keep track of all speeds
+    enriched, speeds = segment_store.join_speeds(speed_lookup, segment_path)
+    # Summarize the speed history of each route for the tooltips
+    speed_analytics.add_trend_properties(
+        enriched,
+        speed_analytics.route_trends(speed_lookup))
     return speeds
 
-def generate_folium_map(segment_file, census_file, colormap):
+def speed_colormap(speeds):
+    """Creates the colormap used to color routes by their average speed.
+
+    Args:
+        speeds: An array of the average speeds (m/s) of routes with data.
+
+    Returns:
+        A LinearColormap from red (0 m/s) through yellow to green at the 95th
+        percentile of the positive speeds, rounded up to a whole m/s.
+    """
+    speeds = np.asarray(speeds, dtype=float)
+    speeds = speeds[speeds > 0.0]
+    vmax = np.ceil(np.percentile(speeds, 95)) if len(speeds) > 0 else 1.0
+    return cm.LinearColormap(
+        ['red', 'yellow', 'green'],
+        vmin=0.0,
+        vmax=vmax)
+
+def metric_colormap(values, colors, vmax=None):
+    """Creates the colormap used to color routes by one of their metrics.
+
+    Args:
+        values: A list of the values of the metric, with None for routes
+            without data.
+        colors: A list of the colors from 0 to vmax.
+        vmax: The value of the high end of the colormap, or None for the 95th
+            percentile of the values, rounded up to a whole number.
+
+    Returns:
+        A LinearColormap from 0 to vmax; values past either end take the
+        color of that end.
+    """
+    if vmax is None:
+        values = np.array([value for value in values if value is not None],
+                          dtype=float)
+        vmax = np.ceil(np.percentile(values, 95)) if len(values) > 0 else 1.0
+    return cm.LinearColormap(colors, vmin=0.0, vmax=max(float(vmax), 1e-9))
+
+def speed_histogram_svg(speeds, bins=15, max_speed=30):
+    """Draws a histogram of network speeds as a small inline svg image.
+
+    Counts the speeds with np.histogram and draws the bars, axes and labels
+    directly as svg markup, so the histogram can be embedded in the map html
+    without plotting libraries or image files.
+
+    Args:
+        speeds: An array of average speeds (m/s); speeds of 0 (routes without
+            data) are left out.
+        bins: The number of equal width bins between 0 and max_speed.
+        max_speed: The largest speed shown on the x axis (m/s).
+
+    Returns:
+        A string containing an <svg> element.
+    """
+    speeds = np.asarray(speeds, dtype=float)
+    counts, edges = np.histogram(
+        speeds[speeds > 0], bins=bins, range=(0, max_speed))
+    width, height = 320, 200
+    left, right, top, bottom = 42, 10, 24, 36
+    plot_w = width - left - right
+    plot_h = height - top - bottom
+    max_count = max(int(counts.max()), 1)
+    y_step = max(1, int(np.ceil(max_count / 4)))
+    y_max = y_step * int(np.ceil(max_count / y_step))
+
+    def x_pos(speed):
+        return left + plot_w * speed / max_speed
+
+    def y_pos(count):
+        return top + plot_h * (1 - count / y_max)
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+        f'height="{height}" font-family="sans-serif" font-size="10">',
+        f'<rect width="{width}" height="{height}" fill="white" opacity="0.85"/>',
+        f'<text x="{left + plot_w / 2}" y="15" text-anchor="middle" '
+        f'font-size="12">Network Speeds</text>']
+    for count, low, high in zip(counts, edges[:-1], edges[1:]):
+        if count > 0:
+            parts.append(
+                f'<rect x="{x_pos(low):.1f}" y="{y_pos(count):.1f}" '
+                f'width="{x_pos(high) - x_pos(low) - 1:.1f}" '
+                f'height="{top + plot_h - y_pos(count):.1f}" fill="#4c72b0">'
+                f'<title>{low:g}-{high:g} m/s: {count}</title></rect>')
+    for tick in range(0, max_speed + 1, 5):
+        parts.append(
+            f'<text x="{x_pos(tick):.1f}" y="{top + plot_h + 12}" '
+            f'text-anchor="middle">{tick}</text>')
+    for tick in range(0, y_max + 1, y_step):
+        parts.append(
+            f'<text x="{left - 4}" y="{y_pos(tick) + 3:.1f}" '
+            f'text-anchor="end">{tick}</text>')
+    parts.extend([
+        f'<path d="M{left},{top} V{top + plot_h} H{left + plot_w}" '
+        f'stroke="black" fill="none"/>',
+        f'<text x="{left + plot_w / 2}" y="{height - 4}" '
+        f'text-anchor="middle">Average Speed (m/s)</text>',
+        f'<text transform="translate(11,{top + plot_h / 2}) rotate(-90)" '
+        f'text-anchor="middle">Count of Routes</text>',
+        '</svg>'])
+    return ''.join(parts)
+
+def route_tooltip_fields(segment_data):
+    """Lists the route properties to show in tooltips, and their labels.
+
+    Args:
+        segment_data: A geojson dictionary of route segments with speed data.
+
+    Returns:
+        A tuple of the list of property names and the list of their labels.
+        The trend statistics from speed_analytics are included if the
+        segments have them.
+    """
+    tooltip_fields = list(ROUTE_TOOLTIP_FIELDS)
+    tooltip_aliases = list(ROUTE_TOOLTIP_ALIASES)
+    if len(segment_data['features']) > 0 and all(
+            field in segment_data['features'][0]['properties']
+            for field in speed_analytics.TREND_FIELDS):
+        tooltip_fields += speed_analytics.TREND_FIELDS
+        tooltip_aliases += speed_analytics.TREND_ALIASES
+    return tooltip_fields, tooltip_aliases
+
+def generate_folium_map(segment_file, census_file, colormap,
+                        compact_routes=False, tract_speeds=None,
+                        num_slowdowns=10):
     """Draws together speed/socioeconomic data to create a Folium map.
 
     Loads segments with speed data, combined census data, and the colormap
@@ -212,44 +623,113 @@ def generate_folium_map(segment_file, census_file, colormap):
     a new Folium Map object centered on Seattle, and returns the map.
 
     Args:
-        segment_file: A string path to the geojson file generated by
-            write_speeds_to_map_segments that should contain geometry as well
-            as speed data.
-        census_file: A string path to the geojson file generated by
-            write_census_data_to_csv that should contain the combined s0801 and
-            s1902 tables.
+        segment_file: A string path to the geojson file that speeds were
+            joined to by write_speeds_to_map_segments, or a geojson dictionary
+            that already contains geometry as well as speed data.
+        census_file: A string path to the geojson TIGER shapefile that the
+            combined s0801 and s1902 tables were prepared for by
+            census_data.prepare_census_data.
         colormap: A Colormap object that describes what speeds should be mapped
             to what colors.
+        compact_routes: If True the routes are written to the map with the
+            quantized, shared arc encoding in compact_layer, which makes the
+            saved map much smaller. If False a folium GeoJson layer is used.
+        tract_speeds: A Pandas Dataframe with GEO_ID and tract_speed_m_s
+            columns as returned by tract_join.tract_speeds. If given, the
+            average bus speed in each tract is drawn as its own choropleth.
+        num_slowdowns: The number of routes with the largest drop in speed to
+            highlight in a separate layer, if the segments have the trend
+            properties added by write_speeds_to_map_segments. 0 for none.
+
+    Each of the METRIC_LAYERS that any route has data for is drawn as its own
+    layer of the routes, hidden until it is selected in the layer control.
 
     Returns:
         A Folium Map object containing the most up-to-date speed data from the
         dynamodb.
     """
-    # Read in route shapefile and give it styles
-    kcm_routes = folium.GeoJson(
-        name='King Country Metro Speed Data',
-        data=f"{segment_file}_w_speeds_tmp.geojson",
-        style_function=lambda feature: {
-            'color': 'gray' if feature['properties']['AVG_SPEED_M_S'] == 0 \
-                else colormap(feature['properties']['AVG_SPEED_M_S']),
-            'weight': 1 if feature['properties']['AVG_SPEED_M_S'] == 0 \
-                else 3},
-        highlight_function=lambda feature: {
-            'fillColor': '#ffaf00', 'color': 'blue', 'weight': 6},
-        tooltip=folium.features.GeoJsonTooltip(
-            fields=['ROUTE_NUM', 'AVG_SPEED_M_S',
-                    'ROUTE_ID', 'LOCAL_EXPR', 'HISTORIC_SPEEDS'],
-            aliases=['Route Number', 'Most Recent Speed (m/s)',
-                     'Route ID', 'Local (L) or Express (E)', 'Previous Speeds']))
+    # Get the route segments with speeds and give them styles
+    if isinstance(segment_file, dict):
+        segment_data = segment_file
+    else:
+        segment_data = segment_store.get_enriched_segments(segment_file)
+    tooltip_fields, tooltip_aliases = route_tooltip_fields(segment_data)
+    has_trends = speed_analytics.TREND_FIELDS[0] in tooltip_fields
+    if compact_routes:
+        kcm_routes = compact_layer.CompactRouteLayer(
+            segment_data,
+            colormap,
+            fields=tooltip_fields,
+            aliases=tooltip_aliases,
+            name='King Country Metro Speed Data')
+    else:
+        kcm_routes = folium.GeoJson(
+            name='King Country Metro Speed Data',
+            data=segment_data,
+            style_function=lambda feature: {
+                'color': 'gray' if feature['properties']['AVG_SPEED_M_S'] == 0 \
+                    else colormap(feature['properties']['AVG_SPEED_M_S']),
+                'weight': 1 if feature['properties']['AVG_SPEED_M_S'] == 0 \
+                    else 3},
+            highlight_function=lambda feature: {
+                'fillColor': '#ffaf00', 'color': 'blue', 'weight': 6},
+            tooltip=folium.features.GeoJsonTooltip(
+                fields=tooltip_fields,
+                aliases=tooltip_aliases))
+    # Color the routes by each of their other metrics in hidden layers
+    metric_layers = []
+    for field, layer_name, colors, vmax in METRIC_LAYERS:
+        values = [
+            feature['properties'].get(field)
+            for feature in segment_data['features']]
+        if all(value is None for value in values):
+            continue
+        metric_cm = metric_colormap(values, colors, vmax)
+        metric_fields = ['ROUTE_NUM', 'LOCAL_EXPR', field]
+        metric_aliases = [
+            ROUTE_TOOLTIP_ALIASES[ROUTE_TOOLTIP_FIELDS.index(name)]
+            for name in metric_fields]
+        if compact_routes:
+            metric_layers.append(compact_layer.CompactRouteLayer(
+                segment_data,
+                metric_cm,
+                fields=metric_fields,
+                aliases=metric_aliases,
+                name=layer_name,
+                color_field=field,
+                geometry_from=kcm_routes,
+                show=False))
+        else:
+            metric_layers.append(folium.GeoJson(
+                name=layer_name,
+                data={
+                    'type': 'FeatureCollection',
+                    'features': [
+                        dict(feature, properties=dict(feature['properties']))
+                        for feature in segment_data['features']]},
+                style_function=lambda feature, field=field, metric_cm=metric_cm: {
+                    'color': 'gray' if feature['properties'][field] is None \
+                        else metric_cm(feature['properties'][field]),
+                    'weight': 1 if feature['properties'][field] is None else 3},
+                tooltip=folium.features.GeoJsonTooltip(
+                    fields=metric_fields,
+                    aliases=metric_aliases),
+                show=False))
     # Read in the census data/shapefile and create a choropleth based on income
-    seattle_tracts_df = pd.read_csv(f"{census_file}_tmp.csv")
+    seattle_tracts_df = census_data.load_census_data(census_file)
+    seattle_tracts_df = seattle_tracts_df[['GEO_ID', 'mean_income']].copy()
     seattle_tracts_df['GEO_ID'] = seattle_tracts_df['GEO_ID'].astype(str)
     seattle_tracts_df['mean_income'] = pd.to_numeric(\
                                          seattle_tracts_df['mean_income'],\
                                          errors='coerce')
     seattle_tracts_df = seattle_tracts_df.dropna()
+    # Only draw the tracts with data near the routes, with simplified borders
+    tract_layer = census_data.prepare_tract_layer(
+        census_file,
+        seattle_tracts_df,
+        topology.geojson_bbox(segment_data))
     seattle_tracts = folium.Choropleth(
-        geo_data=f"{census_file}.geojson",
+        geo_data=tract_layer,
         name='Socioeconomic Data',
         data=seattle_tracts_df,
         columns=['GEO_ID', 'mean_income'],
@@ -258,19 +738,62 @@ def generate_folium_map(segment_file, census_file, colormap):
         fill_opacity=0.7,
         line_opacity=0.4,
         legend_name='Mean Income (usd)')
-    # Read in histogram images for citywide speeds and arrange them on map
-    histogram_figs = FloatImage(
-        f"{segment_file}_histogram.png",
-        bottom=0,
-        left=0)
+    # Optionally shade each tract by the average speed of the routes in it
+    if tract_speeds is not None:
+        # Copy the properties, which folium may add style information to
+        tract_speed_layer = folium.Choropleth(
+            geo_data={
+                'type': 'FeatureCollection',
+                'features': [
+                    dict(feature, properties=dict(feature['properties']))
+                    for feature in tract_layer['features']]},
+            name='Transit Speed by Tract',
+            data=tract_speeds,
+            columns=['GEO_ID', 'tract_speed_m_s'],
+            key_on='feature.properties.GEOID10',
+            fill_color='RdYlGn',
+            fill_opacity=0.7,
+            line_opacity=0.4,
+            nan_fill_opacity=0.0,
+            legend_name='Average Bus Speed in Tract (m/s)',
+            show=False)
+    # Highlight the routes that slowed down the most
+    slowdowns = speed_analytics.biggest_slowdowns(segment_data, num_slowdowns) \
+        if has_trends and num_slowdowns > 0 else []
+    if len(slowdowns) > 0:
+        slowdown_layer = folium.GeoJson(
+            name='Biggest Slowdowns',
+            data={'type': 'FeatureCollection', 'features': slowdowns},
+            style_function=lambda feature: {
+                'color': 'purple', 'weight': 7, 'opacity': 0.8},
+            tooltip=folium.features.GeoJsonTooltip(
+                fields=['ROUTE_NUM', 'LOCAL_EXPR', 'SPEED_PCT_CHANGE',
+                        'SPEED_Z_SCORE', 'SPEED_TREND'],
+                aliases=['Route Number', 'Local (L) or Express (E)',
+                         speed_analytics.TREND_ALIASES[2],
+                         speed_analytics.TREND_ALIASES[1],
+                         speed_analytics.TREND_ALIASES[0]]))
+    # Draw a histogram of citywide speeds in the bottom left of the map
+    speeds = [
+        feature['properties']['AVG_SPEED_M_S']
+        for feature in segment_data['features']]
+    histogram_figs = folium.Element(
+        '<div style="position: fixed; bottom: 0px; left: 0px; z-index: 1000;">'
+        + speed_histogram_svg(speeds) + '</div>')
     # Draw map using the speeds and census data
     f_map = folium.Map(
         location=[47.606209, -122.332069],
         zoom_start=11,
         prefer_canvas=True)
     seattle_tracts.add_to(f_map)
+    if tract_speeds is not None:
+        tract_speed_layer.add_to(f_map)
     kcm_routes.add_to(f_map)
-    histogram_figs.add_to(f_map)
+    for metric_layer in metric_layers:
+        metric_layer.add_to(f_map)
+    if len(slowdowns) > 0:
+        slowdown_layer.add_to(f_map)
+    f_map.get_root().html.add_child(histogram_figs)
     colormap.caption = 'Average Speed (m/s)'
     colormap.add_to(f_map)
     folium.LayerControl().add_to(f_map)
@@ -303,12 +826,144 @@ def save_and_view_map(f_map, output_path):
           f"{output_path}")
     return 1
 
+def render_map(table_name, segment_path, census_path, fetch_mode='cache',
+               output_path='output_map.html'):
+    """Downloads speed data and plots it on a map with prepared census data.
+
+    Args:
+        table_name: The name of the dynamodb table containing speed data.
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data.
+        census_path: A string path to the geojson TIGER shapefile that the
+            combined s0801 and s1902 tables were prepared for by
+            census_data.prepare_census_data.
+        fetch_mode: A string of how speeds are read from dynamodb. 'cache'
+            keeps a local copy that is synced with only the changed routes,
+            'keys' reads only the routes present in segment_path, and 'scan'
+            downloads the full table. 'snapshot' reads the Arrow snapshots
+            written by summarize_rds.py instead of dynamodb.
+        output_path: A string path to save the map to, including file type
+            ending (.html).
+
+    Returns:
+        The output_path the map was saved to.
+    """
+    if fetch_mode in ('cache', 'keys', 'scan', 'snapshot'):
+        pass
+    else:
+        raise ValueError("fetch_mode must be 'cache', 'keys', 'scan' or 'snapshot'")
+
+    if fetch_mode == 'snapshot':
+        # Read the speeds written by summarize_rds.py instead of dynamodb
+        print("Loading speed data from snapshots...")
+        speed_lookup = speed_snapshot.load_snapshot_lookup(include_history=True)
+    else:
+        # Connect to dynamodb
+        print("Connecting to dynamodb...")
+        table = connect_to_dynamo_table(table_name)
+
+        # Query the dynamoDB for all speed data
+        print("Getting speed data from dynamodb...")
+        if fetch_mode == 'cache':
+            speed_lookup = cached_table_to_lookup(
+                table,
+                f"{os.path.dirname(segment_path)}/{table_name}_lookup_tmp.json.gz",
+                total_segments=4)
+        elif fetch_mode == 'keys':
+            speed_lookup = keys_to_lookup(
+                table,
+                geojson_to_route_keys(segment_path))
+        else:
+            speed_lookup = table_to_lookup(table, total_segments=4)
+
+    print("Writing speed data to segments for visualization...")
+    speeds = write_speeds_to_map_segments(
+        speed_lookup,
+        segment_path)
+
+    # Create the color mapping for speeds
+    print("Generating map...")
+    linear_cm = speed_colormap(speeds)
+
+    # Average the route speeds within each census tract
+    print("Joining speeds to census tracts...")
+    feature_speeds = [
+        feature['properties']['AVG_SPEED_M_S'] for feature in
+        segment_store.get_enriched_segments(segment_path)['features']]
+    tract_speed_df = tract_join.tract_speeds(
+        tract_join.load_incidence(segment_path, census_path),
+        feature_speeds)
+
+    f_map = generate_folium_map(
+        segment_path,
+        census_path,
+        linear_cm,
+        compact_routes=True,
+        tract_speeds=tract_speed_df)
+    print("Saving map...")
+    save_and_view_map(f_map, output_path)
+    return output_path
+
+def map_stages(table_name, s0801_path, s1902_path, segment_path, census_path,
+               fetch_mode='cache', after=()):
+    """Describes the stages that draw the map for pipeline.run_pipeline.
+
+    The census stage is keyed by the raw ACS and tract files, so it only runs
+    again when they change. The render stage is keyed by its inputs, so it
+    runs again whenever a stage listed in after makes a new artifact.
+
+    Args:
+        table_name: The name of the dynamodb table containing speed data.
+        s0801_path: A string path to the location of the raw s0801 data, not
+            including file type ending (.csv).
+        s1902_path: A string path to the location of the raw s1902 data, not
+            including file type ending (.csv).
+        segment_path: A string path to the geojson file generated by
+            initialize_db.py that contains route coordinate data.
+        census_path: A string path to the geojson TIGER shapefile as
+            downloaded from the ACS, containing polygon data for census tracts
+            in the state of Washington.
+        fetch_mode: A string of how speeds are read from dynamodb, as in
+            render_map.
+        after: Names of artifacts (such as summarize_rds' num_uploaded) that
+            must be made before the map is drawn.
+
+    Returns:
+        A list of stage dictionaries; the last stage, 'render', makes the
+        map_path artifact.
+    """
+    def prepare_census():
+        census_data.prepare_census_data(s0801_path, s1902_path, census_path)
+        return {'census_ready': census_path}
+
+    def render(census_ready, **_):
+        return {'map_path': render_map(
+            table_name, segment_path, census_ready, fetch_mode)}
+
+    return [
+        {'name': 'census_prep',
+         'inputs': [],
+         'outputs': ['census_ready'],
+         'params': {'files': [
+             pipeline.file_signature(f"{s0801_path}.csv"),
+             pipeline.file_signature(f"{s1902_path}.csv"),
+             pipeline.file_signature(f"{census_path}.geojson")]},
+         'run': prepare_census},
+        {'name': 'render',
+         'inputs': ['census_ready'] + list(after),
+         'outputs': ['map_path'],
+         'params': {'table': table_name, 'fetch_mode': fetch_mode,
+                    'segments': pipeline.file_signature(
+                        f"{segment_path}.geojson")},
+         'run': render}]
+
 def main_function(
         table_name,
         s0801_path,
         s1902_path,
         segment_path,
-        census_path):
+        census_path,
+        fetch_mode='cache'):
     """Combines ACS data, downloads speed data, and plots map of results.
 
     Build the final map by first preparing ACS and dynamodb data, then plotting
@@ -326,37 +981,25 @@ def main_function(
         census_path: A string path to the geojson TIGER shapefile as
             downloaded from the ACS, containing polygon data for census tracts
             in the state of Washington.
+        fetch_mode: A string of how speeds are read from dynamodb. 'cache'
+            keeps a local copy that is synced with only the changed routes,
+            'keys' reads only the routes present in segment_path, and 'scan'
+            downloads the full table. 'snapshot' reads the Arrow snapshots
+            written by summarize_rds.py instead of dynamodb.
 
     Returns:
         1 when done writing and opening the Folium map .html file.
     """
-    # Combine census tract data from multiple ACS tables for Seattle
-    print("Modifying and writing census data...")
-    write_census_data_to_csv(s0801_path, s1902_path, census_path)
-
-    # Connect to dynamodb
-    print("Connecting to dynamodb...")
-    table = connect_to_dynamo_table(table_name)
-
-    # Query the dynamoDB for all speed data
-    print("Getting speed data from dynamodb...")
-    speed_lookup = table_to_lookup(table)
-
-    print("Writing speed data to segments for visualization...")
-    speeds = write_speeds_to_map_segments(
-        speed_lookup,
-        segment_path)
+    if fetch_mode in ('cache', 'keys', 'scan', 'snapshot'):
+        pass
+    else:
+        raise ValueError("fetch_mode must be 'cache', 'keys', 'scan' or 'snapshot'")
 
-    # Create the color mapping for speeds
-    print("Generating map...")
-    linear_cm = cm.LinearColormap(
-        ['red', 'yellow', 'green'],
-        vmin=0.0,
-        vmax=np.ceil(np.percentile(speeds[speeds > 0.0], 95)))
+    # Combine census tract data from multiple ACS tables for Seattle
+    print("Preparing census data...")
+    census_data.prepare_census_data(s0801_path, s1902_path, census_path)
 
-    f_map = generate_folium_map(segment_path, census_path, linear_cm)
-    print("Saving map...")
-    save_and_view_map(f_map, 'output_map.html')
+    render_map(table_name, segment_path, census_path, fetch_mode)
     return 1
 
 if __name__ == "__main__":
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Creates and drops the daily partitions of the bus location table.
+
+active_trips_study is partitioned by range on collectedTime (see
+create_gtfs_tables.sql), with one partition per UTC day named
+active_trips_study_pYYYYMMDD and a default partition for rows outside of
+them. A query with literal bounds on collectedTime, such as the one built by
+summarize_rds.build_trip_query, only reads the partitions its range overlaps,
+and the BRIN index on collectedTime narrows the blocks read within them.
+
+Partitions must exist before their rows arrive, or the rows end up in the
+default partition, so maintain_partitions should run at least daily (python -m
+transit_vis partitions) to create the coming days. Rows already in the default
+partition for a new day are moved into it when it is created. Old partitions
+can be dropped, which is much cheaper than deleting their rows.
+"""
+
+
+from datetime import datetime, timezone
+import time
+
+
+TABLE_NAME = 'active_trips_study'
+DEFAULT_PARTITION = f"{TABLE_NAME}_default"
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def day_start(epoch_time):
+    """Returns the epoch time of the start of the UTC day containing a time."""
+    epoch_time = int(epoch_time)
+    return epoch_time - epoch_time % SECONDS_PER_DAY
+
+def partition_name(start_time):
+    """Returns the name of the partition for the day starting at start_time."""
+    day = datetime.fromtimestamp(start_time, timezone.utc)
+    return f"{TABLE_NAME}_p{day:%Y%m%d}"
+
+def partition_days(start_time, end_time):
+    """Lists the days whose partitions a collectedTime range overlaps.
+
+    Args:
+        start_time: The first epoch time in the range.
+        end_time: The epoch time the range ends before.
+
+    Returns:
+        A list of the epoch start times of each day.
+    """
+    return list(range(day_start(start_time), int(end_time), SECONDS_PER_DAY))
+
+def create_partition_statements(start_time):
+    """Writes the SQL that creates the partition for one day.
+
+    The partition is made as a plain table, any rows for the day are moved
+    into it from the default partition, and then it is attached. Attaching
+    adds the indexes of active_trips_study to it.
+
+    Args:
+        start_time: The epoch start time of the day.
+
+    Returns:
+        A list of SQL statements to run in one transaction.
+    """
+    name = partition_name(start_time)
+    end_time = start_time + SECONDS_PER_DAY
+    return [
+        f"CREATE TABLE {name} (LIKE {TABLE_NAME} INCLUDING DEFAULTS);",
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE collectedTime >= {start_time} AND collectedTime < {end_time} "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved;",
+        f"ALTER TABLE {TABLE_NAME} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ({start_time}) TO ({end_time});"]
+
+def list_partitions(conn):
+    """Lists the daily partitions of active_trips_study.
+
+    Args:
+        conn: A Psycopg Connection object for the RDS data warehouse.
+
+    Returns:
+        A sorted list of the daily partition names (not the default partition).
+    """
+    with conn.cursor() as curs:
+        curs.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s;",
+            [TABLE_NAME])
+        names = [row[0] for row in curs.fetchall()]
+    return sorted(name for name in names if name != DEFAULT_PARTITION)
+
+def ensure_partitions(conn, start_time, num_days):
+    """Creates any missing partitions for a number of days.
+
+    Args:
+        conn: A Psycopg Connection object for the RDS data warehouse.
+        start_time: An epoch time in the first day.
+        num_days: The number of days to create partitions for.
+
+    Returns:
+        A list of the names of the partitions that were created.
+    """
+    existing = set(list_partitions(conn))
+    created = []
+    first_day = day_start(start_time)
+    for day in range(first_day, first_day + num_days * SECONDS_PER_DAY,
+                     SECONDS_PER_DAY):
+        if partition_name(day) in existing:
+            continue
+        with conn.cursor() as curs:
+            for statement in create_partition_statements(day):
+                curs.execute(statement)
+        conn.commit()
+        created.append(partition_name(day))
+    return created
+
+def drop_partitions_before(conn, before_time):
+    """Drops the partitions of every day that ends before a time.
+
+    Args:
+        conn: A Psycopg Connection object for the RDS data warehouse.
+        before_time: An epoch time; days ending at or before it are dropped.
+
+    Returns:
+        A list of the names of the partitions that were dropped.
+    """
+    cutoff = partition_name(day_start(before_time))
+    dropped = [name for name in list_partitions(conn) if name < cutoff]
+    with conn.cursor() as curs:
+        for name in dropped:
+            curs.execute(f"DROP TABLE {name};")
+    conn.commit()
+    return dropped
+
+def maintain_partitions(conn, days_ahead=7, days_to_keep=None, now=None):
+    """Creates the partitions for the coming days and drops expired ones.
+
+    Args:
+        conn: A Psycopg Connection object for the RDS data warehouse.
+        days_ahead: The number of days, starting today, to have partitions for.
+        days_to_keep: The number of past days of data to keep, or None to keep
+            everything.
+        now: The current epoch time, or None to use the system clock.
+
+    Returns:
+        A tuple of the lists of partition names created and dropped.
+    """
+    if days_ahead >= 1:
+        pass
+    else:
+        raise ValueError('days_ahead must be at least 1')
+    now = time.time() if now is None else now
+    created = ensure_partitions(conn, now, days_ahead)
+    dropped = []
+    if days_to_keep is not None:
+        dropped = drop_partitions_before(
+            conn, day_start(now) - days_to_keep * SECONDS_PER_DAY)
+    return created, dropped
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# pylint: disable=E1101
+# pylint: disable=E0611
+# pylint: disable=E0401
+"""Draws the map of the notebook widget from its inputs.
+
+The map has the routes colored by speed, the census tracts shaded by mean
+income around the income range entered, and markers at the home and
+destination that list the routes within walking distance and the estimated
+trip between them. This module has no notebook dependencies, so the map can
+also be drawn from the command line, as batch_maps does; widget_modules builds
+the interactive widget around it.
+"""
+
+
+import folium
+import pandas as pd
+
+from transit_vis.src import census_data
+from transit_vis.src import nearest_routes
+from transit_vis.src import route_graph
+from transit_vis.src import segment_store
+from transit_vis.src import topology
+
+
+# The most routes listed for home and destination, and the farthest a route
+# can be from either and still be walkable
+NEARBY_ROUTES = 5
+NEARBY_DISTANCE_M = 800.0
+
+
+def prepare_widget_tracts(census_file, segment_data):
+    """Loads the census table and tract shapes drawn by the widget map.
+
+    Args:
+        census_file: A string path to the geojson TIGER shapefile that the
+            combined s0801 and s1902 tables were prepared for by
+            census_data.prepare_census_data.
+        segment_data: A geojson dictionary of the route segments, used to
+            only keep the tracts near the routes.
+
+    Returns:
+        A tuple of a Pandas Dataframe with the GEO_ID and mean_income (in
+        thousands of dollars) of each tract with data, and the geojson
+        dictionary of the simplified tract shapes.
+    """
+    seattle_tracts_df = census_data.load_census_data(census_file)
+    seattle_tracts_df = seattle_tracts_df[['GEO_ID', 'mean_income']].copy()
+    seattle_tracts_df['GEO_ID'] = seattle_tracts_df['GEO_ID'].astype(str)
+    seattle_tracts_df['mean_income'] = pd.to_numeric(\
+                                         seattle_tracts_df['mean_income'],\
+                                         errors='coerce')
+
+    # Makes the numbers smaller so the legend would look better
+    seattle_tracts_df['mean_income'] = seattle_tracts_df['mean_income']/1000
+
+    seattle_tracts_df = seattle_tracts_df.dropna()
+
+    # Only draw the tracts with data near the routes, with simplified borders
+    tract_layer = census_data.prepare_tract_layer(
+        census_file,
+        seattle_tracts_df,
+        topology.geojson_bbox(segment_data))
+    return seattle_tracts_df, tract_layer
+
+def nearby_routes_html(title, nearby, route_info):
+    """Lists the routes near a marker, with their distance and speed.
+
+    Args:
+        title: The name of the marker, such as Home.
+        nearby: A list of (route key, distance in meters) tuples as returned
+            by nearest_routes.nearest_routes.
+        route_info: A dictionary with route keys and (route number, most
+            recent speed) values.
+
+    Returns:
+        A string of html for the popup of the marker.
+    """
+    if len(nearby) == 0:
+        return f"<b>{title}</b><br>No routes within {NEARBY_DISTANCE_M:.0f} m"
+    lines = [f"<b>{title}</b>"]
+    for key, distance in nearby:
+        route_num, speed = route_info[key]
+        lines.append(f"Route {route_num} ({key[1]}): {distance:.0f} m away, "
+                     f"{speed:.1f} m/s")
+    return "<br>".join(lines)
+
+def trip_html(trip):
+    """Describes the estimated trip from home to destination.
+
+    Args:
+        trip: A trip as returned by route_graph.estimate_trip, or None.
+
+    Returns:
+        A string of html with the travel time and the routes ridden.
+    """
+    if trip is None:
+        return "No trip found on the route network"
+    return (f"Estimated travel time: {trip['seconds'] / 60:.0f} min "
+            f"(plus {trip['walk_m']:.0f} m walking)<br>"
+            f"Routes: {', '.join(str(num) for num in trip['route_nums'])}")
+
+# Generates folium map based off census data, transportation data, and user inputs
+def generate_folium_map_widget(segment_file, census_file, colormap,\
+                               home_loc_value, destination_loc_value, \
+                                   min_income_value, max_income_value, \
+                                   tracts=None, route_layer=None, \
+                                       vertex_index=None, trip_graph=None):
+    """Draws together speed/socioeconomic data to create a Folium map.
+
+    Loads segments with speed data, combined census data, and the colormap
+    generated from the list of speeds to be plotted. Plots all data sources on
+    a new Folium Map object centered on Seattle, and returns the map.
+
+    Args:
+        segment_file: A string path to the geojson file that speeds were
+            joined to by write_speeds_to_map_segments, or a geojson dictionary
+            that already contains geometry as well as speed data.
+        census_file: A string path to the geojson TIGER shapefile that the
+            combined s0801 and s1902 tables were prepared for by
+            census_data.prepare_census_data.
+        colormap: A Colormap object that describes what speeds should be mapped
+            to what colors.
+        home_loc_value: A string of latitude and longitude for the home box
+        destination_loc_value: A string of latitude and longitude of the destination
+        min_income_value: A decimal value for the minimum income inputted
+        max_income_value: A decimal value for the maximum income inputted
+        tracts: The census table and tract shapes as returned by
+            prepare_widget_tracts, or None to prepare them for this map.
+        route_layer: A Folium layer of the routes built ahead of time (such
+            as the compact_layer.CompactRouteLayer kept by the widget session),
+            or None to draw the routes from segment_file.
+        vertex_index: A nearest_routes vertex index of the same route
+            features, or None to build (or load) one for this map.
+        trip_graph: A route_graph graph of the same route features, or None
+            to build one for this map.
+
+    Returns:
+        A Folium Map object containing the most up-to-date speed data from the
+        dynamodb.
+    """
+    # Get the route segments with speeds and give them the style function above
+    if isinstance(segment_file, dict):
+        segment_data = segment_file
+        if vertex_index is None:
+            vertex_index = nearest_routes.build_vertex_index(
+                segment_data['features'])
+    else:
+        segment_data = segment_store.get_enriched_segments(segment_file)
+        if vertex_index is None:
+            vertex_index = nearest_routes.load_vertex_index(segment_file)
+    if route_layer is not None:
+        kcm_routes = route_layer
+    else:
+        kcm_routes = folium.GeoJson(
+            name='King Country Metro Speed Data',
+            data=segment_data,
+            style_function=lambda feature: {
+                'color': 'gray' if feature['properties']['AVG_SPEED_M_S'] == 0 \
+                    else colormap(feature['properties']['AVG_SPEED_M_S']),
+                'weight': 1 if feature['properties']['AVG_SPEED_M_S'] == 0 \
+                    else 3},
+            highlight_function=lambda feature: {
+                'fillColor': '#ffaf00', 'color': 'blue', 'weight': 6},
+            tooltip=folium.features.GeoJsonTooltip(
+                fields=['ROUTE_NUM', 'AVG_SPEED_M_S',
+                        'ROUTE_ID', 'LOCAL_EXPR', 'HISTORIC_SPEEDS'],
+                aliases=['Route Number', 'Most Recent Speed (m/s)',
+                         'Route ID', 'Local (L) or Express (E)', 'Previous Speeds']))
+
+    # Read in the census data/shapefile and create a choropleth based on income
+    if tracts is None:
+        tracts = prepare_widget_tracts(census_file, segment_data)
+    seattle_tracts_df, tract_layer = tracts
+    seattle_tracts = folium.Choropleth(
+        geo_data=tract_layer,
+        name='Socioeconomic Data',
+        data=seattle_tracts_df,
+        columns=['GEO_ID', 'mean_income'],
+        # added thresholding values for coloring based off widget income inputs
+        threshold_scale=[seattle_tracts_df["mean_income"].min()-1, \
+                         int(min_income_value)/1000, \
+                         int(max_income_value)/1000, \
+                         seattle_tracts_df["mean_income"].max()+1],
+        key_on='feature.properties.GEOID10',
+        fill_color="PuBuGn",
+        fill_opacity=0.7,
+        line_opacity=0.4,
+        legend_name='mean income (x$1000)')
+
+    # Find the routes within walking distance of each end of the trip
+    dest_lat = float(destination_loc_value.split(",")[0])
+    dest_long = float(destination_loc_value.split(" ")[1])
+    home_lat = float(home_loc_value.split(",")[0])
+    home_long = float(home_loc_value.split(" ")[1])
+    dest_nearby = nearest_routes.nearest_routes(
+        vertex_index, dest_lat, dest_long, NEARBY_ROUTES, NEARBY_DISTANCE_M)
+    home_nearby = nearest_routes.nearest_routes(
+        vertex_index, home_lat, home_long, NEARBY_ROUTES, NEARBY_DISTANCE_M)
+    nearby_features = nearest_routes.route_features(
+        vertex_index,
+        segment_data['features'],
+        [key for key, _ in dest_nearby + home_nearby])
+    route_info = {}
+    for feature in nearby_features:
+        properties = feature['properties']
+        route_info.setdefault(
+            (properties['ROUTE_ID'], properties['LOCAL_EXPR']),
+            (properties['ROUTE_NUM'], properties['AVG_SPEED_M_S']))
+    both_keys = {key for key, _ in home_nearby} & {key for key, _ in dest_nearby}
+    if trip_graph is None:
+        trip_graph = route_graph.build_route_graph(segment_data['features'])
+    trip = route_graph.estimate_trip(
+        trip_graph, home_lat, home_long, dest_lat, dest_long, NEARBY_DISTANCE_M)
+    both_features = [
+        feature for feature in nearby_features
+        if (feature['properties']['ROUTE_ID'],
+            feature['properties']['LOCAL_EXPR']) in both_keys]
+
+    # Creates folium marker based off destination latitude and longtitude
+    dest_marker = folium.Marker(
+        location=[dest_lat, dest_long],
+        popup=folium.Popup(
+            nearby_routes_html("Destination", dest_nearby, route_info)
+            + "<br>" + trip_html(trip),
+            max_width=300),
+        icon=folium.Icon(color="green", icon="info-sign"))
+
+    # Creates folium marker based off home latitude and longtitude
+    home_marker = folium.Marker(
+        location=[home_lat, home_long],
+        popup=folium.Popup(
+            nearby_routes_html("Home", home_nearby, route_info),
+            max_width=300),
+        icon=folium.Icon(color="red", icon="info-sign"))
+
+    # Draw map using the speeds and census data
+    f_map = folium.Map(
+        location=[47.606209, -122.332069],
+        zoom_start=11,
+        prefer_canvas=True)
+    seattle_tracts.add_to(f_map)
+    kcm_routes.add_to(f_map)
+    if len(both_features) > 0:
+        folium.GeoJson(
+            name='Routes Serving Home and Destination',
+            data={'type': 'FeatureCollection', 'features': both_features},
+            style_function=lambda feature: {
+                'color': '#1f78b4', 'weight': 7, 'opacity': 0.6},
+            tooltip=folium.features.GeoJsonTooltip(
+                fields=['ROUTE_NUM', 'AVG_SPEED_M_S'],
+                aliases=['Route Number', 'Most Recent Speed (m/s)'])
+            ).add_to(f_map)
+    if trip is not None:
+        folium.PolyLine(
+            trip['path'],
+            color='black',
+            weight=4,
+            dash_array='8',
+            tooltip=trip_html(trip)).add_to(
+                folium.FeatureGroup(name='Estimated Trip').add_to(f_map))
+    dest_marker.add_to(f_map)
+    home_marker.add_to(f_map)
+    colormap.caption = 'Average Speed (m/s)'
+    colormap.add_to(f_map)
+    folium.LayerControl().add_to(f_map)
+    return f_map
@@ -1,265 +1,472 @@
 """Set up and run transit_vis with a widget interface for a jupyter notebook
 
 This sets up the widget interface and then collects the inputs to integrate
-with the transit_vis data visualization
+with the transit_vis data visualization. The widget is built and displayed by
+show_widget, which the notebook calls, and the map itself is drawn by
+widget_map. The census table, dynamodb table,
+speeds and route layer are kept in a session cache between clicks, so a click
+that only changes the income range or locations only redraws the choropleth
+and markers. The Refresh Speeds button (or invalidate_session) drops cached
+artifacts so they are rebuilt on the next click. Maps are built in a
+background thread so the notebook stays responsive, with the progress of each
+stage shown in the output widget; a new click supersedes any earlier build.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
 from ipywidgets import VBox, Layout, widgets
 from IPython.display import display, clear_output
 
-import folium
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-
-import branca.colormap as cm
+from transit_vis.src import census_data
+from transit_vis.src import compact_layer
+from transit_vis.src import nearest_routes
+from transit_vis.src import pipeline
+from transit_vis.src import route_graph
+from transit_vis.src import segment_store
+from transit_vis.src import widget_map
 import transit_vis.src.transit_vis as transit_vis
 
-# Generates folium map based off census data, transportation data, and user inputs
-def generate_folium_map_widget(segment_file, census_file, colormap,\
-                               home_loc_value, destination_loc_value, \
-                                   min_income_value, max_income_value):
-    """Draws together speed/socioeconomic data to create a Folium map.
+# Where the widget reads its inputs from and saves the map to
+WIDGET_PATHS = {
+    'table_name': 'KCM_Bus_Routes',
+    's0801_path': './transit_vis/data/s0801',
+    's1902_path': './transit_vis/data/s1902',
+    'segment_path': './transit_vis/data/kcm_routes',
+    'census_path': './transit_vis/data/seattle_census_tracts_2010',
+    'cache_path': './transit_vis/data/KCM_Bus_Routes_lookup_tmp.json.gz',
+    'output_path': 'output_map_widgets.html'}
+
+# Map builds run one at a time in the background; only the build with the
+# latest generation number is allowed to finish
+_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+_BUILDS = {'generation': 0, 'future': None, 'lock': threading.Lock()}
+
+# The widgets of the interface, built by make_widgets
+_WIDGETS = {'widgets': None, 'lock': threading.Lock()}
+
+# Pipeline artifacts kept between clicks of the widget, as (key, artifact)
+# tuples by name
+_SESSION = {}
+
+# The artifacts that are built from each artifact, and so are invalidated
+# along with it
+SESSION_DEPENDENTS = {
+    'census': ['tracts'],
+    'table': ['speed_lookup'],
+    'speed_lookup': ['segments'],
+    'segments': ['tracts'],
+    'tracts': []}
+
+def session_artifact(name, build, key=None):
+    """Returns an artifact from the session cache, building it if missing.
+
+    The artifact is kept along with the key it was built for. If it is asked
+    for with a different key, such as for another file path, it and
+    everything built from it are dropped, and it is built again.
+
+    Args:
+        name: One of the artifact names in SESSION_DEPENDENTS.
+        build: A function with no arguments that builds the artifact.
+        key: A value that describes what the artifact is built from, such as
+            the paths it reads, compared with ==.
 
-    Loads segments with speed data, combined census data, and the colormap
-    generated from the list of speeds to be plotted. Plots all data sources on
-    a new Folium Map object centered on Seattle, and returns the map.
+    Returns:
+        The cached or newly built artifact.
+    """
+    if name in SESSION_DEPENDENTS:
+        pass
+    else:
+        raise KeyError(f"unknown session artifact {name}")
+    if name in _SESSION and _SESSION[name][0] != key:
+        invalidate_session(name)
+    if name not in _SESSION:
+        _SESSION[name] = (key, build())
+    return _SESSION[name][1]
+
+def invalidate_session(*names):
+    """Drops artifacts, and everything built from them, from the session cache.
 
     Args:
-        segment_file: A string path to the geojson file generated by
-            write_speeds_to_map_segments that should contain geometry as well
-            as speed data.
-        census_file: A string path to the geojson file generated by
-            write_census_data_to_csv that should contain the combined s0801 and
-            s1902 tables.
-        colormap: A Colormap object that describes what speeds should be mapped
-            to what colors.
-        home_loc_value: A string of latitude and longitude for the home box
-        destination_loc_value: A string of latitude and longitude of the destination
-        min_income_value: A decimal value for the minimum income inputted
-        max_income_value: A decimal value for the maximum income inputted
+        names: Names of artifacts in SESSION_DEPENDENTS. With no names the
+            whole session is cleared.
 
     Returns:
-        A Folium Map object containing the most up-to-date speed data from the
-        dynamodb.
+        A sorted list of the names of the artifacts that were dropped.
     """
-    # Read in route shapefile and give it the style function above
-    kcm_routes = folium.GeoJson(
-        name='King Country Metro Speed Data',
-        data=f"{segment_file}_w_speeds_tmp.geojson",
-        style_function=lambda feature: {
-            'color': 'gray' if feature['properties']['AVG_SPEED_M_S'] == 0 \
-                else colormap(feature['properties']['AVG_SPEED_M_S']),
-            'weight': 1 if feature['properties']['AVG_SPEED_M_S'] == 0 \
-                else 3},
-        highlight_function=lambda feature: {
-            'fillColor': '#ffaf00', 'color': 'blue', 'weight': 6},
-        tooltip=folium.features.GeoJsonTooltip(
-            fields=['ROUTE_NUM', 'AVG_SPEED_M_S',
-                    'ROUTE_ID', 'LOCAL_EXPR', 'HISTORIC_SPEEDS'],
-            aliases=['Route Number', 'Most Recent Speed (m/s)',
-                     'Route ID', 'Local (L) or Express (E)', 'Previous Speeds']))
-
-    # Read in the census data/shapefile and create a choropleth based on income
-    seattle_tracts_df = pd.read_csv(f"{census_file}_tmp.csv")
-    seattle_tracts_df['GEO_ID'] = seattle_tracts_df['GEO_ID'].astype(str)
-    seattle_tracts_df['mean_income'] = pd.to_numeric(\
-                                         seattle_tracts_df['mean_income'],\
-                                         errors='coerce')
-
-    # Makes the numbers smaller so the legend would look better
-    seattle_tracts_df['mean_income'] = seattle_tracts_df['mean_income']/1000
-
-    seattle_tracts_df = seattle_tracts_df.dropna()
-
-    seattle_tracts = folium.Choropleth(
-        geo_data=f"{census_file}.geojson",
-        name='Socioeconomic Data',
-        data=seattle_tracts_df,
-        columns=['GEO_ID', 'mean_income'],
-        # added thresholding values for coloring based off widget income inputs
-        threshold_scale=[seattle_tracts_df["mean_income"].min()-1, \
-                         int(min_income_value)/1000, \
-                         int(max_income_value)/1000, \
-                         seattle_tracts_df["mean_income"].max()+1],
-        key_on='feature.properties.GEOID10',
-        fill_color="PuBuGn",
-        fill_opacity=0.7,
-        line_opacity=0.4,
-        legend_name='mean income (x$1000)')
-
-    # Creates folium marker based off destination latitude and longtitude
-    dest_lat = float(destination_loc_value.split(",")[0])
-    dest_long = float(destination_loc_value.split(" ")[1])
-    dest_marker = folium.Marker(
-        location=[dest_lat, dest_long],
-        popup="Destination",
-        icon=folium.Icon(color="green", icon="info-sign"))
-
-    # Creates folium marker based off home latitude and longtitude
-    home_lat = float(home_loc_value.split(",")[0])
-    home_long = float(home_loc_value.split(" ")[1])
-    home_marker = folium.Marker(
-        location=[home_lat, home_long],
-        popup="Home",
-        icon=folium.Icon(color="red", icon="info-sign"))
-
-    # Draw map using the speeds and census data
-    f_map = folium.Map(
-        location=[47.606209, -122.332069],
-        zoom_start=11,
-        prefer_canvas=True)
-    seattle_tracts.add_to(f_map)
-    kcm_routes.add_to(f_map)
-    dest_marker.add_to(f_map)
-    home_marker.add_to(f_map)
-    colormap.caption = 'Average Speed (m/s)'
-    colormap.add_to(f_map)
-    folium.LayerControl().add_to(f_map)
-    return f_map
+    to_drop = list(names) if len(names) > 0 else list(SESSION_DEPENDENTS)
+    dropped = set()
+    while len(to_drop) > 0:
+        name = to_drop.pop()
+        if name in SESSION_DEPENDENTS:
+            pass
+        else:
+            raise KeyError(f"unknown session artifact {name}")
+        if name not in dropped:
+            dropped.add(name)
+            to_drop.extend(SESSION_DEPENDENTS[name])
+    for name in dropped:
+        _SESSION.pop(name, None)
+    return sorted(dropped)
+
+class BuildSuperseded(Exception):
+    """Raised inside a map build when a newer build has been requested."""
+
+def read_widget_inputs():
+    """Reads and checks the values entered in the widget input boxes.
+
+    Returns:
+        A dictionary with the home_loc_value, destination_loc_value,
+        min_income_value and max_income_value entered in the widget.
+    """
+    widget_set = make_widgets()
+    home_loc = widget_set['home_loc'].value
+    destination_loc = widget_set['destination_loc'].value
+    min_income = widget_set['min_income'].value
+    max_income = widget_set['max_income'].value
+    if len(destination_loc) > 0:
+        pass
+    else:
+        raise ValueError("Please enter a value for your destination.")
+
+    if len(min_income) > 0:
+        pass
+    else:
+        raise ValueError("Please enter a value for your minimum yearly income.")
+
+
+    if len(max_income) > 0:
+        pass
+    else:
+        raise ValueError("Please enter a value for your maximum yearly income.")
+
+    if min_income.isdecimal():
+        pass
+    else:
+        raise ValueError("Minimum income value input must be a whole number.")
+
+    if max_income.isdecimal():
+        pass
+    else:
+        raise ValueError("Maximum income value input must be a whole number.")
+
+
+    if int(max_income) > int(min_income):
+        pass
+    else:
+        raise ValueError("Maximum yearly income value must be greater than minimum.")
+
+    return {
+        'home_loc_value': home_loc,
+        'destination_loc_value': destination_loc,
+        'min_income_value': min_income,
+        'max_income_value': max_income}
+
+def build_widget_map(inputs, progress=print, check_current=None,
+                     paths=None):
+    """Runs each stage of the widget pipeline and saves the map.
+
+    Only the artifacts missing from the session cache, or cached for other
+    paths or an older route file, are rebuilt. Between
+    stages check_current is called, which lets a newer build stop this one.
+
+    Args:
+        inputs: A dictionary of widget values as returned by
+            read_widget_inputs. If it has a true 'refresh' value, the cached
+            speeds are dropped first.
+        progress: A function that is called with a message as each stage
+            starts.
+        check_current: A function that raises BuildSuperseded if this build
+            should stop, or None to always finish.
+        paths: A dictionary to override any of the entries of WIDGET_PATHS.
+
+    Returns:
+        The path of the saved map .html file.
+    """
+    paths = dict(WIDGET_PATHS, **(paths or {}))
+    if check_current is None:
+        check_current = lambda: None
+    start = time.perf_counter()
+    if inputs.get('refresh', False):
+        invalidate_session('speed_lookup')
+
+    def build_census():
+        progress("Preparing census data...")
+        return census_data.prepare_census_data(
+            paths['s0801_path'], paths['s1902_path'], paths['census_path'])
+    session_artifact(
+        'census',
+        build_census,
+        key=(paths['s0801_path'], paths['s1902_path'], paths['census_path']))
+    check_current()
+
+    def build_table():
+        progress("Connecting to dynamodb...")
+        return transit_vis.connect_to_dynamo_table(paths['table_name'])
+    table = session_artifact('table', build_table, key=paths['table_name'])
+    check_current()
+
+    def build_speed_lookup():
+        progress("Getting speed data from dynamodb...")
+        return transit_vis.cached_table_to_lookup(
+            table, paths['cache_path'], total_segments=4)
+    speed_lookup = session_artifact(
+        'speed_lookup', build_speed_lookup, key=paths['cache_path'])
+    check_current()
+
+    def build_segments():
+        progress("Writing speed data to segments for visualization...")
+        speeds = transit_vis.write_speeds_to_map_segments(
+            speed_lookup, paths['segment_path'])
+        segment_data = segment_store.get_enriched_segments(paths['segment_path'])
+        linear_cm = transit_vis.speed_colormap(speeds)
+        tooltip_fields, tooltip_aliases = \
+            transit_vis.route_tooltip_fields(segment_data)
+        route_layer = compact_layer.CompactRouteLayer(
+            segment_data,
+            linear_cm,
+            fields=tooltip_fields,
+            aliases=tooltip_aliases,
+            name='King Country Metro Speed Data')
+        return {
+            'segment_data': segment_data,
+            'colormap': linear_cm,
+            'route_layer': route_layer,
+            'vertex_index': nearest_routes.load_vertex_index(
+                paths['segment_path']),
+            'trip_graph': route_graph.build_route_graph(
+                segment_data['features'])}
+    segments = session_artifact(
+        'segments',
+        build_segments,
+        key=pipeline.file_signature(f"{paths['segment_path']}.geojson"))
+    check_current()
+
+    tracts = session_artifact(
+        'tracts',
+        lambda: widget_map.prepare_widget_tracts(
+            paths['census_path'], segments['segment_data']),
+        key=paths['census_path'])
+    check_current()
+
+    progress("Generating map...")
+    f_map = widget_map.generate_folium_map_widget(
+        segments['segment_data'],
+        paths['census_path'],
+        segments['colormap'],
+        inputs['home_loc_value'],
+        inputs['destination_loc_value'],
+        inputs['min_income_value'],
+        inputs['max_income_value'],
+        tracts=tracts,
+        route_layer=segments['route_layer'],
+        vertex_index=segments['vertex_index'],
+        trip_graph=segments['trip_graph'])
+    check_current()
+
+    progress("Saving map...")
+    f_map.save(paths['output_path'])
+    progress("Map saved, please copy this file path into any browser: "
+             f"file://{os.path.abspath(paths['output_path'])}")
+    progress(f"Done in {time.perf_counter() - start:.2f} s")
+    return paths['output_path']
+
+def run_build(generation, inputs, paths=None):
+    """Runs one map build in the background executor, reporting to the output widget.
+
+    Args:
+        generation: The build number given by submit_build; the build stops
+            at the next stage once a newer build has been submitted.
+        inputs: A dictionary of widget values as returned by
+            read_widget_inputs.
+        paths: A dictionary to override any of the entries of WIDGET_PATHS.
+
+    Returns:
+        The path of the saved map, or None if the build was superseded.
+    """
+    output = make_widgets()['output']
+
+    def progress(message):
+        if generation == _BUILDS['generation']:
+            output.append_stdout(message + '\n')
+
+    def check_current():
+        if generation == _BUILDS['generation']:
+            pass
+        else:
+            raise BuildSuperseded(f"build {generation} superseded")
+
+    try:
+        check_current()
+        return build_widget_map(inputs, progress, check_current, paths)
+    except BuildSuperseded:
+        return None
+    except Exception as error: # pylint: disable=W0703
+        progress(f"Map build failed: {error!r}")
+        raise
+
+def submit_build(inputs, paths=None):
+    """Starts a map build in the background, superseding any earlier build.
+
+    Builds run one at a time in a background thread, so the notebook stays
+    responsive. A build that has not started yet is cancelled, and a build in
+    progress stops at the start of its next stage.
+
+    Args:
+        inputs: A dictionary of widget values as returned by
+            read_widget_inputs.
+        paths: A dictionary to override any of the entries of WIDGET_PATHS.
+
+    Returns:
+        A concurrent.futures.Future for the path of the saved map.
+    """
+    with _BUILDS['lock']:
+        _BUILDS['generation'] += 1
+        if _BUILDS['future'] is not None:
+            _BUILDS['future'].cancel()
+        _BUILDS['future'] = _EXECUTOR.submit(
+            run_build, _BUILDS['generation'], inputs, paths)
+        return _BUILDS['future']
 
 def button_execute_app(obj):
     """Sets up an executable widget to interfact with transit_vis visualization
 
     Run an executable widget with location coordinates and a salary range that
-    utilizes the transit_vis data to create the visualization html
+    utilizes the transit_vis data to create the visualization html. The map
+    is built in the background; progress is shown in the output widget.
 
     Args:
         obj: widget object
 
     Returns:
-        Widget is displayed
+        A Future for the path of the saved map, or None if the inputs are not
+        valid
     """
-    with OUTPUT:
+    with make_widgets()['output']:
         clear_output()
+        try:
+            inputs = read_widget_inputs()
+        except ValueError as error:
+            print(error)
+            return None
+    return submit_build(inputs)
 
-        if len(DESTINATION_LOC.value) > 0:
-            pass
-        else:
-            raise ValueError("Please enter a value for your destination.")
-
-        if len(MIN_INCOME_INPUT_BOX.value) > 0:
-            pass
-        else:
-            raise ValueError("Please enter a value for your minimum yearly income.")
+def button_refresh_speeds(obj):
+    """Builds the map as button_execute_app does, with the latest speeds.
 
+    Args:
+        obj: widget object
 
-        if len(MAX_INCOME_INPUT_BOX.value) > 0:
-            pass
-        else:
-            raise ValueError("Please enter a value for your maximum yearly income.")
+    Returns:
+        A Future for the path of the saved map, or None if the inputs are not
+        valid
+    """
+    with make_widgets()['output']:
+        clear_output()
+        try:
+            inputs = read_widget_inputs()
+        except ValueError as error:
+            print(error)
+            return None
+    inputs['refresh'] = True
+    return submit_build(inputs)
 
-        if MIN_INCOME_INPUT_BOX.value.isdecimal():
-            pass
-        else:
-            raise ValueError("Minimum income value input must be a whole number.")
+def make_widgets():
+    """Builds the input boxes, buttons and output area of the widget.
 
-        if MAX_INCOME_INPUT_BOX.value.isdecimal():
-            pass
-        else:
-            raise ValueError("Maximum income value input must be a whole number.")
+    The widgets are built once, the first time they are needed, so importing
+    this module does not build or display anything.
 
+    Returns:
+        A dictionary of the home_loc, destination_loc, min_income and
+        max_income input boxes, the app_button and refresh_button, the
+        input_box that combines them, and the output widget.
+    """
+    with _WIDGETS['lock']:
+        if _WIDGETS['widgets'] is not None:
+            return _WIDGETS['widgets']
+
+        # Creates home input box
+        home_loc = widgets.Text(
+            value="47.653834, -122.307858",
+            placeholder='Enter Home Location in "lat, long"',
+            description='Home: ',
+            disabled=False,
+            style={'description_width': 'initial'},
+            layout=Layout(width="380px", height="auto")
+        )
+
+        # Creates destination input box
+        destination_loc = widgets.Text(
+            value="47.606209, -122.332069",
+            placeholder='Enter Destination Location in "lat, long"',
+            description='Destination: ',
+            disabled=False,
+            style={'description_width': 'initial'},
+            layout=Layout(width="380px", height="auto")
+        )
+
+        # Creates minimum income input box
+        min_income = widgets.Text(
+            placeholder='Enter minimum yearly income ($)',
+            description='Income Minimum:',
+            disabled=False,
+            style={'description_width': 'initial'},
+            layout=Layout(width="380px", height="auto")
+        )
+
+        # Creates maximum income input box
+        max_income = widgets.Text(
+            placeholder='Enter maximum yearly income ($)',
+            description='Income Maximum:',
+            disabled=False,
+            style={'description_width': 'initial'},
+            layout=Layout(width="380px", height="auto")
+        )
+
+        # Creates a clickable button to execute a function based off inputs
+        app_button = widgets.Button(description='Generate Map',\
+                                    layout=Layout(width="380px", height="auto"))
+
+        # A function which executes upon app_button being clicked and executes
+        ## verifications as well as filter and output the map
+        app_button.on_click(button_execute_app)
+
+        # Creates a button that downloads the latest speeds before drawing the map
+        refresh_button = widgets.Button(description='Refresh Speeds',\
+                                        layout=Layout(width="380px", height="auto"))
+        refresh_button.on_click(button_refresh_speeds)
+
+        # Combines all input boxes and widget together
+        input_box = VBox([home_loc, destination_loc, min_income,\
+                          max_income, app_button, refresh_button])
+
+        # Assigns an output widget to display the output from the executed
+        # function and allow for overwriting
+        output = widgets.Output()
+
+        _WIDGETS['widgets'] = {
+            'home_loc': home_loc,
+            'destination_loc': destination_loc,
+            'min_income': min_income,
+            'max_income': max_income,
+            'app_button': app_button,
+            'refresh_button': refresh_button,
+            'input_box': input_box,
+            'output': output}
+        return _WIDGETS['widgets']
+
+def show_widget():
+    """Displays the widget in a jupyter notebook.
+
+    This is the entry point of widget_transit_vis.ipynb.
 
-        if int(MAX_INCOME_INPUT_BOX.value) > int(MIN_INCOME_INPUT_BOX.value):
-            pass
-        else:
-            raise ValueError("Maximum yearly income value must be greater than minimum.")
-
-
-        table_name = 'KCM_Bus_Routes'
-        s0801_path = './transit_vis/data/s0801'
-        s1902_path = './transit_vis/data/s1902'
-        segment_path = './transit_vis/data/kcm_routes'
-        census_path = './transit_vis/data/seattle_census_tracts_2010'
-
-        print("Modifying and writing census data...")
-        transit_vis.write_census_data_to_csv(s0801_path, s1902_path, census_path)
-
-        # Connect to dynamodb
-        print("Connecting to dynamodb...")
-        table = transit_vis.connect_to_dynamo_table(table_name)
-
-        # Query the dynamoDB for all speed data
-        print("Getting speed data from dynamodb...")
-        speed_lookup = transit_vis.table_to_lookup(table)
-
-        print("Writing speed data to segments for visualization...")
-        speeds = transit_vis.write_speeds_to_map_segments(speed_lookup, segment_path)
-
-        plt.close("all")
-
-        # Create the color mapping for speeds
-        print("Generating map...")
-        linear_cm = cm.LinearColormap(
-            ['red', 'yellow', 'green'],
-            vmin=0.0,
-            vmax=np.ceil(np.percentile(speeds[speeds > 0.0], 95)))
-
-        f_map = generate_folium_map_widget(segment_path,\
-                                           census_path,\
-                                           linear_cm,\
-                                           HOME_LOC.value,\
-                                           DESTINATION_LOC.value,\
-                                           MIN_INCOME_INPUT_BOX.value,\
-                                           MAX_INCOME_INPUT_BOX.value)
-
-        print("Saving map...")
-        transit_vis.save_and_view_map(f_map, 'output_map_widgets.html')
-        return 1
-
-# Creates home input box
-HOME_LOC = widgets.Text(
-    value="47.653834, -122.307858",
-    placeholder='Enter Home Location in "lat, long"',
-    description='Home: ',
-    disabled=False,
-    style={'description_width': 'initial'},
-    layout=Layout(width="380px", height="auto")
-)
-
-# Creates destination input box
-DESTINATION_LOC = widgets.Text(
-    value="47.606209, -122.332069",
-    placeholder='Enter Destination Location in "lat, long"',
-    description='Destination: ',
-    disabled=False,
-    style={'description_width': 'initial'},
-    layout=Layout(width="380px", height="auto")
-)
-
-# Creates minimum income input box
-MIN_INCOME_INPUT_BOX = widgets.Text(
-    placeholder='Enter minimum yearly income ($)',
-    description='Income Minimum:',
-    disabled=False,
-    style={'description_width': 'initial'},
-    layout=Layout(width="380px", height="auto")
-)
-
-# Creates maximum income input box
-MAX_INCOME_INPUT_BOX = widgets.Text(
-    placeholder='Enter maximum yearly income ($)',
-    description='Income Maximum:',
-    disabled=False,
-    style={'description_width': 'initial'},
-    layout=Layout(width="380px", height="auto")
-)
-
-# Creates a clickable button to execute a function based off inputs
-APP_BUTTON = widgets.Button(description='Generate Map',\
-                            layout=Layout(width="380px", height="auto"))
-
-# A function which executes upon app_button being clicked and executes verifications
-## as well as filter and output the map
-APP_BUTTON.on_click(button_execute_app)
-
-# Combines all input boxes and widget together
-INPUT_BOX = VBox([HOME_LOC, DESTINATION_LOC, MIN_INCOME_INPUT_BOX,\
-                  MAX_INCOME_INPUT_BOX, APP_BUTTON])
-
-# Assigns an output widget to display the output from the executed function
-# and allow for overwriting
-OUTPUT = widgets.Output()
-
-display(INPUT_BOX)
-display(OUTPUT)
+    Returns:
+        The dictionary of widgets as returned by make_widgets.
+    """
+    widget_set = make_widgets()
+    display(widget_set['input_box'])
+    display(widget_set['output'])
+    return widget_set
@@ -20,19 +20,31 @@ test_edgecase_get_results_negative(cls) -- edge case test for input value to get
 
 test_edgecase_get_results_no_connection(cls) -- edge case test for input value to get results
 
+test_oneshot_get_results_run_date(self) -- oneshot test that the query covers the UTC day of run_date
+
 test_smoke_preprocess(cls) -- smoke test for preprocessing trip data
 
 test_oneshot_preprocess(self) -- oneshot test for preprocessing trip data
+
+test_oneshot_aggregate(self) -- oneshot test for summarizing speeds and schedule deviations by route
+
+test_oneshot_upload_metrics(self) -- oneshot test that every metric of a route is written in one update
+
+test_oneshot_resume_upload(self) -- oneshot test that resuming a failed upload appends each speed once
+
+test_oneshot_trip_query(self) -- oneshot test for the half open collectedtime range query
 """
 
 
 import os
 
 import unittest
+import botocore.exceptions
 import numpy as np
 import pandas as pd
 
 from transit_vis.src import initialize_dynamodb
+from transit_vis.src import speed_cache
 from transit_vis.src import summarize_rds
 
 
@@ -136,6 +148,41 @@ class TestBackendHelpers(unittest.TestCase):
         except TypeError:
             pass
 
+    def test_oneshot_get_results_run_date(self):
+        """
+        Oneshot test that 'get_last_xdays_results' queries the UTC days ending
+        with run_date, whenever it is run
+        """
+        class FakeCursor():
+            """Records the queries run and returns one bus location"""
+            description = [
+                type('Column', (), {'name': name})() for name in [
+                    'tripid', 'vehicleid', 'orientation', 'scheduledeviation',
+                    'locationtime', 'collectedtime']]
+            def __init__(self, queries):
+                self.queries = queries
+            def __enter__(self):
+                return self
+            def __exit__(self, *args):
+                return False
+            def __iter__(self):
+                return iter([(1, 2, 90, 30, 1606780900, 1606780910)])
+            def execute(self, query_text, query_params):
+                """Records one query"""
+                self.queries.append(query_params)
+        class FakeConnection():
+            """Makes cursors that record their queries"""
+            def __init__(self):
+                self.queries = []
+            def cursor(self):
+                """Returns a new recording cursor"""
+                return FakeCursor(self.queries)
+        conn = FakeConnection()
+        summarize_rds.get_last_xdays_results(conn, 1, 0, '2020-12-01')
+        summarize_rds.get_last_xdays_results(conn, 2, 10, '2020-12-01')
+        self.assertEqual(conn.queries, [
+            [1606780800, 1606867200], [1606694400, 1606867200, 10]])
+
     @classmethod
     def test_smoke_preprocess(cls):
         """
@@ -150,6 +197,127 @@ class TestBackendHelpers(unittest.TestCase):
         preprocessed_data = summarize_rds.preprocess_trip_data(DAILY_RESULTS)
         self.assertTrue(pd.notnull(preprocessed_data).any)
 
+    def test_oneshot_aggregate(self):
+        """
+        Oneshot test for the function 'aggregate_speeds'
+        """
+        route_speeds = summarize_rds.aggregate_speeds(pd.DataFrame({
+            'route_id': [100002, 100001, 100001, 100001, 100001, 100001, np.nan],
+            'trip_short_name': [
+                'EXPRESS', 'LOCAL', 'LOCAL', 'LOCAL', 'EXPRESS', np.nan, 'LOCAL'],
+            'avg_speed_m_s': [9.0, 4.0, 6.0, 5.0, 7.0, 3.0, 2.0],
+            'scheduledeviation': [30, 400, -90, 100, 0, 0, 0]}))
+        self.assertEqual(
+            [(track['route_id'], track['trip_short_name']) for track in route_speeds],
+            [(100001, 'EXPRESS'), (100001, 'LOCAL'), (100002, 'EXPRESS')])
+        self.assertEqual(route_speeds[1], {
+            'route_id': 100001, 'trip_short_name': 'LOCAL',
+            'avg_speed_m_s': '5.0', 'sample_count': 3,
+            'on_time_share': '0.333', 'median_lateness_s': 100})
+        self.assertEqual(route_speeds[2]['sample_count'], 1)
+        self.assertEqual(route_speeds[2]['median_lateness_s'], 30)
+        self.assertEqual(summarize_rds.aggregate_speeds(pd.DataFrame(columns=[
+            'route_id', 'trip_short_name', 'avg_speed_m_s', 'scheduledeviation'])), [])
+
+    def test_oneshot_upload_metrics(self):
+        """
+        Oneshot test that the function 'upload_route_speeds' writes the speed
+        and metrics of each route with a single update
+        """
+        class FakeTable():
+            """Records the updates made to a dynamodb table"""
+            def __init__(self):
+                self.updates = []
+            def update_item(self, **kwargs):
+                """Records one update"""
+                self.updates.append(kwargs)
+        table = FakeTable()
+        route_speeds = summarize_rds.aggregate_speeds(pd.DataFrame({
+            'route_id': [100001, 100002],
+            'trip_short_name': ['LOCAL', 'EXPRESS'],
+            'avg_speed_m_s': [4.0, 9.0],
+            'scheduledeviation': [30, 400]}))
+        self.assertEqual(summarize_rds.upload_route_speeds(table, route_speeds), 2)
+        self.assertEqual(len(table.updates), 4)
+        self.assertEqual(
+            table.updates[2]['ExpressionAttributeValues'][':keys'],
+            [[100001, 'L'], [100002, 'E']])
+        self.assertTrue(table.updates[2]['Key']['local_express_code'].startswith(
+            speed_cache.CHANGES_PREFIX))
+        update = table.updates[1]
+        self.assertEqual(update['Key'], {'route_id': 100002, 'local_express_code': 'E'})
+        for name in ['avg_speed_m_s', 'on_time_share', 'median_lateness_s',
+                     'sample_count', 'historic_speeds']:
+            self.assertIn(f"{name}=", update['UpdateExpression'])
+        self.assertEqual(update['ExpressionAttributeValues'][':on_time_share'], '0.0')
+        self.assertEqual(update['ExpressionAttributeValues'][':median_lateness_s'], 400)
+
+    def test_oneshot_resume_upload(self):
+        """
+        Oneshot test that running 'upload_route_speeds' again for a date after
+        it failed partway adds one historic speed to each route, and that a
+        later date adds another
+        """
+        class FailingTable():
+            """Applies the speed updates of a dynamodb table, and fails after
+            a number of them"""
+            def __init__(self):
+                self.items = {}
+                self.conditions = set()
+                self.num_left = None
+            def update_item(self, Key, UpdateExpression, ExpressionAttributeValues,
+                            ConditionExpression=None):
+                """Applies an update the way dynamodb would for these tests"""
+                key = (Key['route_id'], Key['local_express_code'])
+                if ':vals' not in ExpressionAttributeValues:
+                    return
+                if self.num_left == 0:
+                    raise ConnectionError('lost the connection to dynamodb')
+                if self.num_left is not None:
+                    self.num_left -= 1
+                item = self.items.setdefault(key, {'historic_speeds': []})
+                run_date = ExpressionAttributeValues[':run_date']
+                self.conditions.add(ConditionExpression)
+                if item.get('last_run_date') == run_date:
+                    raise botocore.exceptions.ClientError(
+                        {'Error': {'Code': 'ConditionalCheckFailedException'}},
+                        'UpdateItem')
+                item['last_run_date'] = run_date
+                item['historic_speeds'] += ExpressionAttributeValues[':vals']
+        table = FailingTable()
+        route_speeds = summarize_rds.aggregate_speeds(pd.DataFrame({
+            'route_id': [100001, 100002, 100003],
+            'trip_short_name': ['LOCAL', 'EXPRESS', 'LOCAL'],
+            'avg_speed_m_s': [4.0, 9.0, 6.0],
+            'scheduledeviation': [30, 400, 0]}))
+        table.num_left = 2
+        with self.assertRaises(ConnectionError):
+            summarize_rds.upload_route_speeds(table, route_speeds, '2020-12-01')
+        table.num_left = None
+        self.assertEqual(
+            summarize_rds.upload_route_speeds(table, route_speeds, '2020-12-01'), 3)
+        self.assertEqual(
+            [item['historic_speeds'] for item in table.items.values()],
+            [['4.0'], ['9.0'], ['6.0']])
+        summarize_rds.upload_route_speeds(table, route_speeds, '2020-12-02')
+        self.assertEqual(
+            [len(item['historic_speeds']) for item in table.items.values()],
+            [2, 2, 2])
+        self.assertEqual(table.conditions, {
+            'attribute_not_exists(last_run_date) OR last_run_date <> :run_date'})
+
+    def test_oneshot_trip_query(self):
+        """
+        Oneshot test for the function 'build_trip_query'
+        """
+        query_text, query_params = summarize_rds.build_trip_query(100, 200, 0)
+        self.assertIn('collectedtime >= %s AND collectedtime < %s', query_text)
+        self.assertNotIn('LIMIT', query_text)
+        self.assertEqual(query_params, [100, 200])
+        query_text, query_params = summarize_rds.build_trip_query(100, 200, 5)
+        self.assertTrue(query_text.endswith('LIMIT %s;'))
+        self.assertEqual(query_params, [100, 200, 5])
+
 ##############################################################################
 
 SUITE = unittest.TestLoader().loadTestsFromTestCase(TestBackendHelpers)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test rendering map scenarios in batches
+
+test_smoke_render_scenarios(cls) -- smoke test for rendering scenarios in this process
+
+test_oneshot_render_scenarios(self) -- one shot test for rendering scenarios with a process pool
+
+test_edgecase_check_scenarios(self) -- edge case to catch scenarios with missing inputs
+
+test_edgecase_quiet_import(self) -- edge case to catch notebook widgets loaded or shown on import
+"""
+
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from transit_vis.src import batch_maps
+from transit_vis.src import census_data
+from transit_vis.src import transit_vis
+
+
+S0801_PATH = './transit_vis/tests/data/s0801'
+S1902_PATH = './transit_vis/tests/data/s1902'
+SEGMENT_PATH = './transit_vis/tests/data/kcm_routes'
+CENSUS_PATH = './transit_vis/tests/data/seattle_census_tracts_2010'
+ROUTE_DICT = {(100001, 'L'): {'avg_speed_m_s': 7.5, 'historic_speeds': [2.2, 7.5]}}
+
+
+def make_scenarios(output_dir, num_scenarios):
+    """Creates scenarios with different income ranges and output files."""
+    return [{
+        'home_loc_value': '47.653834, -122.307858',
+        'destination_loc_value': '47.606209, -122.332069',
+        'min_income_value': 30000 + 10000 * i,
+        'max_income_value': 90000,
+        'vmax': 10 + i,
+        'output_path': os.path.join(output_dir, f"scenario_{i}.html")}
+            for i in range(num_scenarios)]
+
+
+class TestBatchMaps(unittest.TestCase):
+    """
+    Unittest for the module 'batch_maps'
+    """
+    @classmethod
+    def setUpClass(cls):
+        census_data.prepare_census_data(S0801_PATH, S1902_PATH, CENSUS_PATH)
+        transit_vis.write_speeds_to_map_segments(ROUTE_DICT, SEGMENT_PATH)
+
+    @classmethod
+    def test_smoke_render_scenarios(cls):
+        """
+        Smoke test for the function 'render_scenarios' in this process
+        """
+        with tempfile.TemporaryDirectory() as output_dir:
+            assert batch_maps.render_scenarios(
+                make_scenarios(output_dir, 1),
+                SEGMENT_PATH,
+                CENSUS_PATH,
+                max_workers=1) is not None
+
+    def test_oneshot_render_scenarios(self):
+        """
+        One shot test that the function 'render_scenarios' writes a map for
+        every scenario using a pool of worker processes
+        """
+        with tempfile.TemporaryDirectory() as output_dir:
+            scenarios = make_scenarios(output_dir, 3)
+            result = batch_maps.render_scenarios(
+                scenarios,
+                SEGMENT_PATH,
+                CENSUS_PATH,
+                max_workers=2)
+            self.assertEqual(
+                result['output_paths'],
+                [scenario['output_path'] for scenario in scenarios])
+            for path in result['output_paths']:
+                self.assertGreater(os.path.getsize(path), 0)
+            self.assertGreater(result['maps_per_minute'], 0)
+
+    def test_edgecase_check_scenarios(self):
+        """
+        Edge case test to catch a scenario without an output path
+        """
+        scenario = make_scenarios('.', 1)[0]
+        del scenario['output_path']
+        with self.assertRaises(ValueError):
+            batch_maps.check_scenarios([scenario])
+
+    def test_edgecase_quiet_import(self):
+        """
+        Edge case test that importing batch_maps prints nothing and does not
+        load the notebook widget libraries
+        """
+        result = subprocess.run(
+            [sys.executable, '-c',
+             "import sys; from transit_vis.src import batch_maps; "
+             "sys.stderr.write(str(sorted({'ipywidgets', 'IPython'} & set(sys.modules))))"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True)
+        self.assertEqual(result.stdout, '')
+        self.assertEqual(result.stderr, '[]')
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestBatchMaps)
+_ = unittest.TextTestRunner().run(SUITE)
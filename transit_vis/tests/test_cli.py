@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the command line entry point
+
+test_smoke_parser(cls) -- smoke test for parsing the arguments of each stage
+
+test_oneshot_parser_defaults(self) -- one shot test for the default render arguments
+
+test_edgecase_parser_fetch_mode(self) -- edge case to catch an invalid fetch mode
+
+test_oneshot_lazy_imports(self) -- one shot test that parsing does not import heavy libraries
+
+test_oneshot_import_budgets(self) -- one shot test that modules import within their budgets
+
+test_edgecase_over_budget(self) -- edge case for the exit status of a module over its budget
+"""
+
+
+import subprocess
+import sys
+import unittest
+
+from transit_vis.src import cli
+
+
+class TestCli(unittest.TestCase):
+    """
+    Unittest for the module 'cli'
+    """
+    @classmethod
+    def test_smoke_parser(cls):
+        """
+        Smoke test for the function 'build_parser'
+        """
+        parser = cli.build_parser()
+        for command in ['init', 'summarize', 'render', 'serve', 'daily', 'partitions',
+                        'importtime']:
+            assert parser.parse_args([command]) is not None
+        assert parser.parse_args(['batch', 'scenarios.json']) is not None
+
+    def test_oneshot_parser_defaults(self):
+        """
+        One shot test for the default arguments of the render stage
+        """
+        args = cli.build_parser().parse_args(['render'])
+        self.assertEqual(args.table, 'KCM_Bus_Routes')
+        self.assertEqual(args.fetch_mode, 'cache')
+        self.assertIs(args.func, cli.run_render)
+
+    def test_edgecase_parser_fetch_mode(self):
+        """
+        Edge case test to catch an unknown fetch mode for the render stage
+        """
+        with self.assertRaises(SystemExit):
+            cli.build_parser().parse_args(['render', '--fetch-mode', 'all'])
+
+    def test_oneshot_lazy_imports(self):
+        """
+        One shot test that loading the command line tool and parsing arguments
+        does not import any of the libraries used by the stages
+        """
+        result = subprocess.run(
+            [sys.executable, '-c',
+             "import sys; from transit_vis.src import cli; "
+             "cli.build_parser().parse_args(['render']); "
+             "print(sorted({'boto3', 'folium', 'pandas', 'numpy', "
+             "'matplotlib', 'psycopg2'} & set(sys.modules)))"],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_oneshot_import_budgets(self):
+        """
+        One shot test that each module with an import budget is imported
+        within it
+        """
+        for module_name, budget_us in cli.IMPORT_BUDGETS_US.items():
+            self.assertLessEqual(cli.measure_import_time(module_name), budget_us)
+
+    def test_edgecase_over_budget(self):
+        """
+        Edge case test that the command line exits with an error when a
+        module is over its import budget
+        """
+        module_name = 'transit_vis.src.speed_cache'
+        self.assertEqual(cli.main(['importtime', module_name]), 0)
+        budget_us = cli.IMPORT_BUDGETS_US[module_name]
+        cli.IMPORT_BUDGETS_US[module_name] = 0
+        try:
+            self.assertEqual(cli.main(['importtime', module_name]), 1)
+        finally:
+            cli.IMPORT_BUDGETS_US[module_name] = budget_us
+        result = subprocess.run(
+            [sys.executable, '-c',
+             "import runpy, sys; from transit_vis.src import cli; "
+             f"cli.IMPORT_BUDGETS_US['{module_name}'] = 0; "
+             f"sys.argv = ['transit_vis', 'importtime', '{module_name}']; "
+             "runpy.run_module('transit_vis', run_name='__main__')"],
+            stdout=subprocess.PIPE,
+            check=False)
+        self.assertEqual(result.returncode, 1)
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestCli)
+_ = unittest.TextTestRunner().run(SUITE)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the shared AWS and warehouse clients
+
+test_smoke_dynamo_table(cls) -- smoke test for getting a table from the pooled resource
+
+test_oneshot_client_config(self) -- one shot test for the pool size and retry settings
+
+test_oneshot_resource_cache(self) -- one shot test that resources are made once per thread and share a client
+
+test_oneshot_check_connection(self) -- one shot test for the warehouse connection health check
+
+test_edgecase_broken_connection(self) -- edge case to catch a broken connection given back to the pool
+
+test_edgecase_no_healthy_connection(self) -- edge case to catch a pool that only has broken connections
+"""
+
+
+import os
+import threading
+import unittest
+
+import psycopg2
+
+from transit_vis.src import clients
+
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+
+
+class FakeCursor():
+    """
+    A stand in for a psycopg2 cursor that can fail every query
+    """
+    def __init__(self, error):
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query):
+        """Runs nothing, or raises the error if there is one"""
+        if self.error is not None:
+            raise self.error
+
+class FakeConnection():
+    """
+    A stand in for a psycopg2 connection
+    """
+    def __init__(self, closed=0, error=None):
+        self.closed = closed
+        self.error = error
+        self.num_rollbacks = 0
+
+    def cursor(self):
+        """Returns a cursor that fails if the connection is broken"""
+        return FakeCursor(self.error)
+
+    def rollback(self):
+        """Counts the rollbacks, or raises the error if there is one"""
+        if self.error is not None:
+            raise self.error
+        self.num_rollbacks += 1
+
+class FakePool():
+    """
+    A stand in for a psycopg2 connection pool that records returned
+    connections, and hands out connections that fail with an error
+    """
+    def __init__(self, error=None):
+        self.returned = []
+        self.error = error
+        self.num_checkouts = 0
+
+    def getconn(self):
+        """Counts the checkouts and makes a new connection"""
+        self.num_checkouts += 1
+        return FakeConnection(error=self.error)
+
+    def putconn(self, conn, close=False):
+        """Records a returned connection and if it was closed"""
+        self.returned.append((conn, close))
+
+
+class TestClients(unittest.TestCase):
+    """
+    Unittest for the module 'clients'
+    """
+    @classmethod
+    def test_smoke_dynamo_table(cls):
+        """
+        Smoke test for the function 'get_dynamo_table'
+        """
+        assert clients.get_dynamo_table('KCM_Bus_Routes').name == 'KCM_Bus_Routes'
+
+    def test_oneshot_client_config(self):
+        """
+        One shot test that resources keep enough pooled connections for the
+        parallel readers and retry with adaptive backoff
+        """
+        config = clients.get_resource('dynamodb').meta.client.meta.config
+        self.assertEqual(config.max_pool_connections, clients.MAX_POOL_CONNECTIONS)
+        self.assertEqual(config.retries['mode'], 'adaptive')
+
+    def test_oneshot_resource_cache(self):
+        """
+        One shot test that a resource is made once per thread, that the
+        threads share one client, and that it is made again after a fork
+        """
+        resource = clients.get_resource('dynamodb')
+        self.assertIs(clients.get_resource('dynamodb'), resource)
+        other = {}
+        thread = threading.Thread(
+            target=lambda: other.update(resource=clients.get_resource('dynamodb')))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other['resource'], resource)
+        self.assertIs(other['resource'].meta.client, resource.meta.client)
+        clients._CLIENTS['pid'] = -1
+        forked = clients.get_resource('dynamodb')
+        self.assertIsNot(forked, resource)
+        self.assertIsNot(forked.meta.client, resource.meta.client)
+
+    def test_oneshot_check_connection(self):
+        """
+        One shot test that only open connections that answer a query pass
+        the health check
+        """
+        self.assertTrue(clients.check_connection(FakeConnection()))
+        self.assertFalse(clients.check_connection(FakeConnection(closed=1)))
+        self.assertFalse(clients.check_connection(
+            FakeConnection(error=psycopg2.OperationalError())))
+
+    def test_edgecase_broken_connection(self):
+        """
+        Edge case test that a broken connection given back to the pool is
+        closed, and a healthy one is rolled back and kept
+        """
+        clients.get_session()
+        pool = FakePool()
+        clients._CLIENTS['rds_pool'] = pool
+        healthy = FakeConnection()
+        broken = FakeConnection(error=psycopg2.InterfaceError())
+        clients.release_rds_connection(healthy)
+        clients.release_rds_connection(broken)
+        clients._CLIENTS['rds_pool'] = None
+        self.assertEqual(pool.returned, [(healthy, False), (broken, True)])
+        self.assertEqual(healthy.num_rollbacks, 1)
+
+    def test_edgecase_no_healthy_connection(self):
+        """
+        Edge case test that an error is raised, instead of a connection that
+        was never checked being handed out, when every connection is broken
+        """
+        clients.get_session()
+        pool = FakePool(error=psycopg2.OperationalError())
+        clients._CLIENTS['rds_pool'] = pool
+        try:
+            with self.assertRaises(psycopg2.OperationalError):
+                clients.get_rds_connection()
+        finally:
+            clients._CLIENTS['rds_pool'] = None
+        self.assertEqual(pool.num_checkouts, clients.RDS_MAX_CONNECTIONS + 1)
+        self.assertTrue(all(close for _, close in pool.returned))
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestClients)
+_ = unittest.TextTestRunner().run(SUITE)
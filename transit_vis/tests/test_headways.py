@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the headway and bus bunching analysis
+
+test_smoke_route_headways(cls) -- smoke test for summarizing the headways of a route
+
+test_oneshot_bucket_crossings(self) -- one shot test for interpolating when trips pass each stretch
+
+test_oneshot_bunching_rate(self) -- one shot test for the bunching rate and median headway of routes
+
+test_oneshot_merge_metrics(self) -- one shot test for adding headway metrics to route speeds
+
+test_edgecase_ping_gaps(self) -- edge case for trips that restart or go unseen between pings
+
+test_edgecase_unmatched_pings(self) -- edge case for pings without a route or trip short name
+"""
+
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from transit_vis.src import headways
+from transit_vis.src import summarize_rds
+
+
+def make_pings(trips):
+    """
+    Makes pings every 30 s for trips given as (route id, trip short name,
+    direction, trip id, start time, speed in m/s)
+    """
+    rows = []
+    for route_id, short_name, direction, trip_id, start, speed in trips:
+        for step in range(40):
+            rows.append({
+                'route_id': route_id, 'trip_short_name': short_name,
+                'direction_id': direction, 'tripid': trip_id,
+                'tripdistance': step * 30 * speed,
+                'locationtime': start + step * 30})
+    return pd.DataFrame(rows).sample(frac=1, random_state=0)
+
+
+class TestHeadways(unittest.TestCase):
+    """
+    Unittest for the module 'headways'
+    """
+    @classmethod
+    def test_smoke_route_headways(cls):
+        """
+        Smoke test for the function 'route_headways'
+        """
+        pings = make_pings([
+            (100001, 'LOCAL', 0, 1, 1000, 10.0),
+            (100001, 'LOCAL', 0, 2, 1600, 10.0)])
+        assert len(headways.route_headways(pings)) == 1
+
+    def test_oneshot_bucket_crossings(self):
+        """
+        One shot test that every stretch start passed between two pings is
+        found, at the time interpolated between them
+        """
+        ping_index, buckets, times = headways.bucket_crossings(
+            [7, 7, 7], [100.0, 900.0, 1300.0], [0.0, 80.0, 120.0], 400.0)
+        np.testing.assert_array_equal(ping_index, [0, 0, 1])
+        np.testing.assert_array_equal(buckets, [1, 2, 3])
+        np.testing.assert_allclose(times, [30.0, 70.0, 110.0])
+
+    def test_oneshot_bunching_rate(self):
+        """
+        One shot test that buses only a minute apart count as bunched, and
+        that directions and routes are kept apart
+        """
+        pings = make_pings([
+            (100001, 'LOCAL', 0, 1, 1000, 10.0),
+            (100001, 'LOCAL', 0, 2, 1060, 10.0),
+            (100001, 'LOCAL', 0, 3, 1660, 10.0),
+            (100001, 'LOCAL', 1, 4, 1010, 10.0),
+            (100002, 'EXPRESS', 0, 5, 1005, 10.0)])
+        route_headways = headways.route_headways(pings)
+        self.assertEqual(len(route_headways), 1)
+        route = route_headways[0]
+        self.assertEqual(
+            (route['route_id'], route['trip_short_name']), (100001, 'LOCAL'))
+        # Trips 1 and 2 are 60 s apart and 2 and 3 600 s apart at each stretch
+        self.assertEqual(route['headway_count'] % 2, 0)
+        self.assertEqual(route['bunching_rate'], '0.5')
+        self.assertEqual(route['median_headway_s'], 330)
+
+    def test_oneshot_merge_metrics(self):
+        """
+        One shot test for the function 'merge_route_metrics'
+        """
+        route_speeds = [
+            {'route_id': 100001, 'trip_short_name': 'LOCAL', 'avg_speed_m_s': '5.0'},
+            {'route_id': 100002, 'trip_short_name': 'EXPRESS', 'avg_speed_m_s': '9.0'}]
+        route_metrics = summarize_rds.merge_route_metrics(route_speeds, [
+            {'route_id': 100001, 'trip_short_name': 'LOCAL', 'headway_count': 4,
+             'median_headway_s': 330, 'bunching_rate': '0.5'}])
+        self.assertEqual(route_metrics[0]['bunching_rate'], '0.5')
+        self.assertNotIn('bunching_rate', route_metrics[1])
+        self.assertNotIn('bunching_rate', route_speeds[0])
+
+    def test_edgecase_ping_gaps(self):
+        """
+        Edge case test that a trip id seen again the next day, or a trip
+        that goes unseen for too long, is not interpolated across the gap
+        """
+        ping_index, _, _ = headways.bucket_crossings(
+            [7, 7, 8, 8], [100.0, 900.0, 100.0, 900.0],
+            [0.0, 86400.0, 0.0, headways.MAX_PING_GAP_S + 1.0])
+        self.assertEqual(len(ping_index), 0)
+
+    def test_edgecase_unmatched_pings(self):
+        """
+        Edge case test that pings that did not match a GTFS trip are left out
+        instead of being counted as a route named 'nan'
+        """
+        pings = make_pings([
+            (100001, 'LOCAL', 0, 1, 1000, 10.0),
+            (100001, 'LOCAL', 0, 2, 1600, 10.0),
+            (100001, None, 0, 3, 1030, 10.0),
+            (100001, None, 0, 4, 1060, 10.0),
+            (np.nan, 'LOCAL', 0, 5, 1090, 10.0),
+            (np.nan, 'LOCAL', 0, 6, 1120, 10.0)])
+        route_headways = headways.route_headways(pings)
+        self.assertEqual(
+            [(route['route_id'], route['trip_short_name'], route['bunching_rate'])
+             for route in route_headways],
+            [(100001, 'LOCAL', '0.0')])
+        self.assertEqual(headways.route_headways(pings.iloc[0:0]), [])
+        self.assertEqual(headways.route_headways(make_pings([
+            (100001, 'LOCAL', 0, 1, 1000, 10.0)])), [])
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestHeadways)
+_ = unittest.TextTestRunner().run(SUITE)
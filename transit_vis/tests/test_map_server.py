@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the local map server
+
+test_smoke_map_page(cls) -- smoke test for serving the map page
+
+test_oneshot_layers(self) -- one shot test for serving each layer with an ETag
+
+test_oneshot_not_modified(self) -- one shot test that a matching ETag returns 304
+
+test_oneshot_speed_refresh(self) -- one shot test that only changed speeds rebuild the speed layer
+
+test_oneshot_gzip_etag(self) -- one shot test that the gzip encoding has its own ETag
+
+test_oneshot_layer_locks(self) -- one shot test that a slow layer does not block the others
+
+test_edgecase_unknown_layer(self) -- edge case to catch a request for an unknown layer
+"""
+
+
+import gzip
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from transit_vis.src import census_data
+from transit_vis.src import map_server
+
+
+S0801_PATH = './transit_vis/tests/data/s0801'
+S1902_PATH = './transit_vis/tests/data/s1902'
+SEGMENT_PATH = './transit_vis/tests/data/kcm_routes'
+CENSUS_PATH = './transit_vis/tests/data/seattle_census_tracts_2010'
+SPEEDS = {'version': 1, 'num_loads': 0}
+
+
+def get_speed_version():
+    """Returns the version of the fake speed data."""
+    return SPEEDS['version']
+
+def load_speeds():
+    """Returns a fake speed lookup and counts how many times it was loaded."""
+    SPEEDS['num_loads'] += 1
+    return {(100001, 'L'): {
+        'avg_speed_m_s': 5.0 + SPEEDS['version'],
+        'historic_speeds': [2.2, 5.0]}}
+
+
+class TestMapServer(unittest.TestCase):
+    """
+    Unittest for the module 'map_server'
+    """
+    @classmethod
+    def setUpClass(cls):
+        census_data.prepare_census_data(S0801_PATH, S1902_PATH, CENSUS_PATH)
+        cls.map_layers = map_server.MapLayers(
+            SEGMENT_PATH,
+            CENSUS_PATH,
+            get_speed_version,
+            load_speeds,
+            refresh_interval=0)
+        cls.server = map_server.make_server(cls.map_layers, port=0)
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    @classmethod
+    def test_smoke_map_page(cls):
+        """
+        Smoke test for serving the map page
+        """
+        with urllib.request.urlopen(f"{cls.url}/") as response:
+            page = response.read()
+        assert b'decodeTopology' in page
+        assert b'escapeHtml(speeds.aliases[j])' in page
+
+    def test_oneshot_layers(self):
+        """
+        One shot test for serving each layer of the map with an ETag
+        """
+        layers = {}
+        for name in ['routes', 'census', 'speeds']:
+            with urllib.request.urlopen(f"{self.url}/layers/{name}.json") as response:
+                self.assertEqual(response.status, 200)
+                self.assertIsNotNone(response.headers['ETag'])
+                layers[name] = json.loads(response.read())
+        num_features = len(layers['routes']['geometries'])
+        self.assertEqual(
+            len(layers['speeds']['columns']['color']), num_features)
+        self.assertGreater(len(layers['census']['features']), 0)
+        self.assertIn('fill', layers['census']['features'][0]['properties'])
+
+    def test_oneshot_not_modified(self):
+        """
+        One shot test that revalidating a layer with its ETag returns 304
+        """
+        with urllib.request.urlopen(f"{self.url}/layers/routes.json") as response:
+            etag = response.headers['ETag']
+        request = urllib.request.Request(
+            f"{self.url}/layers/routes.json",
+            headers={'If-None-Match': etag})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request)
+        self.assertEqual(context.exception.code, 304)
+
+    def test_oneshot_speed_refresh(self):
+        """
+        One shot test that the speed layer is only rebuilt when the speed
+        version changes, and that the route layer is never rebuilt
+        """
+        routes = self.map_layers.get('routes')
+        speeds = self.map_layers.get('speeds')
+        num_loads = SPEEDS['num_loads']
+        self.assertIs(self.map_layers.get('speeds'), speeds)
+        self.assertEqual(SPEEDS['num_loads'], num_loads)
+        SPEEDS['version'] += 1
+        new_speeds = self.map_layers.get('speeds')
+        self.assertEqual(SPEEDS['num_loads'], num_loads + 1)
+        self.assertNotEqual(new_speeds['etag'], speeds['etag'])
+        self.assertIs(self.map_layers.get('routes'), routes)
+
+    def test_oneshot_gzip_etag(self):
+        """
+        One shot test that the gzip and plain bodies have different ETags, so
+        a cache never serves one to a client that asked for the other
+        """
+        url = f"{self.url}/layers/census.json"
+        with urllib.request.urlopen(url) as response:
+            plain_etag = response.headers['ETag']
+            self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+            body = response.read()
+        request = urllib.request.Request(
+            url, headers={'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(request) as response:
+            gzip_etag = response.headers['ETag']
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.read()), body)
+        self.assertNotEqual(gzip_etag, plain_etag)
+        request = urllib.request.Request(
+            url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain_etag})
+        with urllib.request.urlopen(request) as response:
+            self.assertEqual(response.status, 200)
+        request = urllib.request.Request(
+            url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request)
+        self.assertEqual(context.exception.code, 304)
+
+    def test_oneshot_layer_locks(self):
+        """
+        One shot test that the routes layer is served while another thread is
+        building the speed layer
+        """
+        routes = self.map_layers.get('routes')
+        with self.map_layers.locks['speeds']:
+            with urllib.request.urlopen(
+                    f"{self.url}/layers/routes.json", timeout=5) as response:
+                self.assertEqual(response.headers['ETag'], routes['etag'])
+
+    def test_edgecase_unknown_layer(self):
+        """
+        Edge case test to catch a request for a layer that does not exist
+        """
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(f"{self.url}/layers/unknown.json")
+        self.assertEqual(context.exception.code, 404)
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestMapServer)
+_ = unittest.TextTestRunner().run(SUITE)
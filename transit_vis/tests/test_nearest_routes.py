@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the nearest route lookup
+
+test_smoke_nearest_routes(cls) -- smoke test for finding the routes near a point
+
+test_oneshot_brute_force(self) -- one shot test that the grid search matches measuring every vertex
+
+test_oneshot_max_distance(self) -- one shot test that routes past max_distance are left out
+
+test_oneshot_load_vertex_index(self) -- one shot test that the index of a file is only built once
+
+test_edgecase_k(self) -- edge case to catch asking for fewer than one route
+"""
+
+
+import unittest
+
+import numpy as np
+
+from transit_vis.src import nearest_routes
+from transit_vis.src import tract_join
+
+
+SEGMENT_PATH = './transit_vis/tests/data/kcm_routes'
+
+
+def make_features(num_routes, seed=0):
+    """Makes random walk route features around Seattle."""
+    generator = np.random.default_rng(seed)
+    features = []
+    for i in range(num_routes):
+        start = [-122.35, 47.6] + generator.uniform(-0.05, 0.05, 2)
+        steps = generator.normal(0, 0.001, (20, 2))
+        line = start + np.cumsum(steps, axis=0)
+        features.append({
+            'type': 'Feature',
+            'properties': {'ROUTE_ID': 100000 + i // 2, 'LOCAL_EXPR': 'LE'[i % 2]},
+            'geometry': {'type': 'LineString', 'coordinates': line.tolist()}})
+    return features
+
+def brute_force(features, lat, lon, lat_0):
+    """Measures the distance from a point to the closest vertex of each route."""
+    distances = {}
+    for feature in features:
+        key = (feature['properties']['ROUTE_ID'], feature['properties']['LOCAL_EXPR'])
+        points = tract_join.project_points(
+            feature['geometry']['coordinates'], lat_0)
+        point = tract_join.project_points([[lon, lat]], lat_0)[0]
+        distance = np.hypot(*(points - point).T).min()
+        distances[key] = min(distances.get(key, np.inf), distance)
+    return sorted(distances.items(), key=lambda item: item[1])
+
+
+class TestNearestRoutes(unittest.TestCase):
+    """
+    Unittest for the module 'nearest_routes'
+    """
+    @classmethod
+    def test_smoke_nearest_routes(cls):
+        """
+        Smoke test for the function 'nearest_routes'
+        """
+        vertex_index = nearest_routes.build_vertex_index(make_features(10))
+        assert len(nearest_routes.nearest_routes(
+            vertex_index, 47.6, -122.35, k=3)) == 3
+
+    def test_oneshot_brute_force(self):
+        """
+        One shot test that the grid search finds the same routes as measuring
+        the distance to every vertex, for points inside and outside the grid
+        """
+        features = make_features(40)
+        generator = np.random.default_rng(1)
+        for cell_size in [100.0, 1000.0]:
+            vertex_index = nearest_routes.build_vertex_index(features, cell_size)
+            for _ in range(20):
+                lat, lon = [47.6, -122.35] + generator.uniform(-0.2, 0.2, 2)
+                found = nearest_routes.nearest_routes(vertex_index, lat, lon, k=5)
+                expected = brute_force(
+                    features, lat, lon, vertex_index['lat_0'])[:5]
+                self.assertEqual(
+                    [key for key, _ in found], [key for key, _ in expected])
+                for (_, distance), (_, expected_distance) in zip(found, expected):
+                    self.assertAlmostEqual(distance, expected_distance)
+
+    def test_oneshot_max_distance(self):
+        """
+        One shot test that only routes within max_distance are returned
+        """
+        features = make_features(40)
+        vertex_index = nearest_routes.build_vertex_index(features)
+        expected = brute_force(features, 47.6, -122.35, vertex_index['lat_0'])
+        found = nearest_routes.nearest_routes(
+            vertex_index, 47.6, -122.35, k=40, max_distance=2000.0)
+        self.assertEqual(
+            [key for key, _ in found],
+            [key for key, distance in expected if distance <= 2000.0])
+        self.assertEqual(nearest_routes.nearest_routes(
+            vertex_index, 48.6, -122.35, max_distance=2000.0), [])
+        selected = nearest_routes.route_features(
+            vertex_index, features, [key for key, _ in found[:1]])
+        self.assertEqual(len(selected), 1)
+
+    def test_oneshot_load_vertex_index(self):
+        """
+        One shot test that the vertex index of a route file is built once
+        """
+        vertex_index = nearest_routes.load_vertex_index(SEGMENT_PATH)
+        self.assertIs(nearest_routes.load_vertex_index(SEGMENT_PATH), vertex_index)
+        self.assertEqual(
+            len(vertex_index['points']), len(vertex_index['routes']))
+
+    def test_edgecase_k(self):
+        """
+        Edge case test to catch asking for fewer than one route
+        """
+        vertex_index = nearest_routes.build_vertex_index(make_features(2))
+        with self.assertRaises(ValueError):
+            nearest_routes.nearest_routes(vertex_index, 47.6, -122.35, k=0)
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestNearestRoutes)
+_ = unittest.TextTestRunner().run(SUITE)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the stage pipeline runner
+
+test_smoke_run_pipeline(cls) -- smoke test for running a small pipeline
+
+test_oneshot_resume(self) -- one shot test that a failed run resumes after the last finished stage
+
+test_oneshot_upstream_change(self) -- one shot test that changing a stage reruns the stages after it
+
+test_oneshot_prune(self) -- one shot test that a finished run deletes the artifacts of earlier runs
+
+test_oneshot_concurrent_stages(self) -- one shot test that independent stages run at the same time
+
+test_oneshot_daily_stages(self) -- one shot test that the summary and map stages form one graph
+
+test_edgecase_check_stages(self) -- edge case to catch missing inputs and cycles
+"""
+
+
+import os
+import tempfile
+import threading
+import unittest
+
+from transit_vis.src import pipeline
+from transit_vis.src import summarize_rds
+from transit_vis.src import transit_vis
+
+
+def make_stages(calls, scale=2, fail_upload=False):
+    """Makes a four stage pipeline that records each stage that runs."""
+    def run(name, function):
+        def stage_run(**inputs):
+            calls.append(name)
+            return function(**inputs)
+        return stage_run
+
+    def upload(total):
+        if fail_upload:
+            raise RuntimeError('upload failed')
+        return {'uploaded': total}
+
+    return [
+        {'name': 'extract', 'inputs': [], 'outputs': ['raw'],
+         'params': {'day': 1},
+         'run': run('extract', lambda: {'raw': [1, 2, 3]})},
+        {'name': 'scale', 'inputs': ['raw'], 'outputs': ['scaled'],
+         'params': {'scale': scale},
+         'run': run('scale', lambda raw: {'scaled': [scale * x for x in raw]})},
+        {'name': 'total', 'inputs': ['scaled'], 'outputs': ['total'],
+         'params': {},
+         'run': run('total', lambda scaled: {'total': sum(scaled)})},
+        {'name': 'upload', 'inputs': ['total'], 'outputs': ['uploaded'],
+         'params': {},
+         'run': run('upload', upload)}]
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    Unittest for the module 'pipeline'
+    """
+    @classmethod
+    def test_smoke_run_pipeline(cls):
+        """
+        Smoke test for the function 'run_pipeline'
+        """
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            result = pipeline.run_pipeline(
+                make_stages([]), artifact_dir, progress=lambda message: None)
+        assert result['artifacts']['uploaded'] == 12
+
+    def test_oneshot_resume(self):
+        """
+        One shot test that running a pipeline again after its last stage
+        failed only runs the failed stage
+        """
+        calls = []
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            with self.assertRaises(RuntimeError):
+                pipeline.run_pipeline(
+                    make_stages(calls, fail_upload=True), artifact_dir,
+                    progress=lambda message: None)
+            self.assertEqual(calls, ['extract', 'scale', 'total', 'upload'])
+            calls.clear()
+            result = pipeline.run_pipeline(
+                make_stages(calls), artifact_dir, targets=['upload'],
+                progress=lambda message: None)
+            self.assertEqual(calls, ['upload'])
+            self.assertEqual(result['run'], ['upload'])
+            self.assertEqual(result['reused'], ['total'])
+            self.assertEqual(result['artifacts'], {'uploaded': 12})
+
+    def test_oneshot_upstream_change(self):
+        """
+        One shot test that changing the params of a stage reruns it and the
+        stages after it, but not the stages before it
+        """
+        calls = []
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            pipeline.run_pipeline(
+                make_stages(calls), artifact_dir, progress=lambda message: None)
+            calls.clear()
+            result = pipeline.run_pipeline(
+                make_stages(calls, scale=3), artifact_dir,
+                progress=lambda message: None)
+        self.assertEqual(calls, ['scale', 'total', 'upload'])
+        self.assertEqual(result['artifacts']['uploaded'], 18)
+        self.assertNotEqual(
+            pipeline.stage_keys(make_stages([]))['upload'],
+            pipeline.stage_keys(make_stages([], scale=3))['upload'])
+
+    def test_oneshot_prune(self):
+        """
+        One shot test that a pruning run deletes the artifacts saved by runs
+        with other params only once it finishes, and leaves other files
+        """
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            with open(os.path.join(artifact_dir, 'notes.txt'), 'w'):
+                pass
+            pipeline.run_pipeline(
+                make_stages([]), artifact_dir, progress=lambda message: None,
+                prune=True)
+            with self.assertRaises(RuntimeError):
+                pipeline.run_pipeline(
+                    make_stages([], scale=3, fail_upload=True), artifact_dir,
+                    progress=lambda message: None, prune=True)
+            self.assertEqual(len(os.listdir(artifact_dir)), 7)
+            pipeline.run_pipeline(
+                make_stages([], scale=3), artifact_dir,
+                progress=lambda message: None, prune=True)
+            keys = pipeline.stage_keys(make_stages([], scale=3))
+            self.assertEqual(sorted(os.listdir(artifact_dir)), sorted([
+                'notes.txt',
+                f"raw_{keys['extract']}.pkl",
+                f"scaled_{keys['scale']}.pkl",
+                f"total_{keys['total']}.pkl",
+                f"uploaded_{keys['upload']}.pkl"]))
+
+    def test_oneshot_concurrent_stages(self):
+        """
+        One shot test that two stages without a dependency between them run
+        at the same time
+        """
+        barrier = threading.Barrier(2, timeout=10)
+        def wait_for_other():
+            return {'index': barrier.wait()}
+        stages = [
+            {'name': 'gtfs', 'inputs': [], 'outputs': ['index'],
+             'run': wait_for_other},
+            {'name': 'rds', 'inputs': [], 'outputs': ['other_index'],
+             'run': lambda: {'other_index': barrier.wait()}}]
+        with tempfile.TemporaryDirectory() as artifact_dir:
+            result = pipeline.run_pipeline(
+                stages, artifact_dir, progress=lambda message: None)
+        self.assertEqual(result['run'], ['gtfs', 'rds'])
+
+    def test_oneshot_daily_stages(self):
+        """
+        One shot test that the summary and map stages join into one graph in
+        which the extracts and census preparation come first
+        """
+        stages = summarize_rds.summary_stages('KCM_Bus_Routes', 1, 100, '2020-12-01')
+        stages += transit_vis.map_stages(
+            'KCM_Bus_Routes', './transit_vis/tests/data/s0801',
+            './transit_vis/tests/data/s1902', './transit_vis/tests/data/kcm_routes',
+            './transit_vis/tests/data/seattle_census_tracts_2010',
+            after=['num_uploaded', 'snapshot_path', 'archive_days'])
+        order = pipeline.check_stages(stages)
+        self.assertEqual(
+            sorted(order[:3]), ['census_prep', 'gtfs_refresh', 'rds_extract'])
+        self.assertEqual(
+            sorted(order[-4:-1]), ['archive', 'snapshot', 'upload'])
+        self.assertEqual(order[-1], 'render')
+
+    def test_edgecase_check_stages(self):
+        """
+        Edge case test to catch stages with inputs that no stage makes, and
+        stages that depend on each other
+        """
+        stages = make_stages([])
+        with self.assertRaises(ValueError):
+            pipeline.check_stages(stages[1:])
+        stages[0]['inputs'] = ['uploaded']
+        with self.assertRaises(ValueError):
+            pipeline.check_stages(stages)
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestPipeline)
+_ = unittest.TextTestRunner().run(SUITE)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the incrementally maintained rolling average speeds
+
+test_smoke_update_rolling_speeds(cls) -- smoke test for adding the first day of speeds
+
+test_oneshot_window_averages(self) -- one shot test against averaging each window from scratch
+
+test_oneshot_rerun_day(self) -- one shot test that adding a day again replaces it
+
+test_oneshot_saved_state(self) -- one shot test that the state carries over between runs
+
+test_edgecase_old_day(self) -- edge case to catch days that have left the ring buffer
+"""
+
+
+import datetime
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from transit_vis.src import rolling_speeds
+
+
+def day_speeds(day, rng):
+    """
+    Makes random speeds of two routes for a date ordinal, where the second
+    route only runs on even days
+    """
+    route_speeds = [
+        {'route_id': 100001, 'trip_short_name': 'LOCAL',
+         'avg_speed_m_s': str(round(rng.uniform(3, 8), 2)),
+         'sample_count': int(rng.integers(1, 50))}]
+    if day % 2 == 0:
+        route_speeds.append(
+            {'route_id': 100002, 'trip_short_name': 'EXPRESS',
+             'avg_speed_m_s': str(round(rng.uniform(6, 12), 2)),
+             'sample_count': int(rng.integers(1, 50))})
+    return route_speeds
+
+def run_date(day):
+    """
+    Returns the date string of a date ordinal
+    """
+    return datetime.date.fromordinal(day).isoformat()
+
+
+class TestRollingSpeeds(unittest.TestCase):
+    """
+    Unittest for the module 'rolling_speeds'
+    """
+    @classmethod
+    def test_smoke_update_rolling_speeds(cls):
+        """
+        Smoke test for the function 'update_rolling_speeds'
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rolling_metrics = rolling_speeds.update_rolling_speeds(
+                [{'route_id': 100001, 'trip_short_name': 'LOCAL',
+                  'avg_speed_m_s': '5.5', 'sample_count': 40}],
+                '2020-12-01', os.path.join(temp_dir, 'rolling_speeds.npz'))
+        assert rolling_metrics[0]['avg_speed_7d_m_s'] == '5.5'
+
+    def test_oneshot_window_averages(self):
+        """
+        One shot test that the running windows match the sample weighted
+        average of the days in each window, over days with gaps between them
+        """
+        rng = np.random.default_rng(0)
+        first_day = datetime.date(2020, 11, 1).toordinal()
+        days = [
+            first_day + offset for offset in range(80)
+            if offset % 5 != 3 and not 40 <= offset < 75]
+        history = {}
+        state = rolling_speeds.empty_state()
+        for day in days:
+            route_speeds = day_speeds(day, rng)
+            state = rolling_speeds.add_day(state, route_speeds, run_date(day))
+            for track in route_speeds:
+                history.setdefault(track['route_id'], {})[day] = (
+                    float(track['avg_speed_m_s']), track['sample_count'])
+            route_keys = [(100001, 'L'), (100002, 'E')]
+            averages = rolling_speeds.window_averages(state, route_keys)
+            for (route_id, _), route_averages in zip(route_keys, averages):
+                for window in rolling_speeds.WINDOWS:
+                    in_window = [
+                        value for past_day, value in history.get(route_id, {}).items()
+                        if day - window < past_day <= day]
+                    field = rolling_speeds.window_field(window)
+                    if len(in_window) == 0:
+                        self.assertNotIn(field, route_averages)
+                        continue
+                    expected = sum(speed * count for speed, count in in_window) \
+                        / sum(count for _, count in in_window)
+                    self.assertEqual(route_averages[field], str(round(expected, 1)))
+
+    def test_oneshot_rerun_day(self):
+        """
+        One shot test that adding a day that was already added, including one
+        before the latest day, replaces its speeds in every window
+        """
+        speeds = lambda speed, count: [
+            {'route_id': 100001, 'trip_short_name': 'LOCAL',
+             'avg_speed_m_s': speed, 'sample_count': count}]
+        state = rolling_speeds.empty_state()
+        state = rolling_speeds.add_day(state, speeds('4.0', 10), '2020-12-01')
+        state = rolling_speeds.add_day(state, speeds('8.0', 10), '2020-12-09')
+        state = rolling_speeds.add_day(state, speeds('6.0', 30), '2020-12-09')
+        state = rolling_speeds.add_day(state, speeds('2.0', 10), '2020-12-01')
+        averages = rolling_speeds.window_averages(state, [(100001, 'L')])
+        self.assertEqual(averages[0], {
+            'avg_speed_7d_m_s': '6.0', 'avg_speed_30d_m_s': '5.0'})
+
+    def test_oneshot_saved_state(self):
+        """
+        One shot test that each run continues from the state the last run
+        saved, and that new routes can be added to it
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state_path = os.path.join(temp_dir, 'data', 'rolling_speeds.npz')
+            rolling_speeds.update_rolling_speeds(
+                [{'route_id': 100001, 'trip_short_name': 'LOCAL',
+                  'avg_speed_m_s': '4.0', 'sample_count': 10}],
+                '2020-12-01', state_path)
+            rolling_metrics = rolling_speeds.update_rolling_speeds(
+                [{'route_id': 100001, 'trip_short_name': 'LOCAL',
+                  'avg_speed_m_s': '6.0', 'sample_count': 10},
+                 {'route_id': 100002, 'trip_short_name': 'EXPRESS',
+                  'avg_speed_m_s': '9.0', 'sample_count': 5}],
+                '2020-12-10', state_path)
+            state = rolling_speeds.load_state(state_path)
+        self.assertEqual(rolling_metrics[0]['avg_speed_7d_m_s'], '6.0')
+        self.assertEqual(rolling_metrics[0]['avg_speed_30d_m_s'], '5.0')
+        self.assertEqual(rolling_metrics[1]['avg_speed_30d_m_s'], '9.0')
+        self.assertEqual(rolling_metrics[0]['avg_speed_m_s'], '6.0')
+        self.assertEqual(state['route_ids'].tolist(), [100001, 100002])
+        self.assertEqual(
+            state['last_day'], datetime.date(2020, 12, 10).toordinal())
+
+    def test_edgecase_old_day(self):
+        """
+        Edge case to catch a day too long before the latest day to be in the
+        ring buffer any more
+        """
+        speeds = [{'route_id': 100001, 'trip_short_name': 'LOCAL',
+                   'avg_speed_m_s': '4.0', 'sample_count': 10}]
+        state = rolling_speeds.add_day(
+            rolling_speeds.empty_state(), speeds, '2020-12-31')
+        with self.assertRaises(ValueError):
+            rolling_speeds.add_day(state, speeds, '2020-12-01')
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestRollingSpeeds)
+_ = unittest.TextTestRunner().run(SUITE)
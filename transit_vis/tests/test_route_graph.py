@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the route network graph
+
+test_smoke_route_graph(cls) -- smoke test for building the graph of the test routes
+
+test_oneshot_transfer_trip(self) -- one shot test for a trip that transfers between two routes
+
+test_oneshot_dijkstra(self) -- one shot test that the A* search finds the same times as a plain Dijkstra search
+
+test_edgecase_unreachable(self) -- edge case to catch points too far from the network or not joined to each other
+"""
+
+
+import unittest
+
+import numpy as np
+
+from transit_vis.src import route_graph
+from transit_vis.src import segment_store
+from transit_vis.src import tract_join
+
+
+SEGMENT_PATH = './transit_vis/tests/data/kcm_routes'
+# Degrees of longitude and latitude per 1000 m at the test latitude
+LON_KM = 1000 / (tract_join.METERS_PER_DEGREE * np.cos(np.radians(47.6)))
+LAT_KM = 1000 / tract_join.METERS_PER_DEGREE
+
+
+def make_route(route_id, route_num, speed, coordinates):
+    """Makes a route feature with a speed from points in km."""
+    return {
+        'type': 'Feature',
+        'properties': {
+            'ROUTE_ID': route_id, 'LOCAL_EXPR': 'L', 'ROUTE_NUM': route_num,
+            'AVG_SPEED_M_S': speed},
+        'geometry': {'type': 'LineString', 'coordinates': [
+            [-122.3 + x * LON_KM, 47.6 + y * LAT_KM] for x, y in coordinates]}}
+
+
+class TestRouteGraph(unittest.TestCase):
+    """
+    Unittest for the module 'route_graph'
+    """
+    @classmethod
+    def test_smoke_route_graph(cls):
+        """
+        Smoke test for the function 'build_route_graph'
+        """
+        segment_data, _ = segment_store.join_speeds({}, SEGMENT_PATH)
+        graph = route_graph.build_route_graph(segment_data['features'])
+        assert len(graph['indptr']) == len(graph['points']) + 1
+
+    def test_oneshot_transfer_trip(self):
+        """
+        One shot test for a trip that rides east on one route and north on a
+        second route that starts 50 m away, instead of a slow direct route
+        """
+        features = [
+            make_route(1, '1', 10.0, [[0, 0], [1, 0], [2, 0]]),
+            make_route(2, '2', 5.0, [[2, 0.05], [2, 1], [2, 2]]),
+            make_route(3, '3', 1.0, [[0, 0], [2, 2]])]
+        graph = route_graph.build_route_graph(features)
+        trip = route_graph.estimate_trip(
+            graph, 47.6, -122.3, 47.6 + 2 * LAT_KM, -122.3 + 2 * LON_KM)
+        expected = 2000 / 10.0 + 50 / route_graph.WALK_SPEED_M_S + 1950 / 5.0
+        self.assertAlmostEqual(trip['seconds'], expected, delta=2)
+        self.assertEqual(trip['route_nums'], ['1', '2'])
+        self.assertLess(trip['walk_m'], 1)
+        self.assertAlmostEqual(trip['path'][0][0], 47.6)
+
+    def test_oneshot_dijkstra(self):
+        """
+        One shot test that the A* search finds the same travel times as a
+        Dijkstra search without the distance estimate
+        """
+        segment_data, _ = segment_store.join_speeds({}, SEGMENT_PATH)
+        graph = route_graph.build_route_graph(segment_data['features'])
+        dijkstra_graph = dict(graph, max_speed=np.inf)
+        generator = np.random.default_rng(0)
+        for source, target in generator.integers(0, len(graph['points']), (20, 2)):
+            result = route_graph.shortest_path(graph, source, target)
+            expected = route_graph.shortest_path(dijkstra_graph, source, target)
+            self.assertEqual(result is None, expected is None)
+            if result is not None:
+                self.assertAlmostEqual(result[0], expected[0])
+                self.assertEqual(result[1][0], source)
+                self.assertEqual(result[1][-1], target)
+
+    def test_edgecase_unreachable(self):
+        """
+        Edge case test to catch trips from too far away or between routes
+        that are not joined
+        """
+        features = [
+            make_route(1, '1', 10.0, [[0, 0], [1, 0]]),
+            make_route(2, '2', 0.0, [[0, 5], [1, 5]])]
+        graph = route_graph.build_route_graph(features)
+        self.assertIsNone(route_graph.estimate_trip(
+            graph, 47.6, -122.3, 47.6 + 5 * LAT_KM, -122.3))
+        self.assertIsNone(route_graph.estimate_trip(
+            graph, 47.6, -122.3, 47.6 + 3 * LAT_KM, -122.3))
+        self.assertIsNone(route_graph.estimate_trip(
+            route_graph.build_route_graph([]), 47.6, -122.3, 47.6, -122.3))
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestRouteGraph)
+_ = unittest.TextTestRunner().run(SUITE)
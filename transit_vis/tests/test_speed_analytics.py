@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the speed trend analytics
+
+test_smoke_route_trends(cls) -- smoke test for computing trends for every route
+
+test_oneshot_pack_histories(self) -- one shot test for packing histories without missing days
+
+test_oneshot_rolling_mean(self) -- one shot test that rolling means stay within each route
+
+test_oneshot_route_trends(self) -- one shot test for the slope, z-score and percent change
+
+test_edgecase_rolling_mean(self) -- edge case to catch an invalid window
+
+test_oneshot_slowdown_map(self) -- one shot test for the biggest slowdowns layer of the map
+"""
+
+
+import unittest
+
+import branca.colormap as cm
+import numpy as np
+
+from transit_vis.src import census_data
+from transit_vis.src import segment_store
+from transit_vis.src import speed_analytics
+from transit_vis.src import transit_vis
+
+
+S0801_PATH = './transit_vis/tests/data/s0801'
+S1902_PATH = './transit_vis/tests/data/s1902'
+SEGMENT_PATH = './transit_vis/tests/data/kcm_routes'
+CENSUS_PATH = './transit_vis/tests/data/seattle_census_tracts_2010'
+LINEAR_CM = cm.LinearColormap(['red', 'green'], vmin=0.5, vmax=100.)
+SPEED_LOOKUP = {
+    (100001, 'L'): {
+        'avg_speed_m_s': 4.0,
+        'historic_speeds': [8.0, 8.5, 0, 8.0, 8.5, 8.0, 8.5, 8.0, 8.5, 4.0]},
+    (100002, 'L'): {
+        'avg_speed_m_s': 5.0,
+        'historic_speeds': [1.0, 2.0, 3.0, 4.0, 5.0]},
+    (100003, 'L'): {'avg_speed_m_s': 6.0, 'historic_speeds': [6.0]},
+    (100004, 'L'): {'avg_speed_m_s': 0, 'historic_speeds': []}}
+
+
+class TestSpeedAnalytics(unittest.TestCase):
+    """
+    Unittest for the module 'speed_analytics'
+    """
+    @classmethod
+    def test_smoke_route_trends(cls):
+        """
+        Smoke test for the function 'route_trends'
+        """
+        assert speed_analytics.route_trends(SPEED_LOOKUP) is not None
+
+    def test_oneshot_pack_histories(self):
+        """
+        One shot test that the function 'pack_histories' places histories end
+        to end and drops days without data
+        """
+        packed = speed_analytics.pack_histories(SPEED_LOOKUP)
+        self.assertEqual(list(packed['offsets']), [0, 9, 14, 15, 15])
+        self.assertEqual(packed['values'][9], 1.0)
+        self.assertNotIn(0.0, list(packed['values']))
+
+    def test_oneshot_rolling_mean(self):
+        """
+        One shot test that the function 'rolling_mean' does not average days
+        from different routes together
+        """
+        packed = speed_analytics.pack_histories(SPEED_LOOKUP)
+        means = speed_analytics.rolling_mean(packed, 2)
+        np.testing.assert_allclose(means[9:15], [1.0, 1.5, 2.5, 3.5, 4.5, 6.0])
+
+    def test_oneshot_route_trends(self):
+        """
+        One shot test for the slope, z-score and percent change of each route
+        """
+        trends = speed_analytics.route_trends(
+            SPEED_LOOKUP, window=3, trend_days=30, change_days=4)
+        self.assertAlmostEqual(trends['trend'][1], 1.0)
+        self.assertAlmostEqual(trends['rolling_mean'][1], 4.0)
+        self.assertAlmostEqual(trends['percent_change'][1], 400.0)
+        self.assertAlmostEqual(trends['percent_change'][0], -50.0)
+        self.assertLess(trends['z_score'][0], -10)
+        self.assertTrue(np.isnan(trends['trend'][2]))
+        self.assertTrue(np.isnan(trends['rolling_mean'][3]))
+
+    def test_edgecase_rolling_mean(self):
+        """
+        Edge case test to catch a rolling mean over no days
+        """
+        packed = speed_analytics.pack_histories(SPEED_LOOKUP)
+        with self.assertRaises(ValueError):
+            speed_analytics.rolling_mean(packed, 0)
+
+    def test_oneshot_slowdown_map(self):
+        """
+        One shot test that routes that slowed down get trend tooltips and are
+        drawn in the biggest slowdowns layer
+        """
+        census_data.prepare_census_data(S0801_PATH, S1902_PATH, CENSUS_PATH)
+        transit_vis.write_speeds_to_map_segments(SPEED_LOOKUP, SEGMENT_PATH)
+        segment_data = segment_store.get_enriched_segments(SEGMENT_PATH)
+        slowdowns = speed_analytics.biggest_slowdowns(segment_data)
+        self.assertGreater(len(slowdowns), 0)
+        self.assertEqual(slowdowns[0]['properties']['ROUTE_ID'], 100001)
+        html = transit_vis.generate_folium_map(
+            SEGMENT_PATH, CENSUS_PATH, LINEAR_CM).get_root().render()
+        self.assertIn('Biggest Slowdowns', html)
+        self.assertIn('SPEED_PCT_CHANGE', html)
+        self.assertNotIn('SPEED_ROLLING_MEAN', html)
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestSpeedAnalytics)
+_ = unittest.TextTestRunner().run(SUITE)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the memory mapped speed history archive
+
+test_smoke_append_day(cls) -- smoke test for starting an archive with one day
+
+test_oneshot_query_history(self) -- one shot test for reading some routes over a range of dates
+
+test_oneshot_rerun_day(self) -- one shot test that writing a day again replaces it
+
+test_oneshot_resize_routes(self) -- one shot test for adding more routes than the files have room for
+
+test_oneshot_network_history(self) -- one shot test for reducing across routes each day
+
+test_edgecase_earlier_day(self) -- edge case to catch days before the start of the archive
+"""
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from transit_vis.src import speed_archive
+
+
+ROUTE_SPEEDS = [
+    {'route_id': 100001, 'trip_short_name': 'LOCAL', 'avg_speed_m_s': '5.5',
+     'sample_count': 40},
+    {'route_id': 100002, 'trip_short_name': 'EXPRESS', 'avg_speed_m_s': '9.0',
+     'sample_count': 12}]
+
+
+class TestSpeedArchive(unittest.TestCase):
+    """
+    Unittest for the module 'speed_archive'
+    """
+    @classmethod
+    def test_smoke_append_day(cls):
+        """
+        Smoke test for the function 'append_day'
+        """
+        with tempfile.TemporaryDirectory() as archive_dir:
+            speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-12-01')
+            header = speed_archive.read_header(archive_dir)
+        assert header['num_days'] == 1
+        assert header['routes'] == [(100001, 'L'), (100002, 'E')]
+
+    def test_oneshot_query_history(self):
+        """
+        One shot test that a range of dates and a subset of routes come back
+        as (route, day) values, with skipped days and missing routes empty
+        """
+        with tempfile.TemporaryDirectory() as archive_dir:
+            speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-12-01')
+            speed_archive.append_day(
+                [dict(ROUTE_SPEEDS[0], avg_speed_m_s='6.0', sample_count=30)],
+                archive_dir,
+                '2020-12-03')
+            history = speed_archive.query_history(
+                archive_dir,
+                start_date='2020-12-02',
+                route_keys=[(100002, 'E'), (100001, 'L')])
+            counts = speed_archive.query_history(
+                archive_dir, 'sample_count', end_date='2020-12-01')
+        self.assertEqual(history['dates'], ['2020-12-02', '2020-12-03'])
+        self.assertEqual(history['route_keys'], [(100002, 'E'), (100001, 'L')])
+        self.assertEqual(history['values'].shape, (2, 2))
+        self.assertTrue(np.isnan(history['values'][:, 0]).all())
+        self.assertTrue(np.isnan(history['values'][0, 1]))
+        self.assertAlmostEqual(history['values'][1, 1], 6.0)
+        np.testing.assert_array_equal(counts['values'], [[40], [12]])
+
+    def test_oneshot_rerun_day(self):
+        """
+        One shot test that writing the last day again replaces it instead of
+        adding a day, and that bytes left by an interrupted append are dropped
+        """
+        with tempfile.TemporaryDirectory() as archive_dir:
+            speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-12-01')
+            path = speed_archive.column_path(
+                archive_dir, 'avg_speed_m_s', speed_archive.INITIAL_ROUTE_CAPACITY)
+            with open(path, 'ab') as column_file:
+                column_file.write(b'partial')
+            speed_archive.append_day(
+                [dict(ROUTE_SPEEDS[1], avg_speed_m_s='8.0')], archive_dir, '2020-12-01')
+            speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-12-02')
+            history = speed_archive.query_history(archive_dir)
+            size = os.path.getsize(path)
+        self.assertEqual(len(history['dates']), 2)
+        self.assertTrue(np.isnan(history['values'][0, 0]))
+        self.assertAlmostEqual(history['values'][1, 0], 8.0)
+        self.assertEqual(size, 2 * speed_archive.INITIAL_ROUTE_CAPACITY * 4)
+
+    def test_oneshot_resize_routes(self):
+        """
+        One shot test that the archive grows to fit new routes and keeps the
+        values of earlier days
+        """
+        many_routes = [
+            {'route_id': i, 'trip_short_name': 'LOCAL', 'avg_speed_m_s': i / 100,
+             'sample_count': i}
+            for i in range(speed_archive.INITIAL_ROUTE_CAPACITY + 10)]
+        with tempfile.TemporaryDirectory() as archive_dir:
+            speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-12-01')
+            header = speed_archive.append_day(many_routes, archive_dir, '2020-12-02')
+            history = speed_archive.query_history(
+                archive_dir, 'sample_count', route_keys=[(100001, 'L'), (5, 'L')])
+            files = sorted(os.listdir(archive_dir))
+        self.assertEqual(
+            header['route_capacity'], 2 * speed_archive.INITIAL_ROUTE_CAPACITY)
+        np.testing.assert_array_equal(history['values'], [[40, 0], [0, 5]])
+        self.assertEqual(files, sorted(
+            [f"{column}_512.bin" for column in speed_archive.ARCHIVE_COLUMNS]
+            + ['header.json']))
+
+    def test_oneshot_network_history(self):
+        """
+        One shot test that reductions across routes skip routes without data
+        """
+        with tempfile.TemporaryDirectory() as archive_dir:
+            speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-12-01')
+            speed_archive.append_day(ROUTE_SPEEDS[:1], archive_dir, '2020-12-02')
+            speeds = speed_archive.network_history(archive_dir)
+            counts = speed_archive.network_history(
+                archive_dir, 'sample_count', 'sum', start_date='2020-12-02')
+        np.testing.assert_allclose(speeds['values'], [7.25, 5.5])
+        np.testing.assert_array_equal(counts['values'], [40])
+        self.assertEqual(counts['dates'], ['2020-12-02'])
+
+    def test_edgecase_earlier_day(self):
+        """
+        Edge case test to catch appending a day before the archive starts,
+        and unknown routes and reductions
+        """
+        with tempfile.TemporaryDirectory() as archive_dir:
+            speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-12-01')
+            with self.assertRaises(ValueError):
+                speed_archive.append_day(ROUTE_SPEEDS, archive_dir, '2020-11-30')
+            with self.assertRaises(ValueError):
+                speed_archive.query_history(archive_dir, route_keys=[(1, 'L')])
+            with self.assertRaises(ValueError):
+                speed_archive.network_history(archive_dir, reduction='mode')
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestSpeedArchive)
+_ = unittest.TextTestRunner().run(SUITE)
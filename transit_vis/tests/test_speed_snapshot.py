@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the Arrow speed snapshots
+
+test_smoke_snapshot_files(cls) -- smoke test for listing snapshots by date
+
+test_oneshot_snapshot_lookup(self) -- one shot test for building the speed lookup from daily snapshots
+
+test_oneshot_latest_lookup(self) -- one shot test that the lookup without history reads only the latest snapshot
+
+test_oneshot_snapshot_reload(self) -- one shot test that the lookup is only rebuilt when a snapshot changes
+
+test_edgecase_no_snapshots(self) -- edge case for a folder without any snapshots, or only empty ones
+
+The tests that write snapshots are skipped when pyarrow is not installed.
+"""
+
+
+import importlib.util
+import os
+import tempfile
+import unittest
+
+from transit_vis.src import speed_snapshot
+
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+ROUTE_SPEEDS = [
+    {'route_id': 100001, 'trip_short_name': 'LOCAL', 'avg_speed_m_s': '5.5',
+     'sample_count': 40, 'on_time_share': '0.75', 'median_lateness_s': 120},
+    {'route_id': 100002, 'trip_short_name': 'EXPRESS', 'avg_speed_m_s': '9.0',
+     'sample_count': 12}]
+
+
+class TestSpeedSnapshot(unittest.TestCase):
+    """
+    Unittest for the module 'speed_snapshot'
+    """
+    @classmethod
+    def test_smoke_snapshot_files(cls):
+        """
+        Smoke test for the function 'snapshot_files'
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            for run_date in ['2020-12-02', '2020-11-30', '2020-12-01']:
+                with open(os.path.join(snapshot_dir, f"speeds_{run_date}.arrow"), 'w'):
+                    pass
+            files = speed_snapshot.snapshot_files(snapshot_dir)
+        assert [os.path.basename(path)[7:17] for path in files] == \
+            ['2020-11-30', '2020-12-01', '2020-12-02']
+
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow is not installed')
+    def test_oneshot_snapshot_lookup(self):
+        """
+        One shot test that the lookup has the latest speed and the history of
+        every route, including routes missing from the latest day, and the
+        latest metrics a route has
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            speed_snapshot.write_snapshot(ROUTE_SPEEDS, snapshot_dir, '2020-12-01')
+            speed_snapshot.write_snapshot(
+                [dict(ROUTE_SPEEDS[0], avg_speed_m_s='6.0', on_time_share='0.5')],
+                snapshot_dir,
+                '2020-12-02')
+            table = speed_snapshot.read_snapshot(
+                speed_snapshot.snapshot_files(snapshot_dir)[0])
+            route_lookup = speed_snapshot.load_snapshot_lookup(
+                snapshot_dir, include_history=True)
+        self.assertEqual(table.column('sample_count').to_pylist(), [40, 12])
+        self.assertEqual(route_lookup[(100001, 'L')], {
+            'avg_speed_m_s': 6.0, 'historic_speeds': [5.5, 6.0],
+            'sample_count': 40, 'on_time_share': 0.5, 'median_lateness_s': 120.0})
+        self.assertEqual(route_lookup[(100002, 'E')], {
+            'avg_speed_m_s': 9.0, 'historic_speeds': [9.0], 'sample_count': 12})
+
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow is not installed')
+    def test_oneshot_latest_lookup(self):
+        """
+        One shot test that the lookup without history has only the routes and
+        metrics of the latest snapshot, and is kept apart from the lookup with
+        history
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            speed_snapshot.write_snapshot(ROUTE_SPEEDS, snapshot_dir, '2020-12-01')
+            speed_snapshot.write_snapshot(
+                [dict(ROUTE_SPEEDS[1], avg_speed_m_s='8.5'),
+                 dict(ROUTE_SPEEDS[0], on_time_share='0.5')],
+                snapshot_dir,
+                '2020-12-02')
+            history_lookup = speed_snapshot.load_snapshot_lookup(
+                snapshot_dir, include_history=True)
+            route_lookup = speed_snapshot.load_snapshot_lookup(snapshot_dir)
+        self.assertEqual(route_lookup, {
+            (100001, 'L'): {
+                'avg_speed_m_s': 5.5, 'sample_count': 40, 'on_time_share': 0.5,
+                'median_lateness_s': 120.0},
+            (100002, 'E'): {'avg_speed_m_s': 8.5, 'sample_count': 12}})
+        self.assertEqual(
+            history_lookup[(100002, 'E')]['historic_speeds'], [9.0, 8.5])
+
+    @unittest.skipUnless(HAS_PYARROW, 'pyarrow is not installed')
+    def test_oneshot_snapshot_reload(self):
+        """
+        One shot test that the lookup is reused until a new snapshot is added
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            speed_snapshot.write_snapshot(ROUTE_SPEEDS, snapshot_dir, '2020-12-01')
+            route_lookup = speed_snapshot.load_snapshot_lookup(
+                snapshot_dir, include_history=True)
+            self.assertIs(speed_snapshot.load_snapshot_lookup(
+                snapshot_dir, include_history=True), route_lookup)
+            speed_snapshot.write_snapshot(ROUTE_SPEEDS, snapshot_dir, '2020-12-02')
+            self.assertEqual(len(speed_snapshot.load_snapshot_lookup(
+                snapshot_dir, include_history=True)[(100001, 'L')]['historic_speeds']), 2)
+
+    def test_edgecase_no_snapshots(self):
+        """
+        Edge case test that a folder without snapshots gives an empty lookup
+        """
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            self.assertEqual(speed_snapshot.load_snapshot_lookup(snapshot_dir), {})
+            if HAS_PYARROW:
+                speed_snapshot.write_snapshot([], snapshot_dir, '2020-12-01')
+                self.assertEqual(speed_snapshot.load_snapshot_lookup(
+                    snapshot_dir, include_history=True), {})
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestSpeedSnapshot)
+_ = unittest.TextTestRunner().run(SUITE)
@@ -6,6 +6,12 @@ test_smoke_census(cls) -- smoke test for writing census data to geoJSON
 
 test_oneshot_census(self) -- one-shot test for writing census data to geoJSON
 
+test_oneshot_prepare_census(self) -- one-shot test that prepared census data is cached
+
+test_oneshot_acs_markers(self) -- one-shot test for reading ACS estimates with markers
+
+test_edgecase_stale_census(self) -- edge case for loading a census table whose ACS files changed
+
 test_smoke_folium_map(cls) -- smoke test for generating folium map
 
 test_smoke_write_speed(cls) -- smoke test for writing speeds to map
@@ -14,20 +20,76 @@ test_oneshot_write_speed(self) -- one shot test for writing speeds to map
 
 test_edgecase_write_speed(cls) -- edge case to catch invalid input type
 
+test_oneshot_speed_histogram(self) -- one shot test for the inline speed histogram
+
 test_smoke_save_map(cls) -- smoke test for saving final map object
 
 test_oneshot_save_map(self) -- one shot test for saving final map object
 
 test_edgecase_save_map(cls) -- edge case to catch invalid file type to save to
+
+test_oneshot_dump_table(self) -- one shot test for a sequential table scan
+
+test_oneshot_dump_table_parallel(self) -- one shot test for a parallel table scan
+
+test_edgecase_dump_table(self) -- edge case to catch invalid segment count
+
+test_oneshot_lookup_cache(self) -- one shot test for saving and loading the lookup cache
+
+test_oneshot_cached_lookup(self) -- one shot test that a current cache skips the scan
+
+test_oneshot_changed_routes(self) -- one shot test that a stale cache reads only the logged routes
+
+test_edgecase_changes_missing(self) -- edge case for a change log that does not reach the last upload
+
+test_edgecase_no_metadata(self) -- edge case for a table without a metadata item
+
+test_oneshot_route_keys(self) -- one shot test for collecting route keys from geojson
+
+test_oneshot_keys_to_lookup(self) -- one shot test for batched reads with retries
+
+test_edgecase_batch_get_chunk(self) -- edge case to catch oversized batches
+
+test_oneshot_load_segments(self) -- one shot test that parsed segments are reused
+
+test_oneshot_join_speeds(self) -- one shot test for joining speeds to segments in memory
+
+test_edgecase_no_joined_speeds(self) -- edge case to catch reading segments before any speeds were joined
+
+test_oneshot_topology(self) -- one shot test that overlapping routes share arcs
+
+test_smoke_compact_folium_map(cls) -- smoke test for generating a map with compact routes
+
+test_oneshot_metric_layers(self) -- one shot test for the route metric layers and their lookup
+
+test_oneshot_simplify_tracts(self) -- one shot test that simplified neighbors keep their shared border
+
+test_oneshot_tract_layer(self) -- one shot test for the clipped and simplified tract layer
+
+test_oneshot_length_inside(self) -- one shot test for the length of a route inside a tract with a hole
+
+test_oneshot_tract_speeds(self) -- one shot test for length weighted speeds by tract
+
+test_oneshot_load_incidence(self) -- one shot test that the route by tract table is cached
+
+test_smoke_tract_speed_map(cls) -- smoke test for generating a map with tract speeds
 """
 
 
 import os
+import tempfile
 import unittest
+import warnings
 
 import branca.colormap as cm
 import numpy as np
 
+from transit_vis.src import census_data
+from transit_vis.src import compact_layer
+from transit_vis.src import segment_store
+from transit_vis.src import speed_cache
+from transit_vis.src import topology
+from transit_vis.src import tract_join
 from transit_vis.src import transit_vis as vis_functions
 
 
@@ -36,10 +98,136 @@ S1902_PATH = './transit_vis/tests/data/s1902'
 SEGMENT_PATH = './transit_vis/tests/data/kcm_routes'
 CENSUS_PATH = './transit_vis/tests/data/seattle_census_tracts_2010'
 OUTPUT_PATH = './transit_vis/tests/output_map.html'
+CACHE_PATH = './transit_vis/tests/data/KCM_Bus_Routes_lookup_tmp.json.gz'
 LINEAR_CM = cm.LinearColormap(['red', 'green'], vmin=0.5, vmax=100.)
 ROUTE_DICT = {}
 ROUTE_DICT[(100001, 'L')] = {'avg_speed_m_s': 7.5, 'historic_speeds': [2.2, 7.5]}
 ROUTE_DICT[(999999, 'L')] = {'avg_speed_m_s': 5.9, 'historic_speeds': [0.5, 5.9]}
+OVERLAPPING_ROUTES = [
+    {'type': 'Feature', 'properties': {},
+     'geometry': {'type': 'LineString', 'coordinates': [
+         [-122.30, 47.60], [-122.31, 47.61], [-122.32, 47.62]]}},
+    {'type': 'Feature', 'properties': {},
+     'geometry': {'type': 'LineString', 'coordinates': [
+         [-122.32, 47.62], [-122.31, 47.61], [-122.30, 47.60], [-122.29, 47.60]]}}]
+TABLE_ITEMS = [
+    {'route_id': i, 'local_express_code': 'L', 'avg_speed_m_s': '5.0',
+     'historic_speeds': ['5.0']} for i in range(25)]
+
+
+def write_acs_tables(folder, mean_incomes):
+    """
+    Writes small s0801 and s1902 tables with a tract for each mean income,
+    and returns their paths and the tract shape path to prepare them for
+    """
+    geo_ids = [f"1400000US530330{i:05d}" for i in range(len(mean_incomes))]
+    s0801_path = os.path.join(folder, 's0801')
+    s1902_path = os.path.join(folder, 's1902')
+    with open(f"{s0801_path}.csv", 'w') as acs_file:
+        acs_file.write(','.join(census_data.S0801_COLUMNS) + '\n')
+        acs_file.write(','.join(census_data.S0801_COLUMNS.values()) + '\n')
+        for geo_id in geo_ids:
+            acs_file.write(f"{geo_id},N,-\n")
+    with open(f"{s1902_path}.csv", 'w') as acs_file:
+        acs_file.write(','.join(census_data.S1902_COLUMNS) + '\n')
+        acs_file.write(','.join(census_data.S1902_COLUMNS.values()) + '\n')
+        for geo_id, mean_income in zip(geo_ids, mean_incomes):
+            acs_file.write(f'{geo_id},100,"{mean_income}",10.5,50.0,20.0\n')
+    return s0801_path, s1902_path, os.path.join(folder, 'tracts')
+
+
+class FakeClient():
+    """
+    Stand-in for a boto3 client that pages scans through its table, and
+    leaves the last key of each batch unprocessed on the first request
+    """
+    def __init__(self, table):
+        self.table = table
+        self.requests = []
+        self.queries = []
+
+    def scan(self, TableName, **kwargs):
+        """
+        Returns one page of the table's scan
+        """
+        assert TableName == self.table.name
+        return self.table.scan_page(**kwargs)
+
+    def get_item(self, TableName, **kwargs):
+        """
+        Returns an item of the table
+        """
+        assert TableName == self.table.name
+        return self.table.get_item(**kwargs)
+
+    def query(self, TableName, KeyConditionExpression, **kwargs):
+        """
+        Returns the change log items after the lower bound of the query, one
+        per page
+        """
+        assert TableName == self.table.name
+        self.queries.append(KeyConditionExpression)
+        lower = KeyConditionExpression.get_expression()['values'][1] \
+            .get_expression()['values'][1]
+        items = [
+            {'local_express_code': speed_cache.changes_key(last_updated),
+             'route_keys': route_keys}
+            for last_updated, route_keys in self.table.changes
+            if speed_cache.changes_key(last_updated) >= lower]
+        start = kwargs.get('ExclusiveStartKey', 0)
+        response = {'Items': items[start:start+1]}
+        if start + 1 < len(items):
+            response['LastEvaluatedKey'] = start + 1
+        return response
+
+    def batch_get_item(self, RequestItems):
+        """
+        Returns the requested items from TABLE_ITEMS
+        """
+        self.requests.append(RequestItems)
+        keys = RequestItems['FakeTable']['Keys']
+        unprocessed = {}
+        if len(self.requests) == 1 and len(keys) > 1:
+            unprocessed = {'FakeTable': {'Keys': keys[-1:]}}
+            keys = keys[:-1]
+        items = [item for item in TABLE_ITEMS if {
+            'route_id': item['route_id'],
+            'local_express_code': item['local_express_code']} in keys]
+        return {'Responses': {'FakeTable': items}, 'UnprocessedKeys': unprocessed}
+
+
+class FakeTable():
+    """
+    Stand-in for a boto3 Table whose client pages through TABLE_ITEMS like
+    scan()
+    """
+    def __init__(self, page_size, last_updated=None, changes=()):
+        self.name = 'FakeTable'
+        self.meta = type('FakeMeta', (), {'client': FakeClient(self)})()
+        self.page_size = page_size
+        self.last_updated = last_updated
+        self.changes = list(changes)
+        self.scan_calls = []
+
+    def get_item(self, **kwargs):
+        """
+        Returns the metadata item if the table has been summarized
+        """
+        if self.last_updated is None or kwargs['Key']['route_id'] != 0:
+            return {}
+        return {'Item': {'route_id': 0, 'last_updated': self.last_updated}}
+
+    def scan_page(self, **kwargs):
+        """
+        Returns one page of the items in the requested scan segment
+        """
+        self.scan_calls.append(kwargs)
+        items = TABLE_ITEMS[kwargs.get('Segment', 0)::kwargs.get('TotalSegments', 1)]
+        start = kwargs.get('ExclusiveStartKey', 0)
+        response = {'Items': items[start:start+self.page_size]}
+        if start + self.page_size < len(items):
+            response['LastEvaluatedKey'] = start + self.page_size
+        return response
 
 
 class TestTransitVis(unittest.TestCase):
@@ -68,6 +256,51 @@ class TestTransitVis(unittest.TestCase):
             CENSUS_PATH)
         self.assertTrue(os.path.exists(f"{CENSUS_PATH}_tmp.csv"))
 
+    def test_oneshot_prepare_census(self):
+        """
+        One shot test that the function 'prepare_census_data' keeps only the
+        variables of interest and reuses its result while the inputs are unchanged
+        """
+        census_df = census_data.prepare_census_data(
+            S0801_PATH,
+            S1902_PATH,
+            CENSUS_PATH)
+        self.assertEqual(list(census_df.columns), [
+            'GEO_ID', 'total_workers', 'workers_using_transit',
+            'total_households', 'mean_income', 'percent_w_assistance',
+            'percent_white', 'percent_black_or_african_american'])
+        self.assertTrue((census_df['GEO_ID'].str.len() == 11).all())
+        self.assertTrue(os.path.exists(f"{CENSUS_PATH}_tmp.pkl"))
+        self.assertIs(
+            census_data.prepare_census_data(S0801_PATH, S1902_PATH, CENSUS_PATH),
+            census_df)
+
+    def test_oneshot_acs_markers(self):
+        """
+        One-shot test that the function 'prepare_census_data' reads top coded
+        ACS estimates as their number and other markers as missing
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = write_acs_tables(temp_dir, ['250,000+', '(X)', '41000'])
+            census_df = census_data.prepare_census_data(*paths)
+        self.assertEqual(census_df['mean_income'].tolist()[0], 250000)
+        self.assertTrue(census_df['mean_income'].isna().tolist()[1])
+        self.assertEqual(census_df['mean_income'].tolist()[2], 41000)
+        self.assertTrue(census_df['total_workers'].isna().all())
+
+    def test_edgecase_stale_census(self):
+        """
+        Edge case test that the function 'load_census_data' prepares the
+        table again when an ACS file changed since it was cached
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = write_acs_tables(temp_dir, ['40000', '50000', '60000'])
+            census_data.prepare_census_data(*paths)
+            write_acs_tables(temp_dir, ['40000', '50000', '70000'])
+            census_data._PREPARED_TABLES.clear()
+            census_df = census_data.load_census_data(paths[2])
+        self.assertEqual(census_df['mean_income'].tolist(), [40000, 50000, 70000])
+
     @classmethod
     def test_smoke_folium_map(cls):
         """
@@ -109,6 +342,16 @@ class TestTransitVis(unittest.TestCase):
                 speed_lookup,
                 SEGMENT_PATH)
 
+    def test_oneshot_speed_histogram(self):
+        """
+        One shot test that the function 'speed_histogram_svg' draws one bar
+        for each bin with speeds, leaving out routes without speeds
+        """
+        svg = vis_functions.speed_histogram_svg(np.array([0, 0, 1.0, 1.5, 7.5, 29.0]))
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertEqual(svg.count('<title>'), 3)
+        self.assertIn('<title>0-2 m/s: 2</title>', svg)
+
     @classmethod
     def test_smoke_save_map(cls):
         """
@@ -145,6 +388,344 @@ class TestTransitVis(unittest.TestCase):
         bad_output_path = 'transit_vis/tests/output_map.csv'
         with self.assertRaises(ValueError):
             vis_functions.save_and_view_map(f_map, bad_output_path)
+    def test_oneshot_dump_table(self):
+        """
+        One shot test for the function 'dump_table' with a single segment
+        """
+        table = FakeTable(page_size=10)
+        items = vis_functions.dump_table(table)
+        self.assertEqual(items, TABLE_ITEMS)
+        self.assertEqual(len(table.scan_calls), 3)
+
+    def test_oneshot_dump_table_parallel(self):
+        """
+        One shot test for the function 'dump_table' with a parallel scan and
+        a projection expression
+        """
+        table = FakeTable(page_size=4)
+        items = vis_functions.dump_table(
+            table,
+            total_segments=3,
+            projection_expression='route_id, avg_speed_m_s')
+        self.assertEqual(
+            sorted(item['route_id'] for item in items),
+            list(range(25)))
+        for kwargs in table.scan_calls:
+            self.assertEqual(kwargs['TotalSegments'], 3)
+            self.assertEqual(
+                kwargs['ProjectionExpression'],
+                'route_id, avg_speed_m_s')
+
+    def test_edgecase_dump_table(self):
+        """
+        Edge case test to catch that the number of scan segments must be at
+        least 1 for the function 'dump_table'
+        """
+        with self.assertRaises(ValueError):
+            vis_functions.dump_table(FakeTable(page_size=10), total_segments=0)
+    def test_oneshot_lookup_cache(self):
+        """
+        One shot test for the functions 'save_lookup_cache' and
+        'load_lookup_cache'
+        """
+        speed_cache.save_lookup_cache(CACHE_PATH, ROUTE_DICT, 1000)
+        speed_cache._LOADED_CACHES.clear()
+        route_lookup, last_updated = speed_cache.load_lookup_cache(CACHE_PATH)
+        self.assertEqual(route_lookup, ROUTE_DICT)
+        self.assertEqual(last_updated, 1000)
+        speed_cache.clear_lookup_cache(CACHE_PATH)
+        self.assertFalse(os.path.exists(CACHE_PATH))
+
+    def test_oneshot_cached_lookup(self):
+        """
+        One shot test that the function 'cached_table_to_lookup' does not scan
+        the table when the cache is at least as recent as the table
+        """
+        speed_cache.save_lookup_cache(CACHE_PATH, ROUTE_DICT, 1000)
+        table = FakeTable(page_size=10, last_updated=1000)
+        route_lookup = vis_functions.cached_table_to_lookup(table, CACHE_PATH)
+        self.assertEqual(route_lookup, ROUTE_DICT)
+        self.assertEqual(len(table.scan_calls), 0)
+        speed_cache.clear_lookup_cache(CACHE_PATH)
+
+    def test_oneshot_changed_routes(self):
+        """
+        One shot test that the function 'cached_table_to_lookup' reads only
+        the routes in the change log since the cache, without a scan
+        """
+        speed_cache.save_lookup_cache(CACHE_PATH, ROUTE_DICT, 1000)
+        table = FakeTable(page_size=10, last_updated=3000, changes=[
+            (1000, [[1, 'L']]), (2000, [[3, 'L']]), (3000, [[4, 'L'], [3, 'L']])])
+        route_lookup = vis_functions.cached_table_to_lookup(table, CACHE_PATH)
+        self.assertEqual(len(table.scan_calls), 0)
+        self.assertEqual(len(table.meta.client.queries), 2)
+        requested = [
+            key['route_id'] for request in table.meta.client.requests
+            for key in request['FakeTable']['Keys']]
+        self.assertEqual(sorted(set(requested)), [3, 4])
+        self.assertEqual(
+            sorted(route_lookup.keys()),
+            [(3, 'L'), (4, 'L'), (100001, 'L'), (999999, 'L')])
+        speed_cache._LOADED_CACHES.clear()
+        self.assertEqual(speed_cache.load_lookup_cache(CACHE_PATH)[1], 3000)
+        speed_cache.clear_lookup_cache(CACHE_PATH)
+
+    def test_edgecase_changes_missing(self):
+        """
+        Edge case test that the table is downloaded in full when its change
+        log does not go up to the last upload
+        """
+        speed_cache.save_lookup_cache(CACHE_PATH, ROUTE_DICT, 1000)
+        table = FakeTable(page_size=10, last_updated=3000, changes=[
+            (2000, [[3, 'L']])])
+        route_lookup = vis_functions.cached_table_to_lookup(table, CACHE_PATH)
+        self.assertEqual(len(table.scan_calls), 3)
+        self.assertEqual(len(route_lookup), len(TABLE_ITEMS))
+        speed_cache.clear_lookup_cache(CACHE_PATH)
+
+    def test_edgecase_no_metadata(self):
+        """
+        Edge case test that a table without a metadata item is downloaded
+        once with a warning, and the cache is used after that
+        """
+        speed_cache.clear_lookup_cache(CACHE_PATH)
+        table = FakeTable(page_size=10)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            first = vis_functions.cached_table_to_lookup(table, CACHE_PATH)
+            second = vis_functions.cached_table_to_lookup(table, CACHE_PATH)
+        self.assertEqual(len(table.scan_calls), 3)
+        self.assertEqual(first, second)
+        self.assertEqual(len(caught), 2)
+        speed_cache.clear_lookup_cache(CACHE_PATH)
+    def test_oneshot_route_keys(self):
+        """
+        One shot test for the function 'geojson_to_route_keys'
+        """
+        route_keys = vis_functions.geojson_to_route_keys(SEGMENT_PATH)
+        self.assertIn((100001, 'L'), route_keys)
+        self.assertEqual(len(route_keys), len(set(route_keys)))
+
+    def test_oneshot_keys_to_lookup(self):
+        """
+        One shot test for the function 'keys_to_lookup', including the retry of
+        unprocessed keys
+        """
+        table = FakeTable(page_size=10)
+        route_keys = [(i, 'L') for i in range(5)] + [(999, 'L')]
+        route_lookup = vis_functions.keys_to_lookup(table, route_keys)
+        self.assertEqual(sorted(route_lookup.keys()), route_keys[:5])
+        self.assertEqual(len(table.meta.client.requests), 2)
+
+    def test_edgecase_batch_get_chunk(self):
+        """
+        Edge case test to catch that more than 100 keys can not be requested
+        at once by the function 'batch_get_chunk'
+        """
+        with self.assertRaises(ValueError):
+            vis_functions.batch_get_chunk(
+                FakeTable(page_size=10),
+                [(i, 'L') for i in range(101)])
+    def test_oneshot_load_segments(self):
+        """
+        One shot test that the function 'load_segments' only parses the
+        segment file once while it is unchanged
+        """
+        segments = segment_store.load_segments(SEGMENT_PATH)
+        self.assertIs(segment_store.load_segments(SEGMENT_PATH), segments)
+        self.assertIn((100001, 'L'), segments['route_index'])
+
+    def test_oneshot_join_speeds(self):
+        """
+        One shot test for the function 'join_speeds'
+        """
+        enriched, speeds = segment_store.join_speeds(ROUTE_DICT, SEGMENT_PATH)
+        self.assertTrue(np.array_equal(speeds, [7.5]))
+        for feature in enriched['features']:
+            properties = feature['properties']
+            if properties['ROUTE_ID'] == 100001 and properties['LOCAL_EXPR'] == 'L':
+                self.assertEqual(properties['AVG_SPEED_M_S'], 7.5)
+                self.assertEqual(properties['HISTORIC_SPEEDS'], [2.2, 7.5])
+            else:
+                self.assertEqual(properties['AVG_SPEED_M_S'], 0)
+        self.assertIs(segment_store.get_enriched_segments(SEGMENT_PATH), enriched)
+
+    def test_edgecase_no_joined_speeds(self):
+        """
+        Edge case test that the function 'get_enriched_segments' does not
+        hand out segments without speeds when none were joined in this process
+        """
+        enriched = segment_store._ENRICHED_SEGMENTS.pop(SEGMENT_PATH, None)
+        with self.assertRaises(ValueError):
+            segment_store.get_enriched_segments(SEGMENT_PATH)
+        with self.assertRaises(ValueError):
+            vis_functions.generate_folium_map(SEGMENT_PATH, CENSUS_PATH, LINEAR_CM)
+        if enriched is not None:
+            segment_store._ENRICHED_SEGMENTS[SEGMENT_PATH] = enriched
+    def test_oneshot_topology(self):
+        """
+        One shot test that the function 'build_topology' stores the part of
+        two routes that overlap as a single shared arc
+        """
+        topology = compact_layer.build_topology(OVERLAPPING_ROUTES, 1000)
+        self.assertEqual(len(topology['arcs']), 2)
+        self.assertEqual(topology['geometries'][0], [[0]])
+        self.assertEqual(topology['geometries'][1], [[~0, 1]])
+
+    @classmethod
+    def test_smoke_compact_folium_map(cls):
+        """
+        Smoke test for the function 'generate_folium_map' with compact routes
+        """
+        assert vis_functions.generate_folium_map(
+            SEGMENT_PATH,
+            CENSUS_PATH,
+            LINEAR_CM,
+            compact_routes=True) is not None
+
+    def test_oneshot_metric_layers(self):
+        """
+        One shot test that route metrics are kept by the lookup cache and
+        joined to the segments, and that each metric with data gets a hidden
+        layer which shares the geometry of the compact speed layer
+        """
+        route_lookup = {(100001, 'L'): dict(
+            ROUTE_DICT[(100001, 'L')], on_time_share=0.8, median_lateness_s=45.0)}
+        speed_cache.save_lookup_cache(CACHE_PATH, route_lookup, 1000)
+        speed_cache._LOADED_CACHES.clear()
+        self.assertEqual(speed_cache.load_lookup_cache(CACHE_PATH)[0], route_lookup)
+        speed_cache.clear_lookup_cache(CACHE_PATH)
+        self.assertEqual(vis_functions.items_to_lookup([dict(
+            TABLE_ITEMS[0], sample_count=12)])[(0, 'L')]['sample_count'], 12.0)
+
+        enriched, _ = segment_store.join_speeds(route_lookup, SEGMENT_PATH)
+        on_time = [
+            feature['properties']['ON_TIME_SHARE'] for feature in enriched['features']
+            if feature['properties']['ROUTE_ID'] == 100001]
+        self.assertIn(0.8, on_time)
+        for compact_routes in [True, False]:
+            html = vis_functions.generate_folium_map(
+                enriched, CENSUS_PATH, LINEAR_CM,
+                compact_routes=compact_routes).get_root().render()
+            self.assertIn('Share of Buses On Time', html)
+            self.assertIn('Median Lateness (s)', html)
+            self.assertNotIn('Number of Speed Samples', html)
+            if compact_routes:
+                self.assertEqual(html.count('return decodeTopology(topology);'), 1)
+
+    def test_oneshot_simplify_tracts(self):
+        """
+        One shot test that the function 'simplify_tracts' removes points from
+        the border shared by two tracts in the same way for both tracts
+        """
+        border = [[0.0, 0.0], [0.5, 0.00001], [1.0, 0.0]]
+        tracts = [
+            {'type': 'Feature', 'properties': {'GEOID10': 'A'},
+             'geometry': {'type': 'Polygon', 'coordinates': [
+                 border + [[1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]]}},
+            {'type': 'Feature', 'properties': {'GEOID10': 'B'},
+             'geometry': {'type': 'Polygon', 'coordinates': [
+                 border[::-1] + [[0.0, -1.0], [1.0, -1.0], [1.0, 0.0]]]}}]
+        simple = census_data.simplify_tracts(tracts, 0.001, 5)
+        ring_a = simple[0]['geometry']['coordinates'][0][0]
+        ring_b = simple[1]['geometry']['coordinates'][0][0]
+        self.assertNotIn([0.5, 0.00001], ring_a)
+        self.assertNotIn([0.5, 0.00001], ring_b)
+        self.assertEqual(ring_a[0], ring_a[-1])
+        self.assertEqual(ring_b[0], ring_b[-1])
+
+    def test_oneshot_tract_layer(self):
+        """
+        One shot test that the function 'prepare_tract_layer' only keeps tracts
+        with census data inside the route bounding box, and is cached on disk
+        """
+        census_df = census_data.prepare_census_data(
+            S0801_PATH,
+            S1902_PATH,
+            CENSUS_PATH)
+        tract_layer = census_data.prepare_tract_layer(
+            CENSUS_PATH,
+            census_df.iloc[:50],
+            (-122.35, 47.55, -122.25, 47.65))
+        geo_ids = set(census_df['GEO_ID'].iloc[:50])
+        for feature in tract_layer['features']:
+            self.assertIn(feature['properties']['GEOID10'], geo_ids)
+            bbox = topology.geojson_bbox({'features': [feature]})
+            self.assertTrue(bbox[0] <= -122.25 and bbox[2] >= -122.35)
+        self.assertTrue(os.path.exists(
+            f"{CENSUS_PATH}_simplified_tmp.geojson"))
+
+    def test_oneshot_length_inside(self):
+        """
+        One shot test that the function 'build_incidence' only counts the
+        length of a route that is inside a tract and outside its hole
+        """
+        tract = {'geometry': {'type': 'Polygon', 'coordinates': [
+            [[0, 0], [0.01, 0], [0.01, 0.01], [0, 0.01], [0, 0]],
+            [[0.004, 0.004], [0.006, 0.004], [0.006, 0.006], [0.004, 0.006],
+             [0.004, 0.004]]]}}
+        route = {'geometry': {'type': 'LineString', 'coordinates': [
+            [-0.005, 0.005], [0.005, 0.005], [0.015, 0.005]]}}
+        incidence = tract_join.build_incidence([route], [tract], cell_size=100.0)
+        expected = 0.008 * tract_join.METERS_PER_DEGREE * np.cos(np.radians(0.005))
+        self.assertEqual(list(incidence['feature_index']), [0])
+        self.assertAlmostEqual(incidence['length_m'][0], expected, places=6)
+        edge_starts, edge_ends = tract_join.tract_edges(tract, 0.0)
+        points = tract_join.project_points(
+            np.random.default_rng(0).uniform(-0.002, 0.012, (50, 2)), 0.0)
+        self.assertTrue(np.allclose(
+            tract_join.length_inside(points[:-1], points[1:], edge_starts, edge_ends),
+            tract_join.length_inside(
+                points[:-1], points[1:], edge_starts, edge_ends, chunk_size=25)))
+
+    def test_oneshot_tract_speeds(self):
+        """
+        One shot test that the function 'tract_speeds' weights speeds by the
+        length of each route in the tract and leaves out routes without data
+        """
+        incidence = {
+            'feature_index': np.array([0, 1, 2, 2]),
+            'tract_index': np.array([0, 0, 0, 1]),
+            'length_m': np.array([100.0, 300.0, 50.0, 10.0]),
+            'geo_ids': np.array(['A', 'B', 'C'])}
+        tract_speed_df = tract_join.tract_speeds(incidence, [2.0, 6.0, 0.0])
+        self.assertEqual(list(tract_speed_df['GEO_ID']), ['A'])
+        self.assertAlmostEqual(tract_speed_df['tract_speed_m_s'].iloc[0], 5.0)
+        self.assertAlmostEqual(tract_speed_df['route_length_m'].iloc[0], 400.0)
+
+    def test_oneshot_load_incidence(self):
+        """
+        One shot test that the function 'load_incidence' saves the route by
+        tract table and reuses it
+        """
+        incidence = tract_join.load_incidence(SEGMENT_PATH, CENSUS_PATH)
+        self.assertTrue(os.path.exists(f"{SEGMENT_PATH}_tracts_tmp.npz"))
+        self.assertGreater(len(incidence['length_m']), 0)
+        tract_join._INCIDENCE_TABLES.clear()
+        reloaded = tract_join.load_incidence(SEGMENT_PATH, CENSUS_PATH)
+        np.testing.assert_array_equal(
+            reloaded['length_m'], incidence['length_m'])
+
+    @classmethod
+    def test_smoke_tract_speed_map(cls):
+        """
+        Smoke test for the function 'generate_folium_map' with tract speeds
+        """
+        census_data.prepare_census_data(S0801_PATH, S1902_PATH, CENSUS_PATH)
+        speeds = vis_functions.write_speeds_to_map_segments(ROUTE_DICT, SEGMENT_PATH)
+        feature_speeds = [
+            feature['properties']['AVG_SPEED_M_S'] for feature in
+            segment_store.get_enriched_segments(SEGMENT_PATH)['features']]
+        tract_speed_df = tract_join.tract_speeds(
+            tract_join.load_incidence(SEGMENT_PATH, CENSUS_PATH),
+            feature_speeds)
+        assert len(speeds) > 0
+        assert vis_functions.generate_folium_map(
+            SEGMENT_PATH,
+            CENSUS_PATH,
+            LINEAR_CM,
+            compact_routes=True,
+            tract_speeds=tract_speed_df) is not None
 
 ##############################################################################
 
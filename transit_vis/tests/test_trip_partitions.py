@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Class to test the daily partitions of the bus location table
+
+test_smoke_partition_name(cls) -- smoke test for naming the partition of a day
+
+test_oneshot_partition_days(self) -- one shot test for the days a time range overlaps
+
+test_oneshot_trip_window(self) -- one shot test that the summary query covers whole partitions
+
+test_oneshot_partition_statements(self) -- one shot test for the SQL that creates a partition
+
+test_edgecase_days_ahead(self) -- edge case to catch maintaining less than one day
+
+test_oneshot_partition_pruning(self) -- one shot test that a day's query only reads its partition
+
+test_oneshot_maintain_partitions(self) -- one shot test for moving default rows and dropping old days
+
+The last two tests need a PostgreSQL 11+ database to create tables in, given as
+a connection string in the TRANSIT_VIS_TEST_DSN environment variable, i.e.
+TRANSIT_VIS_TEST_DSN="dbname=transit_test user=postgres"; they are skipped
+without it. They work in a temporary schema that is dropped afterwards.
+"""
+
+
+import os
+import unittest
+
+from transit_vis.src import summarize_rds
+from transit_vis.src import trip_partitions
+
+
+TEST_DSN = os.environ.get('TRANSIT_VIS_TEST_DSN')
+SCHEMA_PATH = './transit_vis/src/create_gtfs_tables.sql'
+# 2020-12-01 00:00:00 UTC
+DAY = 1606780800
+ONE_DAY = trip_partitions.SECONDS_PER_DAY
+
+
+class TestTripPartitions(unittest.TestCase):
+    """
+    Unittest for the module 'trip_partitions'
+    """
+    @classmethod
+    def test_smoke_partition_name(cls):
+        """
+        Smoke test for the function 'partition_name'
+        """
+        assert trip_partitions.partition_name(DAY) == 'active_trips_study_p20201201'
+
+    def test_oneshot_partition_days(self):
+        """
+        One shot test that a range that ends exactly at midnight does not
+        overlap the next day
+        """
+        self.assertEqual(trip_partitions.day_start(DAY + 5000), DAY)
+        self.assertEqual(
+            trip_partitions.partition_days(DAY + 5000, DAY + ONE_DAY), [DAY])
+        self.assertEqual(
+            trip_partitions.partition_days(DAY - 1, DAY + 1), [DAY - ONE_DAY, DAY])
+
+    def test_oneshot_trip_window(self):
+        """
+        One shot test that the range queried for a summary starts and ends at
+        UTC midnight, so one day only overlaps its own partition
+        """
+        start_time, end_time = summarize_rds.trip_window(1, '2020-12-01')
+        self.assertEqual((start_time, end_time), (DAY, DAY + ONE_DAY))
+        self.assertEqual(
+            trip_partitions.partition_days(start_time, end_time), [DAY])
+        self.assertEqual(
+            trip_partitions.partition_days(
+                *summarize_rds.trip_window(3, '2020-12-01')),
+            [DAY - 2 * ONE_DAY, DAY - ONE_DAY, DAY])
+        start_time, end_time = summarize_rds.trip_window(1)
+        self.assertEqual(len(trip_partitions.partition_days(start_time, end_time)), 1)
+
+    def test_oneshot_partition_statements(self):
+        """
+        One shot test that a new partition takes its rows from the default
+        partition before it is attached with the bounds of its day
+        """
+        statements = trip_partitions.create_partition_statements(DAY)
+        self.assertIn('DELETE FROM active_trips_study_default', statements[1])
+        self.assertTrue(statements[2].endswith(
+            f"FOR VALUES FROM ({DAY}) TO ({DAY + ONE_DAY});"))
+
+    def test_edgecase_days_ahead(self):
+        """
+        Edge case test to catch maintaining partitions for less than one day
+        """
+        with self.assertRaises(ValueError):
+            trip_partitions.maintain_partitions(None, days_ahead=0)
+
+    def setUp(self):
+        self.conn = None
+        if TEST_DSN is None or not self._testMethodName.startswith(
+                ('test_oneshot_partition_pruning', 'test_oneshot_maintain')):
+            return
+        import psycopg2
+        self.conn = psycopg2.connect(TEST_DSN)
+        with self.conn.cursor() as curs:
+            curs.execute(
+                "DROP SCHEMA IF EXISTS transit_vis_test CASCADE; "
+                "CREATE SCHEMA transit_vis_test; "
+                "SET search_path TO transit_vis_test;")
+            with open(SCHEMA_PATH, 'r') as schema_file:
+                curs.execute(schema_file.read())
+        self.conn.commit()
+
+    def tearDown(self):
+        if self.conn is not None:
+            self.conn.rollback()
+            with self.conn.cursor() as curs:
+                curs.execute("DROP SCHEMA transit_vis_test CASCADE;")
+            self.conn.commit()
+            self.conn.close()
+
+    def insert_rows(self, collected_times):
+        """Inserts a bus location at each collected time"""
+        with self.conn.cursor() as curs:
+            for collected_time in collected_times:
+                curs.execute(
+                    "INSERT INTO active_trips_study (tripID, collectedTime) "
+                    "VALUES (1, %s);",
+                    [collected_time])
+        self.conn.commit()
+
+    def count_rows(self, table_name):
+        """Counts the rows in one table"""
+        with self.conn.cursor() as curs:
+            curs.execute(f"SELECT count(*) FROM {table_name};")
+            return curs.fetchone()[0]
+
+    @unittest.skipUnless(TEST_DSN, 'TRANSIT_VIS_TEST_DSN is not set')
+    def test_oneshot_partition_pruning(self):
+        """
+        One shot test that the query for one day only scans that day's
+        partition and returns its rows
+        """
+        trip_partitions.ensure_partitions(self.conn, DAY - ONE_DAY, 3)
+        self.insert_rows([DAY - 10, DAY, DAY + 10, DAY + ONE_DAY])
+        query_text, query_params = summarize_rds.build_trip_query(
+            DAY, DAY + ONE_DAY, 0)
+        with self.conn.cursor() as curs:
+            curs.execute(f"EXPLAIN {query_text}", query_params)
+            plan = '\n'.join(row[0] for row in curs.fetchall())
+            curs.execute(query_text, query_params)
+            rows = curs.fetchall()
+        self.assertIn('active_trips_study_p20201201', plan)
+        self.assertNotIn('active_trips_study_p20201130', plan)
+        self.assertNotIn('active_trips_study_p20201202', plan)
+        self.assertNotIn('active_trips_study_default', plan)
+        self.assertEqual(len(rows), 2)
+
+    @unittest.skipUnless(TEST_DSN, 'TRANSIT_VIS_TEST_DSN is not set')
+    def test_oneshot_maintain_partitions(self):
+        """
+        One shot test that rows that arrived before their partition are moved
+        into it, and that expired partitions are dropped
+        """
+        self.insert_rows([DAY + 10, DAY + ONE_DAY + 10])
+        self.assertEqual(self.count_rows('active_trips_study_default'), 2)
+        created, dropped = trip_partitions.maintain_partitions(
+            self.conn, days_ahead=2, now=DAY + 100)
+        self.assertEqual(created, [
+            'active_trips_study_p20201201', 'active_trips_study_p20201202'])
+        self.assertEqual(dropped, [])
+        self.assertEqual(self.count_rows('active_trips_study_default'), 0)
+        self.assertEqual(self.count_rows('active_trips_study_p20201202'), 1)
+        created, dropped = trip_partitions.maintain_partitions(
+            self.conn, days_ahead=1, days_to_keep=0, now=DAY + ONE_DAY + 100)
+        self.assertEqual(created, [])
+        self.assertEqual(dropped, ['active_trips_study_p20201201'])
+        self.assertEqual(self.count_rows('active_trips_study'), 1)
+
+##############################################################################
+
+SUITE = unittest.TestLoader().loadTestsFromTestCase(TestTripPartitions)
+_ = unittest.TextTestRunner().run(SUITE)
@@ -4,13 +4,37 @@
 
 test_smoke_folium_map_widget(cls) -- smoke test for widget folium map
 
+test_oneshot_invalidate_session(self) -- one shot test that invalidation drops dependent artifacts
+
+test_oneshot_session_keys(self) -- one shot test that an artifact asked for with a new key is rebuilt
+
+test_oneshot_session_map(self) -- one shot test for redrawing the map from session artifacts
+
+test_oneshot_nearby_routes(self) -- one shot test for highlighting the routes near both ends and the trip between them
+
+test_edgecase_session_artifact(self) -- edge case to catch an unknown artifact name
+
+test_oneshot_submit_build(self) -- one shot test that a newer build supersedes an earlier one
+
+test_edgecase_invalid_inputs(self) -- edge case to catch invalid inputs before a build is submitted
+
 """
 
 
+import contextlib
+import io
+import os
+import tempfile
+import threading
 import unittest
 
 import branca.colormap as cm
 
+from transit_vis.src import census_data
+from transit_vis.src import compact_layer
+from transit_vis.src import segment_store
+from transit_vis.src import transit_vis
+from transit_vis.src import widget_map
 from transit_vis.src import widget_modules
 
 S0801_PATH = './transit_vis/tests/data/s0801'
@@ -25,6 +49,30 @@ DESTINATION_LOC_VALUE = '47.606209, -122.332069'
 MIN_INCOME_VALUE = 30000
 MAX_INCOME_VALUE = 60000
 
+class GatedTable():
+    """
+    A stand in for a dynamodb table that waits for a gate to open before
+    answering, to hold a map build in its download stage
+    """
+    def __init__(self):
+        self.name = 'GatedTable'
+        self.meta = type('FakeMeta', (), {'client': self})()
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+
+    def get_item(self, **kwargs):
+        """Waits for the gate, then reports that the table has no metadata"""
+        self.entered.set()
+        self.gate.wait(10)
+        return {}
+
+    @staticmethod
+    def scan(**kwargs):
+        """Returns the speed of one route"""
+        return {'Items': [{
+            'route_id': 100001, 'local_express_code': 'L',
+            'avg_speed_m_s': 7.5, 'historic_speeds': [2.2, 7.5]}]}
+
 class TestWidgetModules(unittest.TestCase):
     """
     Unittest for the module 'widget_modules'
@@ -34,12 +82,147 @@ class TestWidgetModules(unittest.TestCase):
         """
         Smoke test for the function 'generate_folium_map_widget'
         """
-
-        assert widget_modules.generate_folium_map_widget(
+        segment_store.join_speeds({}, SEGMENT_PATH)
+        assert widget_map.generate_folium_map_widget(
             SEGMENT_PATH, CENSUS_PATH, LINEAR_CM, HOME_LOC_VALUE, \
             DESTINATION_LOC_VALUE, MIN_INCOME_VALUE, \
             MAX_INCOME_VALUE) is not None
 
+    def test_oneshot_invalidate_session(self):
+        """
+        One shot test that invalidating the speeds drops the artifacts built
+        from them, and keeps the others
+        """
+        widget_modules.invalidate_session()
+        for name in widget_modules.SESSION_DEPENDENTS:
+            widget_modules.session_artifact(name, lambda: 1)
+        dropped = widget_modules.invalidate_session('speed_lookup')
+        self.assertEqual(dropped, ['segments', 'speed_lookup', 'tracts'])
+        self.assertEqual(
+            sorted(widget_modules._SESSION.keys()), ['census', 'table'])
+        self.assertEqual(widget_modules.session_artifact('census', lambda: 2), 1)
+        widget_modules.invalidate_session()
+        self.assertEqual(widget_modules._SESSION, {})
+
+    def test_oneshot_session_keys(self):
+        """
+        One shot test that an artifact asked for with another key, such as a
+        different table name, is rebuilt along with the artifacts built from it
+        """
+        widget_modules.invalidate_session()
+        widget_modules.session_artifact('census', lambda: 1, key='census_a')
+        widget_modules.session_artifact('table', lambda: 1, key='table_a')
+        widget_modules.session_artifact('speed_lookup', lambda: 1)
+        self.assertEqual(
+            widget_modules.session_artifact('table', lambda: 2, key='table_a'), 1)
+        self.assertEqual(
+            widget_modules.session_artifact('table', lambda: 2, key='table_b'), 2)
+        self.assertEqual(
+            sorted(widget_modules._SESSION.keys()), ['census', 'table'])
+        self.assertEqual(
+            widget_modules.session_artifact('census', lambda: 2, key='census_a'), 1)
+        widget_modules.invalidate_session()
+
+    def test_oneshot_session_map(self):
+        """
+        One shot test that maps with new income thresholds reuse the route
+        layer and tracts kept in the session
+        """
+        census_data.prepare_census_data(S0801_PATH, S1902_PATH, CENSUS_PATH)
+        segment_data, _ = segment_store.join_speeds({}, SEGMENT_PATH)
+        fields, aliases = transit_vis.route_tooltip_fields(segment_data)
+        route_layer = compact_layer.CompactRouteLayer(
+            segment_data, LINEAR_CM, fields=fields, aliases=aliases)
+        tracts = widget_map.prepare_widget_tracts(CENSUS_PATH, segment_data)
+        for min_income in [MIN_INCOME_VALUE, MIN_INCOME_VALUE + 10000]:
+            html = widget_map.generate_folium_map_widget(
+                segment_data, CENSUS_PATH, LINEAR_CM, HOME_LOC_VALUE,
+                DESTINATION_LOC_VALUE, min_income, MAX_INCOME_VALUE,
+                tracts=tracts, route_layer=route_layer).get_root().render()
+            self.assertIn(route_layer.topology_json, html)
+
+    def test_oneshot_nearby_routes(self):
+        """
+        One shot test that a route passing both home and destination is
+        highlighted, listed in the marker popups and ridden between them
+        """
+        census_data.prepare_census_data(S0801_PATH, S1902_PATH, CENSUS_PATH)
+        segment_data, _ = segment_store.join_speeds({}, SEGMENT_PATH)
+        feature = segment_data['features'][0]
+        line = feature['geometry']['coordinates'][0]
+        home_loc_value = f"{line[0][1]}, {line[0][0]}"
+        destination_loc_value = f"{line[-1][1]}, {line[-1][0]}"
+        html = widget_map.generate_folium_map_widget(
+            segment_data, CENSUS_PATH, LINEAR_CM, home_loc_value,
+            destination_loc_value, MIN_INCOME_VALUE,
+            MAX_INCOME_VALUE).get_root().render()
+        self.assertIn('Routes Serving Home and Destination', html)
+        self.assertIn(f"Route {feature['properties']['ROUTE_NUM']} (", html)
+        self.assertIn('Estimated travel time', html)
+
+    def test_edgecase_session_artifact(self):
+        """
+        Edge case test to catch an artifact that the session does not know
+        """
+        with self.assertRaises(KeyError):
+            widget_modules.session_artifact('speeds', lambda: 1)
+
+    def test_oneshot_submit_build(self):
+        """
+        One shot test that builds submitted while another is running replace
+        it, and only the latest one finishes
+        """
+        widget_modules.invalidate_session()
+        table = GatedTable()
+        widget_modules.session_artifact(
+            'table', lambda: table,
+            key=widget_modules.WIDGET_PATHS['table_name'])
+        inputs = {
+            'home_loc_value': HOME_LOC_VALUE,
+            'destination_loc_value': DESTINATION_LOC_VALUE,
+            'min_income_value': str(MIN_INCOME_VALUE),
+            'max_income_value': str(MAX_INCOME_VALUE)}
+        with tempfile.TemporaryDirectory() as output_dir:
+            paths = {
+                's0801_path': S0801_PATH,
+                's1902_path': S1902_PATH,
+                'segment_path': SEGMENT_PATH,
+                'census_path': CENSUS_PATH,
+                'cache_path': os.path.join(output_dir, 'lookup.json.gz'),
+                'output_path': os.path.join(output_dir, 'map.html')}
+            first = widget_modules.submit_build(inputs, paths)
+            self.assertTrue(table.entered.wait(30))
+            queued = widget_modules.submit_build(inputs, paths)
+            latest = widget_modules.submit_build(
+                dict(inputs, min_income_value='40000'), paths)
+            table.gate.set()
+            self.assertEqual(latest.result(timeout=60), paths['output_path'])
+            self.assertTrue(queued.cancelled())
+            self.assertIsNone(first.result())
+            self.assertTrue(os.path.exists(paths['output_path']))
+        widget_modules.invalidate_session()
+
+    def test_edgecase_invalid_inputs(self):
+        """
+        Edge case test to catch invalid widget inputs, which are reported
+        without submitting a build
+        """
+        generation = widget_modules._BUILDS['generation'] # pylint: disable=W0212
+        min_income_box = widget_modules.make_widgets()['min_income']
+        min_income = min_income_box.value
+        min_income_box.value = 'lots'
+        try:
+            for button in [widget_modules.button_execute_app,
+                           widget_modules.button_refresh_speeds]:
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    self.assertIsNone(button(None))
+                self.assertIn('yearly income', output.getvalue())
+        finally:
+            min_income_box.value = min_income
+        self.assertEqual(
+            widget_modules._BUILDS['generation'], generation) # pylint: disable=W0212
+
 
 ##############################################################################
 